@@ -323,7 +323,7 @@ float HasteInference(
         v_dev.data,
         tmp_Rh_dev.data,
         0.0f,
-        nullptr);
+        0);
   }, sample_size);
   return ms;
 }
@@ -341,13 +341,6 @@ float HasteTrain(
   const int input_size = x.dimension(0);
   const int hidden_size = R.dimension(1);
 
-  Eigen::array<int, 3> transpose_x({ 1, 2, 0 });
-  Tensor3 x_t = x.shuffle(transpose_x);
-
-  Eigen::array<int, 2> transpose({ 1, 0 });
-  Tensor2 W_t = W.shuffle(transpose);
-  Tensor2 R_t = R.shuffle(transpose);
-
   device_ptr<Tensor2> W_dev(W);
   device_ptr<Tensor2> R_dev(R);
   device_ptr<Tensor3> x_dev(x);
@@ -356,10 +349,7 @@ float HasteTrain(
   device_ptr<Tensor3> v_dev(time_steps * batch_size * hidden_size * 4);
   device_ptr<Tensor2> tmp_Rh_dev(batch_size * hidden_size * 4);
 
-  device_ptr<Tensor2> W_t_dev(W_t);
-  device_ptr<Tensor2> R_t_dev(R_t);
   device_ptr<Tensor1> b_dev(b);
-  device_ptr<Tensor3> x_t_dev(x_t);
 
   // These gradients should actually come "from above" but we're just allocating
   // a bunch of uninitialized memory and passing it in.
@@ -392,9 +382,6 @@ float HasteTrain(
       hidden_size,
       g_blas_handle);
 
-  static const float alpha = 1.0f;
-  static const float beta = 0.0f;
-
   cudaDeviceSynchronize();
   float ms = TimeLoop([&]() {
     forward.Run(
@@ -408,48 +395,14 @@ float HasteTrain(
         v_dev.data,
         tmp_Rh_dev.data,
         0.0f,
-        nullptr);
-
-    // Haste needs `x`, `W`, and `R` to be transposed between the forward
-    // pass and backward pass. Add these transposes in here to get a fair
-    // measurement of the overall time it takes to run an entire training
-    // loop.
-    cublasSgeam(
-        g_blas_handle,
-        CUBLAS_OP_T, CUBLAS_OP_N,
-        batch_size * time_steps, input_size,
-        &alpha,
-        x_dev.data, input_size,
-        &beta,
-        x_dev.data, batch_size * time_steps,
-        x_t_dev.data, batch_size * time_steps);
-
-    cublasSgeam(
-        g_blas_handle,
-        CUBLAS_OP_T, CUBLAS_OP_N,
-        input_size, hidden_size * 4,
-        &alpha,
-        W_dev.data, hidden_size * 4,
-        &beta,
-        W_dev.data, input_size,
-        W_t_dev.data, input_size);
-
-    cublasSgeam(
-        g_blas_handle,
-        CUBLAS_OP_T, CUBLAS_OP_N,
-        hidden_size, hidden_size * 4,
-        &alpha,
-        R_dev.data, hidden_size * 4,
-        &beta,
-        R_dev.data, hidden_size,
-        R_t_dev.data, hidden_size);
+        0);
 
     backward.Run(
         time_steps,
-        W_t_dev.data,
-        R_t_dev.data,
+        W_dev.data,
+        R_dev.data,
         b_dev.data,
-        x_t_dev.data,
+        x_dev.data,
         h_dev.data,
         c_dev.data,
         dh_new_dev.data,
@@ -461,7 +414,8 @@ float HasteTrain(
         dh_dev.data,
         dc_dev.data,
         v_dev.data,
-        nullptr);
+        0.0f,
+        0);
   }, sample_size);
   return ms;
 }
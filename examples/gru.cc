@@ -109,7 +109,7 @@ void GruInference(const Tensor2& W, const Tensor2& R, const Tensor1& bx, const T
                     tmp_Wx_cur,
                     tmp_Rh_dev.data,
                     0.0f,      // zoneout prob
-                    nullptr);  // zoneout mask
+                    0);        // zoneout seed
   }
 }
 
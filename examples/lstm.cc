@@ -108,7 +108,7 @@ void LstmInference(const Tensor2& W, const Tensor2& R, const Tensor1& b, const T
       v_dev.data,
       tmp_Rh_dev.data,
       0.0f,      // zoneout prob
-      nullptr);  // zoneout mask
+      0);        // zoneout seed
 }
 
 void LstmTrain(const Tensor2& W, const Tensor2& R, const Tensor1& b, const Tensor3& x,
@@ -155,20 +155,9 @@ void LstmTrain(const Tensor2& W, const Tensor2& R, const Tensor1& b, const Tenso
         v_dev.data,
         tmp_Rh_dev.data,
         0.0f,      // zoneout prob
-        nullptr);  // zoneout mask
+        0);        // zoneout seed
   }
 
-  Eigen::array<int, 3> transpose_x({ 1, 2, 0 });
-  Tensor3 x_t = x.shuffle(transpose_x);
-
-  Eigen::array<int, 2> transpose({ 1, 0 });
-  Tensor2 W_t = W.shuffle(transpose);
-  Tensor2 R_t = R.shuffle(transpose);
-
-  device_ptr<Tensor3> x_t_dev(x_t);
-  device_ptr<Tensor2> W_t_dev(W_t);
-  device_ptr<Tensor2> R_t_dev(R_t);
-
   // These gradients should actually come "from above" but we're just allocating
   // a bunch of uninitialized memory and passing it in.
   device_ptr<Tensor3> dh_new_dev(dh);
@@ -197,10 +186,10 @@ void LstmTrain(const Tensor2& W, const Tensor2& R, const Tensor1& b, const Tenso
 
     backward.Run(
         time_steps,
-        W_t_dev.data,
-        R_t_dev.data,
+        W_dev.data,
+        R_dev.data,
         b_dev.data,
-        x_t_dev.data,
+        x_dev.data,
         h_dev.data,
         c_dev.data,
         dh_new_dev.data,
@@ -212,7 +201,8 @@ void LstmTrain(const Tensor2& W, const Tensor2& R, const Tensor1& b, const Tenso
         dh_dev.data,
         dc_dev.data,
         v_dev.data,
-        nullptr);
+        0.0f,
+        0);
   }
 }
 
@@ -261,21 +251,10 @@ void LstmTrainIterative(const Tensor2& W, const Tensor2& R, const Tensor1& b, co
           v_dev.data + t * NH * 4,
           tmp_Rh_dev.data,
           0.0f,      // zoneout prob
-          nullptr);  // zoneout mask
+          0);        // zoneout seed
     }
   }
 
-  Eigen::array<int, 3> transpose_x({ 1, 2, 0 });
-  Tensor3 x_t = x.shuffle(transpose_x);
-
-  Eigen::array<int, 2> transpose({ 1, 0 });
-  Tensor2 W_t = W.shuffle(transpose);
-  Tensor2 R_t = R.shuffle(transpose);
-
-  device_ptr<Tensor3> x_t_dev(x_t);
-  device_ptr<Tensor2> W_t_dev(W_t);
-  device_ptr<Tensor2> R_t_dev(R_t);
-
   // These gradients should actually come "from above" but we're just allocating
   // a bunch of uninitialized memory and passing it in.
   device_ptr<Tensor3> dh_new_dev(dh);
@@ -306,10 +285,10 @@ void LstmTrainIterative(const Tensor2& W, const Tensor2& R, const Tensor1& b, co
     const int NH = batch_size * hidden_size;
     for (int t = time_steps - 1; t >= 0; --t) {
       backward.Iterate(
-          W_t_dev.data,
-          R_t_dev.data,
+          W_dev.data,
+          R_dev.data,
           b_dev.data,
-          x_t_dev.data + t * NC,
+          x_dev.data + t * NC,
           h_dev.data + t * NH,
           c_dev.data + t * NH,
           c_dev.data + (t + 1) * NH,
@@ -322,7 +301,8 @@ void LstmTrainIterative(const Tensor2& W, const Tensor2& R, const Tensor1& b, co
           dh_dev.data,
           dc_dev.data,
           v_dev.data + t * NH * 4,
-          nullptr);
+          0.0f,
+          0);
     }
   }
 }
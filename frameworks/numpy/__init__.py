@@ -0,0 +1,31 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""
+Haste: a fast, simple, and open RNN library.
+"""
+
+
+from .gru import GRU
+from .layer_norm import LayerNorm
+from .layer_norm_lstm import LayerNormLSTM
+from .lstm import LSTM
+
+__all__ = [
+    'GRU',
+    'LayerNorm',
+    'LayerNormLSTM',
+    'LSTM'
+]
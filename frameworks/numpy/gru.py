@@ -0,0 +1,285 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Gated Recurrent Unit"""
+
+
+import numpy as np
+
+from . import support
+
+
+__all__ = [
+    'GRU',
+    'gru_forward',
+    'gru_backward'
+]
+
+
+def gru_forward(training, zoneout_prob, x, kernel, recurrent_kernel, bias, recurrent_bias, zoneout_mask=None):
+  """
+  Runs the GRU over all time steps.
+
+  Arguments:
+    training: bool, `True` if `gru_backward` will be called on the results.
+    zoneout_prob: float, the zoneout probability.
+    x: [T,N,C] the input sequence.
+    kernel: [C,H*3] the input weight matrix (`z,r,h` gate layout).
+    recurrent_kernel: [H,H*3] the recurrent weight matrix.
+    bias: [H*3] the input projection bias vector.
+    recurrent_bias: [H*3] the recurrent projection bias vector.
+    zoneout_mask: (optional) [T,N,H] the zoneout mask used in training mode.
+
+  Returns:
+    h: [T+1,N,H] the hidden states, with the (zero) initial state at `h[0]`.
+    v: [T,N,H*4] the activations `z,r,h` followed by the recurrent projection of
+      the candidate gate, needed by `gru_backward`.
+  """
+  time_steps, batch_size, input_size = x.shape
+  hidden_size = recurrent_kernel.shape[0]
+  H = hidden_size
+
+  h = np.zeros((time_steps + 1, batch_size, hidden_size), dtype=x.dtype)
+  v = np.empty((time_steps, batch_size, H * 4), dtype=x.dtype)
+
+  Wx = (np.dot(x.reshape(-1, input_size), kernel) + bias).reshape(time_steps, batch_size, H * 3)
+  for t in range(time_steps):
+    Rh = np.dot(h[t], recurrent_kernel) + recurrent_bias
+    v_t = v[t]
+    v_t[:, :2*H] = support.sigmoid(Wx[t, :, :2*H] + Rh[:, :2*H])
+    v_t[:, 3*H:] = Rh[:, 2*H:]
+    z, r = v_t[:, :H], v_t[:, H:2*H]
+    v_t[:, 2*H:3*H] = np.tanh(Wx[t, :, 2*H:] + r * Rh[:, 2*H:])
+    g = v_t[:, 2*H:3*H]
+
+    h[t+1] = support.apply_zoneout(
+        h[t],
+        z * h[t] + (1.0 - z) * g,
+        training,
+        zoneout_prob,
+        zoneout_mask[t] if zoneout_mask is not None else None)
+
+  return h, v
+
+
+def gru_backward(x, kernel, recurrent_kernel, bias, recurrent_bias, zoneout_mask, h, v, dh_new):
+  """
+  Runs the GRU backward pass over all time steps.
+
+  Arguments:
+    x, kernel, recurrent_kernel, bias, recurrent_bias, zoneout_mask: the
+      arguments that were passed to `gru_forward`.
+    h, v: the results of `gru_forward`.
+    dh_new: [T+1,N,H] the gradient of the loss with respect to `h`.
+
+  Returns:
+    dx: [T,N,C] the gradient with respect to `x`.
+    dW: [C,H*3] the gradient with respect to `kernel`.
+    dR: [H,H*3] the gradient with respect to `recurrent_kernel`.
+    dbx: [H*3] the gradient with respect to `bias`.
+    dbr: [H*3] the gradient with respect to `recurrent_bias`.
+  """
+  time_steps, batch_size, input_size = x.shape
+  hidden_size = recurrent_kernel.shape[0]
+  H = hidden_size
+
+  # `dp` is the gradient of the input projection and `dq` of the recurrent projection;
+  # they differ only in the candidate gate, where the reset gate sits in between.
+  dp = np.empty((time_steps, batch_size, H * 3), dtype=x.dtype)
+  dq = np.empty((time_steps, batch_size, H * 3), dtype=x.dtype)
+  dh = np.zeros((batch_size, hidden_size), dtype=x.dtype)
+  for t in reversed(range(time_steps)):
+    z, r, g, q_g = v[t, :, :H], v[t, :, H:2*H], v[t, :, 2*H:3*H], v[t, :, 3*H:]
+    dh_total, dh = support.zoneout_grad(dh_new[t+1] + dh, zoneout_mask[t] if zoneout_mask is not None else None)
+
+    dg = (1.0 - z) * dh_total * (1.0 - g * g)
+    dp[t, :, :H] = (h[t] - g) * dh_total * z * (1.0 - z)
+    dp[t, :, H:2*H] = dg * q_g * r * (1.0 - r)
+    dp[t, :, 2*H:] = dg
+    dq[t, :, :2*H] = dp[t, :, :2*H]
+    dq[t, :, 2*H:] = dg * r
+
+    dh = dh + z * dh_total + np.dot(dq[t], recurrent_kernel.T)
+
+  dp_flat = dp.reshape(-1, H * 3)
+  dq_flat = dq.reshape(-1, H * 3)
+  dx = np.dot(dp_flat, kernel.T).reshape(time_steps, batch_size, input_size)
+  dW = np.dot(x.reshape(-1, input_size).T, dp_flat)
+  dR = np.dot(h[:-1].reshape(-1, H).T, dq_flat)
+  dbx = dp_flat.sum(axis=0)
+  dbr = dq_flat.sum(axis=0)
+  return dx, dW, dR, dbx, dbr
+
+
+class GRU(object):
+  """
+  Gated Recurrent Unit layer.
+
+  A vectorized NumPy implementation of `haste_pytorch.GRU` for hosts where
+  neither PyTorch nor TensorFlow is available. Parameters use the same layout
+  as the PyTorch and TensorFlow layers, so trained weights can be assigned
+  directly. The input projection is computed for all time steps with a single
+  matrix multiplication.
+
+  See [\_\_init\_\_](#__init__) and [\_\_call\_\_](#__call__) for usage.
+  """
+
+  def __init__(self,
+      input_size,
+      hidden_size,
+      batch_first=False,
+      dropout=0.0,
+      zoneout=0.0,
+      dtype=np.float32,
+      seed=None):
+    """
+    Initialize the parameters of the GRU layer.
+
+    Arguments:
+      input_size: int, the feature dimension of the input.
+      hidden_size: int, the feature dimension of the output.
+      batch_first: (optional) bool, if `True`, then the input and output
+        arrays are provided as `(batch, seq, feature)`.
+      dropout: (optional) float, sets the dropout rate for DropConnect
+        regularization on the recurrent matrix.
+      zoneout: (optional) float, sets the zoneout rate for Zoneout
+        regularization.
+      dtype: (optional) the NumPy dtype of the parameters.
+      seed: (optional) int, seeds the generator used for initialization and
+        regularization masks.
+
+    Variables:
+      kernel: the input projection weight matrix. Dimensions
+        (input_size, hidden_size * 3) with `z,r,h` gate layout. Initialized
+        with Xavier uniform initialization.
+      recurrent_kernel: the recurrent projection weight matrix. Dimensions
+        (hidden_size, hidden_size * 3) with `z,r,h` gate layout. Initialized
+        with orthogonal initialization.
+      bias: the input projection bias vector. Dimensions (hidden_size * 3) with
+        `z,r,h` gate layout. Initialized to zeros.
+      recurrent_bias: the recurrent projection bias vector. Dimensions
+        (hidden_size * 3) with `z,r,h` gate layout. Initialized to zeros.
+    """
+    if dropout < 0 or dropout > 1:
+      raise ValueError('GRU: dropout must be in [0.0, 1.0]')
+    if zoneout < 0 or zoneout > 1:
+      raise ValueError('GRU: zoneout must be in [0.0, 1.0]')
+
+    self.input_size = input_size
+    self.hidden_size = hidden_size
+    self.batch_first = batch_first
+    self.dropout = dropout
+    self.zoneout = zoneout
+    self.dtype = dtype
+    self.training = False
+    self._rng = np.random.RandomState(seed)
+    self._saved = None
+    self.reset_parameters()
+
+  def reset_parameters(self):
+    """Resets this layer's parameters to their initial values."""
+    hidden_size = self.hidden_size
+    self.kernel, self.recurrent_kernel = support.init_gate_kernels(
+        self._rng, self.input_size, hidden_size, 3, self.dtype)
+    self.bias = np.zeros(hidden_size * 3, dtype=self.dtype)
+    self.recurrent_bias = np.zeros(hidden_size * 3, dtype=self.dtype)
+
+  def __call__(self, input, lengths=None):
+    """
+    Runs a forward pass of the GRU layer.
+
+    Arguments:
+      input: array, a batch of input sequences to pass through the GRU.
+        Dimensions (seq_len, batch_size, input_size) if `batch_first` is
+        `False`, otherwise (batch_size, seq_len, input_size).
+      lengths: (optional) array, list of sequence lengths for each batch
+        element. Dimension (batch_size). This argument may be omitted if
+        all batch elements are unpadded and have the same sequence length.
+
+    Returns:
+      output: array, the output of the GRU layer. Dimensions
+        (seq_len, batch_size, hidden_size) if `batch_first` is `False` (default)
+        or (batch_size, seq_len, hidden_size) if `batch_first` is `True`. Note
+        that if `lengths` was specified, the `output` array will not be
+        masked. It's the caller's responsibility to either not use the invalid
+        entries or to mask them out before using them.
+      h_n: the hidden state for the last sequence item. Dimensions
+        (1, batch_size, hidden_size).
+    """
+    input = np.asarray(input, dtype=self.dtype)
+    if self.batch_first:
+      input = input.transpose(1, 0, 2)
+    input = np.ascontiguousarray(input)
+
+    zoneout_mask = support.zoneout_mask(
+        self._rng,
+        (input.shape[0], input.shape[1], self.hidden_size),
+        self.zoneout,
+        self.dtype,
+        self.training)
+    dropout_seed = support.dropconnect_seed(self._rng, self.dropout, self.training)
+    recurrent_kernel = support.dropconnect(self.recurrent_kernel, self.dropout, dropout_seed)
+    h, v = gru_forward(
+        self.training,
+        self.zoneout,
+        input,
+        self.kernel,
+        recurrent_kernel,
+        self.bias,
+        self.recurrent_bias,
+        zoneout_mask)
+    self._saved = (input, recurrent_kernel, zoneout_mask, h, v, dropout_seed) if self.training else None
+
+    state = support.last_state(h, lengths)
+    output = h[1:]
+    if self.batch_first:
+      output = output.transpose(1, 0, 2)
+    return output, state
+
+  def backward(self, grad_output, grad_state=None):
+    """
+    Runs a backward pass through the most recent training-mode forward pass.
+
+    Arguments:
+      grad_output: array, the gradient of the loss with respect to `output`.
+      grad_state: (optional) array, the gradient of the loss with respect to
+        `h_n`. Only supported if `lengths` was not specified in the forward
+        pass.
+
+    Returns:
+      grad_input: array, the gradient of the loss with respect to `input`.
+      grads: dict, the gradients of the loss with respect to `kernel`,
+        `recurrent_kernel`, `bias`, and `recurrent_bias`.
+    """
+    if self._saved is None:
+      raise RuntimeError('GRU backward can only be called after a forward pass in training mode')
+
+    input, recurrent_kernel, zoneout_mask, h, v, dropout_seed = self._saved
+    grad_output = np.asarray(grad_output, dtype=self.dtype)
+    if self.batch_first:
+      grad_output = grad_output.transpose(1, 0, 2)
+
+    dh_new = np.zeros_like(h)
+    dh_new[1:] = grad_output
+    if grad_state is not None:
+      dh_new[-1] += grad_state[0]
+
+    dx, dW, dR, dbx, dbr = gru_backward(
+        input, self.kernel, recurrent_kernel, self.bias, self.recurrent_bias, zoneout_mask, h, v, dh_new)
+    dR = support.dropconnect_grad(dR, self.dropout, dropout_seed)
+
+    if self.batch_first:
+      dx = dx.transpose(1, 0, 2)
+    return dx, { 'kernel': dW, 'recurrent_kernel': dR, 'bias': dbx, 'recurrent_bias': dbr }
@@ -0,0 +1,158 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Layer Normalization"""
+
+
+import numpy as np
+
+
+__all__ = [
+    'LayerNorm',
+    'layer_norm_forward',
+    'layer_norm_backward'
+]
+
+
+EPSILON = 1e-5
+
+
+def layer_norm_forward(x, gamma, beta=None):
+  """
+  Normalizes the last dimension of `x`.
+
+  Arguments:
+    x: [..., H] the input.
+    gamma: [H] the gain.
+    beta: (optional) [H] the bias. May be `None` to skip the bias.
+
+  Returns:
+    y: [..., H] the normalized output.
+    cache: [..., 2] the mean and inverse standard deviation of each row, needed
+      by `layer_norm_backward`.
+  """
+  mean = x.mean(axis=-1, keepdims=True)
+  centered = x - mean
+  invstd = 1.0 / np.sqrt((centered * centered).mean(axis=-1, keepdims=True) + EPSILON)
+  y = centered * invstd * gamma
+  if beta is not None:
+    y += beta
+  cache = np.concatenate([mean, invstd], axis=-1).astype(x.dtype)
+  return y, cache
+
+
+def layer_norm_backward(x, gamma, beta, dy, cache):
+  """
+  Runs the layer norm backward pass.
+
+  Arguments:
+    x, gamma, beta: the arguments that were passed to `layer_norm_forward`.
+    dy: [..., H] the gradient of the loss with respect to the output.
+    cache: the cache returned by `layer_norm_forward`.
+
+  Returns:
+    dx: [..., H] the gradient with respect to `x`.
+    dgamma: [H] the gradient with respect to `gamma`.
+    dbeta: [H] the gradient with respect to `beta`, or `None` if `beta` is `None`.
+  """
+  hidden_size = x.shape[-1]
+  invstd = cache[..., 1:2]
+  x_hat = (x - cache[..., 0:1]) * invstd
+  dx_hat = dy * gamma
+
+  rows = dy.reshape(-1, hidden_size)
+  dgamma = (x_hat.reshape(-1, hidden_size) * rows).sum(axis=0)
+  dbeta = rows.sum(axis=0) if beta is not None else None
+
+  dx = invstd * (dx_hat
+      - dx_hat.mean(axis=-1, keepdims=True)
+      - x_hat * (dx_hat * x_hat).mean(axis=-1, keepdims=True))
+  return dx, dgamma, dbeta
+
+
+class LayerNorm(object):
+  """
+  Layer normalization layer.
+
+  A NumPy implementation of layer normalization as described by
+  [Ba et al.](https://arxiv.org/abs/1607.06450) that matches the native
+  implementations, including the epsilon.
+  """
+
+  def __init__(self, dtype=np.float32):
+    """
+    Initialize the layer normalization layer.
+
+    Arguments:
+      dtype: (optional) the NumPy dtype of the parameters.
+    """
+    self.dtype = dtype
+    self.gamma = None
+    self.beta = None
+    self.built = False
+    self._saved = None
+
+  def build(self, shape):
+    """
+    Creates the parameters of the layer.
+
+    Calling this method is optional for users of the LayerNorm class. It is
+    called internally with the correct shape when `__call__` is invoked.
+
+    Arguments:
+      shape: tuple, the shape of the input.
+    """
+    if self.built:
+      return
+    hidden_size = int(shape[-1])
+    self.gamma = np.ones(hidden_size, dtype=self.dtype)
+    self.beta = np.zeros(hidden_size, dtype=self.dtype)
+    self.built = True
+
+  def __call__(self, x):
+    """
+    Runs the layer.
+
+    Arguments:
+      x: array, a rank R array.
+
+    Returns:
+      y: array, a rank R array with the last dimension normalized.
+    """
+    x = np.asarray(x, dtype=self.dtype)
+    self.build(x.shape)
+    y, cache = layer_norm_forward(x, self.gamma, self.beta)
+    self._saved = (x, cache)
+    return y
+
+  def backward(self, grad_y):
+    """
+    Runs a backward pass through the most recent forward pass.
+
+    Arguments:
+      grad_y: array, the gradient of the loss with respect to `y`.
+
+    Returns:
+      grad_x: array, the gradient of the loss with respect to `x`.
+      grads: dict, the gradients of the loss with respect to `gamma` and
+        `beta`.
+    """
+    if self._saved is None:
+      raise RuntimeError('LayerNorm backward can only be called after a forward pass')
+
+    x, cache = self._saved
+    dx, dgamma, dbeta = layer_norm_backward(
+        x, self.gamma, self.beta, np.asarray(grad_y, dtype=self.dtype), cache)
+    return dx, { 'gamma': dgamma, 'beta': dbeta }
@@ -0,0 +1,378 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Layer Normalized Long Short-Term Memory"""
+
+
+import numpy as np
+
+from . import support
+from .layer_norm import layer_norm_forward, layer_norm_backward
+
+
+__all__ = [
+    'LayerNormLSTM',
+    'layer_norm_lstm_forward',
+    'layer_norm_lstm_backward'
+]
+
+
+def layer_norm_lstm_forward(
+    training,
+    zoneout_prob,
+    x,
+    kernel,
+    recurrent_kernel,
+    bias,
+    gamma,
+    gamma_h,
+    beta_h,
+    zoneout_mask=None):
+  """
+  Runs the layer normalized LSTM over all time steps.
+
+  Arguments:
+    training: bool, `True` if `layer_norm_lstm_backward` will be called on the
+      results.
+    zoneout_prob: float, the zoneout probability.
+    x: [T,N,C] the input sequence.
+    kernel: [C,H*4] the input weight matrix (`i,g,f,o` gate layout).
+    recurrent_kernel: [H,H*4] the recurrent weight matrix.
+    bias: [H*4] the bias vector.
+    gamma: [2,H*4] the input and recurrent normalization gains.
+    gamma_h: [H] the cell state normalization gain.
+    beta_h: [H] the cell state normalization bias.
+    zoneout_mask: (optional) [T,N,H] the zoneout mask used in training mode.
+
+  Returns:
+    h: [T+1,N,H] the hidden states, with the (zero) initial state at `h[0]`.
+    c: [T+1,N,H] the cell states, with the (zero) initial state at `c[0]`.
+    cache: tuple, intermediate activations needed by
+      `layer_norm_lstm_backward`.
+  """
+  time_steps, batch_size, input_size = x.shape
+  hidden_size = recurrent_kernel.shape[0]
+  H = hidden_size
+
+  h = np.zeros((time_steps + 1, batch_size, hidden_size), dtype=x.dtype)
+  c = np.zeros((time_steps + 1, batch_size, hidden_size), dtype=x.dtype)
+  act_Rh = np.empty((time_steps, batch_size, H * 4), dtype=x.dtype)
+  cache_Rh = np.empty((time_steps, batch_size, 2), dtype=x.dtype)
+  act_c_norm = np.empty((time_steps, batch_size, H), dtype=x.dtype)
+  cache_c = np.empty((time_steps, batch_size, 2), dtype=x.dtype)
+
+  # Layer norm is applied per row, so the input projection and its normalization can
+  # both be done for the whole sequence up front.
+  act_Wx = np.dot(x.reshape(-1, input_size), kernel).reshape(time_steps, batch_size, H * 4)
+  v, cache_Wx = layer_norm_forward(act_Wx, gamma[0])
+  v += bias
+  for t in range(time_steps):
+    act_Rh[t] = np.dot(h[t], recurrent_kernel)
+    Rh_norm, cache_Rh[t] = layer_norm_forward(act_Rh[t], gamma[1])
+
+    v_t = v[t]
+    v_t += Rh_norm
+    v_t[:, :H] = support.sigmoid(v_t[:, :H])
+    v_t[:, H:2*H] = np.tanh(v_t[:, H:2*H])
+    v_t[:, 2*H:] = support.sigmoid(v_t[:, 2*H:])
+    i, g, f, o = v_t[:, :H], v_t[:, H:2*H], v_t[:, 2*H:3*H], v_t[:, 3*H:]
+
+    c[t+1] = f * c[t] + i * g
+    act_c_norm[t], cache_c[t] = layer_norm_forward(c[t+1], gamma_h, beta_h)
+    h[t+1] = support.apply_zoneout(
+        h[t],
+        o * np.tanh(act_c_norm[t]),
+        training,
+        zoneout_prob,
+        zoneout_mask[t] if zoneout_mask is not None else None)
+
+  return h, c, (v, act_Wx, cache_Wx, act_Rh, cache_Rh, act_c_norm, cache_c)
+
+
+def layer_norm_lstm_backward(
+    x,
+    kernel,
+    recurrent_kernel,
+    bias,
+    gamma,
+    gamma_h,
+    beta_h,
+    zoneout_mask,
+    h,
+    c,
+    cache,
+    dh_new,
+    dc_new):
+  """
+  Runs the layer normalized LSTM backward pass over all time steps.
+
+  Arguments:
+    x, kernel, recurrent_kernel, bias, gamma, gamma_h, beta_h, zoneout_mask:
+      the arguments that were passed to `layer_norm_lstm_forward`.
+    h, c, cache: the results of `layer_norm_lstm_forward`.
+    dh_new: [T+1,N,H] the gradient of the loss with respect to `h`.
+    dc_new: [T+1,N,H] the gradient of the loss with respect to `c`.
+
+  Returns:
+    dx: [T,N,C] the gradient with respect to `x`.
+    dW: [C,H*4] the gradient with respect to `kernel`.
+    dR: [H,H*4] the gradient with respect to `recurrent_kernel`.
+    db: [H*4] the gradient with respect to `bias`.
+    dgamma: [2,H*4] the gradient with respect to `gamma`.
+    dgamma_h: [H] the gradient with respect to `gamma_h`.
+    dbeta_h: [H] the gradient with respect to `beta_h`.
+  """
+  time_steps, batch_size, input_size = x.shape
+  hidden_size = recurrent_kernel.shape[0]
+  H = hidden_size
+  v, act_Wx, cache_Wx, act_Rh, cache_Rh, act_c_norm, cache_c = cache
+
+  dv = np.empty_like(v)
+  dRh = np.empty_like(act_Rh)
+  dgamma = np.zeros_like(gamma)
+  dgamma_h = np.zeros_like(gamma_h)
+  dbeta_h = np.zeros_like(beta_h)
+  dh = np.zeros((batch_size, hidden_size), dtype=x.dtype)
+  dc = np.zeros((batch_size, hidden_size), dtype=x.dtype)
+  for t in reversed(range(time_steps)):
+    i, g, f, o = v[t, :, :H], v[t, :, H:2*H], v[t, :, 2*H:3*H], v[t, :, 3*H:]
+    dh_total, dh = support.zoneout_grad(dh_new[t+1] + dh, zoneout_mask[t] if zoneout_mask is not None else None)
+
+    c_tanh = np.tanh(act_c_norm[t])
+    dc_norm, dgamma_h_t, dbeta_h_t = layer_norm_backward(
+        c[t+1], gamma_h, beta_h, (1.0 - c_tanh * c_tanh) * o * dh_total, cache_c[t])
+    dgamma_h += dgamma_h_t
+    dbeta_h += dbeta_h_t
+    dc_total = dc_new[t+1] + dc + dc_norm
+
+    dv_t = dv[t]
+    dv_t[:, :H] = i * (1.0 - i) * g * dc_total
+    dv_t[:, H:2*H] = (1.0 - g * g) * i * dc_total
+    dv_t[:, 2*H:3*H] = f * (1.0 - f) * c[t] * dc_total
+    dv_t[:, 3*H:] = o * (1.0 - o) * c_tanh * dh_total
+
+    dRh[t], dgamma_Rh_t, _ = layer_norm_backward(act_Rh[t], gamma[1], None, dv_t, cache_Rh[t])
+    dgamma[1] += dgamma_Rh_t
+
+    dc = f * dc_total
+    dh = dh + np.dot(dRh[t], recurrent_kernel.T)
+
+  dWx, dgamma[0], _ = layer_norm_backward(act_Wx, gamma[0], None, dv, cache_Wx)
+
+  dWx_flat = dWx.reshape(-1, H * 4)
+  dx = np.dot(dWx_flat, kernel.T).reshape(time_steps, batch_size, input_size)
+  dW = np.dot(x.reshape(-1, input_size).T, dWx_flat)
+  dR = np.dot(h[:-1].reshape(-1, H).T, dRh.reshape(-1, H * 4))
+  db = dv.reshape(-1, H * 4).sum(axis=0)
+  return dx, dW, dR, db, dgamma, dgamma_h, dbeta_h
+
+
+class LayerNormLSTM(object):
+  """
+  Layer Normalized Long Short-Term Memory layer.
+
+  A vectorized NumPy implementation of `haste_pytorch.LayerNormLSTM` for hosts
+  where neither PyTorch nor TensorFlow is available. Parameters use the same
+  layout as the PyTorch and TensorFlow layers, so trained weights can be
+  assigned directly. The input projection and its layer norm are computed for
+  all time steps at once.
+
+  See [\_\_init\_\_](#__init__) and [\_\_call\_\_](#__call__) for usage.
+  """
+
+  def __init__(self,
+      input_size,
+      hidden_size,
+      batch_first=False,
+      forget_bias=1.0,
+      dropout=0.0,
+      zoneout=0.0,
+      dtype=np.float32,
+      seed=None):
+    """
+    Initialize the parameters of the LSTM layer.
+
+    Arguments:
+      input_size: int, the feature dimension of the input.
+      hidden_size: int, the feature dimension of the output.
+      batch_first: (optional) bool, if `True`, then the input and output
+        arrays are provided as `(batch, seq, feature)`.
+      forget_bias: (optional) float, sets the initial bias of the forget gate
+        for this LSTM cell.
+      dropout: (optional) float, sets the dropout rate for DropConnect
+        regularization on the recurrent matrix.
+      zoneout: (optional) float, sets the zoneout rate for Zoneout
+        regularization.
+      dtype: (optional) the NumPy dtype of the parameters.
+      seed: (optional) int, seeds the generator used for initialization and
+        regularization masks.
+
+    Variables:
+      kernel: the input projection weight matrix. Dimensions
+        (input_size, hidden_size * 4) with `i,g,f,o` gate layout. Initialized
+        with Xavier uniform initialization.
+      recurrent_kernel: the recurrent projection weight matrix. Dimensions
+        (hidden_size, hidden_size * 4) with `i,g,f,o` gate layout. Initialized
+        with orthogonal initialization.
+      bias: the projection bias vector. Dimensions (hidden_size * 4) with
+        `i,g,f,o` gate layout. The forget gate biases are initialized to
+        `forget_bias` and the rest are zeros.
+      gamma: the input and recurrent normalization gain. Dimensions
+        (2, hidden_size * 4) with `gamma[0]` specifying the input gain and
+        `gamma[1]` specifying the recurrent gain. Initialized to ones.
+      gamma_h: the output normalization gain. Dimensions (hidden_size).
+        Initialized to ones.
+      beta_h: the output normalization bias. Dimensions (hidden_size).
+        Initialized to zeros.
+    """
+    if dropout < 0 or dropout > 1:
+      raise ValueError('LayerNormLSTM: dropout must be in [0.0, 1.0]')
+    if zoneout < 0 or zoneout > 1:
+      raise ValueError('LayerNormLSTM: zoneout must be in [0.0, 1.0]')
+
+    self.input_size = input_size
+    self.hidden_size = hidden_size
+    self.batch_first = batch_first
+    self.forget_bias = forget_bias
+    self.dropout = dropout
+    self.zoneout = zoneout
+    self.dtype = dtype
+    self.training = False
+    self._rng = np.random.RandomState(seed)
+    self._saved = None
+    self.reset_parameters()
+
+  def reset_parameters(self):
+    """Resets this layer's parameters to their initial values."""
+    hidden_size = self.hidden_size
+    self.kernel, self.recurrent_kernel = support.init_gate_kernels(
+        self._rng, self.input_size, hidden_size, 4, self.dtype)
+    self.bias = np.zeros(hidden_size * 4, dtype=self.dtype)
+    self.bias[hidden_size*2:hidden_size*3] = self.forget_bias
+    self.gamma = np.ones((2, hidden_size * 4), dtype=self.dtype)
+    self.gamma_h = np.ones(hidden_size, dtype=self.dtype)
+    self.beta_h = np.zeros(hidden_size, dtype=self.dtype)
+
+  def __call__(self, input, lengths=None):
+    """
+    Runs a forward pass of the LSTM layer.
+
+    Arguments:
+      input: array, a batch of input sequences to pass through the LSTM.
+        Dimensions (seq_len, batch_size, input_size) if `batch_first` is
+        `False`, otherwise (batch_size, seq_len, input_size).
+      lengths: (optional) array, list of sequence lengths for each batch
+        element. Dimension (batch_size). This argument may be omitted if
+        all batch elements are unpadded and have the same sequence length.
+
+    Returns:
+      output: array, the output of the LSTM layer. Dimensions
+        (seq_len, batch_size, hidden_size) if `batch_first` is `False` (default)
+        or (batch_size, seq_len, hidden_size) if `batch_first` is `True`. Note
+        that if `lengths` was specified, the `output` array will not be
+        masked. It's the caller's responsibility to either not use the invalid
+        entries or to mask them out before using them.
+      (h_n, c_n): the hidden and cell states, respectively, for the last
+        sequence item. Dimensions (1, batch_size, hidden_size).
+    """
+    input = np.asarray(input, dtype=self.dtype)
+    if self.batch_first:
+      input = input.transpose(1, 0, 2)
+    input = np.ascontiguousarray(input)
+
+    zoneout_mask = support.zoneout_mask(
+        self._rng,
+        (input.shape[0], input.shape[1], self.hidden_size),
+        self.zoneout,
+        self.dtype,
+        self.training)
+    dropout_seed = support.dropconnect_seed(self._rng, self.dropout, self.training)
+    recurrent_kernel = support.dropconnect(self.recurrent_kernel, self.dropout, dropout_seed)
+    h, c, cache = layer_norm_lstm_forward(
+        self.training,
+        self.zoneout,
+        input,
+        self.kernel,
+        recurrent_kernel,
+        self.bias,
+        self.gamma,
+        self.gamma_h,
+        self.beta_h,
+        zoneout_mask)
+    self._saved = (input, recurrent_kernel, zoneout_mask, h, c, cache, dropout_seed) if self.training else None
+
+    state = (support.last_state(h, lengths), support.last_state(c, lengths))
+    output = h[1:]
+    if self.batch_first:
+      output = output.transpose(1, 0, 2)
+    return output, state
+
+  def backward(self, grad_output, grad_state=None):
+    """
+    Runs a backward pass through the most recent training-mode forward pass.
+
+    Arguments:
+      grad_output: array, the gradient of the loss with respect to `output`.
+      grad_state: (optional) tuple `(dh_n, dc_n)`, the gradients of the loss
+        with respect to the final states. Only supported if `lengths` was not
+        specified in the forward pass.
+
+    Returns:
+      grad_input: array, the gradient of the loss with respect to `input`.
+      grads: dict, the gradients of the loss with respect to `kernel`,
+        `recurrent_kernel`, `bias`, `gamma`, `gamma_h`, and `beta_h`.
+    """
+    if self._saved is None:
+      raise RuntimeError('LayerNormLSTM backward can only be called after a forward pass in training mode')
+
+    input, recurrent_kernel, zoneout_mask, h, c, cache, dropout_seed = self._saved
+    grad_output = np.asarray(grad_output, dtype=self.dtype)
+    if self.batch_first:
+      grad_output = grad_output.transpose(1, 0, 2)
+
+    dh_new = np.zeros_like(h)
+    dc_new = np.zeros_like(c)
+    dh_new[1:] = grad_output
+    if grad_state is not None:
+      dh_new[-1] += grad_state[0][0]
+      dc_new[-1] += grad_state[1][0]
+
+    dx, dW, dR, db, dgamma, dgamma_h, dbeta_h = layer_norm_lstm_backward(
+        input,
+        self.kernel,
+        recurrent_kernel,
+        self.bias,
+        self.gamma,
+        self.gamma_h,
+        self.beta_h,
+        zoneout_mask,
+        h,
+        c,
+        cache,
+        dh_new,
+        dc_new)
+    dR = support.dropconnect_grad(dR, self.dropout, dropout_seed)
+
+    if self.batch_first:
+      dx = dx.transpose(1, 0, 2)
+    grads = {
+        'kernel': dW,
+        'recurrent_kernel': dR,
+        'bias': db,
+        'gamma': dgamma,
+        'gamma_h': dgamma_h,
+        'beta_h': dbeta_h,
+    }
+    return dx, grads
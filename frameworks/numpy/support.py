@@ -0,0 +1,107 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Shared helpers for the NumPy implementations."""
+
+
+import numpy as np
+
+
+def sigmoid(x):
+  # Evaluated through tanh so large negative inputs don't overflow `exp`.
+  return 0.5 * np.tanh(0.5 * x) + 0.5
+
+
+def xavier_uniform(rng, shape, dtype):
+  limit = np.sqrt(6.0 / (shape[0] + shape[1]))
+  return rng.uniform(-limit, limit, shape).astype(dtype)
+
+
+def orthogonal(rng, shape, dtype):
+  rows, cols = shape
+  a = rng.normal(0.0, 1.0, (max(rows, cols), min(rows, cols)))
+  q, r = np.linalg.qr(a)
+  q *= np.sign(np.diag(r))
+  if rows < cols:
+    q = q.T
+  return q.astype(dtype)
+
+
+def init_gate_kernels(rng, input_size, hidden_size, gates, dtype):
+  """Xavier uniform input kernel and orthogonal recurrent kernel, per gate."""
+  kernel = np.empty((input_size, hidden_size * gates), dtype=dtype)
+  recurrent_kernel = np.empty((hidden_size, hidden_size * gates), dtype=dtype)
+  for i in range(gates):
+    kernel[:, i*hidden_size:(i+1)*hidden_size] = xavier_uniform(rng, (input_size, hidden_size), dtype)
+    recurrent_kernel[:, i*hidden_size:(i+1)*hidden_size] = orthogonal(rng, (hidden_size, hidden_size), dtype)
+  return kernel, recurrent_kernel
+
+
+def dropconnect_seed(rng, dropout, training):
+  """Returns the seed of a new DropConnect mask in training mode and `None` otherwise."""
+  if not training or not dropout:
+    return None
+  return rng.randint(2**31)
+
+
+def dropconnect_mask(seed, shape, dropout):
+  """Regenerates the boolean DropConnect mask drawn from `seed`."""
+  return np.random.RandomState(seed).uniform(size=shape) >= dropout
+
+
+def dropconnect(recurrent_kernel, dropout, seed):
+  if seed is None:
+    return recurrent_kernel
+  mask = dropconnect_mask(seed, recurrent_kernel.shape, dropout)
+  return recurrent_kernel * mask / (1.0 - dropout)
+
+
+def dropconnect_grad(dR, dropout, seed):
+  """Applies the DropConnect mask and scaling of the forward pass to `dR`."""
+  if seed is None:
+    return dR
+  mask = dropconnect_mask(seed, dR.shape, dropout)
+  return dR * mask / (1.0 - dropout)
+
+
+def zoneout_mask(rng, shape, zoneout, dtype, training):
+  """Returns a Bernoulli(1-zoneout) mask in training mode and `None` otherwise."""
+  if not training or not zoneout:
+    return None
+  return (rng.uniform(size=shape) >= zoneout).astype(dtype)
+
+
+def apply_zoneout(h_prev, h_new, training, zoneout_prob, zoneout_mask):
+  if not zoneout_prob:
+    return h_new
+  if not training:
+    return zoneout_prob * h_prev + (1.0 - zoneout_prob) * h_new
+  if zoneout_mask is not None:
+    return (h_new - h_prev) * zoneout_mask + h_prev
+  return h_new
+
+
+def zoneout_grad(dh_total, zoneout_mask):
+  """Splits `dh_total` into the part flowing through the cell and the part zoned out."""
+  if zoneout_mask is None:
+    return dh_total, 0.0
+  return dh_total * zoneout_mask, dh_total * (1.0 - zoneout_mask)
+
+
+def last_state(h, lengths):
+  """Picks the state after the last valid step of each sequence from `h` [T+1,N,H]."""
+  if lengths is None:
+    return h[-1][np.newaxis]
+  return h[np.asarray(lengths), np.arange(h.shape[1])][np.newaxis]
@@ -18,12 +18,14 @@ Haste: a fast, simple, and open RNN library.
 """
 
 
-from .gru import GRU
-from .lstm import LSTM
+from .gru import GRU, QuantizedGRU
+from .lstm import LSTM, QuantizedLSTM
 from .layer_norm_lstm import LayerNormLSTM
 
 __all__ = [
     'GRU',
     'LSTM',
-    'LayerNormLSTM'
+    'LayerNormLSTM',
+    'QuantizedGRU',
+    'QuantizedLSTM'
 ]
@@ -13,161 +13,541 @@
 // limitations under the License.
 // ==============================================================================
 
+#ifdef WITH_CUDA
 #include <ATen/cuda/CUDAContext.h>
+#endif
+#include <functional>
+#include <memory>
 #include <torch/extension.h>
 #include <vector>
 
+#ifdef WITH_CUDA
 #include "haste.h"
+#else
+#include "haste/cpu/gru.h"
+#endif
 #include "support.h"
 
 namespace {
 
+namespace cpu = haste::v0::cpu;
+
+#ifdef WITH_CUDA
 using haste::v0::gru::ForwardPass;
 using haste::v0::gru::BackwardPass;
+#endif
 
 using torch::Tensor;
 
+// If `reverse` is set, the GRU runs from the last time step to the first, the initial
+// state goes in the last slot of the returned hidden states, and the output of time step
+// t is in slot t. `sequence_length` is either empty or holds the length of each sequence;
+// steps past the end carry the state through unchanged. Both are only supported on the
+// CPU.
 std::vector<Tensor> gru_forward(
+    Workspace& workspace,
     bool training,
     float zoneout_prob,
+    float dropout_prob,
+    bool reverse,
     Tensor x,
     Tensor kernel,
     Tensor recurrent_kernel,
     Tensor bias,
     Tensor recurrent_bias,
-    Tensor zoneout_mask) {
+    Tensor h0,
+    int64_t zoneout_seed,
+    int64_t dropout_seed,
+    Tensor sequence_length) {
   const auto time_steps = x.size(0);
   const auto batch_size = x.size(1);
   const auto input_size = x.size(2);
   const auto hidden_size = recurrent_kernel.size(0);
-  const bool has_zoneout = zoneout_prob && zoneout_mask.size(0);
 
   CHECK_INPUT(x);
   CHECK_INPUT(kernel);
   CHECK_INPUT(recurrent_kernel);
   CHECK_INPUT(bias);
   CHECK_INPUT(recurrent_bias);
-  CHECK_INPUT(zoneout_mask);
+  CHECK_SHAPE(h0, batch_size, hidden_size);
+  CHECK_FULL_PRECISION(x, "GRU");
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+  TORCH_CHECK(!x.is_cuda() || (!reverse && !sequence_length.numel()),
+      "the GPU GRU doesn't support reverse or sequence_length; reverse the input instead");
+
+  // The CPU pass applies DropConnect as it packs the recurrent kernel; the GPU pass runs
+  // with a dropped-out copy.
+  const Tensor dropped_recurrent_kernel = x.is_cuda()
+      ? DropConnect(workspace, "dropped_recurrent_kernel", recurrent_kernel, dropout_prob, { dropout_seed })
+      : recurrent_kernel;
 
-  Tensor output = torch::zeros({ time_steps, batch_size, hidden_size }, at::kCUDA);
-  Tensor cache = torch::empty({ time_steps, batch_size, hidden_size * 4 }, at::kCUDA);
-  Tensor tmp_Wx = torch::empty({ time_steps, batch_size, hidden_size * 3 }, at::kCUDA);
-  Tensor tmp_Rh = torch::empty({ batch_size, hidden_size * 3 }, at::kCUDA);
+  // The t=0 slot (t=T in reverse) holds the initial state; the passes fill in the rest.
+  Tensor output = torch::empty({ time_steps + 1, batch_size, hidden_size }, x.options());
+  output[reverse ? time_steps : 0].copy_(h0);
+  // The activations are only kept for the backward pass in training mode.
+  Tensor cache = training
+      ? torch::empty({ time_steps, batch_size, hidden_size * 4 }, x.options())
+      : workspace.Get("cache", { time_steps, batch_size, hidden_size * 4 }, x.options());
+  Tensor tmp_Wx = workspace.Get("tmp_Wx", { time_steps, batch_size, hidden_size * 3 }, x.options());
+  Tensor tmp_Rh = workspace.Get("tmp_Rh", { batch_size, hidden_size * 3 }, x.options());
 
   AT_DISPATCH_FLOATING_TYPES(x.type(), "gru_forward", ([&] {
-    ForwardPass<scalar_t> forward(
-        training,
-        batch_size,
-        input_size,
-        hidden_size,
-        at::cuda::getCurrentCUDABlasHandle());
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      ForwardPass<scalar_t> forward(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
 
-    auto x_a = x.packed_accessor<scalar_t, 3>();
-    auto output_a = output.packed_accessor<scalar_t, 3>();
-    auto cache_a = cache.packed_accessor<scalar_t, 3>();
-    auto tmp_Wx_a = tmp_Wx.packed_accessor<scalar_t, 3>();
-    auto zoneout_mask_a = zoneout_mask.packed_accessor<scalar_t, 3>();
+      auto x_a = x.packed_accessor<scalar_t, 3>();
+      auto output_a = output.packed_accessor<scalar_t, 3>();
+      auto cache_a = cache.packed_accessor<scalar_t, 3>();
+      auto tmp_Wx_a = tmp_Wx.packed_accessor<scalar_t, 3>();
 
-    for (auto i = decltype(time_steps){0}; i < time_steps; ++i) {
-      forward.Iterate(
+      for (auto i = decltype(time_steps){0}; i < time_steps; ++i) {
+        forward.Iterate(
+            kernel.data<scalar_t>(),
+            dropped_recurrent_kernel.data<scalar_t>(),
+            bias.data<scalar_t>(),
+            recurrent_bias.data<scalar_t>(),
+            x_a[i].data(),
+            output_a[i].data(),
+            output_a[i + 1].data(),
+            cache_a[i].data(),
+            tmp_Wx_a[i].data(),
+            tmp_Rh.data<scalar_t>(),
+            zoneout_prob,
+            zoneout_seed + i);
+      }
+#endif
+    } else {
+      cpu::gru::ForwardPass<scalar_t> forward(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+      // Each direction of a bidirectional layer keeps its own packed kernel.
+      const auto packed_R = PackRecurrentKernel<scalar_t>(
+          workspace, reverse ? "packed_recurrent_kernel_reverse" : "packed_recurrent_kernel",
+          forward, recurrent_kernel, dropout_prob, { dropout_seed });
+
+      forward.Run(
+          time_steps,
           kernel.data<scalar_t>(),
           recurrent_kernel.data<scalar_t>(),
           bias.data<scalar_t>(),
           recurrent_bias.data<scalar_t>(),
-          x_a[i].data(),
-          output_a[std::max(i - 1, decltype(i){0})].data(),
-          output_a[i].data(),
-          cache_a[i].data(),
-          tmp_Wx_a[i].data(),
+          x.data<scalar_t>(),
+          output.data<scalar_t>(),
+          cache.data<scalar_t>(),
+          tmp_Wx.data<scalar_t>(),
           tmp_Rh.data<scalar_t>(),
-          has_zoneout ? zoneout_prob : 0.0f,
-          has_zoneout ? zoneout_mask_a[i].data() : nullptr);
+          zoneout_prob,
+          zoneout_seed,
+          sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr,
+          reverse,
+          packed_R[0]);
     }
   }));
 
   return { output, cache };
 }
 
+#ifdef WITH_CUDA
+template<typename T>
+void IterateBackward(
+    BackwardPass<T>& backward,
+    const Tensor& x,
+    const Tensor& kernel,
+    const Tensor& recurrent_kernel,
+    const Tensor& bias,
+    const Tensor& recurrent_bias,
+    const float zoneout_prob,
+    const int64_t zoneout_seed,
+    const Tensor& h,
+    const Tensor& cache,
+    const Tensor& dh_new,
+    Tensor& dx,
+    Tensor& dW,
+    Tensor& dR,
+    Tensor& dbx,
+    Tensor& dbr,
+    Tensor& dh,
+    Tensor& dp,
+    Tensor& dq) {
+  const auto time_steps = x.size(0);
+  const auto NC = x.size(1) * x.size(2);
+
+  auto x_a = x.packed_accessor<T, 3>();
+  auto h_a = h.packed_accessor<T, 3>();
+  auto cache_a = cache.packed_accessor<T, 3>();
+  auto dh_new_a = dh_new.packed_accessor<T, 3>();
+  auto dp_a = dp.packed_accessor<T, 3>();
+  auto dq_a = dq.packed_accessor<T, 3>();
+
+  for (auto i = time_steps - 1; i >= 0; --i) {
+    backward.Iterate(
+        kernel.data<T>(),
+        recurrent_kernel.data<T>(),
+        bias.data<T>(),
+        recurrent_bias.data<T>(),
+        x_a[i].data(),
+        h_a[i].data(),
+        cache_a[i].data(),
+        dh_new_a[i + 1].data(),
+        dx.defined() ? ptr<T>(dx) + i * NC : nullptr,
+        ptr<T>(dW),
+        ptr<T>(dR),
+        dbx.data<T>(),
+        dbr.data<T>(),
+        dh.data<T>(),
+        dp_a[i].data(),
+        dq_a[i].data(),
+        zoneout_prob,
+        zoneout_seed + i);
+  }
+}
+#endif
+
+// `needs_grad` says which of dx, dW, and dR to compute. The others are returned as
+// undefined tensors (None in Python) and their matrix multiplications are skipped. The
+// bias gradients fall out of the pointwise operations, so they're always computed.
+// `accumulate_into` holds a buffer for each of dW, dR, dbx, and dbr that the gradient is
+// added to and that is returned in its place, or an empty tensor to return a new gradient.
+// `reverse` and `sequence_length` must match the values passed to `gru_forward`.
 std::vector<Tensor> gru_backward(
-    Tensor x_t,
-    Tensor kernel_t,
-    Tensor recurrent_kernel_t,
+    Workspace& workspace,
+    std::vector<bool> needs_grad,
+    std::vector<Tensor> accumulate_into,
+    bool reverse,
+    Tensor x,
+    Tensor kernel,
+    Tensor recurrent_kernel,
     Tensor bias,
     Tensor recurrent_bias,
-    Tensor zoneout_mask,
-    Tensor h_t,
+    float zoneout_prob,
+    int64_t zoneout_seed,
+    float dropout_prob,
+    int64_t dropout_seed,
+    Tensor h,
     Tensor cache,
-    Tensor dh_new) {
-  const auto time_steps = x_t.size(0);
-  const auto input_size = x_t.size(1);
-  const auto batch_size = x_t.size(2);
-  const auto hidden_size = recurrent_kernel_t.size(1);
-  const bool has_zoneout = !!zoneout_mask.size(0);
-
-  CHECK_INPUT(x_t);
-  CHECK_INPUT(kernel_t);
-  CHECK_INPUT(recurrent_kernel_t);
+    Tensor dh_new,
+    Tensor sequence_length) {
+  const auto time_steps = x.size(0);
+  const auto batch_size = x.size(1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = recurrent_kernel.size(0);
+
+  CHECK_INPUT(x);
+  CHECK_INPUT(kernel);
+  CHECK_INPUT(recurrent_kernel);
   CHECK_INPUT(bias);
   CHECK_INPUT(recurrent_bias);
-  CHECK_INPUT(h_t);
+  CHECK_INPUT(h);
   CHECK_INPUT(cache);
   CHECK_INPUT(dh_new);
-  CHECK_INPUT(zoneout_mask);
-
-  Tensor dx = torch::empty({ time_steps, batch_size, input_size }, at::kCUDA);
-  Tensor dW = torch::zeros({ input_size, hidden_size * 3 }, at::kCUDA);
-  Tensor dR = torch::zeros({ hidden_size, hidden_size * 3 }, at::kCUDA);
-  Tensor dbx = torch::zeros({ hidden_size * 3 }, at::kCUDA);
-  Tensor dbr = torch::zeros({ hidden_size * 3 }, at::kCUDA);
-  Tensor dh = torch::zeros({ batch_size, hidden_size }, at::kCUDA);
-  Tensor dp = torch::empty({ time_steps, batch_size, hidden_size * 3 }, at::kCUDA);
-  Tensor dq = torch::empty({ time_steps, batch_size, hidden_size * 3 }, at::kCUDA);
-  Tensor zeros = torch::zeros({ batch_size, hidden_size }, at::kCUDA);
-
-  AT_DISPATCH_FLOATING_TYPES(x_t.type(), "gru_backward", ([&] {
-    BackwardPass<scalar_t> backward(
-        batch_size,
-        input_size,
-        hidden_size,
-        at::cuda::getCurrentCUDABlasHandle());
-
-    auto x_t_a = x_t.packed_accessor<scalar_t, 3>();
-    auto h_t_a = h_t.packed_accessor<scalar_t, 3>();
-    auto cache_a = cache.packed_accessor<scalar_t, 3>();
-    auto dh_new_a = dh_new.packed_accessor<scalar_t, 3>();
-    auto dx_a = dx.packed_accessor<scalar_t, 3>();
-    auto dp_a = dp.packed_accessor<scalar_t, 3>();
-    auto dq_a = dq.packed_accessor<scalar_t, 3>();
-    auto zoneout_mask_a = zoneout_mask.packed_accessor<scalar_t, 3>();
-
-    for (auto i = time_steps - 1; i >= 0; --i) {
-      backward.Iterate(
-          kernel_t.data<scalar_t>(),
-          recurrent_kernel_t.data<scalar_t>(),
+  CHECK_FULL_PRECISION(x, "GRU");
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+  TORCH_CHECK(!x.is_cuda() || (!reverse && !sequence_length.numel()),
+      "the GPU GRU doesn't support reverse or sequence_length; reverse the input instead");
+  CHECK_ENTRIES(needs_grad, 3);
+  CHECK_ENTRIES(accumulate_into, 4);
+
+  Tensor dx = needs_grad[0] ? torch::empty({ time_steps, batch_size, input_size }, x.options()) : Tensor();
+  Tensor dW = GradBuffer(needs_grad[1], accumulate_into[0], kernel);
+  // The CPU pass masks the recurrent kernel gradient as it accumulates it. On the GPU, the
+  // DropConnect mask is applied to the whole gradient in place, so it's only added to its
+  // accumulator afterwards.
+  const bool mask_dR = dropout_prob && x.is_cuda();
+  Tensor dR = GradBuffer(needs_grad[2], mask_dR ? Tensor() : accumulate_into[1], recurrent_kernel);
+  Tensor dbx = GradBuffer(true, accumulate_into[2], bias);
+  Tensor dbr = GradBuffer(true, accumulate_into[3], recurrent_bias);
+
+  // Regenerate the dropped-out recurrent kernel that the forward GPU pass used. The CPU pass
+  // regenerates the mask itself.
+  const Tensor dropped_recurrent_kernel = x.is_cuda()
+      ? DropConnect(workspace, "dropped_recurrent_kernel", recurrent_kernel, dropout_prob, { dropout_seed })
+      : recurrent_kernel;
+  // The initial state gradient is consumed by the caller before the next call.
+  Tensor dh = workspace.Zeros("dh", { batch_size, hidden_size }, x.options());
+  Tensor dp = workspace.Get("dp", { time_steps, batch_size, hidden_size * 3 }, x.options());
+  Tensor dq = workspace.Get("dq", { time_steps, batch_size, hidden_size * 3 }, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES(x.type(), "gru_backward", ([&] {
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      BackwardPass<scalar_t> backward(
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+      IterateBackward<scalar_t>(
+          backward, x, kernel, dropped_recurrent_kernel, bias, recurrent_bias, zoneout_prob,
+          zoneout_seed, h, cache, dh_new, dx, dW, dR, dbx, dbr, dh, dp, dq);
+#endif
+    } else {
+      cpu::gru::BackwardPass<scalar_t> backward(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+      backward.Run(
+          time_steps,
+          kernel.data<scalar_t>(),
+          recurrent_kernel.data<scalar_t>(),
           bias.data<scalar_t>(),
           recurrent_bias.data<scalar_t>(),
-          x_t_a[i].data(),
-          i == 0 ? zeros.data<scalar_t>() : h_t_a[i - 1].data(),
-          cache_a[i].data(),
-          dh_new_a[i].data(),
-          dx_a[i].data(),
-          dW.data<scalar_t>(),
-          dR.data<scalar_t>(),
+          x.data<scalar_t>(),
+          h.data<scalar_t>(),
+          cache.data<scalar_t>(),
+          dh_new.data<scalar_t>(),
+          ptr<scalar_t>(dx),
+          ptr<scalar_t>(dW),
+          ptr<scalar_t>(dR),
           dbx.data<scalar_t>(),
           dbr.data<scalar_t>(),
           dh.data<scalar_t>(),
-          dp_a[i].data(),
-          dq_a[i].data(),
-          has_zoneout ? zoneout_mask_a[i].data() : nullptr);
+          dp.data<scalar_t>(),
+          dq.data<scalar_t>(),
+          zoneout_prob,
+          zoneout_seed,
+          sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr,
+          reverse,
+          dropout_prob,
+          dropout_seed);
     }
   }));
 
-  return { dx, dW, dR, dbx, dbr };
+  if (mask_dR) {
+    DropConnectGrad_(dR, dropout_prob, { dropout_seed });
+    if (dR.defined() && accumulate_into[1].numel())
+      dR = GradBuffer(true, accumulate_into[1], recurrent_kernel).add_(dR);
+  }
+  return { dx, dW, dR, dbx, dbr, dh };
 }
 
+// Runs an int8 weight-quantized GRU in inference mode on the CPU. The quantized kernels and
+// their scales come from `quantize_weights`. Returns the hidden state of every time step,
+// laid out as in `gru_forward`.
+Tensor gru_quantized_forward(
+    Workspace& workspace,
+    float zoneout_prob,
+    Tensor x,
+    Tensor kernel_q,
+    Tensor kernel_scale,
+    Tensor recurrent_kernel_q,
+    Tensor recurrent_kernel_scale,
+    Tensor bias,
+    Tensor recurrent_bias,
+    Tensor h0) {
+  const auto time_steps = x.size(0);
+  const auto batch_size = x.size(1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = recurrent_kernel_q.size(1);
+
+  TORCH_CHECK(!x.is_cuda(), "the quantized GRU only runs on the CPU");
+  CHECK_INPUT(x);
+  CHECK_INPUT(kernel_q);
+  CHECK_INPUT(kernel_scale);
+  CHECK_INPUT(recurrent_kernel_q);
+  CHECK_INPUT(recurrent_kernel_scale);
+  CHECK_INPUT(bias);
+  CHECK_INPUT(recurrent_bias);
+  CHECK_SHAPE(kernel_q, hidden_size * 3, input_size);
+  CHECK_SHAPE(kernel_scale, hidden_size * 3);
+  CHECK_SHAPE(recurrent_kernel_q, hidden_size * 3, hidden_size);
+  CHECK_SHAPE(recurrent_kernel_scale, hidden_size * 3);
+  CHECK_SHAPE(bias, hidden_size * 3);
+  CHECK_SHAPE(recurrent_bias, hidden_size * 3);
+  CHECK_SHAPE(h0, batch_size, hidden_size);
+  TORCH_CHECK(kernel_q.scalar_type() == torch::kChar && recurrent_kernel_q.scalar_type() == torch::kChar,
+      "the quantized kernels must be int8");
+  TORCH_CHECK(kernel_scale.scalar_type() == torch::kFloat && recurrent_kernel_scale.scalar_type() == torch::kFloat,
+      "the kernel scales must be float32");
+
+  Tensor output = torch::empty({ time_steps + 1, batch_size, hidden_size }, x.options());
+  output[0].copy_(h0);
+  Tensor tmp_Wx = workspace.Get("tmp_Wx", { time_steps, batch_size, hidden_size * 3 }, x.options());
+  Tensor tmp_Rh = workspace.Get("tmp_Rh", { batch_size, hidden_size * 3 }, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES(x.type(), "gru_quantized_forward", ([&] {
+    cpu::gru::QuantizedForwardPass<scalar_t> forward(
+        batch_size,
+        input_size,
+        hidden_size,
+        GetCpuParallelFor());
+
+    forward.Run(
+        time_steps,
+        kernel_q.data<int8_t>(),
+        kernel_scale.data<float>(),
+        recurrent_kernel_q.data<int8_t>(),
+        recurrent_kernel_scale.data<float>(),
+        bias.data<scalar_t>(),
+        recurrent_bias.data<scalar_t>(),
+        x.data<scalar_t>(),
+        output.data<scalar_t>(),
+        tmp_Wx.data<scalar_t>(),
+        tmp_Rh.data<scalar_t>(),
+        zoneout_prob);
+  }));
+
+  return output;
+}
+
+// Runs the GRU one time step per call for autoregressive decoding. The native forward
+// pass and its scratch space are created once and reused by every step. The output state
+// alternates between two buffers so the state returned by one step can be passed straight
+// back in as the input to the next.
+class GruDecoder {
+  public:
+    GruDecoder(Tensor kernel, Tensor recurrent_kernel, int64_t batch_size, float zoneout_prob)
+        : batch_size_(batch_size),
+          input_size_(kernel.size(0)),
+          hidden_size_(recurrent_kernel.size(0)),
+          zoneout_prob_(zoneout_prob),
+          current_(0) {
+      CHECK_DEVICE(kernel);
+      const auto options = kernel.options();
+      for (int i = 0; i < 2; ++i)
+        h_[i] = torch::empty({ batch_size_, hidden_size_ }, options);
+      v_ = torch::empty({ batch_size_, hidden_size_ * 4 }, options);
+      tmp_Wx_ = torch::empty({ batch_size_, hidden_size_ * 3 }, options);
+      tmp_Rh_ = torch::empty({ batch_size_, hidden_size_ * 3 }, options);
+
+      AT_DISPATCH_FLOATING_TYPES(kernel.type(), "GruDecoder", ([&] {
+        if (kernel.is_cuda()) {
+#ifdef WITH_CUDA
+          Bind<scalar_t>(std::make_shared<ForwardPass<scalar_t>>(
+              false,
+              batch_size_,
+              input_size_,
+              hidden_size_,
+              at::cuda::getCurrentCUDABlasHandle()));
+#endif
+        } else {
+          Bind<scalar_t>(std::make_shared<cpu::gru::ForwardPass<scalar_t>>(
+              false,
+              batch_size_,
+              input_size_,
+              hidden_size_,
+              GetCpuParallelFor()));
+        }
+      }));
+    }
+
+    GruDecoder(const GruDecoder&) = delete;
+    GruDecoder& operator=(const GruDecoder&) = delete;
+
+    Tensor step(
+        Tensor x,
+        Tensor kernel,
+        Tensor recurrent_kernel,
+        Tensor bias,
+        Tensor recurrent_bias,
+        Tensor h) {
+      CHECK_INPUT(x);
+      CHECK_INPUT(kernel);
+      CHECK_INPUT(recurrent_kernel);
+      CHECK_INPUT(bias);
+      CHECK_INPUT(recurrent_bias);
+      CHECK_INPUT(h);
+      CHECK_SHAPE(x, batch_size_, input_size_);
+      CHECK_SHAPE(h, batch_size_, hidden_size_);
+
+      Tensor& h_out = h_[current_];
+      current_ ^= 1;
+
+      iterate_(x, kernel, recurrent_kernel, bias, recurrent_bias, h, h_out);
+      return h_out;
+    }
+
+  private:
+    template<typename T, typename ForwardPassT>
+    void Bind(std::shared_ptr<ForwardPassT> forward) {
+      iterate_ = [this, forward](
+          const Tensor& x,
+          const Tensor& kernel,
+          const Tensor& recurrent_kernel,
+          const Tensor& bias,
+          const Tensor& recurrent_bias,
+          const Tensor& h,
+          Tensor& h_out) {
+        forward->Iterate(
+            kernel.data<T>(),
+            recurrent_kernel.data<T>(),
+            bias.data<T>(),
+            recurrent_bias.data<T>(),
+            x.data<T>(),
+            h.data<T>(),
+            h_out.data<T>(),
+            v_.data<T>(),
+            tmp_Wx_.data<T>(),
+            tmp_Rh_.data<T>(),
+            zoneout_prob_,
+            0);  // Inference-mode zoneout only uses `zoneout_prob`.
+      };
+    }
+
+    // The CPU pass multiplies by a packed copy of the recurrent kernel that's kept across
+    // steps and only repacked once the kernel changes.
+    template<typename T>
+    void Bind(std::shared_ptr<cpu::gru::ForwardPass<T>> forward) {
+      iterate_ = [this, forward](
+          const Tensor& x,
+          const Tensor& kernel,
+          const Tensor& recurrent_kernel,
+          const Tensor& bias,
+          const Tensor& recurrent_bias,
+          const Tensor& h,
+          Tensor& h_out) {
+        forward->Iterate(
+            kernel.data<T>(),
+            recurrent_kernel.data<T>(),
+            bias.data<T>(),
+            recurrent_bias.data<T>(),
+            x.data<T>(),
+            h.data<T>(),
+            h_out.data<T>(),
+            v_.data<T>(),
+            tmp_Wx_.data<T>(),
+            tmp_Rh_.data<T>(),
+            zoneout_prob_,
+            0,  // Inference-mode zoneout only uses `zoneout_prob`.
+            PackRecurrentKernel<T>(workspace_, "packed_recurrent_kernel", *forward, recurrent_kernel, 0.0f)[0]);
+      };
+    }
+
+    const int64_t batch_size_;
+    const int64_t input_size_;
+    const int64_t hidden_size_;
+    const float zoneout_prob_;
+    int current_;
+    Tensor h_[2];
+    Tensor v_;
+    Tensor tmp_Wx_;
+    Tensor tmp_Rh_;
+    Workspace workspace_;
+    std::function<void(
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        Tensor&)> iterate_;
+};
+
 }  // anonymous namespace
 
 void gru_init(py::module& m) {
   m.def("gru_forward", &gru_forward, "GRU forward");
   m.def("gru_backward", &gru_backward, "GRU backward");
+  m.def("gru_quantized_forward", &gru_quantized_forward, "Int8 weight-quantized GRU forward (CPU inference)");
+  py::class_<GruDecoder>(m, "GruDecoder")
+      .def(py::init<Tensor, Tensor, int64_t, float>())
+      .def("step", &GruDecoder::step, "GRU single step");
 }
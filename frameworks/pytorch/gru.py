@@ -16,24 +16,168 @@
 """Gated Recurrent Unit"""
 
 
+import functools
 import haste_pytorch_lib as LIB
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
 
 
 __all__ = [
-    'GRU'
+    'GRU',
+    'QuantizedGRU'
 ]
 
 
+def _reverse_sequence(sequence, lengths):
+  """
+  Reverses a batched sequence in time-major order [T,N,...]. The input sequence
+  may be padded, in which case `lengths` specifies the unpadded length of each
+  sequence and the padding stays where it is.
+  """
+  if lengths is None:
+    return sequence.flip(0)
+  lengths = torch.as_tensor(lengths).to(device=sequence.device, dtype=torch.int64)
+  steps = torch.arange(sequence.shape[0], device=sequence.device).unsqueeze(1)
+  indices = torch.where(steps < lengths, lengths - 1 - steps, steps)
+  indices = indices.view(*indices.shape, *[1] * (sequence.dim() - 2)).expand_as(sequence)
+  return sequence.gather(0, indices)
+
+
+def _sequence_length(lengths, device):
+  """
+  Returns `lengths` as an int64 tensor on `device`, or an empty tensor if
+  `lengths` is missing.
+  """
+  if lengths is None:
+    return torch.empty(0, dtype=torch.int64, device=device)
+  return torch.as_tensor(lengths).to(device=device, dtype=torch.int64)
+
+
+def _check_dtype(input):
+  """
+  Raises an error for 16-bit inputs, which only the `LSTM` supports.
+  """
+  if input.dtype in (torch.float16, torch.bfloat16):
+    raise TypeError(('GRU: {} inputs are not supported, use float32 or float64. '
+                     'Only the LSTM supports float16 and bfloat16.').format(input.dtype))
+
+
+def _seeds(count):
+  """
+  Returns `count` independent seeds for the zoneout and DropConnect masks that
+  the native passes regenerate. They're drawn from PyTorch's default generator,
+  so `torch.manual_seed` makes the masks reproducible.
+  """
+  return torch.randint(1 << 62, (count,)).tolist()
+
+
+def _claim_grad_buffers(pool, params):
+  """
+  Returns `(pool, buffers)` with a gradient buffer for each of `params` for the
+  native backward pass to accumulate into, reused from `pool` if it holds a
+  matching set and newly allocated otherwise. A forward pass that runs during a
+  backward pass, e.g. to recompute a checkpoint, always gets new buffers, since
+  the pooled ones may still be waiting for autograd to add them to `.grad`.
+  """
+  buffers = None
+  if pool and torch._C._current_graph_task_id() == -1:
+    buffers = pool.pop()
+    if any(b.shape != p.shape or b.dtype != p.dtype or b.device != p.device for b, p in zip(buffers, params)):
+      buffers = None  # stale after e.g. `.to()`
+  if buffers is None:
+    buffers = [torch.empty_like(p) for p in params]
+  return pool, buffers
+
+
+def _grad_accumulators(ctx, needs_grad):
+  """
+  Returns the buffers claimed by the forward pass, zeroed, for the native
+  backward pass to accumulate the needed gradients into and return to autograd.
+  The other entries, and all of them if no buffers were claimed, are empty
+  tensors, for which the native pass returns a new gradient instead. The
+  buffers go back to their pool for the next step, so a second backward pass
+  through the same graph gets new gradients.
+  """
+  if ctx.grad_buffers is None:
+    return [torch.empty(0)] * len(needs_grad)
+  pool, buffers = ctx.grad_buffers
+  ctx.grad_buffers = None
+  pool.append(buffers)
+  return [b.zero_() if needed else torch.empty(0) for b, needed in zip(buffers, needs_grad)]
+
+
+def _attach_grads(params, flat_grad):
+  """
+  Points the `.grad` of each of `params` that requires grad at its view into
+  `flat_grad`, unless it already is. A missing gradient, e.g. after
+  `zero_grad()`, which sets gradients to None by default, leaves a zeroed view;
+  a replaced one is copied into the view.
+  """
+  offset = 0
+  for param in params:
+    view = flat_grad[offset:offset + param.numel()].view_as(param)
+    offset += param.numel()
+    if not param.requires_grad or (param.grad is not None and param.grad.data_ptr() == view.data_ptr()):
+      continue
+    if param.grad is None:
+      view.zero_()
+    else:
+      view.copy_(param.grad)
+    param.grad = view
+
+
+def _reattach_grads(module, param):
+  """Hook for `_keep_grads_attached`."""
+  with torch.no_grad():
+    _attach_grads(module._parameters.values(), module.flat_grad)
+
+
+def _keep_grads_attached(module):
+  """
+  Registers a hook on each of `module`'s parameters that points `.grad` back at
+  its view into `module.flat_grad` once autograd has accumulated into it.
+  Autograd keeps an existing `.grad` and adds to it in place, but it installs a
+  new tensor if `.grad` was reset to None after the forward pass or if
+  `create_graph=True`. Returns the hook handles.
+  """
+  hook = functools.partial(_reattach_grads, module)
+  return [p.register_post_accumulate_grad_hook(hook) for p in module._parameters.values() if p.requires_grad]
+
+
+def _flatten(params):
+  """
+  Moves `params` into one contiguous buffer and makes each of them, and its
+  `.grad`, a view into that buffer and a matching gradient buffer. Returns the
+  two buffers.
+  """
+  params = list(params)
+  flat = torch.empty(sum(p.numel() for p in params), dtype=params[0].dtype, device=params[0].device)
+  flat_grad = torch.zeros_like(flat)
+  offset = 0
+  with torch.no_grad():
+    for param in params:
+      view = flat[offset:offset + param.numel()].view_as(param)
+      offset += param.numel()
+      view.copy_(param)
+      param.data = view
+  _attach_grads(params, flat_grad)
+  return flat, flat_grad
+
+
 class GRUFunction(torch.autograd.Function):
   @staticmethod
-  def forward(ctx, training, zoneout_prob, *inputs):
-    h, cache = LIB.gru_forward(training, zoneout_prob, *inputs)
-    ctx.save_for_backward(*inputs, h, cache)
-    ctx.mark_non_differentiable(inputs[-1])
+  def forward(ctx, workspace, grad_buffers, training, zoneout_prob, dropout_prob, reverse, *inputs):
+    h, cache = LIB.gru_forward(workspace, training, zoneout_prob, dropout_prob, reverse, *inputs)
+    ctx.save_for_backward(*inputs[:5], h, cache)  # initial state isn't needed
+    ctx.zoneout_prob = zoneout_prob
+    ctx.zoneout_seed = inputs[-3]
+    ctx.dropout_prob = dropout_prob
+    ctx.dropout_seed = inputs[-2]
+    ctx.sequence_length = inputs[-1]
+    ctx.reverse = reverse
     ctx.training = training
+    ctx.workspace = workspace
+    ctx.grad_buffers = grad_buffers
     return h
 
   @staticmethod
@@ -41,13 +185,28 @@ class GRUFunction(torch.autograd.Function):
     if not ctx.training:
       raise RuntimeError('GRU backward can only be called in training mode')
 
-    saved = [*ctx.saved_tensors]
-    saved[0] = saved[0].permute(0, 2, 1).contiguous()
-    saved[1] = saved[1].permute(1, 0).contiguous()
-    saved[2] = saved[2].permute(1, 0).contiguous()
-    saved[-2] = saved[-2].permute(0, 2, 1).contiguous()
-    grads = LIB.gru_backward(*saved, grad_h.contiguous())
-    return (None, None, *grads, None)
+    x, kernel, recurrent_kernel, bias, recurrent_bias, h, cache = ctx.saved_tensors
+    dx, dW, dR, dbx, dbr, dh = LIB.gru_backward(
+        ctx.workspace,
+        ctx.needs_input_grad[6:9],
+        _grad_accumulators(ctx, ctx.needs_input_grad[7:11]),
+        ctx.reverse,
+        x,
+        kernel,
+        recurrent_kernel,
+        bias,
+        recurrent_bias,
+        ctx.zoneout_prob,
+        ctx.zoneout_seed,
+        ctx.dropout_prob,
+        ctx.dropout_seed,
+        h,
+        cache,
+        grad_h.contiguous(),
+        ctx.sequence_length)
+    # The initial state lives in the last slot in reverse.
+    dh0 = dh + grad_h[-1 if ctx.reverse else 0]
+    return (None, None, None, None, None, None, dx, dW, dR, dbx, dbr, dh0, None, None, None)
 
 
 class GRU(nn.Module):
@@ -64,6 +223,13 @@ class GRU(nn.Module):
   This layer has built-in support for DropConnect and Zoneout, which are
   both techniques used to regularize RNNs.
 
+  The layer runs on whichever device its parameters live on: use `.cuda()`
+  for the GPU kernels or keep it on the CPU for the multithreaded CPU kernels.
+
+  Only float32 and float64 are supported: a layer converted with `.half()` or
+  `.bfloat16()` raises an error when it's run. 16-bit storage is only
+  implemented for the `LSTM`.
+
   See [\_\_init\_\_](#__init__) and [forward](#forward) for usage.
   """
 
@@ -72,7 +238,10 @@ class GRU(nn.Module):
       hidden_size,
       batch_first=False,
       dropout=0.0,
-      zoneout=0.0):
+      zoneout=0.0,
+      bidirectional=False,
+      accumulate_grad_in_place=False,
+      flat_parameters=False):
     """
     Initialize the parameters of the GRU layer.
 
@@ -85,6 +254,30 @@ class GRU(nn.Module):
         regularization on the recurrent matrix.
       zoneout: (optional) float, sets the zoneout rate for Zoneout
         regularization.
+      bidirectional: (optional) bool, if `True`, the layer also runs a second
+        GRU over the reversed input sequence and concatenates the outputs of
+        both directions along the feature dimension.
+      accumulate_grad_in_place: (optional) bool, if `True`, the backward pass
+        accumulates the weight gradients into buffers that the layer keeps and
+        reuses across training steps instead of allocating new ones on every
+        step. The buffers are still returned to autograd, which adds them to
+        `.grad` and runs the parameters' hooks, so `DistributedDataParallel`
+        and `GradScaler` see the gradients as usual. When `.grad` is None,
+        autograd copies the buffer rather than adding it, so the option pays
+        off with `flat_parameters` or `zero_grad(set_to_none=False)`. Supported
+        for both directions of a bidirectional GRU.
+      flat_parameters: (optional) bool, if `True`, all of the layer's
+        parameters are views into one contiguous buffer, `flat_weight`, and
+        their gradients are views into a matching buffer, `flat_grad`, so a
+        single collective (e.g. `torch.distributed.all_reduce(layer.flat_grad)`)
+        or tensor operation covers the whole layer. Every forward pass with
+        gradients enabled points `.grad` back at `flat_grad`, so gradients
+        that were set to None by `zero_grad()` are zeroed there instead.
+        If autograd installs a new `.grad` anyway, e.g. with
+        `create_graph=True`, it's copied back into `flat_grad` as soon as
+        it's accumulated. `DistributedDataParallel` must keep its default
+        `gradient_as_bucket_view=False`, since that option points `.grad` at
+        its own buckets instead.
 
     Variables:
       kernel: the input projection weight matrix. Dimensions
@@ -97,6 +290,11 @@ class GRU(nn.Module):
         `z,r,h` gate layout. Initialized to zeros.
       recurrent_bias: the recurrent projection bias vector. Dimensions
         (hidden_size * 3) with `z,r,h` gate layout. Initialized to zeros.
+      *_reverse: the parameters of the reverse direction if `bidirectional`
+        is `True`, e.g. `kernel_reverse`. Same dimensions and initialization
+        as their forward counterparts.
+      flat_weight, flat_grad: the contiguous parameter and gradient buffers
+        if `flat_parameters` is `True`, otherwise None.
     """
     super(GRU, self).__init__()
 
@@ -110,24 +308,67 @@ class GRU(nn.Module):
     self.batch_first = batch_first
     self.dropout = dropout
     self.zoneout = zoneout
+    self.bidirectional = bidirectional
+    self.accumulate_grad_in_place = accumulate_grad_in_place
+    self.flat_parameters = flat_parameters
 
-    gpu = torch.device('cuda')
-    self.kernel = nn.Parameter(torch.empty(input_size, hidden_size * 3, device=gpu))
-    self.recurrent_kernel = nn.Parameter(torch.empty(hidden_size, hidden_size * 3, device=gpu))
-    self.bias = nn.Parameter(torch.empty(hidden_size * 3, device=gpu))
-    self.recurrent_bias = nn.Parameter(torch.empty(hidden_size * 3, device=gpu))
+    self.kernel = nn.Parameter(torch.empty(input_size, hidden_size * 3))
+    self.recurrent_kernel = nn.Parameter(torch.empty(hidden_size, hidden_size * 3))
+    self.bias = nn.Parameter(torch.empty(hidden_size * 3))
+    self.recurrent_bias = nn.Parameter(torch.empty(hidden_size * 3))
+    if bidirectional:
+      self.kernel_reverse = nn.Parameter(torch.empty(input_size, hidden_size * 3))
+      self.recurrent_kernel_reverse = nn.Parameter(torch.empty(hidden_size, hidden_size * 3))
+      self.bias_reverse = nn.Parameter(torch.empty(hidden_size * 3))
+      self.recurrent_bias_reverse = nn.Parameter(torch.empty(hidden_size * 3))
     self.reset_parameters()
 
+    self.flat_weight = None
+    self.flat_grad = None
+    self._grad_hooks = []
+    if flat_parameters:
+      self._flatten_parameters()
+
+    self._decoder = None
+    self._decoder_key = None
+    self._grad_buffers = []
+    self._workspace = LIB.Workspace()
+
   def reset_parameters(self):
     """Resets this layer's parameters to their initial values."""
     hidden_size = self.hidden_size
-    for i in range(3):
-      nn.init.xavier_uniform_(self.kernel[:, i*hidden_size:(i+1)*hidden_size])
-      nn.init.orthogonal_(self.recurrent_kernel[:, i*hidden_size:(i+1)*hidden_size])
-    nn.init.zeros_(self.bias)
-    nn.init.zeros_(self.recurrent_bias)
+    for kernel, recurrent_kernel, bias, recurrent_bias in self._directions():
+      for i in range(3):
+        nn.init.xavier_uniform_(kernel[:, i*hidden_size:(i+1)*hidden_size])
+        nn.init.orthogonal_(recurrent_kernel[:, i*hidden_size:(i+1)*hidden_size])
+      nn.init.zeros_(bias)
+      nn.init.zeros_(recurrent_bias)
+
+  def _flatten_parameters(self):
+    for handle in self._grad_hooks:
+      handle.remove()
+    self.flat_weight, self.flat_grad = _flatten(self._parameters.values())
+    self._grad_hooks = _keep_grads_attached(self)
+
+  def _apply(self, fn, *args, **kwargs):
+    # Conversions such as `.to()` and `.half()` replace the parameters one at a time,
+    # so the flat buffers are rebuilt afterwards.
+    module = super(GRU, self)._apply(fn, *args, **kwargs)
+    if self.flat_parameters:
+      self._flatten_parameters()
+    return module
 
-  def forward(self, input, lengths=None):
+  def _directions(self):
+    directions = [(self.kernel, self.recurrent_kernel, self.bias, self.recurrent_bias)]
+    if self.bidirectional:
+      directions.append((
+          self.kernel_reverse,
+          self.recurrent_kernel_reverse,
+          self.bias_reverse,
+          self.recurrent_bias_reverse))
+    return directions
+
+  def forward(self, input, lengths=None, state=None):
     """
     Runs a forward pass of the GRU layer.
 
@@ -138,39 +379,93 @@ class GRU(nn.Module):
       lengths: (optional) Tensor, list of sequence lengths for each batch
         element. Dimension (batch_size). This argument may be omitted if
         all batch elements are unpadded and have the same sequence length.
+      state: (optional) Tensor, the initial hidden state. Dimensions
+        (num_directions, batch_size, hidden_size). Defaults to zeros. Passing
+        the state returned by a previous call continues the sequence, which
+        allows long inputs to be processed in chunks. Gradients flow back to
+        the initial state.
 
     Returns:
       output: Tensor, the output of the GRU layer. Dimensions
-        (seq_len, batch_size, hidden_size) if `batch_first` is `False` (default)
-        or (batch_size, seq_len, hidden_size) if `batch_first` is `True`. Note
-        that if `lengths` was specified, the `output` tensor will not be
-        masked. It's the caller's responsibility to either not use the invalid
-        entries or to mask them out before using them.
-      h_n: the hidden state for the last sequence item. Dimensions
-        (1, batch_size, hidden_size).
+        (seq_len, batch_size, num_directions * hidden_size) if `batch_first`
+        is `False` (default) or (batch_size, seq_len, num_directions *
+        hidden_size) if `batch_first` is `True`. Bidirectional layers put the
+        forward direction's features first. Note that if `lengths` was
+        specified, the `output` tensor will not be masked. It's the caller's
+        responsibility to either not use the invalid entries or to mask them
+        out before using them.
+      h_n: the hidden state for the last sequence item of each direction.
+        Dimensions (num_directions, batch_size, hidden_size).
     """
+    _check_dtype(input)
+    if self.flat_parameters and torch.is_grad_enabled():
+      _attach_grads(self._parameters.values(), self.flat_grad)
+
     if self.batch_first:
       input = input.permute(1, 0, 2)
 
-    if self.zoneout:
-      zoneout_mask = torch.empty(
-          input.shape[0],
+    if state is None:
+      state = torch.zeros(
+          len(self._directions()),
           input.shape[1],
           self.hidden_size,
           dtype=input.dtype,
           device=input.device)
-      zoneout_mask.bernoulli_(1.0 - self.zoneout)
-    else:
-      zoneout_mask = torch.empty(0, 0, 0, dtype=input.dtype, device=input.device)
+
+    output, h_n = self._forward_direction(input, lengths, state[0], *self._directions()[0])
+    if self.bidirectional and input.is_cuda:
+      # The reverse direction runs over each sequence back to front, leaving the
+      # padding in place so its final state is found the same way.
+      output_reverse, h_n_reverse = self._forward_direction(
+          _reverse_sequence(input, lengths), lengths, state[1], *self._directions()[1])
+      output = torch.cat([output, _reverse_sequence(output_reverse, lengths)], dim=-1)
+      h_n = torch.cat([h_n, h_n_reverse])
+    elif self.bidirectional:
+      # The CPU pass runs the reverse direction in place, so neither the input
+      # nor the output has to be reversed.
+      output_reverse, h_n_reverse = self._forward_direction(
+          input, lengths, state[1], *self._directions()[1], reverse=True)
+      output = torch.cat([output, output_reverse], dim=-1)
+      h_n = torch.cat([h_n, h_n_reverse])
+
+    if self.batch_first:
+      output = output.permute(1, 0, 2)
+
+    return output, h_n
+
+  def _forward_direction(self, input, lengths, h0, kernel, recurrent_kernel, bias, recurrent_bias, reverse=False):
+    # The native passes regenerate the zoneout and DropConnect masks from these seeds
+    # instead of storing them.
+    dropout = self.dropout if self.training else 0.0
+    zoneout_seed = _seeds(1)[0] if self.training and self.zoneout else 0
+    dropout_seed = _seeds(1)[0] if dropout else 0
+    # Only the CPU pass skips the padding; on the GPU it's computed and ignored.
+    sequence_length = _sequence_length(None if input.is_cuda else lengths, input.device)
+
+    grad_buffers = None
+    if self.accumulate_grad_in_place and self.training and torch.is_grad_enabled():
+      grad_buffers = _claim_grad_buffers(self._grad_buffers, (kernel, recurrent_kernel, bias, recurrent_bias))
+
     h = GRUFunction.apply(
+        self._workspace,
+        grad_buffers,
         self.training,
         self.zoneout,
+        dropout,
+        reverse,
         input.contiguous(),
-        self.kernel.contiguous(),
-        F.dropout(self.recurrent_kernel, self.dropout, self.training).contiguous(),
-        self.bias.contiguous(),
-        self.recurrent_bias.contiguous(),
-        zoneout_mask.contiguous())
+        kernel.contiguous(),
+        recurrent_kernel.contiguous(),
+        bias.contiguous(),
+        recurrent_bias.contiguous(),
+        h0.contiguous(),
+        zoneout_seed,
+        dropout_seed,
+        sequence_length.contiguous())
+
+    if reverse:
+      # Every sequence ends at the first time step in reverse.
+      return h[:-1], h[:1]
 
     if lengths is not None:
       cols = range(h.size(1))
@@ -178,8 +473,189 @@ class GRU(nn.Module):
     else:
       state = h[-1].unsqueeze(0)
 
-    output = h
+    return h[1:], state
+
+  def step(self, input, state=None):
+    """
+    Runs the GRU layer for a single time step.
+
+    This is intended for autoregressive decoding, where each input depends on
+    the previous output. The native forward pass and its buffers are created
+    by the first call and reused by later calls with the same batch size,
+    dtype, and device, so each step costs little more than the recurrent
+    matrix multiplication. Only supported in inference mode.
+
+    Arguments:
+      input: Tensor, the input for this time step. Dimensions
+        (batch_size, input_size).
+      state: (optional) Tensor, the hidden state from the previous step.
+        Dimensions (1, batch_size, hidden_size). Defaults to zeros.
+
+    Returns:
+      output: Tensor, the output for this time step. Dimensions
+        (batch_size, hidden_size).
+      h_n: the hidden state after this step. Dimensions
+        (1, batch_size, hidden_size). This is a view of a buffer that is reused
+        two steps later; clone it to keep it for longer.
+    """
+    if self.training:
+      raise RuntimeError('GRU step can only be called in inference mode')
+    if self.bidirectional:
+      raise RuntimeError('GRU step is not supported for bidirectional layers')
+    _check_dtype(input)
+
+    batch_size = input.shape[0]
+    if state is None:
+      h = torch.zeros(batch_size, self.hidden_size, dtype=input.dtype, device=input.device)
+    else:
+      h = state[0]
+
+    key = (batch_size, input.dtype, input.device)
+    if self._decoder_key != key:
+      self._decoder = LIB.GruDecoder(self.kernel, self.recurrent_kernel, batch_size, self.zoneout)
+      self._decoder_key = key
+
+    with torch.no_grad():
+      h = self._decoder.step(
+          input.contiguous(),
+          self.kernel.contiguous(),
+          self.recurrent_kernel.contiguous(),
+          self.bias.contiguous(),
+          self.recurrent_bias.contiguous(),
+          h.contiguous())
+    return h, h.unsqueeze(0)
+
+  def workspace_stats(self):
+    """
+    Returns the hit and miss counts of this layer's scratch buffer pool.
+
+    The native passes keep their temporary buffers (the input and recurrent
+    projection scratch space, the activations in inference mode, and the
+    backward pass's gate gradients) in a pool that persists across calls, so
+    steady-state calls don't allocate them. A pooled buffer is reused if it's
+    large enough and has the right dtype and device; otherwise it's replaced
+    by one rounded up to the next power of two elements.
+
+    Returns:
+      stats: dict, the number of buffer requests that reused a pooled buffer
+        (`'hits'`) and that allocated a new one (`'misses'`).
+    """
+    return {'hits': self._workspace.hits, 'misses': self._workspace.misses}
+
+
+class QuantizedGRU(nn.Module):
+  """
+  Int8 weight-quantized GRU for CPU inference.
+
+  This layer is built from a trained `GRU`. As in `QuantizedLSTM`, its kernels
+  are quantized to int8 with one scale per output channel, the inputs and
+  hidden states are quantized on the fly, and both matrix multiplications run
+  in int8 with int32 accumulation. The layer only runs on the CPU and has no
+  backward pass.
+
+  See [\_\_init\_\_](#__init__) and [forward](#forward) for usage.
+  """
+
+  def __init__(self, gru):
+    """
+    Quantizes the parameters of a trained GRU layer.
+
+    Arguments:
+      gru: `GRU`, the layer to quantize. Its parameters are copied, so later
+        changes to `gru` don't affect this layer.
+
+    Variables:
+      kernel_q: the int8 input kernel, transposed so that each output channel
+        is contiguous. Dimensions (hidden_size * 3, input_size).
+      recurrent_kernel_q: the int8 recurrent kernel, transposed so that each
+        output channel is contiguous. Dimensions (hidden_size * 3, hidden_size).
+      kernel_scale: the scale of each output channel of `kernel_q`. Dimension
+        (hidden_size * 3).
+      recurrent_kernel_scale: the scale of each output channel of
+        `recurrent_kernel_q`. Dimension (hidden_size * 3).
+      bias: the unquantized input bias vector. Dimension (hidden_size * 3).
+      recurrent_bias: the unquantized recurrent bias vector. Dimension
+        (hidden_size * 3).
+      *_reverse: the same for the reverse direction if `bidirectional`.
+    """
+    super(QuantizedGRU, self).__init__()
+
+    self.input_size = gru.input_size
+    self.hidden_size = gru.hidden_size
+    self.batch_first = gru.batch_first
+    self.zoneout = gru.zoneout
+    self.bidirectional = gru.bidirectional
+    self._suffixes = ['', '_reverse'] if self.bidirectional else ['']
+
+    with torch.no_grad():
+      for suffix, (kernel, recurrent_kernel, bias, recurrent_bias) in zip(self._suffixes, gru._directions()):
+        kernel_q, kernel_scale = LIB.quantize_weights(kernel.detach().cpu().float().contiguous())
+        recurrent_kernel_q, recurrent_kernel_scale = LIB.quantize_weights(
+            recurrent_kernel.detach().cpu().float().contiguous())
+        self.register_buffer('kernel_q' + suffix, kernel_q)
+        self.register_buffer('kernel_scale' + suffix, kernel_scale)
+        self.register_buffer('recurrent_kernel_q' + suffix, recurrent_kernel_q)
+        self.register_buffer('recurrent_kernel_scale' + suffix, recurrent_kernel_scale)
+        self.register_buffer('bias' + suffix, bias.detach().cpu().float().clone())
+        self.register_buffer('recurrent_bias' + suffix, recurrent_bias.detach().cpu().float().clone())
+
+    self._workspace = LIB.Workspace()
+
+  def forward(self, input, lengths=None, state=None):
+    """
+    Runs a forward pass of the quantized GRU layer.
+
+    Arguments and return values are the same as for `GRU.forward`. The input
+    must be a float32 or float64 CPU tensor.
+    """
+    if self.batch_first:
+      input = input.permute(1, 0, 2)
+
+    if state is None:
+      state = torch.zeros(
+          len(self._suffixes),
+          input.shape[1],
+          self.hidden_size,
+          dtype=input.dtype,
+          device=input.device)
+
+    with torch.no_grad():
+      output, h_n = self._forward_direction(input, lengths, state[0], self._suffixes[0])
+      if self.bidirectional:
+        output_reverse, h_n_reverse = self._forward_direction(
+            _reverse_sequence(input, lengths), lengths, state[1], self._suffixes[1])
+        output = torch.cat([output, _reverse_sequence(output_reverse, lengths)], dim=-1)
+        h_n = torch.cat([h_n, h_n_reverse])
+
     if self.batch_first:
       output = output.permute(1, 0, 2)
 
-    return output, state
+    return output, h_n
+
+  def _forward_direction(self, input, lengths, h0, suffix):
+    h = LIB.gru_quantized_forward(
+        self._workspace,
+        self.zoneout,
+        input.contiguous(),
+        getattr(self, 'kernel_q' + suffix),
+        getattr(self, 'kernel_scale' + suffix),
+        getattr(self, 'recurrent_kernel_q' + suffix),
+        getattr(self, 'recurrent_kernel_scale' + suffix),
+        getattr(self, 'bias' + suffix).to(input.dtype),
+        getattr(self, 'recurrent_bias' + suffix).to(input.dtype),
+        h0.contiguous())
+
+    if lengths is not None:
+      cols = range(h.size(1))
+      state = h[[lengths, cols]].unsqueeze(0)
+    else:
+      state = h[-1].unsqueeze(0)
+
+    return h[1:], state
+
+  def workspace_stats(self):
+    """
+    Returns the hit and miss counts of this layer's scratch buffer pool as a
+    dict with the keys `'hits'` and `'misses'`. See `GRU.workspace_stats`.
+    """
+    return {'hits': self._workspace.hits, 'misses': self._workspace.misses}
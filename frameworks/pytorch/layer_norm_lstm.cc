@@ -13,23 +13,42 @@
 // limitations under the License.
 // ==============================================================================
 
+#ifdef WITH_CUDA
 #include <ATen/cuda/CUDAContext.h>
+#endif
+#include <functional>
+#include <memory>
 #include <torch/extension.h>
 #include <vector>
 
+#ifdef WITH_CUDA
 #include "haste.h"
+#else
+#include "haste/cpu/layer_norm.h"
+#include "haste/cpu/layer_norm_lstm.h"
+#endif
 #include "support.h"
 
 namespace {
 
+namespace cpu = haste::v0::cpu;
+#ifdef WITH_CUDA
 namespace layer_norm = haste::v0::layer_norm;
 namespace layer_norm_lstm = haste::v0::layer_norm_lstm;
+#endif
 
 using torch::Tensor;
 
+// If `reverse` is set, the LSTM runs from the last time step to the first, the initial
+// states go in the last slots of the returned states, and the output of time step t is in
+// slot t. `sequence_length` is either empty or holds the length of each sequence; steps
+// past the end carry the state through unchanged. Both are only supported on the CPU.
 std::vector<Tensor> layer_norm_lstm_forward(
+    Workspace& workspace,
     bool training,
     float zoneout_prob,
+    float dropout_prob,
+    bool reverse,
     Tensor x,
     Tensor kernel,
     Tensor recurrent_kernel,
@@ -37,12 +56,15 @@ std::vector<Tensor> layer_norm_lstm_forward(
     Tensor gamma,
     Tensor gamma_h,
     Tensor beta_h,
-    Tensor zoneout_mask) {
+    Tensor h0,
+    Tensor c0,
+    int64_t zoneout_seed,
+    int64_t dropout_seed,
+    Tensor sequence_length) {
   const auto time_steps = x.size(0);
   const auto batch_size = x.size(1);
   const auto input_size = x.size(2);
   const auto hidden_size = recurrent_kernel.size(0);
-  const bool has_zoneout = zoneout_prob && zoneout_mask.size(0);
 
   CHECK_INPUT(x);
   CHECK_INPUT(kernel);
@@ -51,68 +73,149 @@ std::vector<Tensor> layer_norm_lstm_forward(
   CHECK_INPUT(gamma);
   CHECK_INPUT(gamma_h);
   CHECK_INPUT(beta_h);
-  CHECK_INPUT(zoneout_mask);
-
-  Tensor output = torch::zeros({ time_steps + 1, batch_size, hidden_size }, at::kCUDA);
-  Tensor output_state = torch::zeros({ time_steps + 1, batch_size, hidden_size }, at::kCUDA);
-  Tensor act_Wx = torch::empty({ time_steps, batch_size, hidden_size * 4 }, at::kCUDA);
-  Tensor act_Wx_norm = torch::empty({ time_steps, batch_size, hidden_size * 4 }, at::kCUDA);
-  Tensor act_Wx_norm_cache = torch::empty({ time_steps, batch_size, 2 }, at::kCUDA);
-  Tensor act_Rh = torch::empty({ time_steps, batch_size, hidden_size * 4 }, at::kCUDA);
-  Tensor act_Rh_norm_cache = torch::empty({ time_steps, batch_size, 2 }, at::kCUDA);
-  Tensor act_c_norm = torch::empty({ time_steps, batch_size, hidden_size }, at::kCUDA);
-  Tensor act_c_norm_cache = torch::empty({ time_steps, batch_size, 2 }, at::kCUDA);
-  Tensor tmp_Rh = torch::empty({ batch_size, hidden_size * 4 }, at::kCUDA);
+  CHECK_SHAPE(h0, batch_size, hidden_size);
+  CHECK_SHAPE(c0, batch_size, hidden_size);
+  CHECK_FULL_PRECISION(x, "LayerNormLSTM");
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+  TORCH_CHECK(!x.is_cuda() || (!reverse && !sequence_length.numel()),
+      "the GPU LayerNormLSTM doesn't support reverse or sequence_length; reverse the input instead");
+
+  // The CPU pass applies DropConnect as it packs the recurrent kernel; the GPU pass runs
+  // with a dropped-out copy.
+  const Tensor dropped_recurrent_kernel = x.is_cuda()
+      ? DropConnect(workspace, "dropped_recurrent_kernel", recurrent_kernel, dropout_prob, { dropout_seed })
+      : recurrent_kernel;
+
+  // The t=0 slots (t=T in reverse) hold the initial state; `Run` fills in the rest.
+  Tensor output = torch::empty({ time_steps + 1, batch_size, hidden_size }, x.options());
+  Tensor output_state = torch::empty({ time_steps + 1, batch_size, hidden_size }, x.options());
+  output[reverse ? time_steps : 0].copy_(h0);
+  output_state[reverse ? time_steps : 0].copy_(c0);
+  // The activations are only kept for the backward pass in training mode.
+  const auto activation = [&](const char* name, torch::IntArrayRef sizes) {
+    return training ? torch::empty(sizes, x.options()) : workspace.Get(name, sizes, x.options());
+  };
+  Tensor act_Wx = activation("act_Wx", { time_steps, batch_size, hidden_size * 4 });
+  Tensor act_Wx_norm = activation("act_Wx_norm", { time_steps, batch_size, hidden_size * 4 });
+  Tensor act_Wx_norm_cache = activation("act_Wx_norm_cache", { time_steps, batch_size, 2 });
+  Tensor act_Rh = activation("act_Rh", { time_steps, batch_size, hidden_size * 4 });
+  Tensor act_Rh_norm_cache = activation("act_Rh_norm_cache", { time_steps, batch_size, 2 });
+  Tensor act_c_norm = activation("act_c_norm", { time_steps, batch_size, hidden_size });
+  Tensor act_c_norm_cache = activation("act_c_norm_cache", { time_steps, batch_size, 2 });
+  Tensor tmp_Rh = workspace.Get("tmp_Rh", { batch_size, hidden_size * 4 }, x.options());
 
   AT_DISPATCH_FLOATING_TYPES(x.type(), "layer_norm_lstm_forward", ([&] {
-    auto gamma_a = gamma.packed_accessor<scalar_t, 2>();
-
-    layer_norm::ForwardPass<scalar_t> layer_norm1(
-        time_steps * batch_size,
-        hidden_size * 4,
-        gamma_a[0].data(),
-        nullptr,
-        act_Wx_norm_cache.data<scalar_t>());
-
-    layer_norm::ForwardPass<scalar_t> layer_norm2(
-        time_steps * batch_size,
-        hidden_size * 4,
-        gamma_a[1].data(),
-        nullptr,
-        act_Rh_norm_cache.data<scalar_t>());
-
-    layer_norm::ForwardPass<scalar_t> layer_norm3(
-        time_steps * batch_size,
-        hidden_size,
-        gamma_h.data<scalar_t>(),
-        beta_h.data<scalar_t>(),
-        act_c_norm_cache.data<scalar_t>());
-
-    layer_norm_lstm::ForwardPass<scalar_t> lstm(
-        training,
-        batch_size,
-        input_size,
-        hidden_size,
-        at::cuda::getCurrentCUDABlasHandle());
-
-    lstm.Run(
-        time_steps,
-        kernel.data<scalar_t>(),
-        recurrent_kernel.data<scalar_t>(),
-        bias.data<scalar_t>(),
-        x.data<scalar_t>(),
-        output.data<scalar_t>(),
-        output_state.data<scalar_t>(),
-        act_Wx.data<scalar_t>(),
-        tmp_Rh.data<scalar_t>(),
-        layer_norm1,
-        act_Wx_norm.data<scalar_t>(),
-        act_Rh.data<scalar_t>(),
-        layer_norm2,
-        layer_norm3,
-        act_c_norm.data<scalar_t>(),
-        has_zoneout ? zoneout_prob : 0.0f,
-        has_zoneout ? zoneout_mask.data<scalar_t>() : nullptr);
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      auto gamma_a = gamma.packed_accessor<scalar_t, 2>();
+
+      layer_norm::ForwardPass<scalar_t> layer_norm1(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma_a[0].data(),
+          nullptr,
+          act_Wx_norm_cache.data<scalar_t>());
+
+      layer_norm::ForwardPass<scalar_t> layer_norm2(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma_a[1].data(),
+          nullptr,
+          act_Rh_norm_cache.data<scalar_t>());
+
+      layer_norm::ForwardPass<scalar_t> layer_norm3(
+          time_steps * batch_size,
+          hidden_size,
+          gamma_h.data<scalar_t>(),
+          beta_h.data<scalar_t>(),
+          act_c_norm_cache.data<scalar_t>());
+
+      layer_norm_lstm::ForwardPass<scalar_t> lstm(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+
+      lstm.Run(
+          time_steps,
+          kernel.data<scalar_t>(),
+          dropped_recurrent_kernel.data<scalar_t>(),
+          bias.data<scalar_t>(),
+          x.data<scalar_t>(),
+          output.data<scalar_t>(),
+          output_state.data<scalar_t>(),
+          act_Wx.data<scalar_t>(),
+          tmp_Rh.data<scalar_t>(),
+          layer_norm1,
+          act_Wx_norm.data<scalar_t>(),
+          act_Rh.data<scalar_t>(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm.data<scalar_t>(),
+          zoneout_prob,
+          zoneout_seed);
+#endif
+    } else {
+      auto gamma_a = gamma.packed_accessor<scalar_t, 2>();
+
+      cpu::layer_norm::ForwardPass<scalar_t> layer_norm1(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma_a[0].data(),
+          nullptr,
+          act_Wx_norm_cache.data<scalar_t>(),
+          GetCpuParallelFor());
+
+      cpu::layer_norm::ForwardPass<scalar_t> layer_norm2(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma_a[1].data(),
+          nullptr,
+          act_Rh_norm_cache.data<scalar_t>(),
+          GetCpuParallelFor());
+
+      cpu::layer_norm::ForwardPass<scalar_t> layer_norm3(
+          time_steps * batch_size,
+          hidden_size,
+          gamma_h.data<scalar_t>(),
+          beta_h.data<scalar_t>(),
+          act_c_norm_cache.data<scalar_t>(),
+          GetCpuParallelFor());
+
+      cpu::layer_norm_lstm::ForwardPass<scalar_t> lstm(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+      // Each direction of a bidirectional layer keeps its own packed kernel.
+      const auto packed_R = PackRecurrentKernel<scalar_t>(
+          workspace, reverse ? "packed_recurrent_kernel_reverse" : "packed_recurrent_kernel",
+          lstm, recurrent_kernel, dropout_prob, { dropout_seed });
+
+      lstm.Run(
+          time_steps,
+          kernel.data<scalar_t>(),
+          recurrent_kernel.data<scalar_t>(),
+          bias.data<scalar_t>(),
+          x.data<scalar_t>(),
+          output.data<scalar_t>(),
+          output_state.data<scalar_t>(),
+          act_Wx.data<scalar_t>(),
+          tmp_Rh.data<scalar_t>(),
+          layer_norm1,
+          act_Wx_norm.data<scalar_t>(),
+          act_Rh.data<scalar_t>(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm.data<scalar_t>(),
+          zoneout_prob,
+          zoneout_seed,
+          sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr,
+          reverse,
+          packed_R[0]);
+    }
   }));
 
   return {
@@ -127,15 +230,29 @@ std::vector<Tensor> layer_norm_lstm_forward(
       act_c_norm_cache };
 }
 
+// `needs_grad` says which of dx, dW, and dR to compute. The others are returned as
+// undefined tensors (None in Python) and their matrix multiplications are skipped.
+// `accumulate_into` holds a buffer for each of dW, dR, db, dgamma, dgamma_h, and dbeta_h
+// that the gradient is added to and that is returned in its place, or an empty tensor to
+// return a new gradient.
+// `reverse` and `sequence_length` must match the values passed to
+// `layer_norm_lstm_forward`.
 std::vector<Tensor> layer_norm_lstm_backward(
-    Tensor x_t,
-    Tensor kernel_t,
-    Tensor recurrent_kernel_t,
+    Workspace& workspace,
+    std::vector<bool> needs_grad,
+    std::vector<Tensor> accumulate_into,
+    bool reverse,
+    Tensor x,
+    Tensor kernel,
+    Tensor recurrent_kernel,
     Tensor bias,
     Tensor gamma,
     Tensor gamma_h,
     Tensor beta_h,
-    Tensor zoneout_mask,
+    float zoneout_prob,
+    int64_t zoneout_seed,
+    float dropout_prob,
+    int64_t dropout_seed,
     Tensor h,
     Tensor c,
     Tensor act_Wx,
@@ -146,21 +263,20 @@ std::vector<Tensor> layer_norm_lstm_backward(
     Tensor act_c_norm,
     Tensor act_c_norm_cache,
     Tensor dh_new,
-    Tensor dc_new) {
-  const auto input_size = x_t.size(0);
-  const auto time_steps = x_t.size(1);
-  const auto batch_size = x_t.size(2);
-  const auto hidden_size = recurrent_kernel_t.size(1);
-  const bool has_zoneout = !!zoneout_mask.size(0);
-
-  CHECK_INPUT(x_t);
-  CHECK_INPUT(kernel_t);
-  CHECK_INPUT(recurrent_kernel_t);
+    Tensor dc_new,
+    Tensor sequence_length) {
+  const auto time_steps = x.size(0);
+  const auto batch_size = x.size(1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = recurrent_kernel.size(0);
+
+  CHECK_INPUT(x);
+  CHECK_INPUT(kernel);
+  CHECK_INPUT(recurrent_kernel);
   CHECK_INPUT(bias);
   CHECK_INPUT(gamma);
   CHECK_INPUT(gamma_h);
   CHECK_INPUT(beta_h);
-  CHECK_INPUT(zoneout_mask);
   CHECK_INPUT(h);
   CHECK_INPUT(c);
   CHECK_INPUT(act_Wx);
@@ -172,90 +288,397 @@ std::vector<Tensor> layer_norm_lstm_backward(
   CHECK_INPUT(act_c_norm_cache);
   CHECK_INPUT(dh_new);
   CHECK_INPUT(dc_new);
+  CHECK_FULL_PRECISION(x, "LayerNormLSTM");
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+  TORCH_CHECK(!x.is_cuda() || (!reverse && !sequence_length.numel()),
+      "the GPU LayerNormLSTM doesn't support reverse or sequence_length; reverse the input instead");
+  CHECK_ENTRIES(needs_grad, 3);
+  CHECK_ENTRIES(accumulate_into, 6);
+
+  Tensor dx = needs_grad[0] ? torch::empty({ time_steps, batch_size, input_size }, x.options()) : Tensor();
+  Tensor dW = GradBuffer(needs_grad[1], accumulate_into[0], kernel);
+  // The CPU pass masks the recurrent kernel gradient as it accumulates it. On the GPU, the
+  // DropConnect mask is applied to the whole gradient in place, so it's only added to its
+  // accumulator afterwards.
+  const bool mask_dR = dropout_prob && x.is_cuda();
+  Tensor dR = GradBuffer(needs_grad[2], mask_dR ? Tensor() : accumulate_into[1], recurrent_kernel);
+  Tensor db = GradBuffer(true, accumulate_into[2], bias);
+  Tensor dgamma = GradBuffer(true, accumulate_into[3], gamma);
+  Tensor dgamma_h = GradBuffer(true, accumulate_into[4], gamma_h);
+  Tensor dbeta_h = GradBuffer(true, accumulate_into[5], beta_h);
+
+  // Regenerate the dropped-out recurrent kernel that the forward GPU pass used. The CPU pass
+  // regenerates the mask itself.
+  const Tensor dropped_recurrent_kernel = x.is_cuda()
+      ? DropConnect(workspace, "dropped_recurrent_kernel", recurrent_kernel, dropout_prob, { dropout_seed })
+      : recurrent_kernel;
+  // The initial state gradients are consumed by the caller before the next call.
+  Tensor dh = workspace.Zeros("dh", { batch_size, hidden_size }, x.options());
+  Tensor dc = workspace.Zeros("dc", { batch_size, hidden_size }, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES(x.type(), "layer_norm_lstm_backward", ([&] {
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      auto gamma_a = gamma.packed_accessor<scalar_t, 2>();
+      auto dgamma_a = dgamma.packed_accessor<scalar_t, 2>();
+      auto c_a = c.packed_accessor<scalar_t, 3>();
+
+      layer_norm::BackwardPass<scalar_t> layer_norm1(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma_a[0].data(),
+          nullptr,
+          act_Wx.data<scalar_t>(),
+          dgamma_a[0].data(),
+          nullptr,
+          act_Wx_norm_cache.data<scalar_t>());
+
+      layer_norm::BackwardPass<scalar_t> layer_norm2(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma_a[1].data(),
+          nullptr,
+          act_Rh.data<scalar_t>(),
+          dgamma_a[1].data(),
+          nullptr,
+          act_Rh_norm_cache.data<scalar_t>());
+
+      layer_norm::BackwardPass<scalar_t> layer_norm3(
+          time_steps * batch_size,
+          hidden_size,
+          gamma_h.data<scalar_t>(),
+          beta_h.data<scalar_t>(),
+          c_a[1].data(),
+          dgamma_h.data<scalar_t>(),
+          dbeta_h.data<scalar_t>(),
+          act_c_norm_cache.data<scalar_t>());
+
+      layer_norm_lstm::BackwardPass<scalar_t> lstm(
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+
+      lstm.Run(
+          time_steps,
+          kernel.data<scalar_t>(),
+          dropped_recurrent_kernel.data<scalar_t>(),
+          bias.data<scalar_t>(),
+          x.data<scalar_t>(),
+          h.data<scalar_t>(),
+          c.data<scalar_t>(),
+          dh_new.data<scalar_t>(),
+          dc_new.data<scalar_t>(),
+          ptr<scalar_t>(dx),
+          ptr<scalar_t>(dW),
+          ptr<scalar_t>(dR),
+          db.data<scalar_t>(),
+          dh.data<scalar_t>(),
+          dc.data<scalar_t>(),
+          act_Wx.data<scalar_t>(),
+          layer_norm1,
+          act_Wx_norm.data<scalar_t>(),
+          act_Rh.data<scalar_t>(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm.data<scalar_t>(),
+          zoneout_prob,
+          zoneout_seed);
+#endif
+    } else {
+      auto gamma_a = gamma.packed_accessor<scalar_t, 2>();
+      auto dgamma_a = dgamma.packed_accessor<scalar_t, 2>();
+      auto c_a = c.packed_accessor<scalar_t, 3>();
+
+      cpu::layer_norm::BackwardPass<scalar_t> layer_norm1(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma_a[0].data(),
+          nullptr,
+          act_Wx.data<scalar_t>(),
+          dgamma_a[0].data(),
+          nullptr,
+          act_Wx_norm_cache.data<scalar_t>(),
+          GetCpuParallelFor());
 
-  Tensor dx = torch::empty({ time_steps, batch_size, input_size }, at::kCUDA);
-  Tensor dW = torch::zeros({ input_size, hidden_size * 4 }, at::kCUDA);
-  Tensor dR = torch::zeros({ hidden_size, hidden_size * 4 }, at::kCUDA);
-  Tensor db = torch::zeros({ hidden_size * 4 }, at::kCUDA);
-  Tensor dgamma = torch::zeros_like(gamma);
-  Tensor dgamma_h = torch::zeros_like(gamma_h);
-  Tensor dbeta_h = torch::zeros_like(beta_h);
-  Tensor dh = torch::zeros({ batch_size, hidden_size }, at::kCUDA);
-  Tensor dc = torch::zeros({ batch_size, hidden_size }, at::kCUDA);
-
-  AT_DISPATCH_FLOATING_TYPES(x_t.type(), "layer_norm_lstm_backward", ([&] {
-    auto gamma_a = gamma.packed_accessor<scalar_t, 2>();
-    auto dgamma_a = dgamma.packed_accessor<scalar_t, 2>();
-    auto c_a = c.packed_accessor<scalar_t, 3>();
-
-    layer_norm::BackwardPass<scalar_t> layer_norm1(
-        time_steps * batch_size,
-        hidden_size * 4,
-        gamma_a[0].data(),
-        nullptr,
-        act_Wx.data<scalar_t>(),
-        dgamma_a[0].data(),
-        nullptr,
-        act_Wx_norm_cache.data<scalar_t>());
-
-    layer_norm::BackwardPass<scalar_t> layer_norm2(
-        time_steps * batch_size,
-        hidden_size * 4,
-        gamma_a[1].data(),
-        nullptr,
-        act_Rh.data<scalar_t>(),
-        dgamma_a[1].data(),
-        nullptr,
-        act_Rh_norm_cache.data<scalar_t>());
-
-    layer_norm::BackwardPass<scalar_t> layer_norm3(
-        time_steps * batch_size,
-        hidden_size,
-        gamma_h.data<scalar_t>(),
-        beta_h.data<scalar_t>(),
-        c_a[1].data(),
-        dgamma_h.data<scalar_t>(),
-        dbeta_h.data<scalar_t>(),
-        act_c_norm_cache.data<scalar_t>());
-
-    layer_norm_lstm::BackwardPass<scalar_t> lstm(
-        batch_size,
-        input_size,
-        hidden_size,
-        at::cuda::getCurrentCUDABlasHandle());
-
-    lstm.Run(
-        time_steps,
-        kernel_t.data<scalar_t>(),
-        recurrent_kernel_t.data<scalar_t>(),
-        bias.data<scalar_t>(),
-        x_t.data<scalar_t>(),
-        h.data<scalar_t>(),
-        c.data<scalar_t>(),
-        dh_new.data<scalar_t>(),
-        dc_new.data<scalar_t>(),
-        dx.data<scalar_t>(),
-        dW.data<scalar_t>(),
-        dR.data<scalar_t>(),
-        db.data<scalar_t>(),
-        dh.data<scalar_t>(),
-        dc.data<scalar_t>(),
-        act_Wx.data<scalar_t>(),
-        layer_norm1,
-        act_Wx_norm.data<scalar_t>(),
-        act_Rh.data<scalar_t>(),
-        layer_norm2,
-        layer_norm3,
-        act_c_norm.data<scalar_t>(),
-        has_zoneout ? zoneout_mask.data<scalar_t>() : nullptr);
+      cpu::layer_norm::BackwardPass<scalar_t> layer_norm2(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma_a[1].data(),
+          nullptr,
+          act_Rh.data<scalar_t>(),
+          dgamma_a[1].data(),
+          nullptr,
+          act_Rh_norm_cache.data<scalar_t>(),
+          GetCpuParallelFor());
+
+      cpu::layer_norm::BackwardPass<scalar_t> layer_norm3(
+          time_steps * batch_size,
+          hidden_size,
+          gamma_h.data<scalar_t>(),
+          beta_h.data<scalar_t>(),
+          c_a[reverse ? 0 : 1].data(),
+          dgamma_h.data<scalar_t>(),
+          dbeta_h.data<scalar_t>(),
+          act_c_norm_cache.data<scalar_t>(),
+          GetCpuParallelFor());
+
+      cpu::layer_norm_lstm::BackwardPass<scalar_t> lstm(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+
+      lstm.Run(
+          time_steps,
+          kernel.data<scalar_t>(),
+          recurrent_kernel.data<scalar_t>(),
+          bias.data<scalar_t>(),
+          x.data<scalar_t>(),
+          h.data<scalar_t>(),
+          c.data<scalar_t>(),
+          dh_new.data<scalar_t>(),
+          dc_new.data<scalar_t>(),
+          ptr<scalar_t>(dx),
+          ptr<scalar_t>(dW),
+          ptr<scalar_t>(dR),
+          db.data<scalar_t>(),
+          dh.data<scalar_t>(),
+          dc.data<scalar_t>(),
+          act_Wx.data<scalar_t>(),
+          layer_norm1,
+          act_Wx_norm.data<scalar_t>(),
+          act_Rh.data<scalar_t>(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm.data<scalar_t>(),
+          zoneout_prob,
+          zoneout_seed,
+          sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr,
+          reverse,
+          dropout_prob,
+          dropout_seed);
+    }
   }));
 
-  return { dx, dW, dR, db, dgamma, dgamma_h, dbeta_h };
+  if (mask_dR) {
+    DropConnectGrad_(dR, dropout_prob, { dropout_seed });
+    if (dR.defined() && accumulate_into[1].numel())
+      dR = GradBuffer(true, accumulate_into[1], recurrent_kernel).add_(dR);
+  }
+  return { dx, dW, dR, db, dgamma, dgamma_h, dbeta_h, dh, dc };
 }
 
+// Runs the LayerNormLSTM one time step per call for autoregressive decoding. The native
+// forward pass and its scratch space are created once and reused by every step; only the
+// layer norms, which just hold pointers, are set up per step. The output state alternates
+// between two buffers so the state returned by one step can be passed straight back in as
+// the input to the next.
+class LayerNormLstmDecoder {
+  public:
+    LayerNormLstmDecoder(Tensor kernel, Tensor recurrent_kernel, int64_t batch_size, float zoneout_prob)
+        : batch_size_(batch_size),
+          input_size_(kernel.size(0)),
+          hidden_size_(recurrent_kernel.size(0)),
+          zoneout_prob_(zoneout_prob),
+          current_(0) {
+      CHECK_DEVICE(kernel);
+      const auto options = kernel.options();
+      // `Run` expects the input and output states to be adjacent, so each buffer holds
+      // both and the input state is copied into its first slot.
+      for (int i = 0; i < 2; ++i) {
+        h_[i] = torch::empty({ 2, batch_size_, hidden_size_ }, options);
+        c_[i] = torch::empty({ 2, batch_size_, hidden_size_ }, options);
+      }
+      act_Wx_ = torch::empty({ batch_size_, hidden_size_ * 4 }, options);
+      act_Wx_norm_ = torch::empty({ batch_size_, hidden_size_ * 4 }, options);
+      act_Rh_ = torch::empty({ batch_size_, hidden_size_ * 4 }, options);
+      act_c_norm_ = torch::empty({ batch_size_, hidden_size_ }, options);
+      cache_ = torch::empty({ 3, batch_size_, 2 }, options);
+      tmp_Rh_ = torch::empty({ batch_size_, hidden_size_ * 4 }, options);
+
+      AT_DISPATCH_FLOATING_TYPES(kernel.type(), "LayerNormLstmDecoder", ([&] {
+        if (kernel.is_cuda()) {
+#ifdef WITH_CUDA
+          auto lstm = std::make_shared<layer_norm_lstm::ForwardPass<scalar_t>>(
+              false,
+              batch_size_,
+              input_size_,
+              hidden_size_,
+              at::cuda::getCurrentCUDABlasHandle());
+          run_ = [this, lstm](
+              const Tensor& x,
+              const Tensor& kernel,
+              const Tensor& recurrent_kernel,
+              const Tensor& bias,
+              const Tensor& gamma,
+              const Tensor& gamma_h,
+              const Tensor& beta_h,
+              Tensor& h,
+              Tensor& c) {
+            layer_norm::ForwardPass<scalar_t> layer_norm1(
+                batch_size_,
+                hidden_size_ * 4,
+                gamma.data<scalar_t>(),
+                nullptr,
+                cache_.data<scalar_t>());
+            layer_norm::ForwardPass<scalar_t> layer_norm2(
+                batch_size_,
+                hidden_size_ * 4,
+                gamma.data<scalar_t>() + hidden_size_ * 4,
+                nullptr,
+                cache_.data<scalar_t>() + batch_size_ * 2);
+            layer_norm::ForwardPass<scalar_t> layer_norm3(
+                batch_size_,
+                hidden_size_,
+                gamma_h.data<scalar_t>(),
+                beta_h.data<scalar_t>(),
+                cache_.data<scalar_t>() + batch_size_ * 4);
+            RunStep<scalar_t>(*lstm, layer_norm1, layer_norm2, layer_norm3, x, kernel, recurrent_kernel, bias, h, c);
+          };
+#endif
+        } else {
+          auto lstm = std::make_shared<cpu::layer_norm_lstm::ForwardPass<scalar_t>>(
+              false,
+              batch_size_,
+              input_size_,
+              hidden_size_,
+              GetCpuParallelFor());
+          run_ = [this, lstm](
+              const Tensor& x,
+              const Tensor& kernel,
+              const Tensor& recurrent_kernel,
+              const Tensor& bias,
+              const Tensor& gamma,
+              const Tensor& gamma_h,
+              const Tensor& beta_h,
+              Tensor& h,
+              Tensor& c) {
+            cpu::layer_norm::ForwardPass<scalar_t> layer_norm1(
+                batch_size_,
+                hidden_size_ * 4,
+                gamma.data<scalar_t>(),
+                nullptr,
+                cache_.data<scalar_t>(),
+                GetCpuParallelFor());
+            cpu::layer_norm::ForwardPass<scalar_t> layer_norm2(
+                batch_size_,
+                hidden_size_ * 4,
+                gamma.data<scalar_t>() + hidden_size_ * 4,
+                nullptr,
+                cache_.data<scalar_t>() + batch_size_ * 2,
+                GetCpuParallelFor());
+            cpu::layer_norm::ForwardPass<scalar_t> layer_norm3(
+                batch_size_,
+                hidden_size_,
+                gamma_h.data<scalar_t>(),
+                beta_h.data<scalar_t>(),
+                cache_.data<scalar_t>() + batch_size_ * 4,
+                GetCpuParallelFor());
+            RunStep<scalar_t>(*lstm, layer_norm1, layer_norm2, layer_norm3, x, kernel, recurrent_kernel, bias, h, c);
+          };
+        }
+      }));
+    }
+
+    LayerNormLstmDecoder(const LayerNormLstmDecoder&) = delete;
+    LayerNormLstmDecoder& operator=(const LayerNormLstmDecoder&) = delete;
+
+    std::vector<Tensor> step(
+        Tensor x,
+        Tensor kernel,
+        Tensor recurrent_kernel,
+        Tensor bias,
+        Tensor gamma,
+        Tensor gamma_h,
+        Tensor beta_h,
+        Tensor h,
+        Tensor c) {
+      CHECK_INPUT(x);
+      CHECK_INPUT(kernel);
+      CHECK_INPUT(recurrent_kernel);
+      CHECK_INPUT(bias);
+      CHECK_INPUT(gamma);
+      CHECK_INPUT(gamma_h);
+      CHECK_INPUT(beta_h);
+      CHECK_SHAPE(x, batch_size_, input_size_);
+      CHECK_SHAPE(h, batch_size_, hidden_size_);
+      CHECK_SHAPE(c, batch_size_, hidden_size_);
+
+      Tensor& h_buf = h_[current_];
+      Tensor& c_buf = c_[current_];
+      current_ ^= 1;
+
+      h_buf[0].copy_(h);
+      c_buf[0].copy_(c);
+      run_(x, kernel, recurrent_kernel, bias, gamma, gamma_h, beta_h, h_buf, c_buf);
+      return { h_buf[1], c_buf[1] };
+    }
+
+  private:
+    template<typename T, typename ForwardPassT, typename LayerNormT>
+    void RunStep(
+        ForwardPassT& lstm,
+        LayerNormT& layer_norm1,
+        LayerNormT& layer_norm2,
+        LayerNormT& layer_norm3,
+        const Tensor& x,
+        const Tensor& kernel,
+        const Tensor& recurrent_kernel,
+        const Tensor& bias,
+        Tensor& h,
+        Tensor& c) {
+      lstm.Run(
+          1,
+          kernel.data<T>(),
+          recurrent_kernel.data<T>(),
+          bias.data<T>(),
+          x.data<T>(),
+          h.data<T>(),
+          c.data<T>(),
+          act_Wx_.data<T>(),
+          tmp_Rh_.data<T>(),
+          layer_norm1,
+          act_Wx_norm_.data<T>(),
+          act_Rh_.data<T>(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm_.data<T>(),
+          zoneout_prob_,
+          0);  // Inference-mode zoneout only uses `zoneout_prob`.
+    }
+
+    const int64_t batch_size_;
+    const int64_t input_size_;
+    const int64_t hidden_size_;
+    const float zoneout_prob_;
+    int current_;
+    Tensor h_[2];
+    Tensor c_[2];
+    Tensor act_Wx_;
+    Tensor act_Wx_norm_;
+    Tensor act_Rh_;
+    Tensor act_c_norm_;
+    Tensor cache_;
+    Tensor tmp_Rh_;
+    std::function<void(
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        Tensor&,
+        Tensor&)> run_;
+};
+
 }  // anonymous namespace
 
 void layer_norm_lstm_init(py::module& m) {
   m.def("layer_norm_lstm_forward", &layer_norm_lstm_forward, "LayerNormLSTM forward");
   m.def("layer_norm_lstm_backward", &layer_norm_lstm_backward, "LayerNormLSTM backward");
+  py::class_<LayerNormLstmDecoder>(m, "LayerNormLstmDecoder")
+      .def(py::init<Tensor, Tensor, int64_t, float>())
+      .def("step", &LayerNormLstmDecoder::step, "LayerNormLSTM single step");
 }
@@ -16,10 +16,10 @@
 """Layer Normalized Long Short-Term Memory"""
 
 
+import functools
 import haste_pytorch_lib as LIB
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
 
 
 __all__ = [
@@ -27,13 +27,161 @@ __all__ = [
 ]
 
 
+def _reverse_sequence(sequence, lengths):
+  """
+  Reverses a batched sequence in time-major order [T,N,...]. The input sequence
+  may be padded, in which case `lengths` specifies the unpadded length of each
+  sequence and the padding stays where it is.
+  """
+  if lengths is None:
+    return sequence.flip(0)
+  lengths = torch.as_tensor(lengths).to(device=sequence.device, dtype=torch.int64)
+  steps = torch.arange(sequence.shape[0], device=sequence.device).unsqueeze(1)
+  indices = torch.where(steps < lengths, lengths - 1 - steps, steps)
+  indices = indices.view(*indices.shape, *[1] * (sequence.dim() - 2)).expand_as(sequence)
+  return sequence.gather(0, indices)
+
+
+def _sequence_length(lengths, device):
+  """
+  Returns `lengths` as an int64 tensor on `device`, or an empty tensor if
+  `lengths` is missing.
+  """
+  if lengths is None:
+    return torch.empty(0, dtype=torch.int64, device=device)
+  return torch.as_tensor(lengths).to(device=device, dtype=torch.int64)
+
+
+def _segments(time_steps, checkpoint_every):
+  """Returns the `[begin, end)` time step range of each checkpointed segment."""
+  return [(begin, min(begin + checkpoint_every, time_steps)) for begin in range(0, time_steps, checkpoint_every)]
+
+
+def _check_dtype(input):
+  """
+  Raises an error for 16-bit inputs, which only the `LSTM` supports.
+  """
+  if input.dtype in (torch.float16, torch.bfloat16):
+    raise TypeError(('LayerNormLSTM: {} inputs are not supported, use float32 or float64. '
+                     'Only the LSTM supports float16 and bfloat16.').format(input.dtype))
+
+
+def _seeds(count):
+  """
+  Returns `count` independent seeds for the zoneout and DropConnect masks that
+  the native passes regenerate. They're drawn from PyTorch's default generator,
+  so `torch.manual_seed` makes the masks reproducible.
+  """
+  return torch.randint(1 << 62, (count,)).tolist()
+
+
+def _claim_grad_buffers(pool, params):
+  """
+  Returns `(pool, buffers)` with a gradient buffer for each of `params` for the
+  native backward pass to accumulate into, reused from `pool` if it holds a
+  matching set and newly allocated otherwise. A forward pass that runs during a
+  backward pass, e.g. to recompute a checkpoint, always gets new buffers, since
+  the pooled ones may still be waiting for autograd to add them to `.grad`.
+  """
+  buffers = None
+  if pool and torch._C._current_graph_task_id() == -1:
+    buffers = pool.pop()
+    if any(b.shape != p.shape or b.dtype != p.dtype or b.device != p.device for b, p in zip(buffers, params)):
+      buffers = None  # stale after e.g. `.to()`
+  if buffers is None:
+    buffers = [torch.empty_like(p) for p in params]
+  return pool, buffers
+
+
+def _grad_accumulators(ctx, needs_grad):
+  """
+  Returns the buffers claimed by the forward pass, zeroed, for the native
+  backward pass to accumulate the needed gradients into and return to autograd.
+  The other entries, and all of them if no buffers were claimed, are empty
+  tensors, for which the native pass returns a new gradient instead. The
+  buffers go back to their pool for the next step, so a second backward pass
+  through the same graph gets new gradients.
+  """
+  if ctx.grad_buffers is None:
+    return [torch.empty(0)] * len(needs_grad)
+  pool, buffers = ctx.grad_buffers
+  ctx.grad_buffers = None
+  pool.append(buffers)
+  return [b.zero_() if needed else torch.empty(0) for b, needed in zip(buffers, needs_grad)]
+
+
+def _attach_grads(params, flat_grad):
+  """
+  Points the `.grad` of each of `params` that requires grad at its view into
+  `flat_grad`, unless it already is. A missing gradient, e.g. after
+  `zero_grad()`, which sets gradients to None by default, leaves a zeroed view;
+  a replaced one is copied into the view.
+  """
+  offset = 0
+  for param in params:
+    view = flat_grad[offset:offset + param.numel()].view_as(param)
+    offset += param.numel()
+    if not param.requires_grad or (param.grad is not None and param.grad.data_ptr() == view.data_ptr()):
+      continue
+    if param.grad is None:
+      view.zero_()
+    else:
+      view.copy_(param.grad)
+    param.grad = view
+
+
+def _reattach_grads(module, param):
+  """Hook for `_keep_grads_attached`."""
+  with torch.no_grad():
+    _attach_grads(module._parameters.values(), module.flat_grad)
+
+
+def _keep_grads_attached(module):
+  """
+  Registers a hook on each of `module`'s parameters that points `.grad` back at
+  its view into `module.flat_grad` once autograd has accumulated into it.
+  Autograd keeps an existing `.grad` and adds to it in place, but it installs a
+  new tensor if `.grad` was reset to None after the forward pass or if
+  `create_graph=True`. Returns the hook handles.
+  """
+  hook = functools.partial(_reattach_grads, module)
+  return [p.register_post_accumulate_grad_hook(hook) for p in module._parameters.values() if p.requires_grad]
+
+
+def _flatten(params):
+  """
+  Moves `params` into one contiguous buffer and makes each of them, and its
+  `.grad`, a view into that buffer and a matching gradient buffer. Returns the
+  two buffers.
+  """
+  params = list(params)
+  flat = torch.empty(sum(p.numel() for p in params), dtype=params[0].dtype, device=params[0].device)
+  flat_grad = torch.zeros_like(flat)
+  offset = 0
+  with torch.no_grad():
+    for param in params:
+      view = flat[offset:offset + param.numel()].view_as(param)
+      offset += param.numel()
+      view.copy_(param)
+      param.data = view
+  _attach_grads(params, flat_grad)
+  return flat, flat_grad
+
+
 class LayerNormLSTMFunction(torch.autograd.Function):
   @staticmethod
-  def forward(ctx, training, zoneout_prob, *inputs):
-    outputs = LIB.layer_norm_lstm_forward(training, zoneout_prob, *inputs)
-    ctx.save_for_backward(*inputs, *outputs)
-    ctx.mark_non_differentiable(inputs[-1])  # zoneout mask is non-differentiable
+  def forward(ctx, workspace, grad_buffers, training, zoneout_prob, dropout_prob, reverse, *inputs):
+    outputs = LIB.layer_norm_lstm_forward(workspace, training, zoneout_prob, dropout_prob, reverse, *inputs)
+    ctx.save_for_backward(*inputs[:7], *outputs)  # initial state isn't needed
+    ctx.zoneout_prob = zoneout_prob
+    ctx.zoneout_seed = inputs[-3]
+    ctx.dropout_prob = dropout_prob
+    ctx.dropout_seed = inputs[-2]
+    ctx.sequence_length = inputs[-1]
+    ctx.reverse = reverse
     ctx.training = training
+    ctx.workspace = workspace
+    ctx.grad_buffers = grad_buffers
     return outputs[0], outputs[1]
 
   @staticmethod
@@ -42,11 +190,145 @@ class LayerNormLSTMFunction(torch.autograd.Function):
       raise RuntimeError('LayerNormLSTM backward can only be called in training mode')
 
     saved = [*ctx.saved_tensors]
-    saved[0] = saved[0].permute(2, 0, 1).contiguous()  # x -> x_t
-    saved[1] = saved[1].permute(1, 0).contiguous()     # kernel -> kernel_t
-    saved[2] = saved[2].permute(1, 0).contiguous()     # recurrent_kernel -> recurrent_kernel_t
-    grads = LIB.layer_norm_lstm_backward(*saved, grad_h.contiguous(), grad_c.contiguous())
-    return (None, None, *grads, None)
+    grads = LIB.layer_norm_lstm_backward(
+        ctx.workspace,
+        ctx.needs_input_grad[6:9],
+        _grad_accumulators(ctx, ctx.needs_input_grad[7:13]),
+        ctx.reverse,
+        *saved[:7],
+        ctx.zoneout_prob,
+        ctx.zoneout_seed,
+        ctx.dropout_prob,
+        ctx.dropout_seed,
+        *saved[7:],
+        grad_h.contiguous(),
+        grad_c.contiguous(),
+        ctx.sequence_length)
+    dx, *dparams, dh, dc = grads
+    # The initial state lives in the last slot in reverse.
+    initial = -1 if ctx.reverse else 0
+    dh0 = dh + grad_h[initial]
+    dc0 = dc + grad_c[initial]
+    return (None, None, None, None, None, None, dx, *dparams, dh0, dc0, None, None, None)
+
+
+class LayerNormLSTMCheckpointFunction(torch.autograd.Function):
+  @staticmethod
+  def forward(
+      ctx,
+      workspace,
+      grad_buffers,
+      zoneout_prob,
+      dropout_prob,
+      checkpoint_every,
+      x,
+      kernel,
+      recurrent_kernel,
+      bias,
+      gamma,
+      gamma_h,
+      beta_h,
+      h0,
+      c0,
+      zoneout_seed,
+      dropout_seed):
+    params = (kernel, recurrent_kernel, bias, gamma, gamma_h, beta_h)
+    h = [h0.unsqueeze(0)]
+    c = [c0.unsqueeze(0)]
+    for begin, end in _segments(x.shape[0], checkpoint_every):
+      outputs = LIB.layer_norm_lstm_forward(
+          workspace,
+          True,
+          zoneout_prob,
+          dropout_prob,
+          False,
+          x[begin:end],
+          *params,
+          h[-1][-1],
+          c[-1][-1],
+          zoneout_seed + begin,
+          dropout_seed,
+          _sequence_length(None, x.device))
+      h.append(outputs[0][1:])
+      c.append(outputs[1][1:])
+    h = torch.cat(h)
+    c = torch.cat(c)
+
+    # None of the intermediate activations are kept. Only the hidden states, which are
+    # the output anyway, and the cell state at the start of each segment are saved.
+    ctx.save_for_backward(x, *params, h, c[:-1:checkpoint_every].clone())
+    ctx.zoneout_prob = zoneout_prob
+    ctx.zoneout_seed = zoneout_seed
+    ctx.dropout_prob = dropout_prob
+    ctx.dropout_seed = dropout_seed
+    ctx.checkpoint_every = checkpoint_every
+    ctx.workspace = workspace
+    ctx.grad_buffers = grad_buffers
+    return h, c
+
+  @staticmethod
+  def backward(ctx, grad_h, grad_c):
+    x, *params, h, c_checkpoints = ctx.saved_tensors
+    kernel, recurrent_kernel = params[:2]
+    grad_h = grad_h.contiguous()
+    grad_c = grad_c.contiguous()
+
+    # Every segment adds its parameter gradients to the same buffers. Of the parameters,
+    # only the kernels' gradients can be skipped.
+    needs_grad = ctx.needs_input_grad[5:8]
+    needed = [i >= 2 or needs_grad[i + 1] for i in range(len(params))]
+    if ctx.grad_buffers is None:
+      accumulators = [torch.zeros_like(p) if n else torch.empty(0) for p, n in zip(params, needed)]
+    else:
+      accumulators = _grad_accumulators(ctx, needed)
+    dx = torch.empty_like(x) if needs_grad[0] else None
+    dh = torch.zeros_like(h[0])
+    dc = torch.zeros_like(h[0])
+    segments = _segments(x.shape[0], ctx.checkpoint_every)
+    for (begin, end), c0 in reversed(list(zip(segments, c_checkpoints))):
+      # Step t of the sequence always uses the seed `zoneout_seed + t`, so each segment
+      # regenerates exactly the zoneout masks of the full-sequence forward pass.
+      zoneout_seed_segment = ctx.zoneout_seed + begin
+      outputs = LIB.layer_norm_lstm_forward(
+          ctx.workspace,
+          True,
+          ctx.zoneout_prob,
+          ctx.dropout_prob,
+          False,
+          x[begin:end],
+          *params,
+          h[begin],
+          c0,
+          zoneout_seed_segment,
+          ctx.dropout_seed,
+          _sequence_length(None, x.device))
+
+      # The gradient from the later segments enters through this segment's final state.
+      dh_new = grad_h[begin:end+1].clone()
+      dc_new = grad_c[begin:end+1].clone()
+      dh_new[-1] += dh
+      dc_new[-1] += dc
+      dx_segment, *_, dh, dc = LIB.layer_norm_lstm_backward(
+          ctx.workspace,
+          needs_grad,
+          accumulators,
+          False,
+          x[begin:end],
+          kernel,
+          recurrent_kernel,
+          *params[2:],
+          ctx.zoneout_prob,
+          zoneout_seed_segment,
+          ctx.dropout_prob,
+          ctx.dropout_seed,
+          *outputs,
+          dh_new,
+          dc_new,
+          _sequence_length(None, x.device))
+      if dx is not None:
+        dx[begin:end] = dx_segment
+    dparams = [a if n else None for a, n in zip(accumulators, needed)]
+    return (None, None, None, None, None, dx, *dparams, dh + grad_h[0], dc + grad_c[0], None, None)
 
 
 class LayerNormLSTM(nn.Module):
@@ -58,6 +340,13 @@ class LayerNormLSTM(nn.Module):
   GPU-accelerated. DropConnect and Zoneout regularization are built-in, and
   this layer allows setting a non-zero initial forget gate bias.
 
+  The layer runs on whichever device its parameters live on: use `.cuda()`
+  for the GPU kernels or keep it on the CPU for the multithreaded CPU kernels.
+
+  Only float32 and float64 are supported: a layer converted with `.half()` or
+  `.bfloat16()` raises an error when it's run. 16-bit storage is only
+  implemented for the `LSTM`.
+
   Details about the exact function this layer implements can be found at
   https://github.com/lmnt-com/haste/issues/1.
 
@@ -70,7 +359,11 @@ class LayerNormLSTM(nn.Module):
       batch_first=False,
       forget_bias=1.0,
       dropout=0.0,
-      zoneout=0.0):
+      zoneout=0.0,
+      bidirectional=False,
+      checkpoint_every=0,
+      accumulate_grad_in_place=False,
+      flat_parameters=False):
     """
     Initialize the parameters of the LSTM layer.
 
@@ -85,6 +378,36 @@ class LayerNormLSTM(nn.Module):
         regularization on the recurrent matrix.
       zoneout: (optional) float, sets the zoneout rate for Zoneout
         regularization.
+      bidirectional: (optional) bool, if `True`, the layer also runs a second
+        LSTM over the reversed input sequence and concatenates the outputs of
+        both directions along the feature dimension.
+      checkpoint_every: (optional) int, if non-zero, training keeps the
+        cell state only at every `checkpoint_every`-th time step and none of
+        the gate or normalization activations. The backward pass recomputes
+        the activations of each segment just before backpropagating through
+        it, which costs about one extra forward pass.
+      accumulate_grad_in_place: (optional) bool, if `True`, the backward pass
+        accumulates the parameter gradients into buffers that the layer keeps
+        and reuses across training steps instead of allocating new ones on
+        every step. The buffers are still returned to autograd, which adds
+        them to `.grad` and runs the parameters' hooks, so
+        `DistributedDataParallel` and `GradScaler` see the gradients as usual.
+        When `.grad` is None, autograd copies the buffer rather than adding
+        it, so the option pays off with `flat_parameters` or
+        `zero_grad(set_to_none=False)`. Supported for both directions of a
+        bidirectional LayerNormLSTM and with `checkpoint_every`.
+      flat_parameters: (optional) bool, if `True`, all of the layer's
+        parameters are views into one contiguous buffer, `flat_weight`, and
+        their gradients are views into a matching buffer, `flat_grad`, so a
+        single collective (e.g. `torch.distributed.all_reduce(layer.flat_grad)`)
+        or tensor operation covers the whole layer. Every forward pass with
+        gradients enabled points `.grad` back at `flat_grad`, so gradients
+        that were set to None by `zero_grad()` are zeroed there instead.
+        If autograd installs a new `.grad` anyway, e.g. with
+        `create_graph=True`, it's copied back into `flat_grad` as soon as
+        it's accumulated. `DistributedDataParallel` must keep its default
+        `gradient_as_bucket_view=False`, since that option points `.grad` at
+        its own buckets instead.
 
     Variables:
       kernel: the input projection weight matrix. Dimensions
@@ -103,6 +426,11 @@ class LayerNormLSTM(nn.Module):
         Initialized to ones.
       beta_h: the output normalization bias. Dimensions (hidden_size).
         Initialized to zeros.
+      *_reverse: the parameters of the reverse direction if `bidirectional`
+        is `True`, e.g. `kernel_reverse`. Same dimensions and initialization
+        as their forward counterparts.
+      flat_weight, flat_grad: the contiguous parameter and gradient buffers
+        if `flat_parameters` is `True`, otherwise None.
     """
     super(LayerNormLSTM, self).__init__()
 
@@ -110,6 +438,8 @@ class LayerNormLSTM(nn.Module):
       raise ValueError('LayerNormLSTM: dropout must be in [0.0, 1.0]')
     if zoneout < 0 or zoneout > 1:
       raise ValueError('LayerNormLSTM: zoneout must be in [0.0, 1.0]')
+    if checkpoint_every < 0:
+      raise ValueError('LayerNormLSTM: checkpoint_every must be non-negative')
 
     self.input_size = input_size
     self.hidden_size = hidden_size
@@ -117,29 +447,77 @@ class LayerNormLSTM(nn.Module):
     self.forget_bias = forget_bias
     self.dropout = dropout
     self.zoneout = zoneout
+    self.bidirectional = bidirectional
+    self.checkpoint_every = checkpoint_every
+    self.accumulate_grad_in_place = accumulate_grad_in_place
+    self.flat_parameters = flat_parameters
 
-    gpu = torch.device('cuda')
-    self.kernel = nn.Parameter(torch.empty(input_size, hidden_size * 4, device=gpu))
-    self.recurrent_kernel = nn.Parameter(torch.empty(hidden_size, hidden_size * 4, device=gpu))
-    self.bias = nn.Parameter(torch.empty(hidden_size * 4, device=gpu))
-    self.gamma = nn.Parameter(torch.empty(2, hidden_size * 4, device=gpu))
-    self.gamma_h = nn.Parameter(torch.empty(hidden_size, device=gpu))
-    self.beta_h = nn.Parameter(torch.empty(hidden_size, device=gpu))
+    self.kernel = nn.Parameter(torch.empty(input_size, hidden_size * 4))
+    self.recurrent_kernel = nn.Parameter(torch.empty(hidden_size, hidden_size * 4))
+    self.bias = nn.Parameter(torch.empty(hidden_size * 4))
+    self.gamma = nn.Parameter(torch.empty(2, hidden_size * 4))
+    self.gamma_h = nn.Parameter(torch.empty(hidden_size))
+    self.beta_h = nn.Parameter(torch.empty(hidden_size))
+    if bidirectional:
+      self.kernel_reverse = nn.Parameter(torch.empty(input_size, hidden_size * 4))
+      self.recurrent_kernel_reverse = nn.Parameter(torch.empty(hidden_size, hidden_size * 4))
+      self.bias_reverse = nn.Parameter(torch.empty(hidden_size * 4))
+      self.gamma_reverse = nn.Parameter(torch.empty(2, hidden_size * 4))
+      self.gamma_h_reverse = nn.Parameter(torch.empty(hidden_size))
+      self.beta_h_reverse = nn.Parameter(torch.empty(hidden_size))
     self.reset_parameters()
 
+    self.flat_weight = None
+    self.flat_grad = None
+    self._grad_hooks = []
+    if flat_parameters:
+      self._flatten_parameters()
+
+    self._decoder = None
+    self._decoder_key = None
+    self._grad_buffers = []
+    self._workspace = LIB.Workspace()
+
   def reset_parameters(self):
     """Resets this layer's parameters to their initial values."""
     hidden_size = self.hidden_size
-    for i in range(4):
-      nn.init.xavier_uniform_(self.kernel[:, i*hidden_size:(i+1)*hidden_size])
-      nn.init.orthogonal_(self.recurrent_kernel[:, i*hidden_size:(i+1)*hidden_size])
-    nn.init.zeros_(self.bias)
-    nn.init.constant_(self.bias[hidden_size*2:hidden_size*3], self.forget_bias)
-    nn.init.ones_(self.gamma)
-    nn.init.ones_(self.gamma_h)
-    nn.init.zeros_(self.beta_h)
-
-  def forward(self, input, lengths=None):
+    for kernel, recurrent_kernel, bias, gamma, gamma_h, beta_h in self._directions():
+      for i in range(4):
+        nn.init.xavier_uniform_(kernel[:, i*hidden_size:(i+1)*hidden_size])
+        nn.init.orthogonal_(recurrent_kernel[:, i*hidden_size:(i+1)*hidden_size])
+      nn.init.zeros_(bias)
+      nn.init.constant_(bias[hidden_size*2:hidden_size*3], self.forget_bias)
+      nn.init.ones_(gamma)
+      nn.init.ones_(gamma_h)
+      nn.init.zeros_(beta_h)
+
+  def _flatten_parameters(self):
+    for handle in self._grad_hooks:
+      handle.remove()
+    self.flat_weight, self.flat_grad = _flatten(self._parameters.values())
+    self._grad_hooks = _keep_grads_attached(self)
+
+  def _apply(self, fn, *args, **kwargs):
+    # Conversions such as `.to()` and `.half()` replace the parameters one at a time,
+    # so the flat buffers are rebuilt afterwards.
+    module = super(LayerNormLSTM, self)._apply(fn, *args, **kwargs)
+    if self.flat_parameters:
+      self._flatten_parameters()
+    return module
+
+  def _directions(self):
+    directions = [(self.kernel, self.recurrent_kernel, self.bias, self.gamma, self.gamma_h, self.beta_h)]
+    if self.bidirectional:
+      directions.append((
+          self.kernel_reverse,
+          self.recurrent_kernel_reverse,
+          self.bias_reverse,
+          self.gamma_reverse,
+          self.gamma_h_reverse,
+          self.beta_h_reverse))
+    return directions
+
+  def forward(self, input, lengths=None, state=None):
     """
     Runs a forward pass of the LSTM layer.
 
@@ -150,41 +528,105 @@ class LayerNormLSTM(nn.Module):
       lengths: (optional) Tensor, list of sequence lengths for each batch
         element. Dimension (batch_size). This argument may be omitted if
         all batch elements are unpadded and have the same sequence length.
+      state: (optional) tuple `(h_0, c_0)`, the initial hidden and cell states.
+        Dimensions (num_directions, batch_size, hidden_size). Defaults to
+        zeros. Passing the state returned by a previous call continues the
+        sequence, which allows long inputs to be processed in chunks.
+        Gradients flow back to the initial state.
 
     Returns:
       output: Tensor, the output of the LSTM layer. Dimensions
-        (seq_len, batch_size, hidden_size) if `batch_first` is `False` (default)
-        or (batch_size, seq_len, hidden_size) if `batch_first` is `True`. Note
-        that if `lengths` was specified, the `output` tensor will not be
-        masked. It's the caller's responsibility to either not use the invalid
-        entries or to mask them out before using them.
+        (seq_len, batch_size, num_directions * hidden_size) if `batch_first`
+        is `False` (default) or (batch_size, seq_len, num_directions *
+        hidden_size) if `batch_first` is `True`. Bidirectional layers put the
+        forward direction's features first. Note that if `lengths` was
+        specified, the `output` tensor will not be masked. It's the caller's
+        responsibility to either not use the invalid entries or to mask them
+        out before using them.
       (h_n, c_n): the hidden and cell states, respectively, for the last
-        sequence item. Dimensions (1, batch_size, hidden_size).
+        sequence item of each direction. Dimensions (num_directions,
+        batch_size, hidden_size).
     """
+    _check_dtype(input)
+    if self.flat_parameters and torch.is_grad_enabled():
+      _attach_grads(self._parameters.values(), self.flat_grad)
+
     if self.batch_first:
       input = input.permute(1, 0, 2)
 
-    if self.zoneout:
-      zoneout_mask = torch.empty(
-          input.shape[0],
+    if state is None:
+      zeros = torch.zeros(
+          len(self._directions()),
           input.shape[1],
           self.hidden_size,
           dtype=input.dtype,
           device=input.device)
-      zoneout_mask.bernoulli_(1.0 - self.zoneout)
-    else:
-      zoneout_mask = torch.empty(0, dtype=input.dtype, device=input.device)
-    h, c = LayerNormLSTMFunction.apply(
-        self.training,
-        self.zoneout,
+      state = (zeros, zeros)
+
+    output, (h_n, c_n) = self._forward_direction(
+        input, lengths, state[0][0], state[1][0], *self._directions()[0])
+    if self.bidirectional and (input.is_cuda or self._checkpointing()):
+      # The reverse direction runs over each sequence back to front, leaving the
+      # padding in place so its final state is found the same way.
+      output_reverse, (h_n_reverse, c_n_reverse) = self._forward_direction(
+          _reverse_sequence(input, lengths), lengths, state[0][1], state[1][1], *self._directions()[1])
+      output = torch.cat([output, _reverse_sequence(output_reverse, lengths)], dim=-1)
+      h_n = torch.cat([h_n, h_n_reverse])
+      c_n = torch.cat([c_n, c_n_reverse])
+    elif self.bidirectional:
+      # The CPU pass runs the reverse direction in place, so neither the input
+      # nor the output has to be reversed.
+      output_reverse, (h_n_reverse, c_n_reverse) = self._forward_direction(
+          input, lengths, state[0][1], state[1][1], *self._directions()[1], reverse=True)
+      output = torch.cat([output, output_reverse], dim=-1)
+      h_n = torch.cat([h_n, h_n_reverse])
+      c_n = torch.cat([c_n, c_n_reverse])
+
+    if self.batch_first:
+      output = output.permute(1, 0, 2)
+
+    return output, (h_n, c_n)
+
+  def _checkpointing(self):
+    return self.training and self.checkpoint_every
+
+  def _forward_direction(
+      self, input, lengths, h0, c0, kernel, recurrent_kernel, bias, gamma, gamma_h, beta_h, reverse=False):
+    # The native passes regenerate the zoneout and DropConnect masks from these seeds
+    # instead of storing them.
+    dropout = self.dropout if self.training else 0.0
+    zoneout_seed = _seeds(1)[0] if self.training and self.zoneout else 0
+    dropout_seed = _seeds(1)[0] if dropout else 0
+
+    inputs = (
         input.contiguous(),
-        self.kernel.contiguous(),
-        F.dropout(self.recurrent_kernel, self.dropout, self.training).contiguous(),
-        self.bias.contiguous(),
-        self.gamma.contiguous(),
-        self.gamma_h.contiguous(),
-        self.beta_h.contiguous(),
-        zoneout_mask.contiguous())
+        kernel.contiguous(),
+        recurrent_kernel.contiguous(),
+        bias.contiguous(),
+        gamma.contiguous(),
+        gamma_h.contiguous(),
+        beta_h.contiguous(),
+        h0.contiguous(),
+        c0.contiguous(),
+        zoneout_seed,
+        dropout_seed)
+    grad_buffers = None
+    if self.accumulate_grad_in_place and self.training and torch.is_grad_enabled():
+      grad_buffers = _claim_grad_buffers(
+          self._grad_buffers, (kernel, recurrent_kernel, bias, gamma, gamma_h, beta_h))
+    if self._checkpointing():
+      h, c = LayerNormLSTMCheckpointFunction.apply(
+          self._workspace, grad_buffers, self.zoneout, dropout, self.checkpoint_every, *inputs)
+    else:
+      # Only the CPU pass skips the padding; on the GPU it's computed and ignored.
+      sequence_length = _sequence_length(None if input.is_cuda else lengths, input.device)
+      h, c = LayerNormLSTMFunction.apply(
+          self._workspace, grad_buffers, self.training, self.zoneout, dropout, reverse, *inputs,
+          sequence_length.contiguous())
+
+    if reverse:
+      # Every sequence ends at the first time step in reverse.
+      return h[:-1], (h[:1], c[:1])
 
     if lengths is not None:
       cols = range(h.size(1))
@@ -192,8 +634,76 @@ class LayerNormLSTM(nn.Module):
     else:
       state = (h[-1].unsqueeze(0), c[-1].unsqueeze(0))
 
-    output = h[1:]
-    if self.batch_first:
-      output = output.permute(1, 0, 2)
+    return h[1:], state
+
+  def step(self, input, state=None):
+    """
+    Runs the LayerNormLSTM layer for a single time step.
+
+    This is intended for autoregressive decoding, where each input depends on
+    the previous output. The native forward pass and its buffers are created
+    by the first call and reused by later calls with the same batch size,
+    dtype, and device, so each step costs little more than the recurrent
+    matrix multiplication. Only supported in inference mode.
+
+    Arguments:
+      input: Tensor, the input for this time step. Dimensions
+        (batch_size, input_size).
+      state: (optional) tuple `(h, c)`, the hidden and cell states from the
+        previous step. Dimensions (1, batch_size, hidden_size). Defaults to
+        zeros.
+
+    Returns:
+      output: Tensor, the output for this time step. Dimensions
+        (batch_size, hidden_size).
+      (h_n, c_n): the hidden and cell states after this step. Dimensions
+        (1, batch_size, hidden_size). These are views of buffers that are
+        reused two steps later; clone them to keep them for longer.
+    """
+    if self.training:
+      raise RuntimeError('LayerNormLSTM step can only be called in inference mode')
+    if self.bidirectional:
+      raise RuntimeError('LayerNormLSTM step is not supported for bidirectional layers')
+    _check_dtype(input)
+
+    batch_size = input.shape[0]
+    if state is None:
+      h = torch.zeros(batch_size, self.hidden_size, dtype=input.dtype, device=input.device)
+      c = torch.zeros(batch_size, self.hidden_size, dtype=input.dtype, device=input.device)
+    else:
+      h, c = state[0][0], state[1][0]
+
+    key = (batch_size, input.dtype, input.device)
+    if self._decoder_key != key:
+      self._decoder = LIB.LayerNormLstmDecoder(self.kernel, self.recurrent_kernel, batch_size, self.zoneout)
+      self._decoder_key = key
+
+    with torch.no_grad():
+      h, c = self._decoder.step(
+          input.contiguous(),
+          self.kernel.contiguous(),
+          self.recurrent_kernel.contiguous(),
+          self.bias.contiguous(),
+          self.gamma.contiguous(),
+          self.gamma_h.contiguous(),
+          self.beta_h.contiguous(),
+          h.contiguous(),
+          c.contiguous())
+    return h, (h.unsqueeze(0), c.unsqueeze(0))
 
-    return output, state
+  def workspace_stats(self):
+    """
+    Returns the hit and miss counts of this layer's scratch buffer pool.
+
+    The native passes keep their temporary buffers (the recurrent projection
+    scratch space, the activations in inference mode, and the initial state
+    gradients) in a pool that persists across calls, so steady-state calls
+    don't allocate them. A pooled buffer is reused if it's large enough and
+    has the right dtype and device; otherwise it's replaced by one rounded up
+    to the next power of two elements.
+
+    Returns:
+      stats: dict, the number of buffer requests that reused a pooled buffer
+        (`'hits'`) and that allocated a new one (`'misses'`).
+    """
+    return {'hits': self._workspace.hits, 'misses': self._workspace.misses}
@@ -13,138 +13,1387 @@
 // limitations under the License.
 // ==============================================================================
 
+#ifdef WITH_CUDA
 #include <ATen/cuda/CUDAContext.h>
+#endif
+#include <functional>
+#include <memory>
+#include <string>
 #include <torch/extension.h>
 #include <vector>
 
+#ifdef WITH_CUDA
 #include "haste.h"
+#else
+#include "haste/cpu/lstm.h"
+#endif
 #include "support.h"
 
 namespace {
 
+namespace cpu = haste::v0::cpu;
+
+#ifdef WITH_CUDA
 using haste::v0::lstm::ForwardPass;
 using haste::v0::lstm::BackwardPass;
+#endif
 
 using torch::Tensor;
 
 std::vector<Tensor> lstm_forward(
+    Workspace& workspace,
     bool training,
     float zoneout_prob,
+    float dropout_prob,
+    bool batch_first,
     Tensor x,
     Tensor kernel,
     Tensor recurrent_kernel,
     Tensor bias,
-    Tensor zoneout_mask) {
-  const auto time_steps = x.size(0);
-  const auto batch_size = x.size(1);
+    Tensor h0,
+    Tensor c0,
+    int64_t zoneout_seed,
+    int64_t dropout_seed,
+    Tensor batch_sizes) {
+  const auto time_steps = x.size(batch_first ? 1 : 0);
+  const auto batch_size = x.size(batch_first ? 0 : 1);
   const auto input_size = x.size(2);
   const auto hidden_size = recurrent_kernel.size(0);
-  const bool has_zoneout = zoneout_prob && zoneout_mask.size(0);
 
   CHECK_INPUT(x);
   CHECK_INPUT(kernel);
   CHECK_INPUT(recurrent_kernel);
   CHECK_INPUT(bias);
-  CHECK_INPUT(zoneout_mask);
+  CHECK_SHAPE(h0, batch_size, hidden_size);
+  CHECK_SHAPE(c0, batch_size, hidden_size);
+  CHECK_BATCH_SIZES(batch_sizes, time_steps);
 
-  Tensor output = torch::zeros({ time_steps + 1, batch_size, hidden_size }, at::kCUDA);
-  Tensor output_state = torch::zeros({ time_steps + 1, batch_size, hidden_size }, at::kCUDA);
-  Tensor cache = torch::empty({ time_steps, batch_size, hidden_size * 4 }, at::kCUDA);
-  Tensor tmp_Rh = torch::empty({ batch_size, hidden_size * 4 }, at::kCUDA);
+  // The CPU pass applies DropConnect as it packs the recurrent kernel; the GPU pass runs
+  // with a dropped-out copy.
+  const Tensor dropped_recurrent_kernel = x.is_cuda()
+      ? DropConnect(workspace, "dropped_recurrent_kernel", recurrent_kernel, dropout_prob, { dropout_seed })
+      : recurrent_kernel;
 
-  AT_DISPATCH_FLOATING_TYPES(x.type(), "lstm_forward", ([&] {
-    ForwardPass<scalar_t> forward(
-        training,
-        batch_size,
-        input_size,
-        hidden_size,
-        at::cuda::getCurrentCUDABlasHandle());
+  // The t=0 slots hold the initial state; `Run` fills in the rest. Batch-major inputs get
+  // batch-major states and activations, with time along the second dimension.
+  const int64_t time_dim = batch_first ? 1 : 0;
+  const auto state_sizes = batch_first
+      ? std::vector<int64_t>{ batch_size, time_steps + 1, hidden_size }
+      : std::vector<int64_t>{ time_steps + 1, batch_size, hidden_size };
+  const auto cache_sizes = batch_first
+      ? std::vector<int64_t>{ batch_size, time_steps, hidden_size * 4 }
+      : std::vector<int64_t>{ time_steps, batch_size, hidden_size * 4 };
+  Tensor output = torch::empty(state_sizes, x.options());
+  Tensor output_state = torch::empty(state_sizes, x.options());
+  output.select(time_dim, 0).copy_(h0);
+  output_state.select(time_dim, 0).copy_(c0);
+  // The activations are only kept for the backward pass in training mode.
+  Tensor cache = training
+      ? torch::empty(cache_sizes, x.options())
+      : workspace.Get("cache", cache_sizes, x.options());
+  Tensor tmp_Rh = workspace.Get("tmp_Rh", { batch_size, hidden_size * 4 }, x.options());
 
-    forward.Run(
-        time_steps,
-        kernel.data<scalar_t>(),
-        recurrent_kernel.data<scalar_t>(),
-        bias.data<scalar_t>(),
-        x.data<scalar_t>(),
-        output.data<scalar_t>(),
-        output_state.data<scalar_t>(),
-        cache.data<scalar_t>(),
-        tmp_Rh.data<scalar_t>(),
-        has_zoneout ? zoneout_prob : 0.0f,
-        has_zoneout ? zoneout_mask.data<scalar_t>() : nullptr);
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_forward", ([&] {
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      using T = typename native_type<scalar_t>::gpu;
+      ForwardPass<T> forward(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+
+      forward.Run(
+          time_steps,
+          ptr<T>(kernel),
+          ptr<T>(dropped_recurrent_kernel),
+          ptr<T>(bias),
+          ptr<T>(x),
+          ptr<T>(output),
+          ptr<T>(output_state),
+          ptr<T>(cache),
+          ptr<T>(tmp_Rh),
+          zoneout_prob,
+          zoneout_seed,
+          batch_sizes.numel() ? batch_sizes.data<int>() : nullptr,
+          nullptr,
+          false,
+          batch_first);
+#endif
+    } else {
+      using T = typename native_type<scalar_t>::cpu;
+      cpu::lstm::ForwardPass<T> forward(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+      const auto packed_R = PackRecurrentKernel<T>(
+          workspace, "packed_recurrent_kernel", forward, recurrent_kernel, dropout_prob, { dropout_seed });
+
+      forward.Run(
+          time_steps,
+          ptr<T>(kernel),
+          ptr<T>(recurrent_kernel),
+          ptr<T>(bias),
+          ptr<T>(x),
+          ptr<T>(output),
+          ptr<T>(output_state),
+          ptr<T>(cache),
+          ptr<T>(tmp_Rh),
+          zoneout_prob,
+          zoneout_seed,
+          batch_sizes.numel() ? batch_sizes.data<int>() : nullptr,
+          nullptr,
+          false,
+          batch_first,
+          packed_R[0]);
+    }
   }));
 
   return { output, output_state, cache };
 }
 
+// `needs_grad` says which of dx, dW, dR, and db to compute. The others are returned as
+// undefined tensors (None in Python) and their matrix multiplications are skipped.
+// `accumulate_into` holds a buffer for each of dW, dR, and db that the gradient is added
+// to and that is returned in its place, or an empty tensor to return a new gradient.
 std::vector<Tensor> lstm_backward(
-    Tensor x_t,
-    Tensor kernel_t,
-    Tensor recurrent_kernel_t,
+    Workspace& workspace,
+    std::vector<bool> needs_grad,
+    std::vector<Tensor> accumulate_into,
+    Tensor x,
+    Tensor kernel,
+    Tensor recurrent_kernel,
+    Tensor bias,
+    float zoneout_prob,
+    int64_t zoneout_seed,
+    float dropout_prob,
+    int64_t dropout_seed,
+    bool batch_first,
+    Tensor h,
+    Tensor c,
+    Tensor cache,
+    Tensor dh_new,
+    Tensor dc_new,
+    Tensor batch_sizes) {
+  const auto time_steps = x.size(batch_first ? 1 : 0);
+  const auto batch_size = x.size(batch_first ? 0 : 1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = recurrent_kernel.size(0);
+
+  CHECK_INPUT(x);
+  CHECK_INPUT(kernel);
+  CHECK_INPUT(recurrent_kernel);
+  CHECK_INPUT(bias);
+  CHECK_INPUT(h);
+  CHECK_INPUT(c);
+  CHECK_INPUT(cache);
+  CHECK_INPUT(dh_new);
+  CHECK_INPUT(dc_new);
+  CHECK_BATCH_SIZES(batch_sizes, time_steps);
+  CHECK_ENTRIES(needs_grad, 4);
+  CHECK_ENTRIES(accumulate_into, 3);
+
+  Tensor dx = needs_grad[0] ? torch::empty_like(x) : Tensor();
+  Tensor dW = GradBuffer(needs_grad[1], accumulate_into[0], kernel);
+  // The CPU pass masks the recurrent kernel gradient as it accumulates it. On the GPU, the
+  // DropConnect mask is applied to the whole gradient in place, so it's only added to its
+  // accumulator afterwards.
+  const bool mask_dR = dropout_prob && x.is_cuda();
+  Tensor dR = GradBuffer(needs_grad[2], mask_dR ? Tensor() : accumulate_into[1], recurrent_kernel);
+  Tensor db = GradBuffer(needs_grad[3], accumulate_into[2], bias);
+
+  // Regenerate the dropped-out recurrent kernel that the forward GPU pass used. The CPU pass
+  // regenerates the mask itself.
+  const Tensor dropped_recurrent_kernel = x.is_cuda()
+      ? DropConnect(workspace, "dropped_recurrent_kernel", recurrent_kernel, dropout_prob, { dropout_seed })
+      : recurrent_kernel;
+  // The initial state gradients are consumed by the caller before the next call.
+  Tensor dh = workspace.Zeros("dh", { batch_size, hidden_size }, x.options());
+  Tensor dc = workspace.Zeros("dc", { batch_size, hidden_size }, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_backward", ([&] {
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      using T = typename native_type<scalar_t>::gpu;
+      BackwardPass<T> backward(
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+
+      backward.Run(
+          time_steps,
+          ptr<T>(kernel),
+          ptr<T>(dropped_recurrent_kernel),
+          ptr<T>(bias),
+          ptr<T>(x),
+          ptr<T>(h),
+          ptr<T>(c),
+          ptr<T>(dh_new),
+          ptr<T>(dc_new),
+          ptr<T>(dx),
+          ptr<T>(dW),
+          ptr<T>(dR),
+          ptr<T>(db),
+          ptr<T>(dh),
+          ptr<T>(dc),
+          ptr<T>(cache),
+          zoneout_prob,
+          zoneout_seed,
+          batch_sizes.numel() ? batch_sizes.data<int>() : nullptr,
+          nullptr,
+          false,
+          batch_first);
+#endif
+    } else {
+      using T = typename native_type<scalar_t>::cpu;
+      cpu::lstm::BackwardPass<T> backward(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+
+      backward.Run(
+          time_steps,
+          ptr<T>(kernel),
+          ptr<T>(recurrent_kernel),
+          ptr<T>(bias),
+          ptr<T>(x),
+          ptr<T>(h),
+          ptr<T>(c),
+          ptr<T>(dh_new),
+          ptr<T>(dc_new),
+          ptr<T>(dx),
+          ptr<T>(dW),
+          ptr<T>(dR),
+          ptr<T>(db),
+          ptr<T>(dh),
+          ptr<T>(dc),
+          ptr<T>(cache),
+          zoneout_prob,
+          zoneout_seed,
+          batch_sizes.numel() ? batch_sizes.data<int>() : nullptr,
+          nullptr,
+          false,
+          batch_first,
+          dropout_prob,
+          dropout_seed);
+    }
+  }));
+
+  if (mask_dR) {
+    DropConnectGrad_(dR, dropout_prob, { dropout_seed });
+    if (dR.defined() && accumulate_into[1].numel())
+      dR = GradBuffer(true, accumulate_into[1], recurrent_kernel).add_(dR);
+  }
+  return { dx, dW, dR, db, dh, dc };
+}
+
+// Runs the LSTM in inference mode. The final states are returned as [N,H] tensors and hold
+// the state at the end of each sequence, and the [T,N,H] output is only computed if
+// `return_sequences` is set (otherwise an empty tensor is returned in its place). On the
+// CPU, neither the activations nor the states of past time steps are kept (see
+// `cpu::lstm::ForwardPass::RunInference`), so the scratch space doesn't grow with the
+// sequence length. If `batch_first` is set, `x` is [N,T,C] and the output is [N,T,H].
+std::vector<Tensor> lstm_inference_forward(
+    Workspace& workspace,
+    float zoneout_prob,
+    bool return_sequences,
+    bool batch_first,
+    Tensor x,
+    Tensor kernel,
+    Tensor recurrent_kernel,
+    Tensor bias,
+    Tensor h0,
+    Tensor c0,
+    Tensor batch_sizes,
+    Tensor sequence_length) {
+  const auto time_steps = x.size(batch_first ? 1 : 0);
+  const auto batch_size = x.size(batch_first ? 0 : 1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = recurrent_kernel.size(0);
+
+  CHECK_INPUT(x);
+  CHECK_INPUT(kernel);
+  CHECK_INPUT(recurrent_kernel);
+  CHECK_INPUT(bias);
+  CHECK_SHAPE(h0, batch_size, hidden_size);
+  CHECK_SHAPE(c0, batch_size, hidden_size);
+  CHECK_BATCH_SIZES(batch_sizes, time_steps);
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+
+  const int* active = batch_sizes.numel() ? batch_sizes.data<int>() : nullptr;
+  const int64_t* lengths = sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr;
+  const auto state_sizes = batch_first
+      ? std::vector<int64_t>{ batch_size, time_steps + 1, hidden_size }
+      : std::vector<int64_t>{ time_steps + 1, batch_size, hidden_size };
+  Tensor h;
+  Tensor c;
+  // Time dimension and final slot of `h` and `c`.
+  int64_t h_time_dim;
+  int64_t c_time_dim;
+  int64_t last_h;
+  int64_t last_c;
+
+  if (!x.is_cuda()) {
+    // Only the kept hidden states follow the input's layout; the two-slot ring buffers
+    // are the same either way.
+    h = return_sequences
+        ? torch::empty(state_sizes, x.options())
+        : workspace.Get("h", { 2, batch_size, hidden_size }, x.options());
+    c = workspace.Get("c", { 2, batch_size, hidden_size }, x.options());
+    h_time_dim = return_sequences && batch_first ? 1 : 0;
+    c_time_dim = 0;
+    h.select(h_time_dim, 0).copy_(h0);
+    c[0].copy_(c0);
+    Tensor v = workspace.Get("v", { batch_size, hidden_size * 4 }, x.options());
+    Tensor tmp_Rh = workspace.Get("tmp_Rh", { batch_size, hidden_size * 4 }, x.options());
+    last_h = return_sequences ? time_steps : time_steps % 2;
+    last_c = time_steps % 2;
+
+    AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_inference_forward", ([&] {
+      using T = typename native_type<scalar_t>::cpu;
+      cpu::lstm::ForwardPass<T> forward(
+          false,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+      const auto packed_R = PackRecurrentKernel<T>(
+          workspace, "packed_recurrent_kernel", forward, recurrent_kernel, 0.0f);
+
+      forward.RunInference(
+          time_steps,
+          ptr<T>(kernel),
+          ptr<T>(recurrent_kernel),
+          ptr<T>(bias),
+          ptr<T>(x),
+          ptr<T>(h),
+          ptr<T>(c),
+          ptr<T>(v),
+          ptr<T>(tmp_Rh),
+          zoneout_prob,
+          return_sequences,
+          false,
+          active,
+          lengths,
+          false,
+          batch_first,
+          packed_R[0]);
+    }));
+#ifdef WITH_CUDA
+  } else {
+    // The GPU pass overlaps the input projection of every step with the recurrence, so it
+    // still needs the [T,N,H*4] activations; they come from the workspace.
+    h = return_sequences
+        ? torch::empty(state_sizes, x.options())
+        : workspace.Get("h", state_sizes, x.options());
+    c = workspace.Get("c", state_sizes, x.options());
+    h_time_dim = batch_first ? 1 : 0;
+    c_time_dim = h_time_dim;
+    h.select(h_time_dim, 0).copy_(h0);
+    c.select(c_time_dim, 0).copy_(c0);
+    Tensor v = batch_first
+        ? workspace.Get("cache", { batch_size, time_steps, hidden_size * 4 }, x.options())
+        : workspace.Get("cache", { time_steps, batch_size, hidden_size * 4 }, x.options());
+    Tensor tmp_Rh = workspace.Get("tmp_Rh", { batch_size, hidden_size * 4 }, x.options());
+    last_h = time_steps;
+    last_c = time_steps;
+
+    AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_inference_forward", ([&] {
+      using T = typename native_type<scalar_t>::gpu;
+      ForwardPass<T> forward(
+          false,
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+
+      forward.Run(
+          time_steps,
+          ptr<T>(kernel),
+          ptr<T>(recurrent_kernel),
+          ptr<T>(bias),
+          ptr<T>(x),
+          ptr<T>(h),
+          ptr<T>(c),
+          ptr<T>(v),
+          ptr<T>(tmp_Rh),
+          zoneout_prob,
+          0,
+          active,
+          lengths,
+          false,
+          batch_first);
+    }));
+#endif
+  }
+
+  Tensor output = return_sequences ? h.slice(h_time_dim, 1) : torch::empty({ 0 }, x.options());
+  return { output, h.select(h_time_dim, last_h).clone(), c.select(c_time_dim, last_c).clone() };
+}
+
+// Runs one direction of a bidirectional LSTM. Direction 0 runs forward in time and
+// direction 1 in reverse; `direction` selects the slice of every stacked tensor. `extra`
+// is appended to the arguments of `Run` (the CPU passes take the layout and the packed
+// recurrent kernel forward, and the layout and DropConnect parameters backward).
+template<typename T, typename ForwardPassT, typename... Extra>
+void RunForwardDirection(
+    ForwardPassT& forward,
+    const int direction,
+    const float zoneout_prob,
+    const Tensor& x,
+    const Tensor& kernel,
+    const Tensor& recurrent_kernel,
+    const Tensor& bias,
+    const Tensor& h,
+    const Tensor& c,
+    const Tensor& cache,
+    const Tensor& tmp_Rh,
+    const std::vector<int64_t>& zoneout_seed,
+    const Tensor& batch_sizes,
+    const Tensor& sequence_length,
+    const Extra&... extra) {
+  forward.Run(
+      x.size(0),
+      ptr<T>(kernel[direction]),
+      ptr<T>(recurrent_kernel[direction]),
+      ptr<T>(bias[direction]),
+      ptr<T>(x),
+      ptr<T>(h[direction]),
+      ptr<T>(c[direction]),
+      ptr<T>(cache[direction]),
+      ptr<T>(tmp_Rh[direction]),
+      zoneout_prob,
+      zoneout_seed[direction],
+      batch_sizes.numel() ? batch_sizes.data<int>() : nullptr,
+      sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr,
+      direction == 1,
+      extra...);
+}
+
+template<typename T, typename BackwardPassT, typename... Extra>
+void RunBackwardDirection(
+    BackwardPassT& backward,
+    const int direction,
+    const Tensor& x,
+    const Tensor& kernel,
+    const Tensor& recurrent_kernel,
+    const Tensor& bias,
+    const float zoneout_prob,
+    const std::vector<int64_t>& zoneout_seed,
+    const Tensor& h,
+    const Tensor& c,
+    const Tensor& cache,
+    const Tensor& dh_new,
+    const Tensor& dc_new,
+    const Tensor& batch_sizes,
+    const Tensor& sequence_length,
+    const Tensor& dx,
+    const Tensor& dW,
+    const Tensor& dR,
+    const Tensor& db,
+    const Tensor& dh,
+    const Tensor& dc,
+    const Extra&... extra) {
+  // Gradients that aren't needed are undefined and stay that way, so they're skipped.
+  const auto slice = [direction](const Tensor& grad) { return grad.defined() ? grad[direction] : Tensor(); };
+  backward.Run(
+      x.size(0),
+      ptr<T>(kernel[direction]),
+      ptr<T>(recurrent_kernel[direction]),
+      ptr<T>(bias[direction]),
+      ptr<T>(x),
+      ptr<T>(h[direction]),
+      ptr<T>(c[direction]),
+      ptr<T>(dh_new[direction]),
+      ptr<T>(dc_new[direction]),
+      ptr<T>(slice(dx)),
+      ptr<T>(slice(dW)),
+      ptr<T>(slice(dR)),
+      ptr<T>(slice(db)),
+      ptr<T>(dh[direction]),
+      ptr<T>(dc[direction]),
+      ptr<T>(cache[direction]),
+      zoneout_prob,
+      zoneout_seed[direction],
+      batch_sizes.numel() ? batch_sizes.data<int>() : nullptr,
+      sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr,
+      direction == 1,
+      extra...);
+}
+
+// Both directions are computed by one call. The parameters and initial state are stacked
+// along a leading dimension of size 2 (forward, reverse), and each direction has its own
+// zoneout seed. The reverse direction keeps its states aligned with the input, so its
+// initial state lives in the last slot of `h` and `c` and its final state in the first.
+std::vector<Tensor> lstm_bidirectional_forward(
+    Workspace& workspace,
+    bool training,
+    float zoneout_prob,
+    float dropout_prob,
+    Tensor x,
+    Tensor kernel,
+    Tensor recurrent_kernel,
+    Tensor bias,
+    Tensor h0,
+    Tensor c0,
+    std::vector<int64_t> zoneout_seed,
+    std::vector<int64_t> dropout_seed,
+    Tensor batch_sizes,
+    Tensor sequence_length) {
+  const auto time_steps = x.size(0);
+  const auto batch_size = x.size(1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = recurrent_kernel.size(1);
+
+  CHECK_INPUT(x);
+  CHECK_INPUT(kernel);
+  CHECK_INPUT(recurrent_kernel);
+  CHECK_INPUT(bias);
+  CHECK_SEEDS(zoneout_seed, 2);
+  CHECK_SEEDS(dropout_seed, 2);
+  CHECK_SHAPE(kernel, 2, input_size, hidden_size * 4);
+  CHECK_SHAPE(recurrent_kernel, 2, hidden_size, hidden_size * 4);
+  CHECK_SHAPE(bias, 2, hidden_size * 4);
+  CHECK_SHAPE(h0, 2, batch_size, hidden_size);
+  CHECK_SHAPE(c0, 2, batch_size, hidden_size);
+  CHECK_BATCH_SIZES(batch_sizes, time_steps);
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+
+  // As in `lstm_forward`, only the GPU pass needs a dropped-out copy of the recurrent kernel.
+  const Tensor dropped_recurrent_kernel = x.is_cuda()
+      ? DropConnect(workspace, "dropped_recurrent_kernel", recurrent_kernel, dropout_prob, dropout_seed)
+      : recurrent_kernel;
+
+  Tensor h = torch::empty({ 2, time_steps + 1, batch_size, hidden_size }, x.options());
+  Tensor c = torch::empty({ 2, time_steps + 1, batch_size, hidden_size }, x.options());
+  h[0][0].copy_(h0[0]);
+  c[0][0].copy_(c0[0]);
+  h[1][time_steps].copy_(h0[1]);
+  c[1][time_steps].copy_(c0[1]);
+  Tensor cache = training
+      ? torch::empty({ 2, time_steps, batch_size, hidden_size * 4 }, x.options())
+      : workspace.Get("cache", { 2, time_steps, batch_size, hidden_size * 4 }, x.options());
+  Tensor tmp_Rh = workspace.Get("tmp_Rh", { 2, batch_size, hidden_size * 4 }, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_bidirectional_forward", ([&] {
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      using T = typename native_type<scalar_t>::gpu;
+      // Each pass owns its CUDA streams, so the two recurrences run concurrently on the
+      // device even though they're issued from one host thread. Both passes have to stay
+      // alive until the end since their destructors wait for the device.
+      ForwardPass<T> forward(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+      ForwardPass<T> reverse(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+
+      RunForwardDirection<T>(forward, 0, zoneout_prob, x, kernel,
+          dropped_recurrent_kernel, bias, h, c, cache, tmp_Rh, zoneout_seed, batch_sizes, sequence_length);
+      RunForwardDirection<T>(reverse, 1, zoneout_prob, x, kernel,
+          dropped_recurrent_kernel, bias, h, c, cache, tmp_Rh, zoneout_seed, batch_sizes, sequence_length);
+#endif
+    } else {
+      using T = typename native_type<scalar_t>::cpu;
+      cpu::lstm::ForwardPass<T> forward(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+      cpu::lstm::ForwardPass<T> reverse(
+          training,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+      // Packed on this thread: the workspace keeps separate buffers per thread, and the
+      // reverse direction runs on whichever thread the inter-op pool picks.
+      const auto packed_R = PackRecurrentKernel<T>(
+          workspace, "packed_recurrent_kernel", forward, recurrent_kernel, dropout_prob, dropout_seed);
+
+      RunConcurrently(
+          [&] {
+            RunForwardDirection<T>(forward, 0, zoneout_prob, x, kernel,
+                recurrent_kernel, bias, h, c, cache, tmp_Rh, zoneout_seed, batch_sizes, sequence_length,
+                false, packed_R[0]);
+          },
+          [&] {
+            RunForwardDirection<T>(reverse, 1, zoneout_prob, x, kernel,
+                recurrent_kernel, bias, h, c, cache, tmp_Rh, zoneout_seed, batch_sizes, sequence_length,
+                false, packed_R[1]);
+          });
+    }
+  }));
+
+  // Forward features first, then reverse, as in `torch.nn.LSTM`.
+  Tensor output = torch::empty({ time_steps, batch_size, hidden_size * 2 }, x.options());
+  torch::cat_out(output, { h[0].slice(0, 1), h[1].slice(0, 0, time_steps) }, 2);
+  Tensor h_n = torch::stack({ h[0][time_steps], h[1][0] });
+  Tensor c_n = torch::stack({ c[0][time_steps], c[1][0] });
+
+  return { output, h_n, c_n, h, c, cache };
+}
+
+// `needs_grad` says which of dx, dW, dR, and db to compute, as in `lstm_backward`. The
+// weight gradients cover both directions.
+std::vector<Tensor> lstm_bidirectional_backward(
+    Workspace& workspace,
+    std::vector<bool> needs_grad,
+    Tensor x,
+    Tensor kernel,
+    Tensor recurrent_kernel,
     Tensor bias,
-    Tensor zoneout_mask,
+    float zoneout_prob,
+    std::vector<int64_t> zoneout_seed,
+    float dropout_prob,
+    std::vector<int64_t> dropout_seed,
     Tensor h,
     Tensor c,
     Tensor cache,
     Tensor dh_new,
-    Tensor dc_new) {
-  const auto input_size = x_t.size(0);
-  const auto time_steps = x_t.size(1);
-  const auto batch_size = x_t.size(2);
-  const auto hidden_size = recurrent_kernel_t.size(1);
-  const bool has_zoneout = !!zoneout_mask.size(0);
-
-  CHECK_INPUT(x_t);
-  CHECK_INPUT(kernel_t);
-  CHECK_INPUT(recurrent_kernel_t);
+    Tensor dc_new,
+    Tensor batch_sizes,
+    Tensor sequence_length) {
+  const auto time_steps = x.size(0);
+  const auto batch_size = x.size(1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = recurrent_kernel.size(1);
+
+  CHECK_INPUT(x);
+  CHECK_INPUT(kernel);
+  CHECK_INPUT(recurrent_kernel);
   CHECK_INPUT(bias);
   CHECK_INPUT(h);
   CHECK_INPUT(c);
   CHECK_INPUT(cache);
   CHECK_INPUT(dh_new);
   CHECK_INPUT(dc_new);
-  CHECK_INPUT(zoneout_mask);
+  CHECK_SEEDS(zoneout_seed, 2);
+  CHECK_SEEDS(dropout_seed, 2);
+  CHECK_BATCH_SIZES(batch_sizes, time_steps);
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+  CHECK_ENTRIES(needs_grad, 4);
+
+  // Regenerate the dropped-out recurrent kernels that the forward GPU pass used. The CPU
+  // passes regenerate the masks themselves, and mask dR as they accumulate it.
+  const Tensor dropped_recurrent_kernel = x.is_cuda()
+      ? DropConnect(workspace, "dropped_recurrent_kernel", recurrent_kernel, dropout_prob, dropout_seed)
+      : recurrent_kernel;
+
+  // Each direction gets its own input gradient; they're summed at the end.
+  Tensor dx = needs_grad[0] ? torch::empty({ 2, time_steps, batch_size, input_size }, x.options()) : Tensor();
+  Tensor dW = needs_grad[1] ? torch::zeros_like(kernel) : Tensor();
+  Tensor dR = needs_grad[2] ? torch::zeros_like(recurrent_kernel) : Tensor();
+  Tensor db = needs_grad[3] ? torch::zeros_like(bias) : Tensor();
+  Tensor dh = torch::zeros({ 2, batch_size, hidden_size }, x.options());
+  Tensor dc = torch::zeros({ 2, batch_size, hidden_size }, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_bidirectional_backward", ([&] {
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      using T = typename native_type<scalar_t>::gpu;
+      BackwardPass<T> forward(
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+      BackwardPass<T> reverse(
+          batch_size,
+          input_size,
+          hidden_size,
+          at::cuda::getCurrentCUDABlasHandle());
+
+      RunBackwardDirection<T>(forward, 0, x, kernel, dropped_recurrent_kernel, bias,
+          zoneout_prob, zoneout_seed, h, c, cache, dh_new, dc_new, batch_sizes, sequence_length, dx, dW, dR, db, dh, dc);
+      RunBackwardDirection<T>(reverse, 1, x, kernel, dropped_recurrent_kernel, bias,
+          zoneout_prob, zoneout_seed, h, c, cache, dh_new, dc_new, batch_sizes, sequence_length, dx, dW, dR, db, dh, dc);
+#endif
+    } else {
+      using T = typename native_type<scalar_t>::cpu;
+      cpu::lstm::BackwardPass<T> forward(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+      cpu::lstm::BackwardPass<T> reverse(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+
+      RunConcurrently(
+          [&] {
+            RunBackwardDirection<T>(forward, 0, x, kernel, recurrent_kernel, bias,
+                zoneout_prob, zoneout_seed, h, c, cache, dh_new, dc_new, batch_sizes, sequence_length, dx, dW, dR, db, dh, dc,
+                false, dropout_prob, dropout_seed[0]);
+          },
+          [&] {
+            RunBackwardDirection<T>(reverse, 1, x, kernel, recurrent_kernel, bias,
+                zoneout_prob, zoneout_seed, h, c, cache, dh_new, dc_new, batch_sizes, sequence_length, dx, dW, dR, db, dh, dc,
+                false, dropout_prob, dropout_seed[1]);
+          });
+    }
+  }));
+
+  if (x.is_cuda())
+    DropConnectGrad_(dR, dropout_prob, dropout_seed);
+  return { dx.defined() ? dx[0].add_(dx[1]) : dx, dW, dR, db, dh, dc };
+}
+
+// Runs a stack of `num_layers` LSTM layers in one call, where each layer's input is the
+// output of the layer below. The parameters and zoneout seeds are lists with one entry per
+// layer, and the initial states are stacked along a leading layer dimension. On the
+// CPU, the layers run as a wavefront (see `cpu::lstm::StackedForwardPass`); in inference
+// mode, only the last layer's hidden states are kept for every time step, so the returned
+// `h`, `c`, and `cache` are empty.
+std::vector<Tensor> lstm_stacked_forward(
+    Workspace& workspace,
+    bool training,
+    float zoneout_prob,
+    float dropout_prob,
+    Tensor x,
+    std::vector<Tensor> kernel,
+    std::vector<Tensor> recurrent_kernel,
+    std::vector<Tensor> bias,
+    Tensor h0,
+    Tensor c0,
+    std::vector<int64_t> zoneout_seed,
+    std::vector<int64_t> dropout_seed,
+    Tensor sequence_length) {
+  const auto num_layers = static_cast<int64_t>(kernel.size());
+  const auto time_steps = x.size(0);
+  const auto batch_size = x.size(1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = h0.size(2);
+
+  TORCH_CHECK(num_layers > 0, "kernel must not be empty");
+  TORCH_CHECK(recurrent_kernel.size() == kernel.size() && bias.size() == kernel.size(),
+      "kernel, recurrent_kernel, and bias must have one entry per layer");
+  CHECK_INPUT(x);
+  CHECK_SEEDS(zoneout_seed, num_layers);
+  CHECK_SEEDS(dropout_seed, num_layers);
+  for (int64_t layer = 0; layer < num_layers; ++layer) {
+    CHECK_INPUT(kernel[layer]);
+    CHECK_INPUT(recurrent_kernel[layer]);
+    CHECK_INPUT(bias[layer]);
+    CHECK_SHAPE(kernel[layer], layer ? hidden_size : input_size, hidden_size * 4);
+    CHECK_SHAPE(recurrent_kernel[layer], hidden_size, hidden_size * 4);
+    CHECK_SHAPE(bias[layer], hidden_size * 4);
+  }
+  CHECK_SHAPE(h0, num_layers, batch_size, hidden_size);
+  CHECK_SHAPE(c0, num_layers, batch_size, hidden_size);
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+
+  // As in `lstm_forward`, only the GPU pass needs dropped-out copies of the recurrent
+  // kernels; the CPU passes apply DropConnect as they pack them.
+  if (x.is_cuda()) {
+    for (int64_t layer = 0; layer < num_layers; ++layer)
+      recurrent_kernel[layer] = DropConnect(
+          workspace,
+          "dropped_recurrent_kernel_l" + std::to_string(layer),
+          recurrent_kernel[layer],
+          dropout_prob,
+          { dropout_seed[layer] });
+  }
+
+  const int64_t* lengths = sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr;
+  const std::vector<uint64_t> seeds(zoneout_seed.begin(), zoneout_seed.end());
+
+  if (!x.is_cuda() && !training) {
+    // The layers below the last only ever need the current and previous time step.
+    Tensor output = torch::empty({ time_steps + 1, batch_size, hidden_size }, x.options());
+    Tensor h = workspace.Get("h", { num_layers - 1, 2, batch_size, hidden_size }, x.options());
+    Tensor c = workspace.Get("c", { num_layers, 2, batch_size, hidden_size }, x.options());
+    Tensor v = workspace.Get("v", { num_layers, batch_size, hidden_size * 4 }, x.options());
+    Tensor tmp_Rh = workspace.Get("tmp_Rh", { num_layers, batch_size, hidden_size * 4 }, x.options());
+    for (int64_t layer = 0; layer < num_layers - 1; ++layer)
+      h[layer][0].copy_(h0[layer]);
+    output[0].copy_(h0[num_layers - 1]);
+    c.select(1, 0).copy_(c0);
+
+    AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_stacked_forward", ([&] {
+      using T = typename native_type<scalar_t>::cpu;
+      std::vector<const T*> W, R, b;
+      std::vector<T*> h_ptrs, c_ptrs, v_ptrs, tmp_Rh_ptrs;
+      for (int64_t layer = 0; layer < num_layers; ++layer) {
+        W.push_back(ptr<T>(kernel[layer]));
+        R.push_back(ptr<T>(recurrent_kernel[layer]));
+        b.push_back(ptr<T>(bias[layer]));
+        h_ptrs.push_back(layer == num_layers - 1 ? ptr<T>(output) : ptr<T>(h[layer]));
+        c_ptrs.push_back(ptr<T>(c[layer]));
+        v_ptrs.push_back(ptr<T>(v[layer]));
+        tmp_Rh_ptrs.push_back(ptr<T>(tmp_Rh[layer]));
+      }
+
+      cpu::lstm::StackedForwardPass<T> forward(
+          false,
+          num_layers,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+
+      std::vector<const void*> packed_R;
+      for (int64_t layer = 0; layer < num_layers; ++layer) {
+        packed_R.push_back(PackRecurrentKernel<T>(
+            workspace,
+            "packed_recurrent_kernel_l" + std::to_string(layer),
+            forward,
+            recurrent_kernel[layer],
+            dropout_prob,
+            { dropout_seed[layer] })[0]);
+      }
+
+      forward.Run(
+          time_steps,
+          W.data(),
+          R.data(),
+          b.data(),
+          ptr<T>(x),
+          h_ptrs.data(),
+          c_ptrs.data(),
+          v_ptrs.data(),
+          tmp_Rh_ptrs.data(),
+          zoneout_prob,
+          seeds.data(),
+          lengths,
+          packed_R.data());
+    }));
+
+    const auto last = time_steps % 2;
+    Tensor h_n = torch::cat({ h.select(1, last), output[time_steps].unsqueeze(0) });
+    Tensor c_n = c.select(1, last).clone();
+    Tensor empty = torch::empty({ 0 }, x.options());
+    return { output.slice(0, 1), h_n, c_n, empty, empty, empty };
+  }
+
+  Tensor h = torch::empty({ num_layers, time_steps + 1, batch_size, hidden_size }, x.options());
+  Tensor c = torch::empty({ num_layers, time_steps + 1, batch_size, hidden_size }, x.options());
+  h.select(1, 0).copy_(h0);
+  c.select(1, 0).copy_(c0);
+  Tensor cache = torch::empty({ num_layers, time_steps, batch_size, hidden_size * 4 }, x.options());
+  Tensor tmp_Rh = workspace.Get("tmp_Rh", { num_layers, batch_size, hidden_size * 4 }, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_stacked_forward", ([&] {
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      using T = typename native_type<scalar_t>::gpu;
+      // Each layer's recurrence already fills the device, so the GPU runs the stack one
+      // layer at a time.
+      for (int64_t layer = 0; layer < num_layers; ++layer) {
+        ForwardPass<T> forward(
+            training,
+            batch_size,
+            layer ? hidden_size : input_size,
+            hidden_size,
+            at::cuda::getCurrentCUDABlasHandle());
+
+        forward.Run(
+            time_steps,
+            ptr<T>(kernel[layer]),
+            ptr<T>(recurrent_kernel[layer]),
+            ptr<T>(bias[layer]),
+            layer ? ptr<T>(h[layer - 1][1]) : ptr<T>(x),
+            ptr<T>(h[layer]),
+            ptr<T>(c[layer]),
+            ptr<T>(cache[layer]),
+            ptr<T>(tmp_Rh[layer]),
+            zoneout_prob,
+            seeds[layer],
+            nullptr,
+            lengths);
+      }
+#endif
+    } else {
+      using T = typename native_type<scalar_t>::cpu;
+      std::vector<const T*> W, R, b;
+      std::vector<T*> h_ptrs, c_ptrs, v_ptrs, tmp_Rh_ptrs;
+      for (int64_t layer = 0; layer < num_layers; ++layer) {
+        W.push_back(ptr<T>(kernel[layer]));
+        R.push_back(ptr<T>(recurrent_kernel[layer]));
+        b.push_back(ptr<T>(bias[layer]));
+        h_ptrs.push_back(ptr<T>(h[layer]));
+        c_ptrs.push_back(ptr<T>(c[layer]));
+        v_ptrs.push_back(ptr<T>(cache[layer]));
+        tmp_Rh_ptrs.push_back(ptr<T>(tmp_Rh[layer]));
+      }
+
+      cpu::lstm::StackedForwardPass<T> forward(
+          training,
+          num_layers,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor());
+
+      std::vector<const void*> packed_R;
+      for (int64_t layer = 0; layer < num_layers; ++layer) {
+        packed_R.push_back(PackRecurrentKernel<T>(
+            workspace,
+            "packed_recurrent_kernel_l" + std::to_string(layer),
+            forward,
+            recurrent_kernel[layer],
+            dropout_prob,
+            { dropout_seed[layer] })[0]);
+      }
+
+      forward.Run(
+          time_steps,
+          W.data(),
+          R.data(),
+          b.data(),
+          ptr<T>(x),
+          h_ptrs.data(),
+          c_ptrs.data(),
+          v_ptrs.data(),
+          tmp_Rh_ptrs.data(),
+          zoneout_prob,
+          seeds.data(),
+          lengths,
+          packed_R.data());
+    }
+  }));
+
+  Tensor output = h[num_layers - 1].slice(0, 1);
+  return { output, h.select(1, time_steps), c.select(1, time_steps), h, c, cache };
+}
+
+// Walks the stack from the top layer down, feeding each layer's input gradient into the
+// output gradient of the layer below. Returns the input gradient and the initial state
+// gradients, followed by the `kernel`, `recurrent_kernel`, and `bias` gradients of every
+// layer in that order. `needs_grad` says which of them to compute: one entry for `x`, one
+// for the initial state, and one for each weight in the same order as the returned
+// gradients. Gradients that aren't needed are returned as undefined tensors. The walk
+// stops at the highest layer below which nothing needs a gradient, and each layer's input
+// gradient GEMM is skipped if the layers below it don't need it.
+std::vector<Tensor> lstm_stacked_backward(
+    Workspace& workspace,
+    std::vector<bool> needs_grad,
+    Tensor x,
+    std::vector<Tensor> kernel,
+    std::vector<Tensor> recurrent_kernel,
+    std::vector<Tensor> bias,
+    float zoneout_prob,
+    std::vector<int64_t> zoneout_seed,
+    float dropout_prob,
+    std::vector<int64_t> dropout_seed,
+    Tensor h,
+    Tensor c,
+    Tensor cache,
+    Tensor grad_output,
+    Tensor grad_h_n,
+    Tensor grad_c_n,
+    Tensor sequence_length) {
+  const auto num_layers = static_cast<int64_t>(kernel.size());
+  const auto time_steps = x.size(0);
+  const auto batch_size = x.size(1);
+  const auto hidden_size = h.size(3);
+
+  CHECK_INPUT(x);
+  CHECK_SEEDS(zoneout_seed, num_layers);
+  CHECK_SEEDS(dropout_seed, num_layers);
+  CHECK_INPUT(h);
+  CHECK_INPUT(c);
+  CHECK_INPUT(cache);
+  CHECK_INPUT(grad_output);
+  CHECK_INPUT(grad_h_n);
+  CHECK_INPUT(grad_c_n);
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+  CHECK_ENTRIES(needs_grad, 2 + 3 * num_layers);
+
+  const auto needs_weight_grad = [&](int64_t param, int64_t layer) {
+    return static_cast<bool>(needs_grad[2 + param * num_layers + layer]);
+  };
+
+  // `needs_dx[layer]` says whether the layers below need that layer's input gradient.
+  std::vector<bool> needs_dx(num_layers);
+  bool below = needs_grad[0];
+  for (int64_t layer = 0; layer < num_layers; ++layer) {
+    needs_dx[layer] = below;
+    below = below || needs_grad[1] ||
+        needs_weight_grad(0, layer) || needs_weight_grad(1, layer) || needs_weight_grad(2, layer);
+  }
+
+  // Regenerate the dropped-out recurrent kernels that the forward GPU pass used. The CPU
+  // passes regenerate the masks themselves, and mask dR as they accumulate it.
+  if (x.is_cuda()) {
+    for (int64_t layer = 0; layer < num_layers; ++layer)
+      recurrent_kernel[layer] = DropConnect(
+          workspace,
+          "dropped_recurrent_kernel_l" + std::to_string(layer),
+          recurrent_kernel[layer],
+          dropout_prob,
+          { dropout_seed[layer] });
+  }
 
-  Tensor dx = torch::empty({ time_steps, batch_size, input_size }, at::kCUDA);
-  Tensor dW = torch::zeros({ input_size, hidden_size * 4 }, at::kCUDA);
-  Tensor dR = torch::zeros({ hidden_size, hidden_size * 4 }, at::kCUDA);
-  Tensor db = torch::zeros_like(bias);
-  Tensor dh = torch::zeros({ batch_size, hidden_size }, at::kCUDA);
-  Tensor dc = torch::zeros({ batch_size, hidden_size }, at::kCUDA);
+  const int64_t* lengths = sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr;
+
+  Tensor dh0 = torch::zeros({ num_layers, batch_size, hidden_size }, x.options());
+  Tensor dc0 = torch::zeros({ num_layers, batch_size, hidden_size }, x.options());
+  std::vector<Tensor> dW(num_layers), dR(num_layers), db(num_layers);
+  Tensor dy = grad_output;
+  Tensor dx;
+
+  for (int64_t layer = num_layers - 1; layer >= 0; --layer) {
+    // Neither this layer nor any below it needs a gradient.
+    if (!needs_dx[layer] && !needs_grad[1] && !needs_weight_grad(0, layer) &&
+        !needs_weight_grad(1, layer) && !needs_weight_grad(2, layer))
+      break;
+
+    Tensor input = layer ? h[layer - 1].slice(0, 1) : x;
+    const auto input_size = input.size(2);
+
+    // Every slot of `dh_new` is written, but only the last slot of `dc_new` is nonzero.
+    Tensor dh_new = workspace.Get("dh_new", { time_steps + 1, batch_size, hidden_size }, x.options());
+    Tensor dc_new = workspace.Zeros("dc_new", { time_steps + 1, batch_size, hidden_size }, x.options());
+    dh_new[0].zero_();
+    dh_new.slice(0, 1).copy_(dy);
+    dh_new[time_steps].add_(grad_h_n[layer]);
+    dc_new[time_steps].copy_(grad_c_n[layer]);
+
+    dx = needs_dx[layer] ? torch::empty({ time_steps, batch_size, input_size }, x.options()) : Tensor();
+    dW[layer] = needs_weight_grad(0, layer) ? torch::zeros({ input_size, hidden_size * 4 }, x.options()) : Tensor();
+    dR[layer] = needs_weight_grad(1, layer) ? torch::zeros({ hidden_size, hidden_size * 4 }, x.options()) : Tensor();
+    db[layer] = needs_weight_grad(2, layer) ? torch::zeros_like(bias[layer]) : Tensor();
+    Tensor dh = dh0[layer];
+    Tensor dc = dc0[layer];
+
+    AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "lstm_stacked_backward", ([&] {
+      if (x.is_cuda()) {
+#ifdef WITH_CUDA
+        using T = typename native_type<scalar_t>::gpu;
+        BackwardPass<T> backward(
+            batch_size,
+            input_size,
+            hidden_size,
+            at::cuda::getCurrentCUDABlasHandle());
+
+        backward.Run(
+            time_steps,
+            ptr<T>(kernel[layer]),
+            ptr<T>(recurrent_kernel[layer]),
+            ptr<T>(bias[layer]),
+            ptr<T>(input),
+            ptr<T>(h[layer]),
+            ptr<T>(c[layer]),
+            ptr<T>(dh_new),
+            ptr<T>(dc_new),
+            ptr<T>(dx),
+            ptr<T>(dW[layer]),
+            ptr<T>(dR[layer]),
+            ptr<T>(db[layer]),
+            ptr<T>(dh),
+            ptr<T>(dc),
+            ptr<T>(cache[layer]),
+            zoneout_prob,
+            zoneout_seed[layer],
+            nullptr,
+            lengths);
+#endif
+      } else {
+        using T = typename native_type<scalar_t>::cpu;
+        cpu::lstm::BackwardPass<T> backward(
+            batch_size,
+            input_size,
+            hidden_size,
+            GetCpuParallelFor());
+
+        backward.Run(
+            time_steps,
+            ptr<T>(kernel[layer]),
+            ptr<T>(recurrent_kernel[layer]),
+            ptr<T>(bias[layer]),
+            ptr<T>(input),
+            ptr<T>(h[layer]),
+            ptr<T>(c[layer]),
+            ptr<T>(dh_new),
+            ptr<T>(dc_new),
+            ptr<T>(dx),
+            ptr<T>(dW[layer]),
+            ptr<T>(dR[layer]),
+            ptr<T>(db[layer]),
+            ptr<T>(dh),
+            ptr<T>(dc),
+            ptr<T>(cache[layer]),
+            zoneout_prob,
+            zoneout_seed[layer],
+            nullptr,
+            lengths,
+            false,
+            false,
+            dropout_prob,
+            dropout_seed[layer]);
+      }
+    }));
+
+    dy = dx;
+  }
+
+  if (x.is_cuda()) {
+    for (int64_t layer = 0; layer < num_layers; ++layer)
+      DropConnectGrad_(dR[layer], dropout_prob, { dropout_seed[layer] });
+  }
+
+  std::vector<Tensor> grads = { dx, dh0, dc0 };
+  grads.insert(grads.end(), dW.begin(), dW.end());
+  grads.insert(grads.end(), dR.begin(), dR.end());
+  grads.insert(grads.end(), db.begin(), db.end());
+  return grads;
+}
 
-  AT_DISPATCH_FLOATING_TYPES(x_t.type(), "lstm_backward", ([&] {
-    BackwardPass<scalar_t> backward(
+// Runs one direction of an int8 weight-quantized LSTM in inference mode on the CPU. The
+// quantized kernels and their scales come from `quantize_weights`. Returns the hidden and
+// cell states of every time step, laid out as in `lstm_forward` (or as in the reverse
+// direction of `lstm_bidirectional_forward` if `reverse` is set).
+std::vector<Tensor> lstm_quantized_forward(
+    Workspace& workspace,
+    float zoneout_prob,
+    bool reverse,
+    Tensor x,
+    Tensor kernel_q,
+    Tensor kernel_scale,
+    Tensor recurrent_kernel_q,
+    Tensor recurrent_kernel_scale,
+    Tensor bias,
+    Tensor h0,
+    Tensor c0,
+    Tensor sequence_length) {
+  const auto time_steps = x.size(0);
+  const auto batch_size = x.size(1);
+  const auto input_size = x.size(2);
+  const auto hidden_size = recurrent_kernel_q.size(1);
+
+  TORCH_CHECK(!x.is_cuda(), "the quantized LSTM only runs on the CPU");
+  CHECK_INPUT(x);
+  CHECK_INPUT(kernel_q);
+  CHECK_INPUT(kernel_scale);
+  CHECK_INPUT(recurrent_kernel_q);
+  CHECK_INPUT(recurrent_kernel_scale);
+  CHECK_INPUT(bias);
+  CHECK_SHAPE(kernel_q, hidden_size * 4, input_size);
+  CHECK_SHAPE(kernel_scale, hidden_size * 4);
+  CHECK_SHAPE(recurrent_kernel_q, hidden_size * 4, hidden_size);
+  CHECK_SHAPE(recurrent_kernel_scale, hidden_size * 4);
+  CHECK_SHAPE(bias, hidden_size * 4);
+  CHECK_SHAPE(h0, batch_size, hidden_size);
+  CHECK_SHAPE(c0, batch_size, hidden_size);
+  CHECK_SEQUENCE_LENGTH(sequence_length, x, batch_size);
+  TORCH_CHECK(kernel_q.scalar_type() == torch::kChar && recurrent_kernel_q.scalar_type() == torch::kChar,
+      "the quantized kernels must be int8");
+  TORCH_CHECK(kernel_scale.scalar_type() == torch::kFloat && recurrent_kernel_scale.scalar_type() == torch::kFloat,
+      "the kernel scales must be float32");
+
+  const auto initial = reverse ? time_steps : 0;
+  Tensor h = torch::empty({ time_steps + 1, batch_size, hidden_size }, x.options());
+  Tensor c = torch::empty({ time_steps + 1, batch_size, hidden_size }, x.options());
+  h[initial].copy_(h0);
+  c[initial].copy_(c0);
+  Tensor v = workspace.Get("v", { time_steps, batch_size, hidden_size * 4 }, x.options());
+  Tensor tmp_Rh = workspace.Get("tmp_Rh", { batch_size, hidden_size * 4 }, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES(x.scalar_type(), "lstm_quantized_forward", ([&] {
+    cpu::lstm::QuantizedForwardPass<scalar_t> forward(
         batch_size,
         input_size,
         hidden_size,
-        at::cuda::getCurrentCUDABlasHandle());
+        GetCpuParallelFor());
 
-    backward.Run(
+    forward.Run(
         time_steps,
-        kernel_t.data<scalar_t>(),
-        recurrent_kernel_t.data<scalar_t>(),
+        kernel_q.data<int8_t>(),
+        kernel_scale.data<float>(),
+        recurrent_kernel_q.data<int8_t>(),
+        recurrent_kernel_scale.data<float>(),
         bias.data<scalar_t>(),
-        x_t.data<scalar_t>(),
+        x.data<scalar_t>(),
         h.data<scalar_t>(),
         c.data<scalar_t>(),
-        dh_new.data<scalar_t>(),
-        dc_new.data<scalar_t>(),
-        dx.data<scalar_t>(),
-        dW.data<scalar_t>(),
-        dR.data<scalar_t>(),
-        db.data<scalar_t>(),
-        dh.data<scalar_t>(),
-        dc.data<scalar_t>(),
-        cache.data<scalar_t>(),
-        has_zoneout ? zoneout_mask.data<scalar_t>() : nullptr);
+        v.data<scalar_t>(),
+        tmp_Rh.data<scalar_t>(),
+        zoneout_prob,
+        sequence_length.numel() ? sequence_length.data<int64_t>() : nullptr,
+        reverse);
   }));
 
-  return { dx, dW, dR, db };
+  return { h, c };
 }
 
+// Runs the LSTM one time step per call for autoregressive decoding. The native forward
+// pass and its scratch space are created once and reused by every step. The output state
+// alternates between two buffers so the state returned by one step can be passed straight
+// back in as the input to the next.
+class LstmDecoder {
+  public:
+    LstmDecoder(Tensor kernel, Tensor recurrent_kernel, int64_t batch_size, float zoneout_prob)
+        : batch_size_(batch_size),
+          input_size_(kernel.size(0)),
+          hidden_size_(recurrent_kernel.size(0)),
+          zoneout_prob_(zoneout_prob),
+          current_(0) {
+      CHECK_DEVICE(kernel);
+      const auto options = kernel.options();
+      for (int i = 0; i < 2; ++i) {
+        h_[i] = torch::empty({ batch_size_, hidden_size_ }, options);
+        c_[i] = torch::empty({ batch_size_, hidden_size_ }, options);
+      }
+      v_ = torch::empty({ batch_size_, hidden_size_ * 4 }, options);
+      tmp_Rh_ = torch::empty({ batch_size_, hidden_size_ * 4 }, options);
+
+      AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, kernel.scalar_type(), "LstmDecoder", ([&] {
+        if (kernel.is_cuda()) {
+#ifdef WITH_CUDA
+          using T = typename native_type<scalar_t>::gpu;
+          Bind<T>(std::make_shared<ForwardPass<T>>(
+              false,
+              batch_size_,
+              input_size_,
+              hidden_size_,
+              at::cuda::getCurrentCUDABlasHandle()));
+#endif
+        } else {
+          using T = typename native_type<scalar_t>::cpu;
+          Bind<T>(std::make_shared<cpu::lstm::ForwardPass<T>>(
+              false,
+              batch_size_,
+              input_size_,
+              hidden_size_,
+              GetCpuParallelFor()));
+        }
+      }));
+    }
+
+    LstmDecoder(const LstmDecoder&) = delete;
+    LstmDecoder& operator=(const LstmDecoder&) = delete;
+
+    std::vector<Tensor> step(
+        Tensor x,
+        Tensor kernel,
+        Tensor recurrent_kernel,
+        Tensor bias,
+        Tensor h,
+        Tensor c) {
+      CHECK_INPUT(x);
+      CHECK_INPUT(kernel);
+      CHECK_INPUT(recurrent_kernel);
+      CHECK_INPUT(bias);
+      CHECK_INPUT(h);
+      CHECK_INPUT(c);
+      CHECK_SHAPE(x, batch_size_, input_size_);
+      CHECK_SHAPE(h, batch_size_, hidden_size_);
+      CHECK_SHAPE(c, batch_size_, hidden_size_);
+
+      Tensor& h_out = h_[current_];
+      Tensor& c_out = c_[current_];
+      current_ ^= 1;
+
+      iterate_(x, kernel, recurrent_kernel, bias, h, c, h_out, c_out);
+      return { h_out, c_out };
+    }
+
+  private:
+    template<typename T, typename ForwardPassT>
+    void Bind(std::shared_ptr<ForwardPassT> forward) {
+      iterate_ = [this, forward](
+          const Tensor& x,
+          const Tensor& kernel,
+          const Tensor& recurrent_kernel,
+          const Tensor& bias,
+          const Tensor& h,
+          const Tensor& c,
+          Tensor& h_out,
+          Tensor& c_out) {
+        forward->Iterate(
+            ptr<T>(kernel),
+            ptr<T>(recurrent_kernel),
+            ptr<T>(bias),
+            ptr<T>(x),
+            ptr<T>(h),
+            ptr<T>(c),
+            ptr<T>(h_out),
+            ptr<T>(c_out),
+            ptr<T>(v_),
+            ptr<T>(tmp_Rh_),
+            zoneout_prob_,
+            0);  // Inference-mode zoneout only uses `zoneout_prob`.
+      };
+    }
+
+    // The CPU pass multiplies by a packed copy of the recurrent kernel that's kept across
+    // steps and only repacked once the kernel changes.
+    template<typename T>
+    void Bind(std::shared_ptr<cpu::lstm::ForwardPass<T>> forward) {
+      iterate_ = [this, forward](
+          const Tensor& x,
+          const Tensor& kernel,
+          const Tensor& recurrent_kernel,
+          const Tensor& bias,
+          const Tensor& h,
+          const Tensor& c,
+          Tensor& h_out,
+          Tensor& c_out) {
+        forward->Iterate(
+            ptr<T>(kernel),
+            ptr<T>(recurrent_kernel),
+            ptr<T>(bias),
+            ptr<T>(x),
+            ptr<T>(h),
+            ptr<T>(c),
+            ptr<T>(h_out),
+            ptr<T>(c_out),
+            ptr<T>(v_),
+            ptr<T>(tmp_Rh_),
+            zoneout_prob_,
+            0,  // Inference-mode zoneout only uses `zoneout_prob`.
+            PackRecurrentKernel<T>(workspace_, "packed_recurrent_kernel", *forward, recurrent_kernel, 0.0f)[0]);
+      };
+    }
+
+    const int64_t batch_size_;
+    const int64_t input_size_;
+    const int64_t hidden_size_;
+    const float zoneout_prob_;
+    int current_;
+    Tensor h_[2];
+    Tensor c_[2];
+    Tensor v_;
+    Tensor tmp_Rh_;
+    Workspace workspace_;
+    std::function<void(
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        const Tensor&,
+        Tensor&,
+        Tensor&)> iterate_;
+};
+
 }  // anonymous namespace
 
 void lstm_init(py::module& m) {
   m.def("lstm_forward", &lstm_forward, "LSTM forward");
   m.def("lstm_backward", &lstm_backward, "LSTM backward");
+  m.def("lstm_inference_forward", &lstm_inference_forward, "LSTM inference forward");
+  m.def("lstm_bidirectional_forward", &lstm_bidirectional_forward, "Bidirectional LSTM forward");
+  m.def("lstm_bidirectional_backward", &lstm_bidirectional_backward, "Bidirectional LSTM backward");
+  m.def("lstm_stacked_forward", &lstm_stacked_forward, "Stacked LSTM forward");
+  m.def("lstm_stacked_backward", &lstm_stacked_backward, "Stacked LSTM backward");
+  m.def("lstm_quantized_forward", &lstm_quantized_forward, "Int8 weight-quantized LSTM forward (CPU inference)");
+  py::class_<LstmDecoder>(m, "LstmDecoder")
+      .def(py::init<Tensor, Tensor, int64_t, float>())
+      .def("step", &LstmDecoder::step, "LSTM single step");
 }
@@ -16,23 +16,186 @@
 """Long Short-Term Memory"""
 
 
+import functools
 import haste_pytorch_lib as LIB
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
 
 
 __all__ = [
-    'LSTM'
+    'LSTM',
+    'QuantizedLSTM'
 ]
 
 
+def _batch_sizes(lengths, time_steps):
+  """
+  Returns the number of batch entries that are still active at each time step,
+  or an empty tensor if `lengths` is missing or not sorted in decreasing order.
+  """
+  if lengths is None:
+    return torch.empty(0, dtype=torch.int32)
+  lengths = torch.as_tensor(lengths).cpu()
+  if (lengths[1:] > lengths[:-1]).any():
+    return torch.empty(0, dtype=torch.int32)
+  steps = torch.arange(time_steps).unsqueeze(1)
+  return (lengths.unsqueeze(0) > steps).sum(dim=1).int()
+
+
+def _sequence_length(lengths, device):
+  """
+  Returns `lengths` as an int64 tensor on `device`, or an empty tensor if
+  `lengths` is missing.
+  """
+  if lengths is None:
+    return torch.empty(0, dtype=torch.int64, device=device)
+  return torch.as_tensor(lengths).to(device=device, dtype=torch.int64)
+
+
+def _segments(time_steps, checkpoint_every):
+  """Returns the `[begin, end)` time step range of each checkpointed segment."""
+  return [(begin, min(begin + checkpoint_every, time_steps)) for begin in range(0, time_steps, checkpoint_every)]
+
+
+def _time_slice(tensor, begin, end):
+  """Returns time steps `[begin, end)` of `tensor`, or `tensor` itself if it's empty."""
+  return tensor[begin:end] if tensor.numel() else tensor
+
+
+def _pack(cache, key, params, pack, training):
+  """
+  Returns `pack(*params)`. In inference mode, the result is kept in `cache` under
+  `key` and reused until one of `params` is replaced or modified in place (which
+  bumps its version counter, e.g. in `optimizer.step` or `load_state_dict`). In
+  training mode, the weights are packed on every call so that gradients flow
+  back to `params`.
+  """
+  if training:
+    return pack(*params)
+  version = tuple((p.data_ptr(), p._version, p.dtype, p.device) for p in params)
+  entry = cache.get(key)
+  if entry is None or entry[0] != version:
+    with torch.no_grad():
+      entry = (version, pack(*params))
+    cache[key] = entry
+  return entry[1]
+
+
+def _seeds(count):
+  """
+  Returns `count` independent seeds for the zoneout and DropConnect masks that
+  the native passes regenerate. They're drawn from PyTorch's default generator,
+  so `torch.manual_seed` makes the masks reproducible.
+  """
+  return torch.randint(1 << 62, (count,)).tolist()
+
+
+def _claim_grad_buffers(pool, params):
+  """
+  Returns `(pool, buffers)` with a gradient buffer for each of `params` for the
+  native backward pass to accumulate into, reused from `pool` if it holds a
+  matching set and newly allocated otherwise. A forward pass that runs during a
+  backward pass, e.g. to recompute a checkpoint, always gets new buffers, since
+  the pooled ones may still be waiting for autograd to add them to `.grad`.
+  """
+  buffers = None
+  if pool and torch._C._current_graph_task_id() == -1:
+    buffers = pool.pop()
+    if any(b.shape != p.shape or b.dtype != p.dtype or b.device != p.device for b, p in zip(buffers, params)):
+      buffers = None  # stale after e.g. `.to()`
+  if buffers is None:
+    buffers = [torch.empty_like(p) for p in params]
+  return pool, buffers
+
+
+def _grad_accumulators(ctx, needs_grad):
+  """
+  Returns the buffers claimed by the forward pass, zeroed, for the native
+  backward pass to accumulate the needed gradients into and return to autograd.
+  The other entries, and all of them if no buffers were claimed, are empty
+  tensors, for which the native pass returns a new gradient instead. The
+  buffers go back to their pool for the next step, so a second backward pass
+  through the same graph gets new gradients.
+  """
+  if ctx.grad_buffers is None:
+    return [torch.empty(0)] * len(needs_grad)
+  pool, buffers = ctx.grad_buffers
+  ctx.grad_buffers = None
+  pool.append(buffers)
+  return [b.zero_() if needed else torch.empty(0) for b, needed in zip(buffers, needs_grad)]
+
+
+def _attach_grads(params, flat_grad):
+  """
+  Points the `.grad` of each of `params` that requires grad at its view into
+  `flat_grad`, unless it already is. A missing gradient, e.g. after
+  `zero_grad()`, which sets gradients to None by default, leaves a zeroed view;
+  a replaced one is copied into the view.
+  """
+  offset = 0
+  for param in params:
+    view = flat_grad[offset:offset + param.numel()].view_as(param)
+    offset += param.numel()
+    if not param.requires_grad or (param.grad is not None and param.grad.data_ptr() == view.data_ptr()):
+      continue
+    if param.grad is None:
+      view.zero_()
+    else:
+      view.copy_(param.grad)
+    param.grad = view
+
+
+def _reattach_grads(module, param):
+  """Hook for `_keep_grads_attached`."""
+  with torch.no_grad():
+    _attach_grads(module._parameters.values(), module.flat_grad)
+
+
+def _keep_grads_attached(module):
+  """
+  Registers a hook on each of `module`'s parameters that points `.grad` back at
+  its view into `module.flat_grad` once autograd has accumulated into it.
+  Autograd keeps an existing `.grad` and adds to it in place, but it installs a
+  new tensor if `.grad` was reset to None after the forward pass or if
+  `create_graph=True`. Returns the hook handles.
+  """
+  hook = functools.partial(_reattach_grads, module)
+  return [p.register_post_accumulate_grad_hook(hook) for p in module._parameters.values() if p.requires_grad]
+
+
+def _flatten(params):
+  """
+  Moves `params` into one contiguous buffer and makes each of them, and its
+  `.grad`, a view into that buffer and a matching gradient buffer. Returns the
+  two buffers.
+  """
+  params = list(params)
+  flat = torch.empty(sum(p.numel() for p in params), dtype=params[0].dtype, device=params[0].device)
+  flat_grad = torch.zeros_like(flat)
+  offset = 0
+  with torch.no_grad():
+    for param in params:
+      view = flat[offset:offset + param.numel()].view_as(param)
+      offset += param.numel()
+      view.copy_(param)
+      param.data = view
+  _attach_grads(params, flat_grad)
+  return flat, flat_grad
+
+
 class LSTMFunction(torch.autograd.Function):
   @staticmethod
-  def forward(ctx, training, zoneout_prob, *inputs):
-    h, c, cache = LIB.lstm_forward(training, zoneout_prob, *inputs)
-    ctx.save_for_backward(*inputs, h, c, cache)
-    ctx.mark_non_differentiable(inputs[-1])
+  def forward(ctx, workspace, grad_buffers, training, zoneout_prob, dropout_prob, batch_first, *inputs):
+    h, c, cache = LIB.lstm_forward(workspace, training, zoneout_prob, dropout_prob, batch_first, *inputs)
+    ctx.save_for_backward(*inputs[:4], h, c, cache)  # initial state isn't needed
+    ctx.workspace = workspace
+    ctx.grad_buffers = grad_buffers
+    ctx.batch_first = batch_first
+    ctx.zoneout_prob = zoneout_prob
+    ctx.zoneout_seed = inputs[-3]
+    ctx.dropout_prob = dropout_prob
+    ctx.dropout_seed = inputs[-2]
+    ctx.batch_sizes = inputs[-1]
     ctx.training = training
     return h, c
 
@@ -41,12 +204,293 @@ class LSTMFunction(torch.autograd.Function):
     if not ctx.training:
       raise RuntimeError('LSTM backward can only be called in training mode')
 
-    saved = [*ctx.saved_tensors]
-    saved[0] = saved[0].permute(2, 0, 1).contiguous()
-    saved[1] = saved[1].permute(1, 0).contiguous()
-    saved[2] = saved[2].permute(1, 0).contiguous()
-    grads = LIB.lstm_backward(*saved, grad_h.contiguous(), grad_c.contiguous())
-    return (None, None, *grads, None)
+    x, kernel, recurrent_kernel, bias, h, c, cache = ctx.saved_tensors
+    needs_grad = ctx.needs_input_grad[6:10]
+    dx, dW, dR, db, dh, dc = LIB.lstm_backward(
+        ctx.workspace,
+        needs_grad,
+        _grad_accumulators(ctx, needs_grad[1:]),
+        x,
+        kernel,
+        recurrent_kernel,
+        bias,
+        ctx.zoneout_prob,
+        ctx.zoneout_seed,
+        ctx.dropout_prob,
+        ctx.dropout_seed,
+        ctx.batch_first,
+        h,
+        c,
+        cache,
+        grad_h.contiguous(),
+        grad_c.contiguous(),
+        ctx.batch_sizes)
+    time_dim = 1 if ctx.batch_first else 0
+    dh = dh + grad_h.select(time_dim, 0)
+    dc = dc + grad_c.select(time_dim, 0)
+    return (None, None, None, None, None, None, dx, dW, dR, db, dh, dc, None, None, None)
+
+
+class LSTMInferenceFunction(torch.autograd.Function):
+  @staticmethod
+  def forward(ctx, workspace, zoneout_prob, return_sequences, batch_first, *inputs):
+    return tuple(LIB.lstm_inference_forward(workspace, zoneout_prob, return_sequences, batch_first, *inputs))
+
+  @staticmethod
+  def backward(ctx, grad_output, grad_h_n, grad_c_n):
+    raise RuntimeError('LSTM backward can only be called in training mode')
+
+
+class LSTMCheckpointFunction(torch.autograd.Function):
+  @staticmethod
+  def forward(
+      ctx,
+      workspace,
+      grad_buffers,
+      zoneout_prob,
+      dropout_prob,
+      checkpoint_every,
+      x,
+      kernel,
+      recurrent_kernel,
+      bias,
+      h0,
+      c0,
+      zoneout_seed,
+      dropout_seed,
+      batch_sizes):
+    h = [h0.unsqueeze(0)]
+    c = [c0.unsqueeze(0)]
+    for begin, end in _segments(x.shape[0], checkpoint_every):
+      h_segment, c_segment, _ = LIB.lstm_forward(
+          workspace,
+          True,
+          zoneout_prob,
+          dropout_prob,
+          False,
+          x[begin:end],
+          kernel,
+          recurrent_kernel,
+          bias,
+          h[-1][-1],
+          c[-1][-1],
+          zoneout_seed + begin,
+          dropout_seed,
+          _time_slice(batch_sizes, begin, end))
+      h.append(h_segment[1:])
+      c.append(c_segment[1:])
+    h = torch.cat(h)
+    c = torch.cat(c)
+
+    # The gate activations are dropped. Only the hidden states, which are the output
+    # anyway, and the cell state at the start of each segment are kept for backward.
+    ctx.save_for_backward(x, kernel, recurrent_kernel, bias, h, c[:-1:checkpoint_every].clone())
+    ctx.batch_sizes = batch_sizes
+    ctx.zoneout_prob = zoneout_prob
+    ctx.zoneout_seed = zoneout_seed
+    ctx.dropout_prob = dropout_prob
+    ctx.dropout_seed = dropout_seed
+    ctx.checkpoint_every = checkpoint_every
+    ctx.workspace = workspace
+    ctx.grad_buffers = grad_buffers
+    return h, c
+
+  @staticmethod
+  def backward(ctx, grad_h, grad_c):
+    x, kernel, recurrent_kernel, bias, h, c_checkpoints = ctx.saved_tensors
+    grad_h = grad_h.contiguous()
+    grad_c = grad_c.contiguous()
+
+    # Every segment adds its weight gradients to the same buffers.
+    needs_grad = ctx.needs_input_grad[5:9]
+    if ctx.grad_buffers is None:
+      params = (kernel, recurrent_kernel, bias)
+      accumulators = [torch.zeros_like(p) if n else torch.empty(0) for p, n in zip(params, needs_grad[1:])]
+    else:
+      accumulators = _grad_accumulators(ctx, needs_grad[1:])
+    dx = torch.empty_like(x) if needs_grad[0] else None
+    dh = torch.zeros_like(h[0])
+    dc = torch.zeros_like(h[0])
+    segments = _segments(x.shape[0], ctx.checkpoint_every)
+    for (begin, end), c0 in reversed(list(zip(segments, c_checkpoints))):
+      # Step t of the sequence always uses the seed `zoneout_seed + t`, so each segment
+      # regenerates exactly the zoneout masks of the full-sequence forward pass.
+      zoneout_seed_segment = ctx.zoneout_seed + begin
+      batch_sizes_segment = _time_slice(ctx.batch_sizes, begin, end)
+      h_segment, c_segment, cache = LIB.lstm_forward(
+          ctx.workspace,
+          True,
+          ctx.zoneout_prob,
+          ctx.dropout_prob,
+          False,
+          x[begin:end],
+          kernel,
+          recurrent_kernel,
+          bias,
+          h[begin],
+          c0,
+          zoneout_seed_segment,
+          ctx.dropout_seed,
+          batch_sizes_segment)
+
+      # The gradient from the later segments enters through this segment's final state.
+      dh_new = grad_h[begin:end+1].clone()
+      dc_new = grad_c[begin:end+1].clone()
+      dh_new[-1] += dh
+      dc_new[-1] += dc
+      dx_segment, _, _, _, dh, dc = LIB.lstm_backward(
+          ctx.workspace,
+          needs_grad,
+          accumulators,
+          x[begin:end],
+          kernel,
+          recurrent_kernel,
+          bias,
+          ctx.zoneout_prob,
+          zoneout_seed_segment,
+          ctx.dropout_prob,
+          ctx.dropout_seed,
+          False,
+          h_segment,
+          c_segment,
+          cache,
+          dh_new,
+          dc_new,
+          batch_sizes_segment)
+      if dx is not None:
+        dx[begin:end] = dx_segment
+    dW, dR, db = (a if n else None for a, n in zip(accumulators, needs_grad[1:]))
+    return (None, None, None, None, None, dx, dW, dR, db, dh + grad_h[0], dc + grad_c[0], None, None, None)
+
+
+class LSTMBidirectionalFunction(torch.autograd.Function):
+  @staticmethod
+  def forward(ctx, workspace, training, zoneout_prob, dropout_prob, *inputs):
+    output, h_n, c_n, h, c, cache = LIB.lstm_bidirectional_forward(
+        workspace, training, zoneout_prob, dropout_prob, *inputs)
+    ctx.save_for_backward(*inputs[:4], h, c, cache)  # initial state isn't needed
+    ctx.workspace = workspace
+    ctx.zoneout_prob = zoneout_prob
+    ctx.zoneout_seed = inputs[-4]
+    ctx.dropout_prob = dropout_prob
+    ctx.dropout_seed = inputs[-3]
+    ctx.batch_sizes = inputs[-2]
+    ctx.sequence_length = inputs[-1]
+    ctx.training = training
+    return output, h_n, c_n
+
+  @staticmethod
+  def backward(ctx, grad_output, grad_h_n, grad_c_n):
+    if not ctx.training:
+      raise RuntimeError('LSTM backward can only be called in training mode')
+
+    x, kernel, recurrent_kernel, bias, h, c, cache = ctx.saved_tensors
+    hidden_size = h.shape[-1]
+
+    # Scatter the gradients back onto the per-direction state layout. The reverse
+    # direction's outputs are slots [0, T) and its final state is slot 0.
+    dh_new = torch.zeros_like(h)
+    dc_new = torch.zeros_like(c)
+    dh_new[0, 1:] = grad_output[..., :hidden_size]
+    dh_new[1, :-1] = grad_output[..., hidden_size:]
+    dh_new[0, -1] += grad_h_n[0]
+    dh_new[1, 0] += grad_h_n[1]
+    dc_new[0, -1] = grad_c_n[0]
+    dc_new[1, 0] = grad_c_n[1]
+
+    dx, dW, dR, db, dh, dc = LIB.lstm_bidirectional_backward(
+        ctx.workspace,
+        ctx.needs_input_grad[4:8],
+        x,
+        kernel,
+        recurrent_kernel,
+        bias,
+        ctx.zoneout_prob,
+        ctx.zoneout_seed,
+        ctx.dropout_prob,
+        ctx.dropout_seed,
+        h,
+        c,
+        cache,
+        dh_new,
+        dc_new,
+        ctx.batch_sizes,
+        ctx.sequence_length)
+    return (None, None, None, None, dx, dW, dR, db, dh, dc, None, None, None, None)
+
+
+class LSTMStackedFunction(torch.autograd.Function):
+  @staticmethod
+  def forward(
+      ctx,
+      workspace,
+      training,
+      zoneout_prob,
+      dropout_prob,
+      num_layers,
+      x,
+      h0,
+      c0,
+      zoneout_seed,
+      dropout_seed,
+      sequence_length,
+      *weights):
+    kernel = weights[:num_layers]
+    recurrent_kernel = weights[num_layers:2*num_layers]
+    bias = weights[2*num_layers:]
+    output, h_n, c_n, h, c, cache = LIB.lstm_stacked_forward(
+        workspace,
+        training,
+        zoneout_prob,
+        dropout_prob,
+        x,
+        kernel,
+        recurrent_kernel,
+        bias,
+        h0,
+        c0,
+        zoneout_seed,
+        dropout_seed,
+        sequence_length)
+    ctx.save_for_backward(x, h, c, cache, *weights)  # initial state isn't needed
+    ctx.zoneout_prob = zoneout_prob
+    ctx.zoneout_seed = zoneout_seed
+    ctx.dropout_prob = dropout_prob
+    ctx.dropout_seed = dropout_seed
+    ctx.num_layers = num_layers
+    ctx.sequence_length = sequence_length
+    ctx.training = training
+    ctx.workspace = workspace
+    return output, h_n, c_n
+
+  @staticmethod
+  def backward(ctx, grad_output, grad_h_n, grad_c_n):
+    if not ctx.training:
+      raise RuntimeError('LSTM backward can only be called in training mode')
+
+    x, h, c, cache, *weights = ctx.saved_tensors
+    num_layers = ctx.num_layers
+    needs_grad = ctx.needs_input_grad
+    dx, dh0, dc0, *grads = LIB.lstm_stacked_backward(
+        ctx.workspace,
+        [needs_grad[5], needs_grad[6] or needs_grad[7], *needs_grad[11:]],
+        x,
+        weights[:num_layers],
+        weights[num_layers:2*num_layers],
+        weights[2*num_layers:],
+        ctx.zoneout_prob,
+        ctx.zoneout_seed,
+        ctx.dropout_prob,
+        ctx.dropout_seed,
+        h,
+        c,
+        cache,
+        grad_output.contiguous(),
+        grad_h_n.contiguous(),
+        grad_c_n.contiguous(),
+        ctx.sequence_length)
+    return (None, None, None, None, None, dx, dh0, dc0, None, None, None, *grads)
+
 
 class LSTM(nn.Module):
   """
@@ -58,6 +502,12 @@ class LSTM(nn.Module):
   high-performance implementations. DropConnect and Zoneout regularization are
   built-in, and this layer allows setting a non-zero initial forget gate bias.
 
+  The layer runs on whichever device its parameters live on: use `.cuda()`
+  for the GPU kernels or keep it on the CPU for the multithreaded CPU kernels.
+  `.half()` and `.bfloat16()` store the parameters, activations, and state in
+  16 bits; the native ops still accumulate and compute the gates in single
+  precision. The LSTM is the only layer with 16-bit support.
+
   See [\_\_init\_\_](#__init__) and [forward](#forward) for usage.
   """
 
@@ -67,7 +517,13 @@ class LSTM(nn.Module):
       batch_first=False,
       forget_bias=1.0,
       dropout=0.0,
-      zoneout=0.0):
+      zoneout=0.0,
+      bidirectional=False,
+      num_layers=1,
+      checkpoint_every=0,
+      return_sequences=True,
+      accumulate_grad_in_place=False,
+      flat_parameters=False):
     """
     Initialize the parameters of the LSTM layer.
 
@@ -75,13 +531,57 @@ class LSTM(nn.Module):
       input_size: int, the feature dimension of the input.
       hidden_size: int, the feature dimension of the output.
       batch_first: (optional) bool, if `True`, then the input and output
-        tensors are provided as `(batch, seq, feature)`.
+        tensors are provided as `(batch, seq, feature)`. Unidirectional
+        single-layer LSTMs run directly on this layout, without transposing
+        the input or output, unless `checkpoint_every` is set.
       forget_bias: (optional) float, sets the initial bias of the forget gate
         for this LSTM cell.
       dropout: (optional) float, sets the dropout rate for DropConnect
         regularization on the recurrent matrix.
       zoneout: (optional) float, sets the zoneout rate for Zoneout
         regularization.
+      bidirectional: (optional) bool, if `True`, the layer also runs a second
+        LSTM over the reversed input sequence. Both directions are computed
+        concurrently by a single native call and their outputs are
+        concatenated along the feature dimension.
+      num_layers: (optional) int, the number of stacked LSTM layers. Each
+        layer after the first takes the output of the layer below as its
+        input. On the CPU, the whole stack runs as one wavefront in which
+        layer `l` computes time step `t - l`; in inference mode, only the last
+        layer's outputs are kept for the whole sequence. Not supported with
+        `bidirectional`.
+      checkpoint_every: (optional) int, if non-zero, training keeps the
+        cell state only at every `checkpoint_every`-th time step and no gate
+        activations. The backward pass recomputes the activations of each
+        segment just before backpropagating through it, which costs about
+        one extra forward pass. Only supported for unidirectional
+        single-layer LSTMs.
+      return_sequences: (optional) bool, if `False`, `forward` returns only
+        the last layer's hidden state at the end of each sequence instead of
+        its output at every time step. In inference mode, a unidirectional
+        single-layer LSTM on the CPU then keeps no per-step state at all:
+        its scratch space doesn't grow with the sequence length.
+      accumulate_grad_in_place: (optional) bool, if `True`, the backward pass
+        accumulates the weight gradients into buffers that the layer keeps and
+        reuses across training steps instead of allocating new ones on every
+        step. The buffers are still returned to autograd, which adds them to
+        `.grad` and runs the parameters' hooks, so `DistributedDataParallel`
+        and `GradScaler` see the gradients as usual. When `.grad` is None,
+        autograd copies the buffer rather than adding it, so the option pays
+        off with `flat_parameters` or `zero_grad(set_to_none=False)`. Only
+        supported for unidirectional single-layer LSTMs.
+      flat_parameters: (optional) bool, if `True`, all of the layer's
+        parameters are views into one contiguous buffer, `flat_weight`, and
+        their gradients are views into a matching buffer, `flat_grad`, so a
+        single collective (e.g. `torch.distributed.all_reduce(layer.flat_grad)`)
+        or tensor operation covers the whole layer. Every forward pass with
+        gradients enabled points `.grad` back at `flat_grad`, so gradients
+        that were set to None by `zero_grad()` are zeroed there instead.
+        If autograd installs a new `.grad` anyway, e.g. with
+        `create_graph=True`, it's copied back into `flat_grad` as soon as
+        it's accumulated. `DistributedDataParallel` must keep its default
+        `gradient_as_bucket_view=False`, since that option points `.grad` at
+        its own buckets instead.
 
     Variables:
       kernel: the input projection weight matrix. Dimensions
@@ -93,6 +593,15 @@ class LSTM(nn.Module):
       bias: the projection bias vector. Dimensions (hidden_size * 4) with
         `i,g,f,o` gate layout. The forget gate biases are initialized to
         `forget_bias` and the rest are zeros.
+      *_reverse: the parameters of the reverse direction if `bidirectional`
+        is `True`, e.g. `kernel_reverse`. Same dimensions and initialization
+        as their forward counterparts.
+      *_l1, *_l2, ...: the parameters of the second and later layers if
+        `num_layers` > 1, e.g. `kernel_l1`. The kernels have dimensions
+        (hidden_size, hidden_size * 4); otherwise, same dimensions and
+        initialization as their first-layer counterparts.
+      flat_weight, flat_grad: the contiguous parameter and gradient buffers
+        if `flat_parameters` is `True`, otherwise None.
     """
     super(LSTM, self).__init__()
 
@@ -100,6 +609,16 @@ class LSTM(nn.Module):
       raise ValueError('LSTM: dropout must be in [0.0, 1.0]')
     if zoneout < 0 or zoneout > 1:
       raise ValueError('LSTM: zoneout must be in [0.0, 1.0]')
+    if num_layers < 1:
+      raise ValueError('LSTM: num_layers must be at least 1')
+    if num_layers > 1 and bidirectional:
+      raise ValueError('LSTM: num_layers > 1 is not supported for bidirectional layers')
+    if checkpoint_every < 0:
+      raise ValueError('LSTM: checkpoint_every must be non-negative')
+    if checkpoint_every and (bidirectional or num_layers > 1):
+      raise ValueError('LSTM: checkpoint_every is only supported for unidirectional single-layer LSTMs')
+    if accumulate_grad_in_place and (bidirectional or num_layers > 1):
+      raise ValueError('LSTM: accumulate_grad_in_place is only supported for unidirectional single-layer LSTMs')
 
     self.input_size = input_size
     self.hidden_size = hidden_size
@@ -107,23 +626,78 @@ class LSTM(nn.Module):
     self.forget_bias = forget_bias
     self.dropout = dropout
     self.zoneout = zoneout
+    self.bidirectional = bidirectional
+    self.num_layers = num_layers
+    self.checkpoint_every = checkpoint_every
+    self.return_sequences = return_sequences
+    self.accumulate_grad_in_place = accumulate_grad_in_place
+    self.flat_parameters = flat_parameters
 
-    gpu = torch.device('cuda')
-    self.kernel = nn.Parameter(torch.empty(input_size, hidden_size * 4, device=gpu))
-    self.recurrent_kernel = nn.Parameter(torch.empty(hidden_size, hidden_size * 4, device=gpu))
-    self.bias = nn.Parameter(torch.empty(hidden_size * 4, device=gpu))
+    self.kernel = nn.Parameter(torch.empty(input_size, hidden_size * 4))
+    self.recurrent_kernel = nn.Parameter(torch.empty(hidden_size, hidden_size * 4))
+    self.bias = nn.Parameter(torch.empty(hidden_size * 4))
+    if bidirectional:
+      self.kernel_reverse = nn.Parameter(torch.empty(input_size, hidden_size * 4))
+      self.recurrent_kernel_reverse = nn.Parameter(torch.empty(hidden_size, hidden_size * 4))
+      self.bias_reverse = nn.Parameter(torch.empty(hidden_size * 4))
+    for layer in range(1, num_layers):
+      setattr(self, 'kernel_l{}'.format(layer), nn.Parameter(torch.empty(hidden_size, hidden_size * 4)))
+      setattr(self, 'recurrent_kernel_l{}'.format(layer), nn.Parameter(torch.empty(hidden_size, hidden_size * 4)))
+      setattr(self, 'bias_l{}'.format(layer), nn.Parameter(torch.empty(hidden_size * 4)))
     self.reset_parameters()
 
+    self.flat_weight = None
+    self.flat_grad = None
+    self._grad_hooks = []
+    if flat_parameters:
+      self._flatten_parameters()
+
+    self._decoder = None
+    self._decoder_key = None
+    self._packed = {}
+    self._grad_buffers = []
+    self._workspace = LIB.Workspace()
+
   def reset_parameters(self):
     """Resets this layer's parameters to their initial values."""
     hidden_size = self.hidden_size
-    for i in range(4):
-      nn.init.xavier_uniform_(self.kernel[:, i*hidden_size:(i+1)*hidden_size])
-      nn.init.orthogonal_(self.recurrent_kernel[:, i*hidden_size:(i+1)*hidden_size])
-    nn.init.zeros_(self.bias)
-    nn.init.constant_(self.bias[hidden_size*2:hidden_size*3], self.forget_bias)
+    for kernel, recurrent_kernel, bias in self._directions() + self._layers()[1:]:
+      for i in range(4):
+        nn.init.xavier_uniform_(kernel[:, i*hidden_size:(i+1)*hidden_size])
+        nn.init.orthogonal_(recurrent_kernel[:, i*hidden_size:(i+1)*hidden_size])
+      nn.init.zeros_(bias)
+      nn.init.constant_(bias[hidden_size*2:hidden_size*3], self.forget_bias)
+
+  def _flatten_parameters(self):
+    for handle in self._grad_hooks:
+      handle.remove()
+    self.flat_weight, self.flat_grad = _flatten(self._parameters.values())
+    self._grad_hooks = _keep_grads_attached(self)
+
+  def _apply(self, fn, *args, **kwargs):
+    # Conversions such as `.to()` and `.half()` replace the parameters one at a time,
+    # so the flat buffers are rebuilt afterwards.
+    module = super(LSTM, self)._apply(fn, *args, **kwargs)
+    if self.flat_parameters:
+      self._flatten_parameters()
+    return module
+
+  def _directions(self):
+    directions = [(self.kernel, self.recurrent_kernel, self.bias)]
+    if self.bidirectional:
+      directions.append((self.kernel_reverse, self.recurrent_kernel_reverse, self.bias_reverse))
+    return directions
+
+  def _layers(self):
+    layers = [(self.kernel, self.recurrent_kernel, self.bias)]
+    for layer in range(1, self.num_layers):
+      layers.append((
+          getattr(self, 'kernel_l{}'.format(layer)),
+          getattr(self, 'recurrent_kernel_l{}'.format(layer)),
+          getattr(self, 'bias_l{}'.format(layer))))
+    return layers
 
-  def forward(self, input, lengths=None):
+  def forward(self, input, lengths=None, state=None):
     """
     <a name="forward"></a>
     Runs a forward pass of the LSTM layer.
@@ -135,47 +709,403 @@ class LSTM(nn.Module):
       lengths: (optional) Tensor, list of sequence lengths for each batch
         element. Dimension (batch_size). This argument may be omitted if
         all batch elements are unpadded and have the same sequence length.
+        If the batch is sorted by decreasing length, the recurrence skips the
+        padding entirely: each time step only computes the sequences that
+        haven't ended yet.
+      state: (optional) tuple `(h_0, c_0)`, the initial hidden and cell states.
+        Dimensions (num_layers * num_directions, batch_size, hidden_size).
+        Defaults to zeros. Passing the state returned by a previous call
+        continues the sequence, which allows long inputs to be processed in
+        chunks.
+        Gradients flow back to the initial state.
 
     Returns:
       output: Tensor, the output of the LSTM layer. Dimensions
-        (seq_len, batch_size, hidden_size) if `batch_first` is `False` (default)
-        or (batch_size, seq_len, hidden_size) if `batch_first` is `True`. Note
-        that if `lengths` was specified, the `output` tensor will not be
-        masked. It's the caller's responsibility to either not use the invalid
-        entries or to mask them out before using them.
+        (seq_len, batch_size, num_directions * hidden_size) if `batch_first`
+        is `False` (default) or (batch_size, seq_len, num_directions *
+        hidden_size) if `batch_first` is `True`. Bidirectional layers put the
+        forward direction's features first. Note that if `lengths` was
+        specified, the `output` tensor will not be masked. It's the caller's
+        responsibility to either not use the invalid entries or to mask them
+        out before using them. If `return_sequences` is `False`, this is the
+        last layer's hidden state at the end of each sequence instead, with
+        dimensions (batch_size, num_directions * hidden_size).
       (h_n, c_n): the hidden and cell states, respectively, for the last
-        sequence item. Dimensions (1, batch_size, hidden_size).
+        sequence item of each layer and direction. Dimensions (num_layers *
+        num_directions, batch_size, hidden_size).
     """
-    if self.batch_first:
+    if self.flat_parameters and torch.is_grad_enabled():
+      _attach_grads(self._parameters.values(), self.flat_grad)
+
+    # Unidirectional single-layer passes read and write batch-major tensors as they are;
+    # the others work on a time-major copy.
+    batch_first = self.batch_first and not (
+        self.bidirectional or self.num_layers > 1 or (self.training and self.checkpoint_every))
+    if self.batch_first and not batch_first:
       input = input.permute(1, 0, 2)
 
-    if self.zoneout:
-      zoneout_mask = torch.empty(
-          input.shape[0],
-          input.shape[1],
-          self.hidden_size,
-          dtype=input.dtype,
-          device=input.device)
-      zoneout_mask.bernoulli_(1.0 - self.zoneout)
+    if self.bidirectional or self.num_layers > 1:
+      if self.bidirectional:
+        output, state = self._forward_bidirectional(input, lengths, state)
+      else:
+        output, state = self._forward_stacked(input, lengths, state)
+      return self._outputs(output, state)
+
+    # The native passes regenerate the zoneout and DropConnect masks from these seeds
+    # instead of storing them.
+    dropout = self.dropout if self.training else 0.0
+    zoneout_seed = _seeds(1)[0] if self.training and self.zoneout else 0
+    dropout_seed = _seeds(1)[0] if dropout else 0
+
+    time_steps, batch_size = (input.shape[1], input.shape[0]) if batch_first else input.shape[:2]
+    if state is None:
+      h0 = torch.zeros(batch_size, self.hidden_size, dtype=input.dtype, device=input.device)
+      c0 = torch.zeros(batch_size, self.hidden_size, dtype=input.dtype, device=input.device)
     else:
-      zoneout_mask = torch.empty(0, dtype=input.dtype, device=input.device)
-    h, c = LSTMFunction.apply(
-        self.training,
-        self.zoneout,
+      h0, c0 = state[0][0], state[1][0]
+
+    batch_sizes = _batch_sizes(lengths, time_steps)
+    if not self.training:
+      # Unsorted lengths are handled natively as well, so the final states come back
+      # directly and the per-step states don't have to be kept to look them up.
+      output, h_n, c_n = LSTMInferenceFunction.apply(
+          self._workspace,
+          self.zoneout,
+          self.return_sequences,
+          batch_first,
+          input.contiguous(),
+          self.kernel.contiguous(),
+          self.recurrent_kernel.contiguous(),
+          self.bias.contiguous(),
+          h0.contiguous(),
+          c0.contiguous(),
+          batch_sizes,
+          _sequence_length(None if batch_sizes.numel() else lengths, input.device).contiguous())
+      return self._outputs(output, (h_n.unsqueeze(0), c_n.unsqueeze(0)), time_major=not batch_first)
+
+    inputs = (
         input.contiguous(),
         self.kernel.contiguous(),
-        F.dropout(self.recurrent_kernel, self.dropout, self.training).contiguous(),
+        self.recurrent_kernel.contiguous(),
         self.bias.contiguous(),
-        zoneout_mask.contiguous())
+        h0.contiguous(),
+        c0.contiguous(),
+        zoneout_seed,
+        dropout_seed,
+        batch_sizes)
+    grad_buffers = None
+    if self.accumulate_grad_in_place and torch.is_grad_enabled():
+      grad_buffers = _claim_grad_buffers(self._grad_buffers, self._directions()[0])
+    if self.training and self.checkpoint_every:
+      h, c = LSTMCheckpointFunction.apply(
+          self._workspace, grad_buffers, self.zoneout, dropout, self.checkpoint_every, *inputs)
+    else:
+      h, c = LSTMFunction.apply(
+          self._workspace, grad_buffers, self.training, self.zoneout, dropout, batch_first, *inputs)
+
+    if batch_first:
+      # Put time first again; these are views, so only the final states are gathered.
+      h_t, c_t = h.transpose(0, 1), c.transpose(0, 1)
+    else:
+      h_t, c_t = h, c
+    if batch_sizes.numel():
+      # Finished sequences carry their state forward, so the last step holds the final state.
+      state = (h_t[-1].unsqueeze(0), c_t[-1].unsqueeze(0))
+    elif lengths is not None:
+      cols = range(h_t.size(1))
+      state = (h_t[[lengths, cols]].unsqueeze(0), c_t[[lengths, cols]].unsqueeze(0))
+    else:
+      state = (h_t[-1].unsqueeze(0), c_t[-1].unsqueeze(0))
+
+    return self._outputs(h[:, 1:] if batch_first else h[1:], state, time_major=not batch_first)
+
+  def _outputs(self, output, state, time_major=True):
+    """
+    Applies `return_sequences` and `batch_first` to the output, which is
+    time-major unless `time_major` is False.
+    """
+    if not self.return_sequences:
+      h_n = state[0][-len(self._directions()):]
+      return torch.cat(tuple(h_n), dim=-1), state
+    if self.batch_first and time_major:
+      output = output.permute(1, 0, 2)
+    return output, state
+
+  def _forward_bidirectional(self, input, lengths, state):
+    dropout = self.dropout if self.training else 0.0
+    zoneout_seed = _seeds(2) if self.training and self.zoneout else [0, 0]
+    dropout_seed = _seeds(2) if dropout else [0, 0]
+
+    if state is None:
+      h0 = torch.zeros(2, input.shape[1], self.hidden_size, dtype=input.dtype, device=input.device)
+      c0 = torch.zeros(2, input.shape[1], self.hidden_size, dtype=input.dtype, device=input.device)
+    else:
+      h0, c0 = state
+
+    # Padded steps carry the state through unchanged, which is what lets the reverse
+    # direction start at the end of each sequence rather than the end of the batch.
+    sequence_length = _sequence_length(lengths, input.device)
+
+    # Both directions' weights go to the native op as one [2,...] tensor each.
+    kernel, recurrent_kernel, bias = _pack(
+        self._packed,
+        'bidirectional',
+        [p for direction in self._directions() for p in direction],
+        lambda *p: [torch.stack(p[i::3]) for i in range(3)],
+        self.training)
+    output, h_n, c_n = LSTMBidirectionalFunction.apply(
+        self._workspace,
+        self.training,
+        self.zoneout,
+        dropout,
+        input.contiguous(),
+        kernel,
+        recurrent_kernel,
+        bias,
+        h0.contiguous(),
+        c0.contiguous(),
+        zoneout_seed,
+        dropout_seed,
+        _batch_sizes(lengths, input.shape[0]),
+        sequence_length.contiguous())
+    return output, (h_n, c_n)
+
+  def _forward_stacked(self, input, lengths, state):
+    num_layers = self.num_layers
+    dropout = self.dropout if self.training else 0.0
+    zoneout_seed = _seeds(num_layers) if self.training and self.zoneout else [0] * num_layers
+    dropout_seed = _seeds(num_layers) if dropout else [0] * num_layers
+
+    if state is None:
+      h0 = torch.zeros(num_layers, input.shape[1], self.hidden_size, dtype=input.dtype, device=input.device)
+      c0 = torch.zeros(num_layers, input.shape[1], self.hidden_size, dtype=input.dtype, device=input.device)
+    else:
+      h0, c0 = state
+
+    # Padded steps carry every layer's state forward, so the final states are the
+    # states at the end of each sequence.
+    kernel, recurrent_kernel, bias = zip(*self._layers())
+    output, h_n, c_n = LSTMStackedFunction.apply(
+        self._workspace,
+        self.training,
+        self.zoneout,
+        dropout,
+        num_layers,
+        input.contiguous(),
+        h0.contiguous(),
+        c0.contiguous(),
+        zoneout_seed,
+        dropout_seed,
+        _sequence_length(lengths, input.device).contiguous(),
+        *[k.contiguous() for k in kernel],
+        *[r.contiguous() for r in recurrent_kernel],
+        *[b.contiguous() for b in bias])
+    return output, (h_n, c_n)
+
+  def step(self, input, state=None):
+    """
+    Runs the LSTM layer for a single time step.
+
+    This is intended for autoregressive decoding, where each input depends on
+    the previous output. The native forward pass and its buffers are created
+    by the first call and reused by later calls with the same batch size,
+    dtype, and device, so each step costs little more than the recurrent
+    matrix multiplication. Only supported in inference mode.
+
+    Arguments:
+      input: Tensor, the input for this time step. Dimensions
+        (batch_size, input_size).
+      state: (optional) tuple `(h, c)`, the hidden and cell states from the
+        previous step. Dimensions (1, batch_size, hidden_size). Defaults to
+        zeros.
+
+    Returns:
+      output: Tensor, the output for this time step. Dimensions
+        (batch_size, hidden_size).
+      (h_n, c_n): the hidden and cell states after this step. Dimensions
+        (1, batch_size, hidden_size). These are views of buffers that are
+        reused two steps later; clone them to keep them for longer.
+    """
+    if self.training:
+      raise RuntimeError('LSTM step can only be called in inference mode')
+    if self.bidirectional:
+      raise RuntimeError('LSTM step is not supported for bidirectional layers')
+    if self.num_layers > 1:
+      raise RuntimeError('LSTM step is not supported for num_layers > 1')
+
+    batch_size = input.shape[0]
+    if state is None:
+      h = torch.zeros(batch_size, self.hidden_size, dtype=input.dtype, device=input.device)
+      c = torch.zeros(batch_size, self.hidden_size, dtype=input.dtype, device=input.device)
+    else:
+      h, c = state[0][0], state[1][0]
 
-    if lengths is not None:
-      cols = range(h.size(1))
-      state = (h[[lengths, cols]].unsqueeze(0), c[[lengths, cols]].unsqueeze(0))
+    key = (batch_size, input.dtype, input.device)
+    if self._decoder_key != key:
+      self._decoder = LIB.LstmDecoder(self.kernel, self.recurrent_kernel, batch_size, self.zoneout)
+      self._decoder_key = key
+
+    with torch.no_grad():
+      h, c = self._decoder.step(
+          input.contiguous(),
+          self.kernel.contiguous(),
+          self.recurrent_kernel.contiguous(),
+          self.bias.contiguous(),
+          h.contiguous(),
+          c.contiguous())
+    return h, (h.unsqueeze(0), c.unsqueeze(0))
+
+  def workspace_stats(self):
+    """
+    Returns the hit and miss counts of this layer's scratch buffer pool.
+
+    The native passes keep their temporary buffers (the recurrent projection
+    scratch space, the activations in inference mode, and the initial state
+    gradients) in a pool that persists across calls, so steady-state calls
+    don't allocate them. A pooled buffer is reused if it's large enough and
+    has the right dtype and device; otherwise it's replaced by one rounded up
+    to the next power of two elements.
+
+    Returns:
+      stats: dict, the number of buffer requests that reused a pooled buffer
+        (`'hits'`) and that allocated a new one (`'misses'`).
+    """
+    return {'hits': self._workspace.hits, 'misses': self._workspace.misses}
+
+
+class QuantizedLSTM(nn.Module):
+  """
+  Int8 weight-quantized LSTM for CPU inference.
+
+  This layer is built from a trained `LSTM`. Its kernels are quantized to int8
+  with one scale per output channel, which needs no calibration data and cuts
+  their memory by 4x. The inputs and hidden states are quantized on the fly,
+  both matrix multiplications run in int8 with int32 accumulation, and the
+  gates are computed in the input's precision. Bidirectional and stacked
+  layers are supported; the layer only runs on the CPU and has no backward
+  pass.
+
+  See [\_\_init\_\_](#__init__) and [forward](#forward) for usage.
+  """
+
+  def __init__(self, lstm):
+    """
+    Quantizes the parameters of a trained LSTM layer.
+
+    Arguments:
+      lstm: `LSTM`, the layer to quantize. Its parameters are copied, so later
+        changes to `lstm` don't affect this layer.
+
+    Variables:
+      kernel_q: the int8 input kernel, transposed so that each output channel
+        is contiguous. Dimensions (hidden_size * 4, input_size).
+      recurrent_kernel_q: the int8 recurrent kernel, transposed so that each
+        output channel is contiguous. Dimensions (hidden_size * 4, hidden_size).
+      kernel_scale: the scale of each output channel of `kernel_q`. Dimension
+        (hidden_size * 4).
+      recurrent_kernel_scale: the scale of each output channel of
+        `recurrent_kernel_q`. Dimension (hidden_size * 4).
+      bias: the unquantized bias vector. Dimension (hidden_size * 4).
+      *_reverse, *_l1, *_l2, ...: the same for the reverse direction or the
+        later layers, named as in `LSTM`.
+    """
+    super(QuantizedLSTM, self).__init__()
+
+    self.input_size = lstm.input_size
+    self.hidden_size = lstm.hidden_size
+    self.batch_first = lstm.batch_first
+    self.zoneout = lstm.zoneout
+    self.bidirectional = lstm.bidirectional
+    self.num_layers = lstm.num_layers
+    self.return_sequences = lstm.return_sequences
+
+    if self.bidirectional:
+      self._suffixes = ['', '_reverse']
+      parameters = lstm._directions()
     else:
-      state = (h[-1].unsqueeze(0), c[-1].unsqueeze(0))
+      self._suffixes = [''] + ['_l{}'.format(layer) for layer in range(1, self.num_layers)]
+      parameters = lstm._layers()
+
+    with torch.no_grad():
+      for suffix, (kernel, recurrent_kernel, bias) in zip(self._suffixes, parameters):
+        kernel_q, kernel_scale = LIB.quantize_weights(kernel.detach().cpu().float().contiguous())
+        recurrent_kernel_q, recurrent_kernel_scale = LIB.quantize_weights(
+            recurrent_kernel.detach().cpu().float().contiguous())
+        self.register_buffer('kernel_q' + suffix, kernel_q)
+        self.register_buffer('kernel_scale' + suffix, kernel_scale)
+        self.register_buffer('recurrent_kernel_q' + suffix, recurrent_kernel_q)
+        self.register_buffer('recurrent_kernel_scale' + suffix, recurrent_kernel_scale)
+        self.register_buffer('bias' + suffix, bias.detach().cpu().float().clone())
+
+    self._workspace = LIB.Workspace()
+
+  def _run(self, index, input, h0, c0, sequence_length, reverse=False):
+    suffix = self._suffixes[index]
+    return LIB.lstm_quantized_forward(
+        self._workspace,
+        self.zoneout,
+        reverse,
+        input.contiguous(),
+        getattr(self, 'kernel_q' + suffix),
+        getattr(self, 'kernel_scale' + suffix),
+        getattr(self, 'recurrent_kernel_q' + suffix),
+        getattr(self, 'recurrent_kernel_scale' + suffix),
+        getattr(self, 'bias' + suffix).to(input.dtype),
+        h0.contiguous(),
+        c0.contiguous(),
+        sequence_length)
 
-    output = h[1:]
+  def forward(self, input, lengths=None, state=None):
+    """
+    <a name="forward"></a>
+    Runs a forward pass of the quantized LSTM layer.
+
+    Arguments and return values are the same as for `LSTM.forward`. The input
+    must be a float32 or float64 CPU tensor.
+    """
+    if self.batch_first:
+      input = input.permute(1, 0, 2)
+
+    count = 2 if self.bidirectional else self.num_layers
+    if state is None:
+      h0 = torch.zeros(count, input.shape[1], self.hidden_size, dtype=input.dtype, device=input.device)
+      c0 = torch.zeros(count, input.shape[1], self.hidden_size, dtype=input.dtype, device=input.device)
+    else:
+      h0, c0 = state
+
+    # Padded steps carry the state through unchanged, so the last slot of each
+    # pass holds the state at the end of each sequence.
+    sequence_length = _sequence_length(lengths, input.device).contiguous()
+
+    with torch.no_grad():
+      if self.bidirectional:
+        h, c = self._run(0, input, h0[0], c0[0], sequence_length)
+        h_reverse, c_reverse = self._run(1, input, h0[1], c0[1], sequence_length, reverse=True)
+        output = torch.cat([h[1:], h_reverse[:-1]], dim=-1)
+        h_n = torch.stack([h[-1], h_reverse[0]])
+        c_n = torch.stack([c[-1], c_reverse[0]])
+      else:
+        output = input
+        h_n, c_n = [], []
+        for layer in range(self.num_layers):
+          h, c = self._run(layer, output, h0[layer], c0[layer], sequence_length)
+          output = h[1:]
+          h_n.append(h[-1])
+          c_n.append(c[-1])
+        h_n = torch.stack(h_n)
+        c_n = torch.stack(c_n)
+
+    if not self.return_sequences:
+      directions = 2 if self.bidirectional else 1
+      return torch.cat(tuple(h_n[-directions:]), dim=-1), (h_n, c_n)
     if self.batch_first:
       output = output.permute(1, 0, 2)
 
-    return output, state
+    return output, (h_n, c_n)
+
+  def workspace_stats(self):
+    """
+    Returns the hit and miss counts of this layer's scratch buffer pool as a
+    dict with the keys `'hits'` and `'misses'`. See `LSTM.workspace_stats`.
+    """
+    return {'hits': self._workspace.hits, 'misses': self._workspace.misses}
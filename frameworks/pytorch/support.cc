@@ -13,13 +13,207 @@
 // limitations under the License.
 // ==============================================================================
 
+#ifdef WITH_CUDA
+#include <ATen/cuda/CUDAContext.h>
+#endif
+#include <memory>
 #include <torch/extension.h>
 
+#ifdef WITH_CUDA
+#include "haste.h"
+#else
+#include "haste/cpu/dropconnect.h"
+#include "haste/cpu/quantize.h"
+#endif
+#include "support.h"
+
+namespace {
+
+// Applies the mask of each seed to its [H,H*G] matrix of `x`: a single one, or one per
+// entry of the leading dimension of a [D,H,H*G] tensor.
+void ApplyDropConnect(const torch::Tensor& x, torch::Tensor& y, float dropout_prob, const std::vector<int64_t>& dropout_seed) {
+  const int64_t matrices = x.dim() == 3 ? x.size(0) : 1;
+  TORCH_CHECK(static_cast<int64_t>(dropout_seed.size()) == matrices,
+      "expected one dropout seed per direction of the recurrent kernel");
+  if (matrices > 1) {
+    for (int64_t i = 0; i < matrices; ++i) {
+      torch::Tensor y_i = y[i];
+      ApplyDropConnect(x[i], y_i, dropout_prob, { dropout_seed[i] });
+    }
+    return;
+  }
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(), "DropConnect", ([&] {
+    if (x.is_cuda()) {
+#ifdef WITH_CUDA
+      using T = typename native_type<scalar_t>::gpu;
+      haste::v0::dropconnect::Apply<T>(
+          at::cuda::getCurrentCUDAStream(),
+          x.numel(),
+          dropout_prob,
+          dropout_seed[0],
+          ptr<T>(x),
+          ptr<T>(y));
+#endif
+    } else {
+      using T = typename native_type<scalar_t>::cpu;
+      haste::v0::cpu::dropconnect::Apply<T>(
+          x.numel(),
+          dropout_prob,
+          dropout_seed[0],
+          ptr<T>(x),
+          ptr<T>(y),
+          GetCpuParallelFor());
+    }
+  }));
+}
+
+// Returns the int8 weights `[output_dim, input_dim]` and per-output-channel scales of the
+// `[input_dim, output_dim]` weight matrix `W` for the quantized inference passes.
+std::vector<torch::Tensor> quantize_weights(torch::Tensor W) {
+  CHECK_INPUT(W);
+  TORCH_CHECK(!W.is_cuda() && W.dim() == 2, "W must be a 2-D CPU tensor");
+  const auto input_dim = W.size(0);
+  const auto output_dim = W.size(1);
+
+  torch::Tensor W_q = torch::empty({ output_dim, input_dim }, W.options().dtype(torch::kChar));
+  torch::Tensor scale = torch::empty({ output_dim }, W.options().dtype(torch::kFloat));
+  AT_DISPATCH_FLOATING_TYPES(W.scalar_type(), "quantize_weights", ([&] {
+    haste::v0::cpu::quantize::Weights<scalar_t>(
+        input_dim,
+        output_dim,
+        W.data<scalar_t>(),
+        W_q.data<int8_t>(),
+        scale.data<float>(),
+        GetCpuParallelFor());
+  }));
+  return { W_q, scale };
+}
+
+}  // anonymous namespace
+
+torch::Tensor Workspace::Get(const std::string& name, torch::IntArrayRef sizes, const torch::TensorOptions& options) {
+  int64_t numel = 1;
+  for (const auto size : sizes)
+    numel *= size;
+
+  std::lock_guard<std::mutex> lock(mutex_);
+  torch::Tensor& buffer = buffers_[{ std::this_thread::get_id(), name }];
+  if (buffer.defined() &&
+      buffer.numel() >= numel &&
+      buffer.dtype() == options.dtype() &&
+      buffer.device() == options.device()) {
+    ++hits_;
+  } else {
+    ++misses_;
+    int64_t capacity = 1;
+    while (capacity < numel)
+      capacity <<= 1;
+    buffer = torch::Tensor();  // Release the old buffer before allocating its replacement.
+    buffer = torch::empty({ capacity }, options);
+  }
+  return buffer.slice(0, 0, numel).view(sizes);
+}
+
+torch::Tensor Workspace::Zeros(const std::string& name, torch::IntArrayRef sizes, const torch::TensorOptions& options) {
+  return Get(name, sizes, options).zero_();
+}
+
+torch::Tensor Workspace::Packed(
+    const std::string& name,
+    const torch::Tensor& source,
+    int64_t bytes,
+    const std::function<void(void*)>& pack) {
+  TORCH_CHECK(!source.is_cuda(), "packed buffers are only supported for CPU tensors");
+
+  std::lock_guard<std::mutex> lock(mutex_);
+  PackedBuffer& entry = packed_[{ std::this_thread::get_id(), name }];
+  if (entry.buffer.defined() &&
+      entry.buffer.numel() == bytes &&
+      entry.source.is_same(source) &&
+      entry.storage.is_alias_of(source.storage()) &&
+      entry.data == source.data_ptr() &&
+      entry.version == static_cast<int64_t>(source._version())) {
+    ++hits_;
+    return entry.buffer;
+  }
+
+  ++misses_;
+  entry = PackedBuffer();  // Release the old buffer and source before packing the new one.
+  torch::Tensor buffer = torch::empty({ bytes }, torch::TensorOptions().dtype(torch::kUInt8));
+  pack(buffer.data_ptr());
+  entry.buffer = buffer;
+  entry.source = source;
+  entry.storage = source.storage();
+  entry.data = source.data_ptr();
+  entry.version = static_cast<int64_t>(source._version());
+  return buffer;
+}
+
+void Workspace::Clear() {
+  std::lock_guard<std::mutex> lock(mutex_);
+  buffers_.clear();
+  packed_.clear();
+}
+
+int64_t Workspace::hits() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return hits_;
+}
+
+int64_t Workspace::misses() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return misses_;
+}
+
+torch::Tensor DropConnect(
+    Workspace& workspace,
+    const std::string& name,
+    const torch::Tensor& recurrent_kernel,
+    float dropout_prob,
+    const std::vector<int64_t>& dropout_seed) {
+  if (!dropout_prob)
+    return recurrent_kernel;
+  CHECK_INPUT(recurrent_kernel);
+  torch::Tensor output = workspace.Get(name, recurrent_kernel.sizes(), recurrent_kernel.options());
+  ApplyDropConnect(recurrent_kernel, output, dropout_prob, dropout_seed);
+  return output;
+}
+
+void DropConnectGrad_(torch::Tensor& grad, float dropout_prob, const std::vector<int64_t>& dropout_seed) {
+  if (!dropout_prob || !grad.defined())
+    return;
+  CHECK_INPUT(grad);
+  ApplyDropConnect(grad, grad, dropout_prob, dropout_seed);
+}
+
+torch::Tensor GradBuffer(bool needed, const torch::Tensor& accumulator, const torch::Tensor& param) {
+  if (!needed)
+    return torch::Tensor();
+  if (!accumulator.numel())
+    return torch::zeros_like(param);
+  CHECK_INPUT(accumulator);
+  TORCH_CHECK(accumulator.sizes() == param.sizes() &&
+              accumulator.scalar_type() == param.scalar_type() &&
+              accumulator.device() == param.device(),
+      "gradient accumulators must match their parameter's shape, dtype, and device");
+  return accumulator;
+}
+
 void gru_init(py::module&);
 void lstm_init(py::module&);
 void layer_norm_lstm_init(py::module&);
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+  m.def("quantize_weights", &quantize_weights, "Per-channel int8 weight quantization");
+  // The buffers are scratch space, so copies and pickles of a layer start out empty.
+  py::class_<Workspace>(m, "Workspace")
+      .def(py::init<>())
+      .def_property_readonly("hits", &Workspace::hits)
+      .def_property_readonly("misses", &Workspace::misses)
+      .def("clear", &Workspace::Clear, "Releases every buffer")
+      .def(py::pickle(
+          [](const Workspace&) { return py::make_tuple(); },
+          [](py::tuple) { return std::unique_ptr<Workspace>(new Workspace()); }));
   gru_init(m);
   lstm_init(m);
   layer_norm_lstm_init(m);
@@ -15,6 +15,233 @@
 
 #pragma once
 
-#define CHECK_CUDA(x) TORCH_CHECK(x.type().is_cuda(), #x " must be a CUDA tensor")
+#include <ATen/Parallel.h>
+#include <exception>
+#include <functional>
+#include <future>
+#include <map>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <utility>
+#include <torch/extension.h>
+#ifdef WITH_CUDA
+#include <cuda_bf16.h>
+#include <cuda_fp16.h>
+#endif
+
+#include "haste/cpu/parallel.h"
+
 #define CHECK_CONTIGUOUS(x) TORCH_CHECK(x.is_contiguous(), #x " must be contiguous")
-#define CHECK_INPUT(x) CHECK_CUDA(x); CHECK_CONTIGUOUS(x)
+// Builds without `WITH_CUDA` (set by setup.py when nvcc is found) leave out the GPU passes,
+// so they reject CUDA tensors up front.
+#ifdef WITH_CUDA
+#define CHECK_DEVICE(x)
+#else
+#define CHECK_DEVICE(x) TORCH_CHECK(!x.is_cuda(), #x " is a CUDA tensor, but haste_pytorch was built without CUDA support")
+#endif
+#define CHECK_INPUT(x) CHECK_CONTIGUOUS(x); CHECK_DEVICE(x)
+#define CHECK_SHAPE(x, ...) TORCH_CHECK(x.sizes() == torch::IntArrayRef({ __VA_ARGS__ }), #x " must have shape [" #__VA_ARGS__ "]")
+#define CHECK_BATCH_SIZES(x, steps) TORCH_CHECK(!x.numel() || (!x.is_cuda() && x.scalar_type() == torch::kInt && x.is_contiguous() && x.numel() == steps), #x " must be empty or an int32 CPU tensor with one entry per time step")
+#define CHECK_SEQUENCE_LENGTH(x, input, batch) TORCH_CHECK(!x.numel() || (x.is_cuda() == input.is_cuda() && x.scalar_type() == torch::kLong && x.is_contiguous() && x.numel() == batch), #x " must be empty or an int64 tensor on the device of " #input " with one entry per batch element")
+#define CHECK_SEEDS(x, n) TORCH_CHECK(x.size() == static_cast<size_t>(n), #x " must have " #n " entries")
+#define CHECK_ENTRIES(x, n) TORCH_CHECK(x.size() == static_cast<size_t>(n), #x " must have " #n " entries")
+#define CHECK_FULL_PRECISION(x, layer) TORCH_CHECK(x.scalar_type() == torch::kFloat || x.scalar_type() == torch::kDouble, "the " layer " only supports float32 and float64 inputs, got ", x.scalar_type(), "; float16 and bfloat16 are only supported by the LSTM")
+
+namespace Eigen {
+struct half;
+struct bfloat16;
+}  // namespace Eigen
+
+// Maps an ATen scalar type to the element type libhaste uses for it on the GPU and on the
+// CPU. The 16-bit types share their representation with ATen's, so tensors can be passed
+// through `ptr` without conversion.
+template<typename T>
+struct native_type {
+  typedef T gpu;
+  typedef T cpu;
+};
+
+template<>
+struct native_type<at::Half> {
+#ifdef WITH_CUDA
+  typedef __half gpu;
+#endif
+  typedef Eigen::half cpu;
+};
+
+template<>
+struct native_type<at::BFloat16> {
+#ifdef WITH_CUDA
+  typedef __nv_bfloat16 gpu;
+#endif
+  typedef Eigen::bfloat16 cpu;
+};
+
+// Undefined tensors map to nullptr, which the backward passes take to mean that the
+// corresponding gradient isn't needed.
+template<typename T>
+inline T* ptr(const torch::Tensor& t) {
+  return t.defined() ? static_cast<T*>(t.data_ptr()) : nullptr;
+}
+
+// Runs the CPU implementations on ATen's intra-op thread pool so they respect
+// `torch.set_num_threads`.
+inline haste::v0::cpu::ParallelFor GetCpuParallelFor() {
+  return [](const int64_t total, const int64_t cost_per_unit, const std::function<void(int64_t, int64_t)>& fn) {
+    const int64_t grain_size = std::max<int64_t>(1, at::internal::GRAIN_SIZE / std::max<int64_t>(1, cost_per_unit));
+    at::parallel_for(0, total, grain_size, fn);
+  };
+}
+
+// Turns the gradient of the dropped-out recurrent kernel into the gradient of the original
+// one, in place, with the masks of `DropConnect`. Undefined gradients are left alone. Only
+// the GPU passes need this; the CPU passes mask the gradient as they accumulate it.
+void DropConnectGrad_(torch::Tensor& grad, float dropout_prob, const std::vector<int64_t>& dropout_seed);
+
+// Returns the buffer that a backward pass accumulates the gradient of `param` into: an
+// undefined tensor if the gradient isn't `needed`, `accumulator` (a zeroed buffer that the
+// layer reuses across steps) if it isn't empty, and a new zero-filled tensor otherwise.
+// The native passes only ever add to their weight gradients, so every segment of a
+// checkpointed pass accumulates into the same buffer.
+torch::Tensor GradBuffer(bool needed, const torch::Tensor& accumulator, const torch::Tensor& param);
+
+// Scratch buffers that persist across the native calls of one layer. `Get` returns an
+// uninitialized tensor backed by a buffer that is reused by every later request with the
+// same name, dtype, and device from the same thread, so the result must not outlive the
+// call it was requested for. Buffers grow to the next power of two elements, so calls with
+// different sequence lengths or batch sizes share one allocation. GPU buffers are reused
+// without synchronization, which assumes the calls are issued to the same stream.
+class Workspace {
+  public:
+    Workspace() = default;
+    Workspace(const Workspace&) = delete;
+    Workspace& operator=(const Workspace&) = delete;
+
+    torch::Tensor Get(const std::string& name, torch::IntArrayRef sizes, const torch::TensorOptions& options);
+
+    // Like `Get`, but the buffer is zeroed.
+    torch::Tensor Zeros(const std::string& name, torch::IntArrayRef sizes, const torch::TensorOptions& options);
+
+    // Returns a [bytes] uint8 CPU buffer that `pack` has filled from the contents of `source`,
+    // such as a weight matrix repacked for the native passes. Unlike the buffers of `Get`, its
+    // contents are kept: `pack` is only called again once `source` is a different tensor or
+    // has been modified in place (which bumps its version counter), so weights that don't
+    // change between calls are packed once. Writes that bypass the version counter (e.g.
+    // through a raw pointer) go unnoticed. A reference to `source` is held until it's
+    // replaced by another tensor or `Clear` is called.
+    torch::Tensor Packed(
+        const std::string& name,
+        const torch::Tensor& source,
+        int64_t bytes,
+        const std::function<void(void*)>& pack);
+
+    // Releases every buffer. The counters are kept.
+    void Clear();
+
+    // The number of requests that reused an existing buffer and that had to allocate one.
+    int64_t hits() const;
+    int64_t misses() const;
+
+  private:
+    // A buffer returned by `Packed` and the version of its source it was filled from.
+    struct PackedBuffer {
+      torch::Tensor buffer;
+      torch::Tensor source;
+      c10::Storage storage;  // Keeps the address of the source's data from being reused.
+      const void* data = nullptr;
+      int64_t version = 0;
+    };
+
+    mutable std::mutex mutex_;
+    std::map<std::pair<std::thread::id, std::string>, torch::Tensor> buffers_;
+    std::map<std::pair<std::thread::id, std::string>, PackedBuffer> packed_;
+    int64_t hits_ = 0;
+    int64_t misses_ = 0;
+};
+
+// Returns `recurrent_kernel` with DropConnect applied, or `recurrent_kernel` itself if
+// `dropout_prob` is 0, for the GPU passes. `dropout_seed` has one entry per direction of a
+// [D,H,H*G] kernel or a single one for [H,H*G], and each [H,H*G] matrix gets the mask of its
+// own seed, which is the mask that the CPU passes apply as they pack it. The mask is never
+// stored, so the backward pass calls this again with the same seeds to recover the same
+// matrix. The dropped-out copy is written to the `workspace` buffer called `name`, so it's
+// reused across calls instead of being allocated by each of them; it must not outlive the
+// call.
+torch::Tensor DropConnect(
+    Workspace& workspace,
+    const std::string& name,
+    const torch::Tensor& recurrent_kernel,
+    float dropout_prob,
+    const std::vector<int64_t>& dropout_seed);
+
+// Returns the recurrent kernel packed for a CPU forward pass (see e.g.
+// `cpu::lstm::ForwardPass::PackRecurrentKernel`), one pointer per direction of a [D,H,H*G]
+// kernel or a single one for [H,H*G]. The packed copy is kept in the `workspace` buffer
+// called `name` and only repacked once the kernel changes, so inference with fixed weights
+// packs them once rather than on every call. With DropConnect, each direction is packed
+// with the mask of its entry of `dropout_seed` applied. That gives a different matrix on
+// every call, so it's packed into a scratch buffer of the same name instead, which must not
+// outlive the call.
+template<typename T, typename ForwardPassT>
+std::vector<const void*> PackRecurrentKernel(
+    Workspace& workspace,
+    const std::string& name,
+    ForwardPassT& forward,
+    const torch::Tensor& recurrent_kernel,
+    float dropout_prob,
+    const std::vector<int64_t>& dropout_seed = {}) {
+  const int64_t directions = recurrent_kernel.dim() == 3 ? recurrent_kernel.size(0) : 1;
+  const int64_t bytes = forward.PackedRecurrentKernelSize();
+  const auto pack = [&](void* data) {
+    for (int64_t direction = 0; direction < directions; ++direction) {
+      const T* R = ptr<T>(recurrent_kernel) + direction * (recurrent_kernel.numel() / directions);
+      forward.PackRecurrentKernel(
+          R,
+          static_cast<uint8_t*>(data) + direction * bytes,
+          dropout_prob,
+          dropout_prob ? dropout_seed[direction] : 0);
+    }
+  };
+
+  torch::Tensor buffer;
+  if (dropout_prob) {
+    TORCH_CHECK(static_cast<int64_t>(dropout_seed.size()) == directions,
+        "expected one dropout seed per direction of the recurrent kernel");
+    buffer = workspace.Get(name, { directions * bytes }, torch::TensorOptions().dtype(torch::kUInt8));
+    pack(buffer.data_ptr());
+  } else {
+    buffer = workspace.Packed(name, recurrent_kernel, directions * bytes, pack);
+  }
+
+  std::vector<const void*> packed(directions);
+  for (int64_t direction = 0; direction < directions; ++direction)
+    packed[direction] = buffer.data<uint8_t>() + direction * bytes;
+  return packed;
+}
+
+// Runs `fn0` on the calling thread and `fn1` as a task on ATen's inter-op thread pool,
+// and returns once both have completed. Each function may still use the intra-op pool
+// through `GetCpuParallelFor`.
+template<typename F0, typename F1>
+void RunConcurrently(const F0& fn0, const F1& fn1) {
+  std::promise<void> done;
+  std::future<void> finished = done.get_future();
+  at::launch([&] {
+    try {
+      fn1();
+      done.set_value();
+    } catch (...) {
+      done.set_exception(std::current_exception());
+    }
+  });
+
+  // `fn1` refers to the caller's stack, so wait for it even if `fn0` throws.
+  try {
+    fn0();
+  } catch (...) {
+    finished.wait();
+    throw;
+  }
+  finished.get();
+}
@@ -14,6 +14,7 @@
 // ==============================================================================
 
 #include <cuda_runtime_api.h>
+#include <vector>
 
 #include "haste.h"
 #include "support.h"
@@ -25,6 +26,8 @@
 
 using namespace tensorflow;
 
+namespace cpu = haste::v0::cpu;
+
 using haste::v0::gru::BackwardPass;
 using haste::v0::gru::ForwardPass;
 using tensorflow::se::Stream;
@@ -37,12 +40,14 @@ REGISTER_OP("HasteGru")
     .Attr("R: {float, double}")         // Some real number type.
     .Attr("training: bool")
     .Attr("zoneout_prob: float")
+    .Attr("dropout_prob: float")
     .Input("x: R")                      // [T,N,C]
     .Input("kernel: R")                 // [C,H*3]
     .Input("recurrent_kernel: R")       // [H,H*3]
     .Input("bias: R")                   // [H*3]
     .Input("recurrent_bias: R")         // [H*3]
-    .Input("zoneout_mask: R")           // [T,N,H]
+    .Input("zoneout_seed: int64")       // []
+    .Input("dropout_seed: int64")       // []
     .Output("h: R")                     // [T,N,H]
     .Output("v: R")                     // [T,N,H*4]
     .SetShapeFn([](InferenceContext* c) {
@@ -51,14 +56,16 @@ REGISTER_OP("HasteGru")
       ShapeHandle recurrent_shape;
       ShapeHandle bias_shape;
       ShapeHandle recurrent_bias_shape;
-      ShapeHandle zoneout_mask_shape;
+      ShapeHandle zoneout_seed_shape;
+      ShapeHandle dropout_seed_shape;
 
       TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &input_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 2, &kernel_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(2), 2, &recurrent_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(3), 1, &bias_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(4), 1, &recurrent_bias_shape));
-      TF_RETURN_IF_ERROR(c->WithRank(c->input(5), 3, &zoneout_mask_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(5), 0, &zoneout_seed_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(6), 0, &dropout_seed_shape));
 
       const DimensionHandle time_steps = c->Dim(input_shape, 0);
       const DimensionHandle batch_size = c->Dim(input_shape, 1);
@@ -72,29 +79,30 @@ REGISTER_OP("HasteGru")
       return Status::OK();
     });
 
-template<typename T>
+template<typename Device, typename T>
 struct HasteGruOp : public OpKernel {
   explicit HasteGruOp(OpKernelConstruction* context) : OpKernel(context) {
     OP_REQUIRES_OK(context, context->GetAttr("training", &training_));
     OP_REQUIRES_OK(context, context->GetAttr("zoneout_prob", &zoneout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("dropout_prob", &dropout_prob_));
   }
 
-  // When running on GPU, TF backs all inputs and outputs with device memory
-  // and not host memory. We don't need to do explicit memory copies or allocations
-  // for the inputs and outputs.
+  // TF backs all inputs and outputs with memory on the op's device (GPU or host),
+  // so we don't need to do explicit memory copies or allocations for the inputs
+  // and outputs.
   void Compute(OpKernelContext* context) override {
     const Tensor& input = context->input(0);
     const Tensor& kernel = context->input(1);
     const Tensor& recurrent_kernel = context->input(2);
     const Tensor& bias = context->input(3);
     const Tensor& recurrent_bias = context->input(4);
-    const Tensor& zoneout_mask = context->input(5);
+    const int64 zoneout_seed = context->input(5).scalar<int64>()();
+    const int64 dropout_seed = context->input(6).scalar<int64>()();
 
     const auto time_steps = input.shape().dim_size(0);
     const auto batch_size = input.shape().dim_size(1);
     const auto input_size = input.shape().dim_size(2);
     const auto hidden_size = recurrent_kernel.shape().dim_size(0);
-    const bool has_zoneout = zoneout_prob_ && zoneout_mask.NumElements();
     const auto data_type = DataTypeToEnum<T>::value;
 
     OP_REQUIRES(context, input_size == kernel.shape().dim_size(0),
@@ -118,61 +126,105 @@ struct HasteGruOp : public OpKernel {
     const TensorShape tmp_Rh_shape = { batch_size, hidden_size * 3 };
     OP_REQUIRES_OK(context, context->allocate_temp(data_type, tmp_Rh_shape, &tmp_Rh));
 
-    cudaMemset(output->flat<T>().data(), 0, output->AllocatedBytes());
-
-    ForwardPass<T> forward = ForwardPass<T>(
-        training_,
-        batch_size,
-        input_size,
-        hidden_size,
-        GetCublasHandle());
-
-    Tensor h = output->SubSlice(0);
-    for (int64 i = 0; i < time_steps; ++i) {
-      Tensor x = input.SubSlice(i);
-      Tensor new_h = output->SubSlice(i);
-      Tensor v = v_out->SubSlice(i);
-      Tensor tmp_Wx_cur = tmp_Wx.SubSlice(i);
-
-      forward.Iterate(
-          kernel.flat<T>().data(),
-          recurrent_kernel.flat<T>().data(),
-          bias.flat<T>().data(),
-          recurrent_bias.flat<T>().data(),
-          x.unaligned_flat<T>().data(),
-          h.unaligned_flat<T>().data(),
-          new_h.unaligned_flat<T>().data(),
-          training_ ? v.unaligned_flat<T>().data() : nullptr,
-          tmp_Wx_cur.unaligned_flat<T>().data(),
-          tmp_Rh.flat<T>().data(),
-          has_zoneout ? zoneout_prob_ : 0.0f,
-          has_zoneout ? zoneout_mask.SubSlice(i).unaligned_flat<T>().data() : nullptr);
-      h = new_h;
+    SetZero<Device>(output->flat<T>().data(), output->AllocatedBytes());
+
+    // DropConnect writes to a copy of the recurrent kernel in temporary memory of this
+    // call. The gradient op regenerates the same mask from `dropout_seed`, so nothing is
+    // kept between the two.
+    Tensor dropped_recurrent_kernel;
+    OP_REQUIRES_OK(context, DropConnectRecurrentKernel<Device, T>(
+        context, recurrent_kernel, dropout_prob_, dropout_seed, &dropped_recurrent_kernel));
+
+    if (std::is_same<Device, CPUDevice>::value) {
+      cpu::gru::ForwardPass<T> forward = cpu::gru::ForwardPass<T>(
+          training_,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor(context));
+      IterateForward(forward, input, kernel, dropped_recurrent_kernel, bias, recurrent_bias,
+          zoneout_seed, output, v_out, tmp_Wx, tmp_Rh);
+    } else {
+      ForwardPass<T> forward = ForwardPass<T>(
+          training_,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCublasHandle());
+      IterateForward(forward, input, kernel, dropped_recurrent_kernel, bias, recurrent_bias,
+          zoneout_seed, output, v_out, tmp_Wx, tmp_Rh);
     }
   }
 
   private:
+    // The GPU and CPU forward passes share the same `Iterate` contract.
+    template<typename ForwardPassT>
+    void IterateForward(
+        ForwardPassT& forward,
+        const Tensor& input,
+        const Tensor& kernel,
+        const Tensor& recurrent_kernel,
+        const Tensor& bias,
+        const Tensor& recurrent_bias,
+        const int64 zoneout_seed,
+        Tensor* output,
+        Tensor* v_out,
+        Tensor& tmp_Wx,
+        Tensor& tmp_Rh) {
+      const auto time_steps = input.shape().dim_size(0);
+
+      Tensor h = output->SubSlice(0);
+      for (int64 i = 0; i < time_steps; ++i) {
+        Tensor x = input.SubSlice(i);
+        Tensor new_h = output->SubSlice(i);
+        Tensor v = v_out->SubSlice(i);
+        Tensor tmp_Wx_cur = tmp_Wx.SubSlice(i);
+
+        forward.Iterate(
+            kernel.flat<T>().data(),
+            recurrent_kernel.flat<T>().data(),
+            bias.flat<T>().data(),
+            recurrent_bias.flat<T>().data(),
+            x.unaligned_flat<T>().data(),
+            h.unaligned_flat<T>().data(),
+            new_h.unaligned_flat<T>().data(),
+            training_ ? v.unaligned_flat<T>().data() : nullptr,
+            tmp_Wx_cur.unaligned_flat<T>().data(),
+            tmp_Rh.flat<T>().data(),
+            zoneout_prob_,
+            zoneout_seed + i);
+        h = new_h;
+      }
+    }
+
     bool training_;
     float zoneout_prob_;
+    float dropout_prob_;
 };
 
 REGISTER_GPU_KERNEL(HasteGru, float);
 REGISTER_GPU_KERNEL(HasteGru, double);
+REGISTER_CPU_KERNEL(HasteGru, float);
+REGISTER_CPU_KERNEL(HasteGru, double);
 
 REGISTER_OP("HasteGruGrad")
     .Attr("R: {float, double}")
-    .Input("x_t: R")                   // [T,C,N]
-    .Input("kernel_t: R")              // [H*3,C]
-    .Input("recurrent_kernel_t: R")    // [H*3,H]
+    .Attr("zoneout_prob: float")
+    .Attr("dropout_prob: float")
+    .Attr("needs_grad: list(bool) = [true, true, true]")  // [dx, dw, dr]
+    .Input("x: R")                     // [T,N,C]
+    .Input("kernel: R")                // [C,H*3]
+    .Input("recurrent_kernel: R")      // [H,H*3]
     .Input("bias: R")                  // [H*3]
     .Input("recurrent_bias: R")        // [H*3]
-    .Input("h_t: R")                   // [T,H,N]
+    .Input("h: R")                     // [T,N,H]
     .Input("v: R")                     // [T,N,H*4]
     .Input("dh_new: R")                // [T,N,H]
-    .Input("zoneout_mask: R")          // [T,N,H]
-    .Output("dx: R")                   // [T,N,C]
-    .Output("dw: R")                   // [C,H*3]
-    .Output("dr: R")                   // [H,H*3]
+    .Input("zoneout_seed: int64")      // []
+    .Input("dropout_seed: int64")      // []
+    .Output("dx: R")                   // [T,N,C] or [0]
+    .Output("dw: R")                   // [C,H*3] or [0]
+    .Output("dr: R")                   // [H,H*3] or [0]
     .Output("dbx: R")                  // [H*3]
     .Output("dbr: R")                  // [H*3]
     .SetShapeFn([](InferenceContext* c) {
@@ -184,7 +236,8 @@ REGISTER_OP("HasteGruGrad")
       ShapeHandle h_shape;
       ShapeHandle v_shape;
       ShapeHandle dh_new_shape;
-      ShapeHandle zoneout_mask_shape;
+      ShapeHandle zoneout_seed_shape;
+      ShapeHandle dropout_seed_shape;
 
       TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &x_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 2, &kernel_shape));
@@ -194,24 +247,38 @@ REGISTER_OP("HasteGruGrad")
       TF_RETURN_IF_ERROR(c->WithRank(c->input(5), 3, &h_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(6), 3, &v_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(7), 3, &dh_new_shape));
-      TF_RETURN_IF_ERROR(c->WithRank(c->input(8), 3, &zoneout_mask_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(8), 0, &zoneout_seed_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(9), 0, &dropout_seed_shape));
 
       DimensionHandle time_steps = c->Dim(x_shape, 0);
-      DimensionHandle input_size = c->Dim(x_shape, 1);
-      DimensionHandle batch_size = c->Dim(x_shape, 2);
-      DimensionHandle hidden_size = c->Dim(recurrent_kernel_shape, 1);
-
-      c->set_output(0, c->MakeShape({ time_steps, batch_size, input_size }));
-      c->set_output(1, c->MakeShape({ input_size, c->Value(hidden_size) * 3 }));
-      c->set_output(2, c->MakeShape({ hidden_size, c->Value(hidden_size) * 3 }));
+      DimensionHandle batch_size = c->Dim(x_shape, 1);
+      DimensionHandle input_size = c->Dim(x_shape, 2);
+      DimensionHandle hidden_size = c->Dim(recurrent_kernel_shape, 0);
+
+      std::vector<bool> needs_grad;
+      TF_RETURN_IF_ERROR(c->GetAttr("needs_grad", &needs_grad));
+      if (needs_grad.size() != 3)
+        return errors::InvalidArgument("needs_grad must have 3 entries");
+
+      // Gradients that aren't needed are returned as empty tensors. The bias gradients
+      // fall out of the pointwise operations, so they're always computed.
+      c->set_output(0, needs_grad[0] ? c->MakeShape({ time_steps, batch_size, input_size }) : c->MakeShape({ 0 }));
+      c->set_output(1, needs_grad[1] ? c->MakeShape({ input_size, c->Value(hidden_size) * 3 }) : c->MakeShape({ 0 }));
+      c->set_output(2, needs_grad[2] ? c->MakeShape({ hidden_size, c->Value(hidden_size) * 3 }) : c->MakeShape({ 0 }));
       c->set_output(3, bias_shape);
       c->set_output(4, recurrent_bias_shape);
       return Status::OK();
     });
 
-template<typename T>
+template<typename Device, typename T>
 struct HasteGruGradOp : public OpKernel {
-  explicit HasteGruGradOp(OpKernelConstruction* context) : OpKernel(context) {}
+  explicit HasteGruGradOp(OpKernelConstruction* context) : OpKernel(context) {
+    OP_REQUIRES_OK(context, context->GetAttr("zoneout_prob", &zoneout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("dropout_prob", &dropout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("needs_grad", &needs_grad_));
+    OP_REQUIRES(context, needs_grad_.size() == 3,
+        errors::InvalidArgument("needs_grad must have 3 entries"));
+  }
 
   void Compute(OpKernelContext* context) override {
     const Tensor& input = context->input(0);
@@ -222,29 +289,36 @@ struct HasteGruGradOp : public OpKernel {
     const Tensor& h_vector = context->input(5);
     const Tensor& v_vector = context->input(6);
     const Tensor& dh_new = context->input(7);
-    const Tensor& zoneout_mask = context->input(8);
+    const int64 zoneout_seed = context->input(8).scalar<int64>()();
+    const int64 dropout_seed = context->input(9).scalar<int64>()();
 
     const auto time_steps = input.shape().dim_size(0);
-    const auto input_size = input.shape().dim_size(1);
-    const auto batch_size = input.shape().dim_size(2);
-    const auto hidden_size = recurrent_kernel.shape().dim_size(1);
-    const bool has_zoneout = !!zoneout_mask.NumElements();
+    const auto batch_size = input.shape().dim_size(1);
+    const auto input_size = input.shape().dim_size(2);
+    const auto hidden_size = recurrent_kernel.shape().dim_size(0);
     const auto data_type = DataTypeToEnum<T>::value;
 
+    // Gradients that aren't needed are returned as empty tensors and passed to the
+    // backward pass as nullptr, which skips the matrix multiplications that compute them.
+    const TensorShape empty_shape = { 0 };
+
     // Can be uninitialized. Output only, no accumulation.
     const TensorShape dx_shape = { time_steps, batch_size, input_size };
     Tensor* dx = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(0, dx_shape, &dx));
+    OP_REQUIRES_OK(context, context->allocate_output(0, needs_grad_[0] ? dx_shape : empty_shape, &dx));
+    T* dx_data = needs_grad_[0] ? dx->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape dW_shape = { input_size, hidden_size * 3 };
     Tensor* dW = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(1, dW_shape, &dW));
+    OP_REQUIRES_OK(context, context->allocate_output(1, needs_grad_[1] ? dW_shape : empty_shape, &dW));
+    T* dW_data = needs_grad_[1] ? dW->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape dR_shape = { hidden_size, hidden_size * 3 };
     Tensor* dR = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(2, dR_shape, &dR));
+    OP_REQUIRES_OK(context, context->allocate_output(2, needs_grad_[2] ? dR_shape : empty_shape, &dR));
+    T* dR_data = needs_grad_[2] ? dR->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape dbx_shape = { hidden_size * 3 };
@@ -276,54 +350,119 @@ struct HasteGruGradOp : public OpKernel {
     Tensor zero_vector;
     OP_REQUIRES_OK(context, context->allocate_temp(data_type, zero_vector_shape, &zero_vector));
 
-    cudaMemset(dW->flat<T>().data(), 0, dW->AllocatedBytes());
-    cudaMemset(dR->flat<T>().data(), 0, dR->AllocatedBytes());
-    cudaMemset(dbx->flat<T>().data(), 0, dbx->AllocatedBytes());
-    cudaMemset(dbr->flat<T>().data(), 0, dbr->AllocatedBytes());
-    cudaMemset(dh.flat<T>().data(), 0, dh.AllocatedBytes());
-    cudaMemset(zero_vector.flat<T>().data(), 0, zero_vector.AllocatedBytes());
-
-    BackwardPass<T> backward = BackwardPass<T>(
-        batch_size,
-        input_size,
-        hidden_size,
-        GetCublasHandle());
-
-    for (int64 i = time_steps - 1; i >= 0; --i) {
-      Tensor x = input.SubSlice(i);
-
-      // These are slices of cell outputs so we use (i - 1) to get the
-      // cell inputs (i.e., h_t is the output of the t'th LSTM cell
-      // which is also the input to the t+1'th cell).
-      Tensor h = i != 0 ? h_vector.SubSlice(i - 1) : zero_vector;
-      Tensor v = v_vector.SubSlice(i);
-
-      Tensor dh_new_cur = dh_new.SubSlice(i);
-      Tensor dx_cur = dx->SubSlice(i);
-      Tensor dp_cur = dp.SubSlice(i);
-      Tensor dq_cur = dq.SubSlice(i);
-
-      backward.Iterate(
-          kernel.flat<T>().data(),
-          recurrent_kernel.flat<T>().data(),
-          bias.flat<T>().data(),
-          recurrent_bias.flat<T>().data(),
-          x.unaligned_flat<T>().data(),
-          h.unaligned_flat<T>().data(),
-          v.unaligned_flat<T>().data(),
-          dh_new_cur.unaligned_flat<T>().data(),
-          dx_cur.unaligned_flat<T>().data(),
-          dW->flat<T>().data(),
-          dR->flat<T>().data(),
-          dbx->flat<T>().data(),
-          dbr->flat<T>().data(),
-          dh.flat<T>().data(),
-          dp_cur.unaligned_flat<T>().data(),
-          dq_cur.unaligned_flat<T>().data(),
-          has_zoneout ? zoneout_mask.SubSlice(i).unaligned_flat<T>().data() : nullptr);
+    if (dW_data)
+      SetZero<Device>(dW_data, dW->AllocatedBytes());
+    if (dR_data)
+      SetZero<Device>(dR_data, dR->AllocatedBytes());
+    SetZero<Device>(dbx->flat<T>().data(), dbx->AllocatedBytes());
+    SetZero<Device>(dbr->flat<T>().data(), dbr->AllocatedBytes());
+    SetZero<Device>(dh.flat<T>().data(), dh.AllocatedBytes());
+    SetZero<Device>(zero_vector.flat<T>().data(), zero_vector.AllocatedBytes());
+
+    // Regenerate the DropConnect-ed recurrent kernel that the forward op ran with.
+    Tensor dropped_recurrent_kernel;
+    OP_REQUIRES_OK(context, DropConnectRecurrentKernel<Device, T>(
+        context, recurrent_kernel, dropout_prob_, dropout_seed, &dropped_recurrent_kernel));
+
+    if (std::is_same<Device, CPUDevice>::value) {
+      cpu::gru::BackwardPass<T> backward = cpu::gru::BackwardPass<T>(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor(context));
+      IterateBackward(backward, input, kernel, dropped_recurrent_kernel, bias, recurrent_bias,
+          h_vector, v_vector, dh_new, zoneout_seed, dx_data, dW_data, dR_data, dbx, dbr, dh, dp, dq,
+          zero_vector);
+    } else {
+      BackwardPass<T> backward = BackwardPass<T>(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCublasHandle());
+      IterateBackward(backward, input, kernel, dropped_recurrent_kernel, bias, recurrent_bias,
+          h_vector, v_vector, dh_new, zoneout_seed, dx_data, dW_data, dR_data, dbx, dbr, dh, dp, dq,
+          zero_vector);
+    }
+
+    // The recurrent kernel gradient only flows through the elements that were kept.
+    if (dropout_prob_ && dR_data) {
+      DropConnect<Device, T>(
+          context,
+          dR->NumElements(),
+          dropout_prob_,
+          dropout_seed,
+          dR_data,
+          dR_data);
     }
   }
+
+  private:
+    // The GPU and CPU backward passes share the same `Iterate` contract.
+    template<typename BackwardPassT>
+    void IterateBackward(
+        BackwardPassT& backward,
+        const Tensor& input,
+        const Tensor& kernel,
+        const Tensor& recurrent_kernel,
+        const Tensor& bias,
+        const Tensor& recurrent_bias,
+        const Tensor& h_vector,
+        const Tensor& v_vector,
+        const Tensor& dh_new,
+        const int64 zoneout_seed,
+        T* dx,
+        T* dW,
+        T* dR,
+        Tensor* dbx,
+        Tensor* dbr,
+        Tensor& dh,
+        Tensor& dp,
+        Tensor& dq,
+        Tensor& zero_vector) {
+      const auto time_steps = input.shape().dim_size(0);
+      const auto NC = input.shape().dim_size(1) * input.shape().dim_size(2);
+
+      for (int64 i = time_steps - 1; i >= 0; --i) {
+        Tensor x = input.SubSlice(i);
+
+        // These are slices of cell outputs so we use (i - 1) to get the
+        // cell inputs (i.e., h_t is the output of the t'th LSTM cell
+        // which is also the input to the t+1'th cell).
+        Tensor h = i != 0 ? h_vector.SubSlice(i - 1) : zero_vector;
+        Tensor v = v_vector.SubSlice(i);
+
+        Tensor dh_new_cur = dh_new.SubSlice(i);
+        Tensor dp_cur = dp.SubSlice(i);
+        Tensor dq_cur = dq.SubSlice(i);
+
+        backward.Iterate(
+            kernel.flat<T>().data(),
+            recurrent_kernel.flat<T>().data(),
+            bias.flat<T>().data(),
+            recurrent_bias.flat<T>().data(),
+            x.unaligned_flat<T>().data(),
+            h.unaligned_flat<T>().data(),
+            v.unaligned_flat<T>().data(),
+            dh_new_cur.unaligned_flat<T>().data(),
+            dx ? dx + i * NC : nullptr,
+            dW,
+            dR,
+            dbx->flat<T>().data(),
+            dbr->flat<T>().data(),
+            dh.flat<T>().data(),
+            dp_cur.unaligned_flat<T>().data(),
+            dq_cur.unaligned_flat<T>().data(),
+            zoneout_prob_,
+            zoneout_seed + i);
+      }
+    }
+
+    float zoneout_prob_;
+    float dropout_prob_;
+    std::vector<bool> needs_grad_;
 };
 
 REGISTER_GPU_KERNEL(HasteGruGrad, float);
 REGISTER_GPU_KERNEL(HasteGruGrad, double);
+REGISTER_CPU_KERNEL(HasteGruGrad, float);
+REGISTER_CPU_KERNEL(HasteGruGrad, double);
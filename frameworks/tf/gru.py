@@ -48,6 +48,16 @@ def transpose(tensor_or_tuple, perm):
   return tf.transpose(tensor_or_tuple, perm)
 
 
+def needs_gradients(op, count):
+  """
+  Returns whether each of the first `count` inputs of `op` needs a gradient. Eager
+  gradient tapes tell the gradient function which inputs they can skip; graphs always
+  compute every gradient.
+  """
+  skip_input_indices = getattr(op, 'skip_input_indices', None) or ()
+  return [i not in skip_input_indices for i in range(count)]
+
+
 @tf.RegisterGradient("HasteGru")
 def gru_gradient(op, *grads):
   training = op.get_attr('training')
@@ -61,19 +71,29 @@ def gru_gradient(op, *grads):
   R = op.inputs[2]
   bx = op.inputs[3]
   br = op.inputs[4]
-  zoneout_mask = op.inputs[5]
+  zoneout_seed = op.inputs[5]
+  dropout_seed = op.inputs[6]
   h = op.outputs[0]
   v = op.outputs[1]
 
-  # Pre-transpose matrices for better performance.
-  x = tf.transpose(x, [0, 2, 1])
-  W = tf.transpose(W, [1, 0])
-  R = tf.transpose(R, [1, 0])
-  h = tf.transpose(h, [0, 2, 1])
-
-  dx, dW, dR, dbx, dbr = LIB.haste_gru_grad(x, W, R, bx, br, h, v, grads[0], zoneout_mask)
-
-  return [dx, dW, dR, dbx, dbr, None]
+  needs_grad = needs_gradients(op, 3)
+  dx, dW, dR, dbx, dbr = LIB.haste_gru_grad(
+      x,
+      W,
+      R,
+      bx,
+      br,
+      h,
+      v,
+      grads[0],
+      zoneout_seed,
+      dropout_seed,
+      zoneout_prob=op.get_attr('zoneout_prob'),
+      dropout_prob=op.get_attr('dropout_prob'),
+      needs_grad=needs_grad)
+
+  dx, dW, dR = [grad if needed else None for grad, needed in zip((dx, dW, dR), needs_grad)]
+  return [dx, dW, dR, dbx, dbr, None, None]
 
 
 class GRULayer(tf.Module):
@@ -96,7 +116,10 @@ class GRULayer(tf.Module):
 
     self.dropout = dropout
     self.zoneout = zoneout
-    self.dtype = dtype or tf.float32
+    self.dtype = tf.as_dtype(dtype or tf.float32)
+    if self.dtype not in (tf.float32, tf.float64):
+      raise ValueError(('GRU: dtype must be tf.float32 or tf.float64, got {}. The Haste '
+                        'TensorFlow ops have no float16 or bfloat16 kernels.').format(self.dtype.name))
     self.kernel = None
     self.recurrent_kernel = None
     self.bias = None
@@ -144,25 +167,32 @@ class GRULayer(tf.Module):
     time_steps = shape[0]
     batch_size = shape[1]
 
-    # Use an empty zoneout mask if no zoneout is going to be applied.
-    # Sadly, we can't pass `None` to the op but at least we won't be wasting
-    # memory or bandwidth on this tensor.
-    zoneout_mask = tf.zeros([0, 0, 0], dtype=self.dtype)
-    if self.zoneout:
-      zoneout_mask = 1.0 - self.zoneout
-      zoneout_mask += tf.random_uniform([time_steps, batch_size, self.num_units], dtype=self.dtype)
-      zoneout_mask = tf.floor(zoneout_mask)
+    # The op regenerates the zoneout masks from this seed instead of storing them,
+    # so only a scalar is saved for the gradient. The seed is ignored if no zoneout
+    # is going to be applied.
+    zoneout_seed = tf.zeros([], dtype=tf.int64)
+    if self.zoneout and training:
+      zoneout_seed = tf.random_uniform([], maxval=2**62, dtype=tf.int64)
+
+    # DropConnect is applied to the recurrent kernel inside the op, and its mask is
+    # regenerated from this seed in the gradient op, so no masked copy of the kernel
+    # is kept. DropConnect is only applied in training mode.
+    dropout = self.dropout if training else 0.0
+    dropout_seed = tf.zeros([], dtype=tf.int64)
+    if dropout:
+      dropout_seed = tf.random_uniform([], maxval=2**62, dtype=tf.int64)
 
-    recurrent_kernel = tf.nn.dropout(self.recurrent_kernel, rate=self.dropout)
     result, _ = LIB.haste_gru(
         inputs,
         self.kernel,
-        recurrent_kernel,
+        self.recurrent_kernel,
         self.bias,
         self.recurrent_bias,
-        zoneout_mask,
+        zoneout_seed,
+        dropout_seed,
         training=training,
-        zoneout_prob=self.zoneout)
+        zoneout_prob=self.zoneout,
+        dropout_prob=dropout)
 
     if sequence_length is not None:
       # 0-indexed tensors, so length-1.
@@ -211,7 +241,8 @@ class GRU(tf.Module):
         regularization on the recurrent matrix. Defaults to 0.
       zoneout: (optional) float, sets the zoneout rate for Zoneout
         regularization. Defaults to 0.
-      dtype: (optional) the data type for this layer. Defaults to `tf.float32`.
+      dtype: (optional) the data type for this layer, `tf.float32` or
+        `tf.float64`. Defaults to `tf.float32`. 16-bit types aren't supported.
       name: (optional) string, the name for this layer.
     """
     assert direction in ['unidirectional', 'bidirectional']
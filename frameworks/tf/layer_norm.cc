@@ -23,6 +23,8 @@
 
 using namespace tensorflow;
 
+namespace cpu = haste::v0::cpu;
+
 using haste::v0::layer_norm::ForwardPass;
 using haste::v0::layer_norm::BackwardPass;
 using tensorflow::se::Stream;
@@ -51,7 +53,7 @@ REGISTER_OP("HasteLayerNorm")
       return Status::OK();
     });
 
-template<typename T>
+template<typename Device, typename T>
 struct HasteLayerNormOp : public OpKernel {
   explicit HasteLayerNormOp(OpKernelConstruction* context) : OpKernel(context) {}
 
@@ -69,19 +71,33 @@ struct HasteLayerNormOp : public OpKernel {
     Tensor* cache = nullptr;
     OP_REQUIRES_OK(context, context->allocate_output(1, { batch_size, 2 }, &cache));
 
-    ForwardPass<T> forward(
-        batch_size,
-        hidden_size,
-        gamma.flat<T>().data(),
-        beta.shape().dim_size(0) ? beta.flat<T>().data() : nullptr,
-        cache->flat<T>().data());
-
-    forward.Run(GetCudaStream(context), x.flat<T>().data(), y->flat<T>().data());
+    if (std::is_same<Device, CPUDevice>::value) {
+      cpu::layer_norm::ForwardPass<T> forward(
+          batch_size,
+          hidden_size,
+          gamma.flat<T>().data(),
+          beta.shape().dim_size(0) ? beta.flat<T>().data() : nullptr,
+          cache->flat<T>().data(),
+          GetCpuParallelFor(context));
+
+      forward.Run(x.flat<T>().data(), y->flat<T>().data());
+    } else {
+      ForwardPass<T> forward(
+          batch_size,
+          hidden_size,
+          gamma.flat<T>().data(),
+          beta.shape().dim_size(0) ? beta.flat<T>().data() : nullptr,
+          cache->flat<T>().data());
+
+      forward.Run(GetCudaStream(context), x.flat<T>().data(), y->flat<T>().data());
+    }
   }
 };
 
 REGISTER_GPU_KERNEL(HasteLayerNorm, float);
 REGISTER_GPU_KERNEL(HasteLayerNorm, double);
+REGISTER_CPU_KERNEL(HasteLayerNorm, float);
+REGISTER_CPU_KERNEL(HasteLayerNorm, double);
 
 REGISTER_OP("HasteLayerNormGrad")
     .Attr("R: {float, double}")
@@ -112,7 +128,7 @@ REGISTER_OP("HasteLayerNormGrad")
       return Status::OK();
     });
 
-template<typename T>
+template<typename Device, typename T>
 struct HasteLayerNormGradOp : public OpKernel {
   explicit HasteLayerNormGradOp(OpKernelConstruction* context) : OpKernel(context) {}
 
@@ -137,22 +153,39 @@ struct HasteLayerNormGradOp : public OpKernel {
     Tensor* dbeta = nullptr;
     OP_REQUIRES_OK(context, context->allocate_output(2, beta.shape(), &dbeta));
 
-    cudaMemset(dgamma->flat<T>().data(), 0, dgamma->AllocatedBytes());
-    cudaMemset(dbeta->flat<T>().data(), 0, dbeta->AllocatedBytes());
-
-    BackwardPass<T> backward(
-        batch_size,
-        hidden_size,
-        gamma.flat<T>().data(),
-        beta.shape().dim_size(0) ? beta.flat<T>().data() : nullptr,
-        x.flat<T>().data(),
-        dgamma->flat<T>().data(),
-        beta.shape().dim_size(0) ? dbeta->flat<T>().data() : nullptr,
-        const_cast<T*>(cache.flat<T>().data()));
-
-    backward.Run(GetCudaStream(context), dy.flat<T>().data(), dx->flat<T>().data());
+    SetZero<Device>(dgamma->flat<T>().data(), dgamma->AllocatedBytes());
+    SetZero<Device>(dbeta->flat<T>().data(), dbeta->AllocatedBytes());
+
+    if (std::is_same<Device, CPUDevice>::value) {
+      cpu::layer_norm::BackwardPass<T> backward(
+          batch_size,
+          hidden_size,
+          gamma.flat<T>().data(),
+          beta.shape().dim_size(0) ? beta.flat<T>().data() : nullptr,
+          x.flat<T>().data(),
+          dgamma->flat<T>().data(),
+          beta.shape().dim_size(0) ? dbeta->flat<T>().data() : nullptr,
+          const_cast<T*>(cache.flat<T>().data()),
+          GetCpuParallelFor(context));
+
+      backward.Run(dy.flat<T>().data(), dx->flat<T>().data());
+    } else {
+      BackwardPass<T> backward(
+          batch_size,
+          hidden_size,
+          gamma.flat<T>().data(),
+          beta.shape().dim_size(0) ? beta.flat<T>().data() : nullptr,
+          x.flat<T>().data(),
+          dgamma->flat<T>().data(),
+          beta.shape().dim_size(0) ? dbeta->flat<T>().data() : nullptr,
+          const_cast<T*>(cache.flat<T>().data()));
+
+      backward.Run(GetCudaStream(context), dy.flat<T>().data(), dx->flat<T>().data());
+    }
   }
 };
 
 REGISTER_GPU_KERNEL(HasteLayerNormGrad, float);
 REGISTER_GPU_KERNEL(HasteLayerNormGrad, double);
+REGISTER_CPU_KERNEL(HasteLayerNormGrad, float);
+REGISTER_CPU_KERNEL(HasteLayerNormGrad, double);
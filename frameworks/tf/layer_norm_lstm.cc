@@ -14,6 +14,7 @@
 // ==============================================================================
 
 #include <cuda_runtime_api.h>
+#include <vector>
 
 #include "arena.h"
 #include "haste.h"
@@ -31,6 +32,7 @@ using tensorflow::shape_inference::DimensionHandle;
 using tensorflow::shape_inference::InferenceContext;
 using tensorflow::shape_inference::ShapeHandle;
 
+namespace cpu = haste::v0::cpu;
 namespace layer_norm = haste::v0::layer_norm;
 namespace layer_norm_lstm = haste::v0::layer_norm_lstm;
 
@@ -39,6 +41,7 @@ REGISTER_OP("HasteLayerNormLstm")
     .Attr("R: {float, double}")         // Some real number type.
     .Attr("training: bool")
     .Attr("zoneout_prob: float")
+    .Attr("dropout_prob: float")
     .Input("x: R")                      // [T,N,C]
     .Input("kernel: R")                 // [C,H*4]
     .Input("recurrent_kernel: R")       // [H,H*4]
@@ -46,7 +49,8 @@ REGISTER_OP("HasteLayerNormLstm")
     .Input("gamma: R")
     .Input("gamma_h: R")
     .Input("beta_h: R")
-    .Input("zoneout_mask: R")           // [T,N,H]
+    .Input("zoneout_seed: int64")       // []
+    .Input("dropout_seed: int64")       // []
     .Output("h: R")                     // [T,N,H]
     .Output("c: R")                     // [T,N,H]
     .Output("cache: R")                 // [?] (activations cache)
@@ -58,7 +62,8 @@ REGISTER_OP("HasteLayerNormLstm")
       ShapeHandle gamma_shape;
       ShapeHandle gamma_h_shape;
       ShapeHandle beta_h_shape;
-      ShapeHandle zoneout_mask_shape;
+      ShapeHandle zoneout_seed_shape;
+      ShapeHandle dropout_seed_shape;
 
       TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &input_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 2, &kernel_shape));
@@ -67,7 +72,8 @@ REGISTER_OP("HasteLayerNormLstm")
       TF_RETURN_IF_ERROR(c->WithRank(c->input(4), 2, &gamma_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(5), 1, &gamma_h_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(6), 1, &beta_h_shape));
-      TF_RETURN_IF_ERROR(c->WithRank(c->input(7), 3, &zoneout_mask_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(7), 0, &zoneout_seed_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(8), 0, &dropout_seed_shape));
 
       const DimensionHandle time_steps = c->Dim(input_shape, 0);
       const DimensionHandle batch_size = c->Dim(input_shape, 1);
@@ -82,16 +88,17 @@ REGISTER_OP("HasteLayerNormLstm")
       return Status::OK();
     });
 
-template<typename T>
+template<typename Device, typename T>
 struct HasteLayerNormLstmOp : public OpKernel {
   explicit HasteLayerNormLstmOp(OpKernelConstruction* context) : OpKernel(context) {
     OP_REQUIRES_OK(context, context->GetAttr("training", &training_));
     OP_REQUIRES_OK(context, context->GetAttr("zoneout_prob", &zoneout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("dropout_prob", &dropout_prob_));
   }
 
-  // When running on GPU, TF backs all inputs and outputs with device memory
-  // and not host memory. We don't need to do explicit memory copies or allocations
-  // for the inputs and outputs.
+  // TF backs all inputs and outputs with memory on the op's device (GPU or host),
+  // so we don't need to do explicit memory copies or allocations for the inputs
+  // and outputs.
   void Compute(OpKernelContext* context) override {
     const Tensor& input = context->input(0);
     const Tensor& kernel = context->input(1);
@@ -100,13 +107,13 @@ struct HasteLayerNormLstmOp : public OpKernel {
     const Tensor& gamma = context->input(4);
     const Tensor& gamma_h = context->input(5);
     const Tensor& beta_h = context->input(6);
-    const Tensor& zoneout_mask = context->input(7);
+    const int64 zoneout_seed = context->input(7).scalar<int64>()();
+    const int64 dropout_seed = context->input(8).scalar<int64>()();
 
     const auto time_steps = input.shape().dim_size(0);
     const auto batch_size = input.shape().dim_size(1);
     const auto input_size = input.shape().dim_size(2);
     const auto hidden_size = recurrent_kernel.shape().dim_size(0);
-    const bool has_zoneout = zoneout_prob_ && zoneout_mask.NumElements();
     const auto data_type = DataTypeToEnum<T>::value;
 
     OP_REQUIRES(context, input_size == kernel.shape().dim_size(0),
@@ -149,70 +156,142 @@ struct HasteLayerNormLstmOp : public OpKernel {
     const TensorShape tmp_Rh_shape = { batch_size, 4 * hidden_size };
     OP_REQUIRES_OK(context, context->allocate_temp(data_type, tmp_Rh_shape, &tmp_Rh));
 
-    cudaMemset(output->flat<T>().data(), 0, output->AllocatedBytes());
-    cudaMemset(output_cell_state->flat<T>().data(), 0, output_cell_state->AllocatedBytes());
-
-    layer_norm::ForwardPass<T> layer_norm1(
-        time_steps * batch_size,
-        hidden_size * 4,
-        gamma.SubSlice(0).unaligned_flat<T>().data(),
-        nullptr,
-        act_Wx_norm_cache.data());
-
-    layer_norm::ForwardPass<T> layer_norm2(
-        time_steps * batch_size,
-        hidden_size * 4,
-        gamma.SubSlice(1).unaligned_flat<T>().data(),
-        nullptr,
-        act_Rh_norm_cache.data());
-
-    layer_norm::ForwardPass<T> layer_norm3(
-        time_steps * batch_size,
-        hidden_size,
-        gamma_h.flat<T>().data(),
-        beta_h.flat<T>().data(),
-        act_c_norm_cache.data());
-
-    layer_norm_lstm::ForwardPass<T> lstm(
-        training_,
-        batch_size,
-        input_size,
-        hidden_size,
-        GetCublasHandle());
-
-    lstm.Run(
-        time_steps,
-        kernel.flat<T>().data(),
-        recurrent_kernel.flat<T>().data(),
-        bias.flat<T>().data(),
-        input.flat<T>().data(),
-        output->flat<T>().data(),
-        output_cell_state->flat<T>().data(),
-        act_Wx.data(),
-        tmp_Rh.flat<T>().data(),
-        layer_norm1,
-        act_Wx_norm.data(),
-        act_Rh.data(),
-        layer_norm2,
-        layer_norm3,
-        act_c_norm.data(),
-        has_zoneout ? zoneout_prob_ : 0.0f,
-        has_zoneout ? zoneout_mask.flat<T>().data() : nullptr);
+    SetZero<Device>(output->flat<T>().data(), output->AllocatedBytes());
+    SetZero<Device>(output_cell_state->flat<T>().data(), output_cell_state->AllocatedBytes());
+
+    if (std::is_same<Device, CPUDevice>::value) {
+      cpu::layer_norm::ForwardPass<T> layer_norm1(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma.SubSlice(0).unaligned_flat<T>().data(),
+          nullptr,
+          act_Wx_norm_cache.data(),
+          GetCpuParallelFor(context));
+
+      cpu::layer_norm::ForwardPass<T> layer_norm2(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma.SubSlice(1).unaligned_flat<T>().data(),
+          nullptr,
+          act_Rh_norm_cache.data(),
+          GetCpuParallelFor(context));
+
+      cpu::layer_norm::ForwardPass<T> layer_norm3(
+          time_steps * batch_size,
+          hidden_size,
+          gamma_h.flat<T>().data(),
+          beta_h.flat<T>().data(),
+          act_c_norm_cache.data(),
+          GetCpuParallelFor(context));
+
+      cpu::layer_norm_lstm::ForwardPass<T> lstm(
+          training_,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor(context));
+
+      // DropConnect is applied as the recurrent kernel is packed. The gradient op
+      // regenerates the same mask from `dropout_seed`, so nothing is kept between the two.
+      Tensor packed_recurrent_kernel;
+      const void* packed_R;
+      OP_REQUIRES_OK(context, PackDroppedRecurrentKernel<T>(
+          context, lstm, recurrent_kernel, dropout_prob_, dropout_seed, &packed_recurrent_kernel, &packed_R));
+
+      lstm.Run(
+          time_steps,
+          kernel.flat<T>().data(),
+          recurrent_kernel.flat<T>().data(),
+          bias.flat<T>().data(),
+          input.flat<T>().data(),
+          output->flat<T>().data(),
+          output_cell_state->flat<T>().data(),
+          act_Wx.data(),
+          tmp_Rh.flat<T>().data(),
+          layer_norm1,
+          act_Wx_norm.data(),
+          act_Rh.data(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm.data(),
+          zoneout_prob_,
+          zoneout_seed,
+          nullptr,
+          false,
+          packed_R);
+    } else {
+      layer_norm::ForwardPass<T> layer_norm1(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma.SubSlice(0).unaligned_flat<T>().data(),
+          nullptr,
+          act_Wx_norm_cache.data());
+
+      layer_norm::ForwardPass<T> layer_norm2(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma.SubSlice(1).unaligned_flat<T>().data(),
+          nullptr,
+          act_Rh_norm_cache.data());
+
+      layer_norm::ForwardPass<T> layer_norm3(
+          time_steps * batch_size,
+          hidden_size,
+          gamma_h.flat<T>().data(),
+          beta_h.flat<T>().data(),
+          act_c_norm_cache.data());
+
+      layer_norm_lstm::ForwardPass<T> lstm(
+          training_,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCublasHandle());
+
+      Tensor dropped_recurrent_kernel;
+      OP_REQUIRES_OK(context, DropConnectRecurrentKernel<Device, T>(
+          context, recurrent_kernel, dropout_prob_, dropout_seed, &dropped_recurrent_kernel));
+
+      lstm.Run(
+          time_steps,
+          kernel.flat<T>().data(),
+          dropped_recurrent_kernel.flat<T>().data(),
+          bias.flat<T>().data(),
+          input.flat<T>().data(),
+          output->flat<T>().data(),
+          output_cell_state->flat<T>().data(),
+          act_Wx.data(),
+          tmp_Rh.flat<T>().data(),
+          layer_norm1,
+          act_Wx_norm.data(),
+          act_Rh.data(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm.data(),
+          zoneout_prob_,
+          zoneout_seed);
+    }
   }
 
   private:
     bool training_;
     float zoneout_prob_;
+    float dropout_prob_;
 };
 
 REGISTER_GPU_KERNEL(HasteLayerNormLstm, float);
 REGISTER_GPU_KERNEL(HasteLayerNormLstm, double);
+REGISTER_CPU_KERNEL(HasteLayerNormLstm, float);
+REGISTER_CPU_KERNEL(HasteLayerNormLstm, double);
 
 REGISTER_OP("HasteLayerNormLstmGrad")
     .Attr("R: {float, double}")
-    .Input("x_t: R")                   // [C,N,T]
-    .Input("kernel_t: R")              // [H*4,C]
-    .Input("recurrent_kernel_t: R")    // [H*4,H]
+    .Attr("zoneout_prob: float")
+    .Attr("dropout_prob: float")
+    .Attr("needs_grad: list(bool) = [true, true, true]")  // [dx, dw, dr]
+    .Input("x: R")                     // [T,N,C]
+    .Input("kernel: R")                // [C,H*4]
+    .Input("recurrent_kernel: R")      // [H,H*4]
     .Input("bias: R")                  // [H*4]
     .Input("gamma: R")
     .Input("gamma_h: R")
@@ -222,10 +301,11 @@ REGISTER_OP("HasteLayerNormLstmGrad")
     .Input("cache: R")
     .Input("dh_new: R")                // [T,N,H]
     .Input("dc_new: R")                // [T,N,H]
-    .Input("zoneout_mask: R")          // [T,N,H]
-    .Output("dx: R")                   // [T,N,C]
-    .Output("dw: R")                   // [C,H*4]
-    .Output("dr: R")                   // [H,H*4]
+    .Input("zoneout_seed: int64")      // []
+    .Input("dropout_seed: int64")      // []
+    .Output("dx: R")                   // [T,N,C] or [0]
+    .Output("dw: R")                   // [C,H*4] or [0]
+    .Output("dr: R")                   // [H,H*4] or [0]
     .Output("db: R")                   // [H*4]
     .Output("dgamma: R")
     .Output("dgamma_h: R")
@@ -243,7 +323,8 @@ REGISTER_OP("HasteLayerNormLstmGrad")
       ShapeHandle cache_shape;
       ShapeHandle dh_new_shape;
       ShapeHandle dc_new_shape;
-      ShapeHandle zoneout_mask_shape;
+      ShapeHandle zoneout_seed_shape;
+      ShapeHandle dropout_seed_shape;
 
       TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &x_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 2, &kernel_shape));
@@ -257,19 +338,26 @@ REGISTER_OP("HasteLayerNormLstmGrad")
       TF_RETURN_IF_ERROR(c->WithRank(c->input(9), 1, &cache_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(10), 3, &dh_new_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(11), 3, &dc_new_shape));
-      TF_RETURN_IF_ERROR(c->WithRank(c->input(12), 3, &zoneout_mask_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(12), 0, &zoneout_seed_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(13), 0, &dropout_seed_shape));
 
-      DimensionHandle input_size = c->Dim(x_shape, 0);
-      DimensionHandle time_steps = c->Dim(x_shape, 1);
-      DimensionHandle batch_size = c->Dim(x_shape, 2);
-      DimensionHandle hidden_size = c->Dim(recurrent_kernel_shape, 1);
+      DimensionHandle time_steps = c->Dim(x_shape, 0);
+      DimensionHandle batch_size = c->Dim(x_shape, 1);
+      DimensionHandle input_size = c->Dim(x_shape, 2);
+      DimensionHandle hidden_size = c->Dim(recurrent_kernel_shape, 0);
       DimensionHandle hidden_size_4;
 
       TF_RETURN_IF_ERROR(c->Multiply(hidden_size, 4, &hidden_size_4));
 
-      c->set_output(0, c->MakeShape({ time_steps, batch_size, input_size }));
-      c->set_output(1, c->MakeShape({ input_size, hidden_size_4 }));
-      c->set_output(2, c->MakeShape({ hidden_size, hidden_size_4 }));
+      std::vector<bool> needs_grad;
+      TF_RETURN_IF_ERROR(c->GetAttr("needs_grad", &needs_grad));
+      if (needs_grad.size() != 3)
+        return errors::InvalidArgument("needs_grad must have 3 entries");
+
+      // Gradients that aren't needed are returned as empty tensors.
+      c->set_output(0, needs_grad[0] ? c->MakeShape({ time_steps, batch_size, input_size }) : c->MakeShape({ 0 }));
+      c->set_output(1, needs_grad[1] ? c->MakeShape({ input_size, hidden_size_4 }) : c->MakeShape({ 0 }));
+      c->set_output(2, needs_grad[2] ? c->MakeShape({ hidden_size, hidden_size_4 }) : c->MakeShape({ 0 }));
       c->set_output(3, bias_shape);
       c->set_output(4, gamma_shape);
       c->set_output(5, gamma_h_shape);
@@ -277,9 +365,15 @@ REGISTER_OP("HasteLayerNormLstmGrad")
       return Status::OK();
     });
 
-template<typename T>
+template<typename Device, typename T>
 struct HasteLayerNormLstmGradOp : public OpKernel {
-  explicit HasteLayerNormLstmGradOp(OpKernelConstruction* context) : OpKernel(context) {}
+  explicit HasteLayerNormLstmGradOp(OpKernelConstruction* context) : OpKernel(context) {
+    OP_REQUIRES_OK(context, context->GetAttr("zoneout_prob", &zoneout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("dropout_prob", &dropout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("needs_grad", &needs_grad_));
+    OP_REQUIRES(context, needs_grad_.size() == 3,
+        errors::InvalidArgument("needs_grad must have 3 entries"));
+  }
 
   void Compute(OpKernelContext* context) override {
     const Tensor& input = context->input(0);
@@ -294,29 +388,36 @@ struct HasteLayerNormLstmGradOp : public OpKernel {
     const Tensor& cache_input = context->input(9);
     const Tensor& dh_new = context->input(10);
     const Tensor& dc_new = context->input(11);
-    const Tensor& zoneout_mask = context->input(12);
+    const int64 zoneout_seed = context->input(12).scalar<int64>()();
+    const int64 dropout_seed = context->input(13).scalar<int64>()();
 
-    const auto input_size = input.shape().dim_size(0);
-    const auto time_steps = input.shape().dim_size(1);
-    const auto batch_size = input.shape().dim_size(2);
-    const auto hidden_size = recurrent_kernel.shape().dim_size(1);
-    const bool has_zoneout = !!zoneout_mask.NumElements();
+    const auto time_steps = input.shape().dim_size(0);
+    const auto batch_size = input.shape().dim_size(1);
+    const auto input_size = input.shape().dim_size(2);
+    const auto hidden_size = recurrent_kernel.shape().dim_size(0);
     const auto data_type = DataTypeToEnum<T>::value;
 
+    // Gradients that aren't needed are returned as empty tensors and passed to the
+    // backward pass as nullptr, which skips the matrix multiplications that compute them.
+    const TensorShape empty_shape = { 0 };
+
     // Can be uninitialized. Output only, no accumulation.
     const TensorShape dx_shape = { time_steps, batch_size, input_size };
     Tensor* dx = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(0, dx_shape, &dx));
+    OP_REQUIRES_OK(context, context->allocate_output(0, needs_grad_[0] ? dx_shape : empty_shape, &dx));
+    T* dx_data = needs_grad_[0] ? dx->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape dW_shape = { input_size, hidden_size * 4 };
     Tensor* dW = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(1, dW_shape, &dW));
+    OP_REQUIRES_OK(context, context->allocate_output(1, needs_grad_[1] ? dW_shape : empty_shape, &dW));
+    T* dW_data = needs_grad_[1] ? dW->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape dR_shape = { hidden_size, hidden_size * 4 };
     Tensor* dR = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(2, dR_shape, &dR));
+    OP_REQUIRES_OK(context, context->allocate_output(2, needs_grad_[2] ? dR_shape : empty_shape, &dR));
+    T* dR_data = needs_grad_[2] ? dR->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape db_shape = { hidden_size * 4 };
@@ -368,77 +469,175 @@ struct HasteLayerNormLstmGradOp : public OpKernel {
     TensorView<T> act_c_norm = memory["act_c_norm"];
     TensorView<T> act_c_norm_cache = memory["act_c_norm_cache"];
 
-    cudaMemset(dW->flat<T>().data(), 0, dW->AllocatedBytes());
-    cudaMemset(dR->flat<T>().data(), 0, dR->AllocatedBytes());
-    cudaMemset(db->flat<T>().data(), 0, db->AllocatedBytes());
-    cudaMemset(dgamma->flat<T>().data(), 0, dgamma->AllocatedBytes());
-    cudaMemset(dgamma_h->flat<T>().data(), 0, dgamma_h->AllocatedBytes());
-    cudaMemset(dbeta_h->flat<T>().data(), 0, dbeta_h->AllocatedBytes());
-    cudaMemset(dh.flat<T>().data(), 0, dh.AllocatedBytes());
-    cudaMemset(dc.flat<T>().data(), 0, dc.AllocatedBytes());
-
-    layer_norm::BackwardPass<T> layer_norm1(
-        time_steps * batch_size,
-        hidden_size * 4,
-        gamma.SubSlice(0).unaligned_flat<T>().data(),
-        nullptr,
-        act_Wx.data(),
-        dgamma->SubSlice(0).unaligned_flat<T>().data(),
-        nullptr,
-        act_Wx_norm_cache.data());
-
-    layer_norm::BackwardPass<T> layer_norm2(
-        time_steps * batch_size,
-        hidden_size * 4,
-        gamma.SubSlice(1).unaligned_flat<T>().data(),
-        nullptr,
-        act_Rh.data(),
-        dgamma->SubSlice(1).unaligned_flat<T>().data(),
-        nullptr,
-        act_Rh_norm_cache.data());
-
-    layer_norm::BackwardPass<T> layer_norm3(
-        time_steps * batch_size,
-        hidden_size,
-        gamma_h.flat<T>().data(),
-        beta_h.flat<T>().data(),
-        c_vector.SubSlice(1).unaligned_flat<T>().data(),
-        dgamma_h->flat<T>().data(),
-        dbeta_h->flat<T>().data(),
-        act_c_norm_cache.data());
-
-    layer_norm_lstm::BackwardPass<T> lstm(
-        batch_size,
-        input_size,
-        hidden_size,
-        GetCublasHandle());
-
-    lstm.Run(
-        time_steps,
-        kernel.flat<T>().data(),
-        recurrent_kernel.flat<T>().data(),
-        bias.flat<T>().data(),
-        input.flat<T>().data(),
-        h_vector.flat<T>().data(),
-        c_vector.flat<T>().data(),
-        dh_new.flat<T>().data(),
-        dc_new.flat<T>().data(),
-        dx->flat<T>().data(),
-        dW->flat<T>().data(),
-        dR->flat<T>().data(),
-        db->flat<T>().data(),
-        dh.flat<T>().data(),
-        dc.flat<T>().data(),
-        act_Wx.data(),
-        layer_norm1,
-        act_Wx_norm.data(),
-        act_Rh.data(),
-        layer_norm2,
-        layer_norm3,
-        act_c_norm.data(),
-        has_zoneout ? zoneout_mask.flat<T>().data() : nullptr);
+    if (dW_data)
+      SetZero<Device>(dW_data, dW->AllocatedBytes());
+    if (dR_data)
+      SetZero<Device>(dR_data, dR->AllocatedBytes());
+    SetZero<Device>(db->flat<T>().data(), db->AllocatedBytes());
+    SetZero<Device>(dgamma->flat<T>().data(), dgamma->AllocatedBytes());
+    SetZero<Device>(dgamma_h->flat<T>().data(), dgamma_h->AllocatedBytes());
+    SetZero<Device>(dbeta_h->flat<T>().data(), dbeta_h->AllocatedBytes());
+    SetZero<Device>(dh.flat<T>().data(), dh.AllocatedBytes());
+    SetZero<Device>(dc.flat<T>().data(), dc.AllocatedBytes());
+
+    if (std::is_same<Device, CPUDevice>::value) {
+      cpu::layer_norm::BackwardPass<T> layer_norm1(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma.SubSlice(0).unaligned_flat<T>().data(),
+          nullptr,
+          act_Wx.data(),
+          dgamma->SubSlice(0).unaligned_flat<T>().data(),
+          nullptr,
+          act_Wx_norm_cache.data(),
+          GetCpuParallelFor(context));
+
+      cpu::layer_norm::BackwardPass<T> layer_norm2(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma.SubSlice(1).unaligned_flat<T>().data(),
+          nullptr,
+          act_Rh.data(),
+          dgamma->SubSlice(1).unaligned_flat<T>().data(),
+          nullptr,
+          act_Rh_norm_cache.data(),
+          GetCpuParallelFor(context));
+
+      cpu::layer_norm::BackwardPass<T> layer_norm3(
+          time_steps * batch_size,
+          hidden_size,
+          gamma_h.flat<T>().data(),
+          beta_h.flat<T>().data(),
+          c_vector.SubSlice(1).unaligned_flat<T>().data(),
+          dgamma_h->flat<T>().data(),
+          dbeta_h->flat<T>().data(),
+          act_c_norm_cache.data(),
+          GetCpuParallelFor(context));
+
+      cpu::layer_norm_lstm::BackwardPass<T> lstm(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor(context));
+
+      lstm.Run(
+          time_steps,
+          kernel.flat<T>().data(),
+          recurrent_kernel.flat<T>().data(),
+          bias.flat<T>().data(),
+          input.flat<T>().data(),
+          h_vector.flat<T>().data(),
+          c_vector.flat<T>().data(),
+          dh_new.flat<T>().data(),
+          dc_new.flat<T>().data(),
+          dx_data,
+          dW_data,
+          dR_data,
+          db->flat<T>().data(),
+          dh.flat<T>().data(),
+          dc.flat<T>().data(),
+          act_Wx.data(),
+          layer_norm1,
+          act_Wx_norm.data(),
+          act_Rh.data(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm.data(),
+          zoneout_prob_,
+          zoneout_seed,
+          nullptr,
+          false,
+          dropout_prob_,
+          dropout_seed);
+    } else {
+      layer_norm::BackwardPass<T> layer_norm1(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma.SubSlice(0).unaligned_flat<T>().data(),
+          nullptr,
+          act_Wx.data(),
+          dgamma->SubSlice(0).unaligned_flat<T>().data(),
+          nullptr,
+          act_Wx_norm_cache.data());
+
+      layer_norm::BackwardPass<T> layer_norm2(
+          time_steps * batch_size,
+          hidden_size * 4,
+          gamma.SubSlice(1).unaligned_flat<T>().data(),
+          nullptr,
+          act_Rh.data(),
+          dgamma->SubSlice(1).unaligned_flat<T>().data(),
+          nullptr,
+          act_Rh_norm_cache.data());
+
+      layer_norm::BackwardPass<T> layer_norm3(
+          time_steps * batch_size,
+          hidden_size,
+          gamma_h.flat<T>().data(),
+          beta_h.flat<T>().data(),
+          c_vector.SubSlice(1).unaligned_flat<T>().data(),
+          dgamma_h->flat<T>().data(),
+          dbeta_h->flat<T>().data(),
+          act_c_norm_cache.data());
+
+      layer_norm_lstm::BackwardPass<T> lstm(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCublasHandle());
+
+      // Regenerate the DropConnect-ed recurrent kernel that the forward op ran with.
+      Tensor dropped_recurrent_kernel;
+      OP_REQUIRES_OK(context, DropConnectRecurrentKernel<Device, T>(
+          context, recurrent_kernel, dropout_prob_, dropout_seed, &dropped_recurrent_kernel));
+
+      lstm.Run(
+          time_steps,
+          kernel.flat<T>().data(),
+          dropped_recurrent_kernel.flat<T>().data(),
+          bias.flat<T>().data(),
+          input.flat<T>().data(),
+          h_vector.flat<T>().data(),
+          c_vector.flat<T>().data(),
+          dh_new.flat<T>().data(),
+          dc_new.flat<T>().data(),
+          dx_data,
+          dW_data,
+          dR_data,
+          db->flat<T>().data(),
+          dh.flat<T>().data(),
+          dc.flat<T>().data(),
+          act_Wx.data(),
+          layer_norm1,
+          act_Wx_norm.data(),
+          act_Rh.data(),
+          layer_norm2,
+          layer_norm3,
+          act_c_norm.data(),
+          zoneout_prob_,
+          zoneout_seed);
+
+      // The recurrent kernel gradient only flows through the elements that were kept. The
+      // CPU pass masks it as it's accumulated.
+      if (dropout_prob_ && dR_data) {
+        DropConnect<Device, T>(
+            context,
+            dR->NumElements(),
+            dropout_prob_,
+            dropout_seed,
+            dR_data,
+            dR_data);
+      }
+    }
   }
+
+  private:
+    float zoneout_prob_;
+    float dropout_prob_;
+    std::vector<bool> needs_grad_;
 };
 
 REGISTER_GPU_KERNEL(HasteLayerNormLstmGrad, float);
 REGISTER_GPU_KERNEL(HasteLayerNormLstmGrad, double);
+REGISTER_CPU_KERNEL(HasteLayerNormLstmGrad, float);
+REGISTER_CPU_KERNEL(HasteLayerNormLstmGrad, double);
@@ -49,6 +49,16 @@ def transpose(tensor_or_tuple, perm):
   return tf.transpose(tensor_or_tuple, perm)
 
 
+def needs_gradients(op, count):
+  """
+  Returns whether each of the first `count` inputs of `op` needs a gradient. Eager
+  gradient tapes tell the gradient function which inputs they can skip; graphs always
+  compute every gradient.
+  """
+  skip_input_indices = getattr(op, 'skip_input_indices', None) or ()
+  return [i not in skip_input_indices for i in range(count)]
+
+
 @tf.RegisterGradient("HasteLayerNormLstm")
 def lstm_gradient(op, *grads):
   training = op.get_attr('training')
@@ -64,16 +74,13 @@ def lstm_gradient(op, *grads):
   gamma = op.inputs[4]
   gamma_h = op.inputs[5]
   beta_h = op.inputs[6]
-  zoneout_mask = op.inputs[7]
+  zoneout_seed = op.inputs[7]
+  dropout_seed = op.inputs[8]
   h = op.outputs[0]
   c = op.outputs[1]
   cache = op.outputs[2]
 
-  # Pre-transpose matrices for better performance.
-  x = tf.transpose(x, [2, 0, 1])
-  W = tf.transpose(W, [1, 0])
-  R = tf.transpose(R, [1, 0])
-
+  needs_grad = needs_gradients(op, 3)
   dx, dW, dR, db, dgamma, dgamma_h, dbeta_h = LIB.haste_layer_norm_lstm_grad(
       x,
       W,
@@ -87,8 +94,13 @@ def lstm_gradient(op, *grads):
       cache,
       grads[0],
       grads[1],
-      zoneout_mask)
-  return [dx, dW, dR, db, dgamma, dgamma_h, dbeta_h, None]
+      zoneout_seed,
+      dropout_seed,
+      zoneout_prob=op.get_attr('zoneout_prob'),
+      dropout_prob=op.get_attr('dropout_prob'),
+      needs_grad=needs_grad)
+  dx, dW, dR = [grad if needed else None for grad, needed in zip((dx, dW, dR), needs_grad)]
+  return [dx, dW, dR, db, dgamma, dgamma_h, dbeta_h, None, None]
 
 
 class LayerNormLSTMLayer(tf.Module):
@@ -113,7 +125,10 @@ class LayerNormLSTMLayer(tf.Module):
     self.forget_bias = forget_bias
     self.dropout = dropout
     self.zoneout = zoneout
-    self.dtype = dtype or tf.float32
+    self.dtype = tf.as_dtype(dtype or tf.float32)
+    if self.dtype not in (tf.float32, tf.float64):
+      raise ValueError(('LayerNormLSTM: dtype must be tf.float32 or tf.float64, got {}. The Haste '
+                        'TensorFlow ops have no float16 or bfloat16 kernels.').format(self.dtype.name))
     self.kernel = None
     self.recurrent_kernel = None
     self.bias = None
@@ -171,27 +186,34 @@ class LayerNormLSTMLayer(tf.Module):
     time_steps = shape[0]
     batch_size = shape[1]
 
-    # Use an empty zoneout mask if no zoneout is going to be applied.
-    # Sadly, we can't pass `None` to the op but at least we won't be wasting
-    # memory or bandwidth on this tensor.
-    zoneout_mask = tf.zeros([0, 0, 0], dtype=self.dtype)
-    if self.zoneout:
-      zoneout_mask = 1.0 - self.zoneout
-      zoneout_mask += tf.random_uniform([time_steps, batch_size, self.num_units], dtype=self.dtype)
-      zoneout_mask = tf.floor(zoneout_mask)
+    # The op regenerates the zoneout masks from this seed instead of storing them,
+    # so only a scalar is saved for the gradient. The seed is ignored if no zoneout
+    # is going to be applied.
+    zoneout_seed = tf.zeros([], dtype=tf.int64)
+    if self.zoneout and training:
+      zoneout_seed = tf.random_uniform([], maxval=2**62, dtype=tf.int64)
+
+    # DropConnect is applied to the recurrent kernel inside the op, and its mask is
+    # regenerated from this seed in the gradient op, so no masked copy of the kernel
+    # is kept. DropConnect is only applied in training mode.
+    dropout = self.dropout if training else 0.0
+    dropout_seed = tf.zeros([], dtype=tf.int64)
+    if dropout:
+      dropout_seed = tf.random_uniform([], maxval=2**62, dtype=tf.int64)
 
-    recurrent_kernel = tf.nn.dropout(self.recurrent_kernel, rate=self.dropout)
     h, c, _ = LIB.haste_layer_norm_lstm(
         x,
         self.kernel,
-        recurrent_kernel,
+        self.recurrent_kernel,
         self.bias,
         self.gamma,
         self.gamma_h,
         self.beta_h,
-        zoneout_mask,
+        zoneout_seed,
+        dropout_seed,
         training=training,
-        zoneout_prob=self.zoneout)
+        zoneout_prob=self.zoneout,
+        dropout_prob=dropout)
 
     if sequence_length is not None:
       indices = sequence_length
@@ -240,7 +262,8 @@ class LayerNormLSTM(tf.Module):
         regularization on the recurrent matrix. Defaults to 0.
       zoneout: (optional) float, sets the zoneout rate for Zoneout
         regularization. Defaults to 0.
-      dtype: (optional) the data type for this layer. Defaults to `tf.float32`.
+      dtype: (optional) the data type for this layer, `tf.float32` or
+        `tf.float64`. Defaults to `tf.float32`. 16-bit types aren't supported.
       name: (optional) string, the name for this layer.
     """
     assert direction in ['unidirectional', 'bidirectional']
@@ -14,6 +14,7 @@
 // ==============================================================================
 
 #include <cuda_runtime_api.h>
+#include <vector>
 
 #include "haste.h"
 #include "support.h"
@@ -25,6 +26,8 @@
 
 using namespace tensorflow;
 
+namespace cpu = haste::v0::cpu;
+
 using haste::v0::lstm::ForwardPass;
 using haste::v0::lstm::BackwardPass;
 using tensorflow::se::Stream;
@@ -37,29 +40,44 @@ REGISTER_OP("HasteLstm")
     .Attr("R: {float, double}")         // Some real number type.
     .Attr("training: bool")
     .Attr("zoneout_prob: float")
+    .Attr("dropout_prob: float")
+    .Attr("reverse: bool = false")
+    .Attr("batch_first: bool = false")  // Swaps the leading T and N dimensions below.
     .Input("x: R")                      // [T,N,C]
     .Input("kernel: R")                 // [C,H*4]
     .Input("recurrent_kernel: R")       // [H,H*4]
     .Input("bias: R")                   // [H*4]
-    .Input("zoneout_mask: R")           // [T,N,H]
-    .Output("h: R")                     // [T,N,H]
-    .Output("c: R")                     // [T,N,H]
+    .Input("zoneout_seed: int64")       // []
+    .Input("dropout_seed: int64")       // []
+    .Input("batch_sizes: int32")        // [T] or [0]
+    .Input("sequence_length: int64")    // [N] or [0]
+    .Output("h: R")                     // [T+1,N,H]
+    .Output("c: R")                     // [T+1,N,H]
     .Output("v: R")                     // [T,N,H*4]
     .SetShapeFn([](InferenceContext* c) {
       ShapeHandle input_shape;
       ShapeHandle kernel_shape;
       ShapeHandle recurrent_shape;
       ShapeHandle bias_shape;
-      ShapeHandle zoneout_mask_shape;
+      ShapeHandle zoneout_seed_shape;
+      ShapeHandle dropout_seed_shape;
+      ShapeHandle batch_sizes_shape;
+      ShapeHandle sequence_length_shape;
 
       TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &input_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 2, &kernel_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(2), 2, &recurrent_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(3), 1, &bias_shape));
-      TF_RETURN_IF_ERROR(c->WithRank(c->input(4), 3, &zoneout_mask_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(4), 0, &zoneout_seed_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(5), 0, &dropout_seed_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(6), 1, &batch_sizes_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(7), 1, &sequence_length_shape));
+
+      bool batch_first;
+      TF_RETURN_IF_ERROR(c->GetAttr("batch_first", &batch_first));
 
-      const DimensionHandle time_steps = c->Dim(input_shape, 0);
-      const DimensionHandle batch_size = c->Dim(input_shape, 1);
+      const DimensionHandle time_steps = c->Dim(input_shape, batch_first ? 1 : 0);
+      const DimensionHandle batch_size = c->Dim(input_shape, batch_first ? 0 : 1);
       const DimensionHandle hidden_size = c->Dim(recurrent_shape, 0);
       DimensionHandle time_steps_plus_1;
       DimensionHandle hidden_size_4;
@@ -67,42 +85,63 @@ REGISTER_OP("HasteLstm")
       TF_RETURN_IF_ERROR(c->Add(time_steps, 1, &time_steps_plus_1));
       TF_RETURN_IF_ERROR(c->Multiply(hidden_size, 4, &hidden_size_4));
 
-      c->set_output(0, c->MakeShape({ time_steps_plus_1, batch_size, hidden_size }));
-      c->set_output(1, c->MakeShape({ time_steps_plus_1, batch_size, hidden_size }));
-      c->set_output(2, c->MakeShape({ time_steps, batch_size, hidden_size_4 }));
+      if (batch_first) {
+        c->set_output(0, c->MakeShape({ batch_size, time_steps_plus_1, hidden_size }));
+        c->set_output(1, c->MakeShape({ batch_size, time_steps_plus_1, hidden_size }));
+        c->set_output(2, c->MakeShape({ batch_size, time_steps, hidden_size_4 }));
+      } else {
+        c->set_output(0, c->MakeShape({ time_steps_plus_1, batch_size, hidden_size }));
+        c->set_output(1, c->MakeShape({ time_steps_plus_1, batch_size, hidden_size }));
+        c->set_output(2, c->MakeShape({ time_steps, batch_size, hidden_size_4 }));
+      }
       return Status::OK();
     });
 
-template<typename T>
+template<typename Device, typename T>
 struct HasteLstmOp : public OpKernel {
   explicit HasteLstmOp(OpKernelConstruction* context) : OpKernel(context) {
     OP_REQUIRES_OK(context, context->GetAttr("training", &training_));
     OP_REQUIRES_OK(context, context->GetAttr("zoneout_prob", &zoneout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("dropout_prob", &dropout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("reverse", &reverse_));
+    OP_REQUIRES_OK(context, context->GetAttr("batch_first", &batch_first_));
   }
 
-  // When running on GPU, TF backs all inputs and outputs with device memory
-  // and not host memory. We don't need to do explicit memory copies or allocations
-  // for the inputs and outputs.
+  // TF backs all inputs and outputs with memory on the op's device (GPU or host),
+  // so we don't need to do explicit memory copies or allocations for the inputs
+  // and outputs.
   void Compute(OpKernelContext* context) override {
     const Tensor& input = context->input(0);
     const Tensor& kernel = context->input(1);
     const Tensor& recurrent_kernel = context->input(2);
     const Tensor& bias = context->input(3);
-    const Tensor& zoneout_mask = context->input(4);
+    const int64 zoneout_seed = context->input(4).scalar<int64>()();
+    const int64 dropout_seed = context->input(5).scalar<int64>()();
+    const Tensor& batch_sizes = context->input(6);
+    const Tensor& sequence_length = context->input(7);
 
-    const auto time_steps = input.shape().dim_size(0);
-    const auto batch_size = input.shape().dim_size(1);
+    const auto time_steps = input.shape().dim_size(batch_first_ ? 1 : 0);
+    const auto batch_size = input.shape().dim_size(batch_first_ ? 0 : 1);
     const auto input_size = input.shape().dim_size(2);
     const auto hidden_size = recurrent_kernel.shape().dim_size(0);
-    const bool has_zoneout = zoneout_prob_ && zoneout_mask.NumElements();
     const auto data_type = DataTypeToEnum<T>::value;
 
     OP_REQUIRES(context, input_size == kernel.shape().dim_size(0),
         errors::InvalidArgument("input[2] and kernel[0] dimensions must match. Found ",
             input_size, " and ", kernel.shape().dim_size(0)));
-
-    const TensorShape output_shape = { time_steps + 1, batch_size, hidden_size };
-    const TensorShape activations_shape = { time_steps, batch_size, hidden_size * 4 };
+    OP_REQUIRES(context, !batch_sizes.NumElements() || batch_sizes.NumElements() == time_steps,
+        errors::InvalidArgument("batch_sizes must be empty or have one entry per time step. Found ",
+            batch_sizes.NumElements(), " entries for ", time_steps, " time steps"));
+    OP_REQUIRES(context, !sequence_length.NumElements() || sequence_length.NumElements() == batch_size,
+        errors::InvalidArgument("sequence_length must be empty or have one entry per batch entry. Found ",
+            sequence_length.NumElements(), " entries for a batch size of ", batch_size));
+
+    const TensorShape output_shape = batch_first_
+        ? TensorShape({ batch_size, time_steps + 1, hidden_size })
+        : TensorShape({ time_steps + 1, batch_size, hidden_size });
+    const TensorShape activations_shape = batch_first_
+        ? TensorShape({ batch_size, time_steps, hidden_size * 4 })
+        : TensorShape({ time_steps, batch_size, hidden_size * 4 });
 
     Tensor* output = nullptr;
     OP_REQUIRES_OK(context, context->allocate_output(0, output_shape, &output));
@@ -116,63 +155,150 @@ struct HasteLstmOp : public OpKernel {
       OP_REQUIRES_OK(context, context->allocate_output(2, activations_shape, &output_v));
     } else {
       // Return an empty tensor in inference mode and provide temp memory
-      // to the forward pass instead.
+      // to the forward pass instead. The CPU pass only needs one time step of it.
+      const TensorShape temp_shape = std::is_same<Device, CPUDevice>::value
+          ? TensorShape({ batch_size, hidden_size * 4 })
+          : activations_shape;
       OP_REQUIRES_OK(context, context->allocate_output(2, TensorShape({ 0 }), &output_v));
-      OP_REQUIRES_OK(context, context->allocate_temp(data_type, activations_shape, &output_v_temp));
+      OP_REQUIRES_OK(context, context->allocate_temp(data_type, temp_shape, &output_v_temp));
       output_v = &output_v_temp;
     }
 
     Tensor tmp_Rh;
     const TensorShape tmp_Rh_shape = { batch_size, 4 * hidden_size };
     OP_REQUIRES_OK(context, context->allocate_temp(data_type, tmp_Rh_shape, &tmp_Rh));
-    cudaMemset(output->flat<T>().data(), 0, output->AllocatedBytes());
-    cudaMemset(output_cell_state->flat<T>().data(), 0, output_cell_state->AllocatedBytes());
-
-    ForwardPass<T> forward = ForwardPass<T>(
-        training_,
-        batch_size,
-        input_size,
-        hidden_size,
-        GetCublasHandle());
-
-    forward.Run(
-        time_steps,
-        kernel.flat<T>().data(),
-        recurrent_kernel.flat<T>().data(),
-        bias.flat<T>().data(),
-        input.flat<T>().data(),
-        output->flat<T>().data(),
-        output_cell_state->flat<T>().data(),
-        output_v->flat<T>().data(),
-        tmp_Rh.flat<T>().data(),
-        has_zoneout ? zoneout_prob_ : 0.0f,
-        has_zoneout ? zoneout_mask.flat<T>().data() : nullptr);
+    SetZero<Device>(output->flat<T>().data(), output->AllocatedBytes());
+    SetZero<Device>(output_cell_state->flat<T>().data(), output_cell_state->AllocatedBytes());
+
+    if (std::is_same<Device, CPUDevice>::value) {
+      cpu::lstm::ForwardPass<T> forward = cpu::lstm::ForwardPass<T>(
+          training_,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor(context));
+
+      // DropConnect is applied as the recurrent kernel is packed. The gradient op
+      // regenerates the same mask from `dropout_seed`, so nothing is kept between the two.
+      Tensor packed_recurrent_kernel;
+      const void* packed_R;
+      OP_REQUIRES_OK(context, PackDroppedRecurrentKernel<T>(
+          context, forward, recurrent_kernel, dropout_prob_, dropout_seed, &packed_recurrent_kernel, &packed_R));
+
+      if (training_) {
+        forward.Run(
+            time_steps,
+            kernel.flat<T>().data(),
+            recurrent_kernel.flat<T>().data(),
+            bias.flat<T>().data(),
+            input.flat<T>().data(),
+            output->flat<T>().data(),
+            output_cell_state->flat<T>().data(),
+            output_v->flat<T>().data(),
+            tmp_Rh.flat<T>().data(),
+            zoneout_prob_,
+            zoneout_seed,
+            batch_sizes.NumElements() ? batch_sizes.flat<int>().data() : nullptr,
+            sequence_length.NumElements() ? sequence_length.flat<int64>().data() : nullptr,
+            reverse_,
+            batch_first_,
+            packed_R);
+      } else {
+        forward.RunInference(
+            time_steps,
+            kernel.flat<T>().data(),
+            recurrent_kernel.flat<T>().data(),
+            bias.flat<T>().data(),
+            input.flat<T>().data(),
+            output->flat<T>().data(),
+            output_cell_state->flat<T>().data(),
+            output_v->flat<T>().data(),
+            tmp_Rh.flat<T>().data(),
+            zoneout_prob_,
+            true,
+            true,
+            batch_sizes.NumElements() ? batch_sizes.flat<int>().data() : nullptr,
+            sequence_length.NumElements() ? sequence_length.flat<int64>().data() : nullptr,
+            reverse_,
+            batch_first_,
+            packed_R);
+      }
+    } else {
+      ForwardPass<T> forward = ForwardPass<T>(
+          training_,
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCublasHandle());
+
+      Tensor dropped_recurrent_kernel;
+      OP_REQUIRES_OK(context, DropConnectRecurrentKernel<Device, T>(
+          context, recurrent_kernel, dropout_prob_, dropout_seed, &dropped_recurrent_kernel));
+
+      forward.Run(
+          time_steps,
+          kernel.flat<T>().data(),
+          dropped_recurrent_kernel.flat<T>().data(),
+          bias.flat<T>().data(),
+          input.flat<T>().data(),
+          output->flat<T>().data(),
+          output_cell_state->flat<T>().data(),
+          output_v->flat<T>().data(),
+          tmp_Rh.flat<T>().data(),
+          zoneout_prob_,
+          zoneout_seed,
+          batch_sizes.NumElements() ? batch_sizes.flat<int>().data() : nullptr,
+          sequence_length.NumElements() ? sequence_length.flat<int64>().data() : nullptr,
+          reverse_,
+          batch_first_);
+    }
   }
 
   private:
     bool training_;
     float zoneout_prob_;
+    float dropout_prob_;
+    bool reverse_;
+    bool batch_first_;
 };
 
-REGISTER_GPU_KERNEL(HasteLstm, float);
-REGISTER_GPU_KERNEL(HasteLstm, double);
+// `batch_sizes` is read on the host while the kernels are being launched.
+#define REGISTER_LSTM_GPU_KERNEL(NAME, T)               \
+  REGISTER_KERNEL_BUILDER(Name(#NAME)                   \
+                            .Device(DEVICE_GPU)         \
+                            .TypeConstraint<T>("R")     \
+                            .HostMemory("batch_sizes"), \
+                          NAME##Op<GPUDevice, T>)
+
+REGISTER_LSTM_GPU_KERNEL(HasteLstm, float);
+REGISTER_LSTM_GPU_KERNEL(HasteLstm, double);
+REGISTER_CPU_KERNEL(HasteLstm, float);
+REGISTER_CPU_KERNEL(HasteLstm, double);
 
 REGISTER_OP("HasteLstmGrad")
     .Attr("R: {float, double}")
-    .Input("x_t: R")                   // [C,N,T]
-    .Input("kernel_t: R")              // [H*4,C]
-    .Input("recurrent_kernel_t: R")    // [H*4,H]
+    .Attr("zoneout_prob: float")
+    .Attr("dropout_prob: float")
+    .Attr("reverse: bool = false")
+    .Attr("batch_first: bool = false")  // Swaps the leading T and N dimensions below.
+    .Attr("needs_grad: list(bool) = [true, true, true, true]")  // [dx, dw, dr, db]
+    .Input("x: R")                     // [T,N,C]
+    .Input("kernel: R")                // [C,H*4]
+    .Input("recurrent_kernel: R")      // [H,H*4]
     .Input("bias: R")                  // [H*4]
-    .Input("h: R")                     // [T,N,H]
-    .Input("c: R")                     // [T,N,H]
+    .Input("h: R")                     // [T+1,N,H]
+    .Input("c: R")                     // [T+1,N,H]
     .Input("v: R")                     // [T,N,H*4]
-    .Input("dh_new: R")                // [T,N,H]
-    .Input("dc_new: R")                // [T,N,H]
-    .Input("zoneout_mask: R")          // [T,N,H]
-    .Output("dx: R")                   // [T,N,C]
-    .Output("dw: R")                   // [C,H*4]
-    .Output("dr: R")                   // [H,H*4]
-    .Output("db: R")                   // [H*4]
+    .Input("dh_new: R")                // [T+1,N,H]
+    .Input("dc_new: R")                // [T+1,N,H]
+    .Input("zoneout_seed: int64")      // []
+    .Input("dropout_seed: int64")      // []
+    .Input("batch_sizes: int32")       // [T] or [0]
+    .Input("sequence_length: int64")   // [N] or [0]
+    .Output("dx: R")                   // [T,N,C] or [0]
+    .Output("dw: R")                   // [C,H*4] or [0]
+    .Output("dr: R")                   // [H,H*4] or [0]
+    .Output("db: R")                   // [H*4] or [0]
     .SetShapeFn([](InferenceContext* c) {
       ShapeHandle x_shape;
       ShapeHandle kernel_shape;
@@ -183,7 +309,10 @@ REGISTER_OP("HasteLstmGrad")
       ShapeHandle v_shape;
       ShapeHandle dh_new_shape;
       ShapeHandle dc_new_shape;
-      ShapeHandle zoneout_mask_shape;
+      ShapeHandle zoneout_seed_shape;
+      ShapeHandle dropout_seed_shape;
+      ShapeHandle batch_sizes_shape;
+      ShapeHandle sequence_length_shape;
 
       TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &x_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 2, &kernel_shape));
@@ -194,26 +323,42 @@ REGISTER_OP("HasteLstmGrad")
       TF_RETURN_IF_ERROR(c->WithRank(c->input(6), 3, &v_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(7), 3, &dh_new_shape));
       TF_RETURN_IF_ERROR(c->WithRank(c->input(8), 3, &dc_new_shape));
-      TF_RETURN_IF_ERROR(c->WithRank(c->input(9), 3, &zoneout_mask_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(9), 0, &zoneout_seed_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(10), 0, &dropout_seed_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(11), 1, &batch_sizes_shape));
+      TF_RETURN_IF_ERROR(c->WithRank(c->input(12), 1, &sequence_length_shape));
 
-      DimensionHandle input_size = c->Dim(x_shape, 0);
-      DimensionHandle time_steps = c->Dim(x_shape, 1);
-      DimensionHandle batch_size = c->Dim(x_shape, 2);
-      DimensionHandle hidden_size = c->Dim(recurrent_kernel_shape, 1);
+      DimensionHandle input_size = c->Dim(x_shape, 2);
+      DimensionHandle hidden_size = c->Dim(recurrent_kernel_shape, 0);
       DimensionHandle hidden_size_4;
 
       TF_RETURN_IF_ERROR(c->Multiply(hidden_size, 4, &hidden_size_4));
 
-      c->set_output(0, c->MakeShape({ time_steps, batch_size, input_size }));
-      c->set_output(1, c->MakeShape({ input_size, hidden_size_4 }));
-      c->set_output(2, c->MakeShape({ hidden_size, hidden_size_4 }));
-      c->set_output(3, bias_shape);
+      std::vector<bool> needs_grad;
+      TF_RETURN_IF_ERROR(c->GetAttr("needs_grad", &needs_grad));
+      if (needs_grad.size() != 4)
+        return errors::InvalidArgument("needs_grad must have 4 entries");
+
+      // Gradients that aren't needed are returned as empty tensors. `dx` has the shape of
+      // `x` in either layout.
+      c->set_output(0, needs_grad[0] ? x_shape : c->MakeShape({ 0 }));
+      c->set_output(1, needs_grad[1] ? c->MakeShape({ input_size, hidden_size_4 }) : c->MakeShape({ 0 }));
+      c->set_output(2, needs_grad[2] ? c->MakeShape({ hidden_size, hidden_size_4 }) : c->MakeShape({ 0 }));
+      c->set_output(3, needs_grad[3] ? bias_shape : c->MakeShape({ 0 }));
       return Status::OK();
     });
 
-template<typename T>
+template<typename Device, typename T>
 struct HasteLstmGradOp : public OpKernel {
-  explicit HasteLstmGradOp(OpKernelConstruction* context) : OpKernel(context) {}
+  explicit HasteLstmGradOp(OpKernelConstruction* context) : OpKernel(context) {
+    OP_REQUIRES_OK(context, context->GetAttr("zoneout_prob", &zoneout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("dropout_prob", &dropout_prob_));
+    OP_REQUIRES_OK(context, context->GetAttr("reverse", &reverse_));
+    OP_REQUIRES_OK(context, context->GetAttr("batch_first", &batch_first_));
+    OP_REQUIRES_OK(context, context->GetAttr("needs_grad", &needs_grad_));
+    OP_REQUIRES(context, needs_grad_.size() == 4,
+        errors::InvalidArgument("needs_grad must have 4 entries"));
+  }
 
   void Compute(OpKernelContext* context) override {
     const Tensor& input = context->input(0);
@@ -225,34 +370,44 @@ struct HasteLstmGradOp : public OpKernel {
     const Tensor& dv = context->input(6);
     const Tensor& dh_new = context->input(7);
     const Tensor& dc_new = context->input(8);
-    const Tensor& zoneout_mask = context->input(9);
+    const int64 zoneout_seed = context->input(9).scalar<int64>()();
+    const int64 dropout_seed = context->input(10).scalar<int64>()();
+    const Tensor& batch_sizes = context->input(11);
+    const Tensor& sequence_length = context->input(12);
 
-    const auto input_size = input.shape().dim_size(0);
-    const auto time_steps = input.shape().dim_size(1);
-    const auto batch_size = input.shape().dim_size(2);
-    const auto hidden_size = recurrent_kernel.shape().dim_size(1);
-    const bool has_zoneout = !!zoneout_mask.NumElements();
+    const auto time_steps = input.shape().dim_size(batch_first_ ? 1 : 0);
+    const auto batch_size = input.shape().dim_size(batch_first_ ? 0 : 1);
+    const auto input_size = input.shape().dim_size(2);
+    const auto hidden_size = recurrent_kernel.shape().dim_size(0);
     const auto data_type = DataTypeToEnum<T>::value;
 
+    // Gradients that aren't needed are returned as empty tensors and passed to the
+    // backward pass as nullptr, which skips the matrix multiplications that compute them.
+    const TensorShape empty_shape = { 0 };
+
     // Can be uninitialized. Output only, no accumulation.
-    const TensorShape dx_shape = { time_steps, batch_size, input_size };
+    const TensorShape dx_shape = input.shape();
     Tensor* dx = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(0, dx_shape, &dx));
+    OP_REQUIRES_OK(context, context->allocate_output(0, needs_grad_[0] ? dx_shape : empty_shape, &dx));
+    T* dx_data = needs_grad_[0] ? dx->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape dW_shape = { input_size, hidden_size * 4 };
     Tensor* dW = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(1, dW_shape, &dW));
+    OP_REQUIRES_OK(context, context->allocate_output(1, needs_grad_[1] ? dW_shape : empty_shape, &dW));
+    T* dW_data = needs_grad_[1] ? dW->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape dR_shape = { hidden_size, hidden_size * 4 };
     Tensor* dR = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(2, dR_shape, &dR));
+    OP_REQUIRES_OK(context, context->allocate_output(2, needs_grad_[2] ? dR_shape : empty_shape, &dR));
+    T* dR_data = needs_grad_[2] ? dR->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape db_shape = { hidden_size * 4 };
     Tensor* db = nullptr;
-    OP_REQUIRES_OK(context, context->allocate_output(3, db_shape, &db));
+    OP_REQUIRES_OK(context, context->allocate_output(3, needs_grad_[3] ? db_shape : empty_shape, &db));
+    T* db_data = needs_grad_[3] ? db->flat<T>().data() : nullptr;
 
     // Needs to be initialized to 0.
     const TensorShape dh_shape = { batch_size, hidden_size };
@@ -264,38 +419,106 @@ struct HasteLstmGradOp : public OpKernel {
     Tensor dc;
     OP_REQUIRES_OK(context, context->allocate_temp(data_type, dc_shape, &dc));
 
-    cudaMemset(dW->flat<T>().data(), 0, dW->AllocatedBytes());
-    cudaMemset(dR->flat<T>().data(), 0, dR->AllocatedBytes());
-    cudaMemset(db->flat<T>().data(), 0, db->AllocatedBytes());
-    cudaMemset(dh.flat<T>().data(), 0, dh.AllocatedBytes());
-    cudaMemset(dc.flat<T>().data(), 0, dc.AllocatedBytes());
-
-    BackwardPass<T> backward = BackwardPass<T>(
-        batch_size,
-        input_size,
-        hidden_size,
-        GetCublasHandle());
-
-    backward.Run(
-        time_steps,
-        kernel.flat<T>().data(),
-        recurrent_kernel.flat<T>().data(),
-        bias.flat<T>().data(),
-        input.flat<T>().data(),
-        h_vector.flat<T>().data(),
-        c_vector.flat<T>().data(),
-        dh_new.flat<T>().data(),
-        dc_new.flat<T>().data(),
-        dx->flat<T>().data(),
-        dW->flat<T>().data(),
-        dR->flat<T>().data(),
-        db->flat<T>().data(),
-        dh.flat<T>().data(),
-        dc.flat<T>().data(),
-        const_cast<T*>(dv.flat<T>().data()),
-        has_zoneout ? zoneout_mask.flat<T>().data() : nullptr);
+    if (dW_data)
+      SetZero<Device>(dW_data, dW->AllocatedBytes());
+    if (dR_data)
+      SetZero<Device>(dR_data, dR->AllocatedBytes());
+    if (db_data)
+      SetZero<Device>(db_data, db->AllocatedBytes());
+    SetZero<Device>(dh.flat<T>().data(), dh.AllocatedBytes());
+    SetZero<Device>(dc.flat<T>().data(), dc.AllocatedBytes());
+
+    if (std::is_same<Device, CPUDevice>::value) {
+      cpu::lstm::BackwardPass<T> backward = cpu::lstm::BackwardPass<T>(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCpuParallelFor(context));
+
+      backward.Run(
+          time_steps,
+          kernel.flat<T>().data(),
+          recurrent_kernel.flat<T>().data(),
+          bias.flat<T>().data(),
+          input.flat<T>().data(),
+          h_vector.flat<T>().data(),
+          c_vector.flat<T>().data(),
+          dh_new.flat<T>().data(),
+          dc_new.flat<T>().data(),
+          dx_data,
+          dW_data,
+          dR_data,
+          db_data,
+          dh.flat<T>().data(),
+          dc.flat<T>().data(),
+          const_cast<T*>(dv.flat<T>().data()),
+          zoneout_prob_,
+          zoneout_seed,
+          batch_sizes.NumElements() ? batch_sizes.flat<int>().data() : nullptr,
+          sequence_length.NumElements() ? sequence_length.flat<int64>().data() : nullptr,
+          reverse_,
+          batch_first_,
+          dropout_prob_,
+          dropout_seed);
+    } else {
+      BackwardPass<T> backward = BackwardPass<T>(
+          batch_size,
+          input_size,
+          hidden_size,
+          GetCublasHandle());
+
+      // Regenerate the DropConnect-ed recurrent kernel that the forward op ran with.
+      Tensor dropped_recurrent_kernel;
+      OP_REQUIRES_OK(context, DropConnectRecurrentKernel<Device, T>(
+          context, recurrent_kernel, dropout_prob_, dropout_seed, &dropped_recurrent_kernel));
+
+      backward.Run(
+          time_steps,
+          kernel.flat<T>().data(),
+          dropped_recurrent_kernel.flat<T>().data(),
+          bias.flat<T>().data(),
+          input.flat<T>().data(),
+          h_vector.flat<T>().data(),
+          c_vector.flat<T>().data(),
+          dh_new.flat<T>().data(),
+          dc_new.flat<T>().data(),
+          dx_data,
+          dW_data,
+          dR_data,
+          db_data,
+          dh.flat<T>().data(),
+          dc.flat<T>().data(),
+          const_cast<T*>(dv.flat<T>().data()),
+          zoneout_prob_,
+          zoneout_seed,
+          batch_sizes.NumElements() ? batch_sizes.flat<int>().data() : nullptr,
+          sequence_length.NumElements() ? sequence_length.flat<int64>().data() : nullptr,
+          reverse_,
+          batch_first_);
+
+      // The recurrent kernel gradient only flows through the elements that were kept. The
+      // CPU pass masks it as it's accumulated.
+      if (dropout_prob_ && dR_data) {
+        DropConnect<Device, T>(
+            context,
+            dR->NumElements(),
+            dropout_prob_,
+            dropout_seed,
+            dR_data,
+            dR_data);
+      }
+    }
   }
+
+  private:
+    float zoneout_prob_;
+    float dropout_prob_;
+    bool reverse_;
+    bool batch_first_;
+    std::vector<bool> needs_grad_;
 };
 
-REGISTER_GPU_KERNEL(HasteLstmGrad, float);
-REGISTER_GPU_KERNEL(HasteLstmGrad, double);
+REGISTER_LSTM_GPU_KERNEL(HasteLstmGrad, float);
+REGISTER_LSTM_GPU_KERNEL(HasteLstmGrad, double);
+REGISTER_CPU_KERNEL(HasteLstmGrad, float);
+REGISTER_CPU_KERNEL(HasteLstmGrad, double);
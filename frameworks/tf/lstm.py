@@ -31,22 +31,26 @@ __all__ = [
 LIB = tf.load_op_library(pkg_resources.resource_filename(__name__, 'libhaste_tf.so'))
 
 
-def reverse_sequence(sequence, sequence_length):
+def active_batch_sizes(sequence_length, time_steps):
   """
-  Reverses a batched sequence in time-major order [T,N,...]. The input sequence
-  may be padded, in which case sequence_length specifies the unpadded length of
-  each sequence.
+  Returns the number of batch entries that are still active at each time step if
+  `sequence_length` is sorted in decreasing order, otherwise an empty tensor.
   """
-  if sequence_length is None:
-    return tf.reverse(sequence, axis=[0])
-  return tf.reverse_sequence(sequence, sequence_length, seq_axis=0, batch_axis=1)
+  sequence_length = tf.cast(sequence_length, tf.int32)
+  is_sorted = tf.reduce_all(sequence_length[1:] <= sequence_length[:-1])
+  active = tf.expand_dims(sequence_length, 0) > tf.expand_dims(tf.range(time_steps), 1)
+  batch_sizes = tf.reduce_sum(tf.cast(active, tf.int32), axis=1)
+  return tf.cond(is_sorted, lambda: batch_sizes, lambda: tf.zeros([0], dtype=tf.int32))
 
 
-def transpose(tensor_or_tuple, perm):
-  """Transposes the given tensor or tuple of tensors by the same permutation."""
-  if isinstance(tensor_or_tuple, tuple):
-    return tuple([tf.transpose(tensor, perm) for tensor in tensor_or_tuple])
-  return tf.transpose(tensor_or_tuple, perm)
+def needs_gradients(op, count):
+  """
+  Returns whether each of the first `count` inputs of `op` needs a gradient. Eager
+  gradient tapes tell the gradient function which inputs they can skip; graphs always
+  compute every gradient.
+  """
+  skip_input_indices = getattr(op, 'skip_input_indices', None) or ()
+  return [i not in skip_input_indices for i in range(count)]
 
 
 @tf.RegisterGradient("HasteLstm")
@@ -61,18 +65,36 @@ def lstm_gradient(op, *grads):
   W = op.inputs[1]
   R = op.inputs[2]
   b = op.inputs[3]
-  zoneout_mask = op.inputs[4]
+  zoneout_seed = op.inputs[4]
+  dropout_seed = op.inputs[5]
+  batch_sizes = op.inputs[6]
+  sequence_length = op.inputs[7]
   h = op.outputs[0]
   c = op.outputs[1]
   v = op.outputs[2]
 
-  # Pre-transpose matrices for better performance.
-  x = tf.transpose(x, [2, 0, 1])
-  W = tf.transpose(W, [1, 0])
-  R = tf.transpose(R, [1, 0])
-
-  dx, dW, dR, db = LIB.haste_lstm_grad(x, W, R, b, h, c, v, grads[0], grads[1], zoneout_mask)
-  return [dx, dW, dR, db, None]
+  needs_grad = needs_gradients(op, 4)
+  dx, dW, dR, db = LIB.haste_lstm_grad(
+      x,
+      W,
+      R,
+      b,
+      h,
+      c,
+      v,
+      grads[0],
+      grads[1],
+      zoneout_seed,
+      dropout_seed,
+      batch_sizes,
+      sequence_length,
+      zoneout_prob=op.get_attr('zoneout_prob'),
+      dropout_prob=op.get_attr('dropout_prob'),
+      reverse=op.get_attr('reverse'),
+      batch_first=op.get_attr('batch_first'),
+      needs_grad=needs_grad)
+  dx, dW, dR, db = [grad if needed else None for grad, needed in zip((dx, dW, dR, db), needs_grad)]
+  return [dx, dW, dR, db, None, None, None, None]
 
 
 class LSTMLayer(tf.Module):
@@ -98,7 +120,10 @@ class LSTMLayer(tf.Module):
     self.forget_bias = forget_bias
     self.dropout = dropout
     self.zoneout = zoneout
-    self.dtype = dtype or tf.float32
+    self.dtype = tf.as_dtype(dtype or tf.float32)
+    if self.dtype not in (tf.float32, tf.float64):
+      raise ValueError(('LSTM: dtype must be tf.float32 or tf.float64, got {}. The Haste '
+                        'TensorFlow ops have no float16 or bfloat16 kernels.').format(self.dtype.name))
     self.cudnn_compat = cudnn_compat
     self.kernel = None
     self.recurrent_kernel = None
@@ -149,6 +174,30 @@ class LSTMLayer(tf.Module):
         opaque_initial_value = tf.concat([kernel_weights, recurrent_weights, biases, extra_biases], axis=-1)
         self.opaque = v1.get_variable('opaque_kernel', initializer=opaque_initial_value)
 
+      # Converting the opaque blob to the op's layout touches all of it, so the result
+      # is kept in non-trainable variables along with the value it was converted from,
+      # and only recomputed once `opaque` has been assigned a new value (see
+      # `_cudnn_weights`). They're local variables so that checkpoints stay compatible
+      # with CudnnLSTM; zeros convert to zeros, so they start out consistent.
+      local = [v1.GraphKeys.LOCAL_VARIABLES]
+      self._converted_from = v1.get_variable(
+          'converted_from', initializer=tf.zeros_like(opaque_initial_value), trainable=False, collections=local)
+      self.kernel = v1.get_variable(
+          'converted_kernel', initializer=tf.zeros([input_size, 4 * num_units], dtype=self.dtype),
+          trainable=False, collections=local)
+      self.recurrent_kernel = v1.get_variable(
+          'converted_recurrent_kernel', initializer=tf.zeros([num_units, 4 * num_units], dtype=self.dtype),
+          trainable=False, collections=local)
+      self.bias = v1.get_variable(
+          'converted_bias', initializer=tf.zeros([4 * num_units], dtype=self.dtype),
+          trainable=False, collections=local)
+    self.built = True
+
+  def _from_opaque(self, opaque):
+    """Converts the cuDNN opaque parameter blob to the kernel, recurrent kernel, and bias."""
+    num_units = self.num_units
+    input_size = int(self.kernel.shape[0])
+
     # Split into 3 variables.
     W_size = 4 * input_size * num_units
     R_size = 4 * num_units * num_units
@@ -166,14 +215,54 @@ class LSTMLayer(tf.Module):
     bias = tf.concat([bi, bg, bf, bo], axis=0)
 
     # Shape them correctly.
-    self.kernel = tf.reshape(kernel, [4 * num_units, input_size])
-    self.recurrent_kernel = tf.reshape(recurrent_kernel, [4 * num_units, num_units])
-    self.bias = tf.reshape(bias, [4 * num_units])
+    kernel = tf.reshape(kernel, [4 * num_units, input_size])
+    recurrent_kernel = tf.reshape(recurrent_kernel, [4 * num_units, num_units])
+    bias = tf.reshape(bias, [4 * num_units])
 
     # Pre-transpose the kernels.
-    self.kernel = tf.transpose(self.kernel, [1, 0])
-    self.recurrent_kernel = tf.transpose(self.recurrent_kernel, [1, 0])
-    self.built = True
+    return tf.transpose(kernel, [1, 0]), tf.transpose(recurrent_kernel, [1, 0]), bias
+
+  def _to_opaque(self, kernel, recurrent_kernel, bias):
+    """The inverse of `_from_opaque`, for gradients: both bias vectors get `bias`."""
+    Wi, Wg, Wf, Wo = tf.split(tf.transpose(kernel, [1, 0]), 4)
+    Ri, Rg, Rf, Ro = tf.split(tf.transpose(recurrent_kernel, [1, 0]), 4)
+    bi, bg, bf, bo = tf.split(bias, 4)
+    kernel = tf.reshape(tf.concat([Wi, Wf, Wg, Wo], axis=0), [-1])
+    recurrent_kernel = tf.reshape(tf.concat([Ri, Rf, Rg, Ro], axis=0), [-1])
+    bias = tf.concat([bi, bf, bg, bo], axis=0)
+    return tf.concat([kernel, recurrent_kernel, bias, bias], axis=0)
+
+  def _cudnn_weights(self):
+    """
+    Returns the kernel, recurrent kernel, and bias converted from `opaque`. The
+    cached conversion is refreshed first if `opaque` has changed since it was
+    made. Their gradients are passed back to `opaque`.
+    """
+    opaque = self.opaque.read_value()
+
+    def refresh():
+      converted = self._from_opaque(opaque)
+      updates = [var.assign(value) for var, value in zip(self._converted(), converted)]
+      updates.append(self._converted_from.assign(opaque))
+      with tf.control_dependencies(updates):
+        return tf.constant(True)
+
+    stale = tf.reduce_any(tf.not_equal(opaque, self._converted_from))
+    refreshed = tf.cond(stale, refresh, lambda: tf.constant(False))
+    with tf.control_dependencies([refreshed]):
+      cached = [var.read_value() for var in self._converted()]
+
+    @tf.custom_gradient
+    def weights(opaque):
+      def grad(*grads):
+        grads = [tf.zeros_like(w) if g is None else g for g, w in zip(grads, cached)]
+        return self._to_opaque(*grads)
+      return cached, grad
+
+    return weights(opaque)
+
+  def _converted(self):
+    return [self.kernel, self.recurrent_kernel, self.bias]
 
   @property
   def state_size(self):
@@ -183,40 +272,63 @@ class LSTMLayer(tf.Module):
   def output_size(self):
     return self.num_units
 
-  def __call__(self, x, sequence_length, training):
+  def __call__(self, x, sequence_length, training, reverse=False, batch_first=False):
     self.build(x.shape)
 
     shape = tf.shape(x)
-    time_steps = shape[0]
-    batch_size = shape[1]
-
-    # Use an empty zoneout mask if no zoneout is going to be applied.
-    # Sadly, we can't pass `None` to the op but at least we won't be wasting
-    # memory or bandwidth on this tensor.
-    zoneout_mask = tf.zeros([0, 0, 0], dtype=self.dtype)
-    if self.zoneout:
-      zoneout_mask = 1.0 - self.zoneout
-      zoneout_mask += tf.random_uniform([time_steps, batch_size, self.num_units], dtype=self.dtype)
-      zoneout_mask = tf.floor(zoneout_mask)
-
-    recurrent_kernel = tf.nn.dropout(self.recurrent_kernel, rate=self.dropout)
+    time_steps = shape[1] if batch_first else shape[0]
+
+    # The op regenerates the zoneout masks from this seed instead of storing them,
+    # so only a scalar is saved for the gradient. The seed is ignored if no zoneout
+    # is going to be applied.
+    zoneout_seed = tf.zeros([], dtype=tf.int64)
+    if self.zoneout and training:
+      zoneout_seed = tf.random_uniform([], maxval=2**62, dtype=tf.int64)
+
+    # DropConnect is applied to the recurrent kernel inside the op, and its mask is
+    # regenerated from this seed in the gradient op, so no masked copy of the kernel
+    # is kept. DropConnect is only applied in training mode.
+    dropout = self.dropout if training else 0.0
+    dropout_seed = tf.zeros([], dtype=tf.int64)
+    if dropout:
+      dropout_seed = tf.random_uniform([], maxval=2**62, dtype=tf.int64)
+
+    # Sorted batches skip the padding at the end of shorter sequences. Either way,
+    # padded time steps carry the state through unchanged.
+    batch_sizes = tf.zeros([0], dtype=tf.int32)
+    lengths = tf.zeros([0], dtype=tf.int64)
+    if sequence_length is not None:
+      batch_sizes = active_batch_sizes(sequence_length, time_steps)
+      lengths = tf.cast(sequence_length, tf.int64)
+
+    kernel, recurrent_kernel, bias = self.kernel, self.recurrent_kernel, self.bias
+    if self.cudnn_compat:
+      kernel, recurrent_kernel, bias = self._cudnn_weights()
+
     h, c, _ = LIB.haste_lstm(
         x,
-        self.kernel,
+        kernel,
         recurrent_kernel,
-        self.bias,
-        zoneout_mask,
+        bias,
+        zoneout_seed,
+        dropout_seed,
+        batch_sizes,
+        lengths,
         training=training,
-        zoneout_prob=self.zoneout)
-
-    if sequence_length is not None:
-      indices = sequence_length
-      indices = tf.stack([indices, tf.range(batch_size, dtype=sequence_length.dtype)], axis=-1)
-      state = rnn_cell.LSTMStateTuple(tf.gather_nd(c, indices), tf.gather_nd(h, indices))
-    else:
-      state = rnn_cell.LSTMStateTuple(c[-1], h[-1])
-
-    return h[1:], state
+        zoneout_prob=self.zoneout,
+        dropout_prob=dropout,
+        reverse=reverse,
+        batch_first=batch_first)
+
+    # In reverse, the op leaves the initial state in the last slot and the final
+    # state in the first.
+    if batch_first:
+      if reverse:
+        return h[:, :-1], rnn_cell.LSTMStateTuple(c[:, 0], h[:, 0])
+      return h[:, 1:], rnn_cell.LSTMStateTuple(c[:, -1], h[:, -1])
+    if reverse:
+      return h[:-1], rnn_cell.LSTMStateTuple(c[0], h[0])
+    return h[1:], rnn_cell.LSTMStateTuple(c[-1], h[-1])
 
 
 class LSTM(tf.Module):
@@ -258,7 +370,8 @@ class LSTM(tf.Module):
         regularization on the recurrent matrix. Defaults to 0.
       zoneout: (optional) float, sets the zoneout rate for Zoneout
         regularization. Defaults to 0.
-      dtype: (optional) the data type for this layer. Defaults to `tf.float32`.
+      dtype: (optional) the data type for this layer, `tf.float32` or
+        `tf.float64`. Defaults to `tf.float32`. 16-bit types aren't supported.
       name: (optional) string, the name for this layer.
       cudnn_compat: (optional) bool, if `True`, the variables created by this
         layer are compatible with `tf.contrib.cudnn_rnn.CudnnLSTM`. Note that
@@ -320,6 +433,9 @@ class LSTM(tf.Module):
       sequence_length: (optional) Tensor, a rank 1 tensor with shape [N] and
         dtype of `tf.int32` or `tf.int64`. This tensor specifies the unpadded
         length of each example in the input minibatch.
+        If the minibatch is sorted by decreasing length, the recurrence skips
+        the padding entirely: each time step only computes the examples that
+        haven't ended yet.
       time_major: (optional) bool, specifies whether `input` has shape [N,T,C]
         (`time_major=False`) or shape [T,N,C] (`time_major=True`).
 
@@ -330,18 +446,14 @@ class LSTM(tf.Module):
     """
     self.build(inputs.shape)
 
-    if not time_major:
-      inputs = transpose(inputs, [1, 0, 2])
-
-    result, state = self.fwd_lstm(inputs, sequence_length, training)
+    # The op reads and writes batch-major tensors directly, so they aren't transposed.
+    batch_first = not time_major
+    result, state = self.fwd_lstm(inputs, sequence_length, training, batch_first=batch_first)
 
     if self.bwd_lstm is not None:
-      inputs = reverse_sequence(inputs, sequence_length)
-      bwd_result, bwd_state = self.bwd_lstm(inputs, sequence_length, training)
-      result = result, reverse_sequence(bwd_result, sequence_length)
+      bwd_result, bwd_state = self.bwd_lstm(
+          inputs, sequence_length, training, reverse=True, batch_first=batch_first)
+      result = result, bwd_result
       state = state, bwd_state
 
-    if not time_major:
-      result = transpose(result, [1, 0, 2])
-
     return result, state
@@ -17,6 +17,7 @@
 
 #include "support.h"
 #include "tensorflow/core/framework/op_kernel.h"
+#include "tensorflow/core/lib/core/threadpool.h"
 #include "tensorflow/core/util/stream_executor_util.h"
 #include "tensorflow/stream_executor/stream.h"
 
@@ -56,3 +57,10 @@ const cudaStream_t& GetCudaStream(tensorflow::OpKernelContext* context) {
       context->op_device_context()->stream()->implementation()->GpuStreamMemberHack();
   return *reinterpret_cast<const cudaStream_t*>(ptr);
 }
+
+haste::v0::cpu::ParallelFor GetCpuParallelFor(tensorflow::OpKernelContext* context) {
+  auto* workers = context->device()->tensorflow_cpu_worker_threads()->workers;
+  return [workers](const int64_t total, const int64_t cost_per_unit, const std::function<void(int64_t, int64_t)>& fn) {
+    workers->ParallelFor(total, cost_per_unit, fn);
+  };
+}
@@ -16,17 +16,120 @@
 #pragma once
 
 #include <cublas_v2.h>
+#include <cstring>
 #include <cuda_runtime_api.h>
+#include <type_traits>
 
-namespace tensorflow {
-class OpKernelContext;
+#include "haste/cpu/dropconnect.h"
+#include "haste/cpu/parallel.h"
+#include "haste/dropconnect.h"
+#include "tensorflow/core/framework/op_kernel.h"
+
+namespace Eigen {
+struct GpuDevice;
+struct ThreadPoolDevice;
 }
 
+typedef Eigen::GpuDevice GPUDevice;
+typedef Eigen::ThreadPoolDevice CPUDevice;
+
 #define REGISTER_GPU_KERNEL(NAME, T)                 \
   REGISTER_KERNEL_BUILDER(Name(#NAME)                \
                             .Device(DEVICE_GPU)      \
                             .TypeConstraint<T>("R"), \
-                          NAME##Op<T>)
+                          NAME##Op<GPUDevice, T>)
+
+#define REGISTER_CPU_KERNEL(NAME, T)                 \
+  REGISTER_KERNEL_BUILDER(Name(#NAME)                \
+                            .Device(DEVICE_CPU)      \
+                            .TypeConstraint<T>("R"), \
+                          NAME##Op<CPUDevice, T>)
 
 cublasHandle_t GetCublasHandle();
 const cudaStream_t& GetCudaStream(tensorflow::OpKernelContext* context);
+
+// Runs the CPU implementations on the op's intra-op thread pool.
+haste::v0::cpu::ParallelFor GetCpuParallelFor(tensorflow::OpKernelContext* context);
+
+template<typename Device>
+inline void SetZero(void* ptr, size_t bytes);
+
+template<>
+inline void SetZero<GPUDevice>(void* ptr, size_t bytes) {
+  cudaMemset(ptr, 0, bytes);
+}
+
+template<>
+inline void SetZero<CPUDevice>(void* ptr, size_t bytes) {
+  std::memset(ptr, 0, bytes);
+}
+
+// Writes the DropConnect-ed copy of the `size` elements at `x` to `y` (which may be `x`).
+// The mask is regenerated from `seed`, so the forward and gradient ops agree on it without
+// either of them storing it.
+template<typename Device, typename T>
+inline void DropConnect(
+    tensorflow::OpKernelContext* context,
+    const int64_t size,
+    const float dropout_prob,
+    const int64_t seed,
+    const T* x,
+    T* y) {
+  if (std::is_same<Device, CPUDevice>::value) {
+    haste::v0::cpu::dropconnect::Apply<T>(
+        size, dropout_prob, seed, x, y, GetCpuParallelFor(context));
+  } else {
+    // Launch on the stream the GPU passes run on so that the ordering is preserved.
+    cudaStream_t stream;
+    cublasGetStream(GetCublasHandle(), &stream);
+    haste::v0::dropconnect::Apply<T>(stream, size, dropout_prob, seed, x, y);
+  }
+}
+
+// Sets `dropped_recurrent_kernel` to a DropConnect-ed copy of `recurrent_kernel` in
+// temporary memory of this call, or to `recurrent_kernel` itself without DropConnect. The
+// GPU passes run with this copy; the CPU passes apply the mask as they pack the kernel.
+template<typename Device, typename T>
+tensorflow::Status DropConnectRecurrentKernel(
+    tensorflow::OpKernelContext* context,
+    const tensorflow::Tensor& recurrent_kernel,
+    float dropout_prob,
+    int64_t seed,
+    tensorflow::Tensor* dropped_recurrent_kernel) {
+  *dropped_recurrent_kernel = recurrent_kernel;
+  if (!dropout_prob)
+    return tensorflow::Status::OK();
+  TF_RETURN_IF_ERROR(context->allocate_temp(
+      recurrent_kernel.dtype(), recurrent_kernel.shape(), dropped_recurrent_kernel));
+  DropConnect<Device, T>(
+      context,
+      recurrent_kernel.NumElements(),
+      dropout_prob,
+      seed,
+      recurrent_kernel.flat<T>().data(),
+      dropped_recurrent_kernel->flat<T>().data());
+  return tensorflow::Status::OK();
+}
+
+// Packs `recurrent_kernel` for the CPU pass `forward` with the DropConnect mask for `seed`
+// applied, in temporary memory of this call, and points `packed_R` at it. Without
+// DropConnect, `packed_R` is set to nullptr and the pass packs the kernel itself.
+template<typename T, typename ForwardPassT>
+tensorflow::Status PackDroppedRecurrentKernel(
+    tensorflow::OpKernelContext* context,
+    ForwardPassT& forward,
+    const tensorflow::Tensor& recurrent_kernel,
+    float dropout_prob,
+    int64_t seed,
+    tensorflow::Tensor* buffer,
+    const void** packed_R) {
+  *packed_R = nullptr;
+  if (!dropout_prob)
+    return tensorflow::Status::OK();
+  TF_RETURN_IF_ERROR(context->allocate_temp(
+      tensorflow::DT_UINT8, tensorflow::TensorShape({ forward.PackedRecurrentKernelSize() }), buffer));
+  forward.PackRecurrentKernel(
+      recurrent_kernel.flat<T>().data(), buffer->flat<tensorflow::uint8>().data(), dropout_prob, seed);
+  *packed_R = buffer->flat<tensorflow::uint8>().data();
+  return tensorflow::Status::OK();
+}
@@ -16,15 +16,53 @@
 #pragma once
 
 #include <cublas_v2.h>
+#include <cuda_bf16.h>
+#include <cuda_fp16.h>
 
 template<typename T>
 struct blas {};
 
-template<>
-struct blas<__half> {
-  static constexpr decltype(cublasHgemm)* gemm = cublasHgemm;
+// The 16-bit types are multiplied with single precision accumulation. `alpha` and `beta`
+// keep the storage type in the signature so that callers don't have to special case them.
+template<typename T, cudaDataType_t DataType>
+struct blas_ex {
+  static cublasStatus_t gemm(
+      cublasHandle_t handle,
+      cublasOperation_t transa,
+      cublasOperation_t transb,
+      int m,
+      int n,
+      int k,
+      const T* alpha,
+      const T* A,
+      int lda,
+      const T* B,
+      int ldb,
+      const T* beta,
+      T* C,
+      int ldc) {
+    const float alpha_f = static_cast<float>(*alpha);
+    const float beta_f = static_cast<float>(*beta);
+    return cublasGemmEx(
+        handle,
+        transa, transb,
+        m, n, k,
+        &alpha_f,
+        A, DataType, lda,
+        B, DataType, ldb,
+        &beta_f,
+        C, DataType, ldc,
+        CUBLAS_COMPUTE_32F,
+        CUBLAS_GEMM_DEFAULT_TENSOR_OP);
+  }
 };
 
+template<>
+struct blas<__half> : blas_ex<__half, CUDA_R_16F> {};
+
+template<>
+struct blas<__nv_bfloat16> : blas_ex<__nv_bfloat16, CUDA_R_16BF> {};
+
 template<>
 struct blas<float> {
   static constexpr decltype(cublasSgemm)* gemm = cublasSgemm;
@@ -0,0 +1,556 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+// We partition work across threads ourselves; don't let Eigen's GEMM start its own
+// OpenMP team inside of ours.
+#define EIGEN_DONT_PARALLELIZE
+
+#include <Eigen/Dense>
+#include <algorithm>
+#include <cstdint>
+#include <functional>
+#include <type_traits>
+#include <vector>
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+#include "haste/cpu/parallel.h"
+#include "zoneout_ops.h"
+
+// Runs `fn` over [0, total) using `parallel_for`, or OpenMP if `parallel_for` is empty.
+// Small ranges are run inline on the calling thread.
+inline void ParallelRange(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int64_t total,
+    const int64_t cost_per_unit,
+    const std::function<void(int64_t, int64_t)>& fn) {
+  if (total <= 0)
+    return;
+
+  if (parallel_for) {
+    parallel_for(total, cost_per_unit, fn);
+    return;
+  }
+
+#ifdef _OPENMP
+  // Below this much work per thread, fork/join overhead dominates.
+  const int64_t min_cost_per_thread = 1 << 15;
+  const int64_t max_threads = std::max<int64_t>(1, total * cost_per_unit / min_cost_per_thread);
+  const int threads = static_cast<int>(std::min<int64_t>(
+      std::min<int64_t>(omp_get_max_threads(), max_threads),
+      total));
+  if (threads > 1) {
+    #pragma omp parallel for num_threads(threads) schedule(static)
+    for (int i = 0; i < threads; ++i)
+      fn(total * i / threads, total * (i + 1) / threads);
+    return;
+  }
+#endif
+
+  fn(0, total);
+}
+
+// Pointwise math and GEMM accumulation on the 16-bit storage types is carried out in single
+// precision. Eigen converts between the two with packet instructions, which include the
+// AVX-512 BF16 conversions when those are enabled at compile time (-mavx512bf16).
+template<typename T>
+struct cpu_accumulator {
+  typedef T type;
+};
+
+template<>
+struct cpu_accumulator<Eigen::half> {
+  typedef float type;
+};
+
+template<>
+struct cpu_accumulator<Eigen::bfloat16> {
+  typedef float type;
+};
+
+// Host GEMM with the same column-major conventions as cublas<t>gemm:
+//   C[m,n] = alpha * op(A)[m,k] * op(B)[k,n] + beta * C[m,n]
+// so that the CPU code paths can mirror their GPU counterparts call-for-call.
+template<typename T>
+struct cpu_blas {
+  using Matrix = Eigen::Matrix<T, Eigen::Dynamic, Eigen::Dynamic, Eigen::ColMajor>;
+  using MatrixMap = Eigen::Map<Matrix, Eigen::Unaligned, Eigen::OuterStride<>>;
+  using ConstMatrixMap = Eigen::Map<const Matrix, Eigen::Unaligned, Eigen::OuterStride<>>;
+  using AccT = typename cpu_accumulator<T>::type;
+  using AccMatrix = Eigen::Matrix<AccT, Eigen::Dynamic, Eigen::Dynamic, Eigen::ColMajor>;
+
+  // Single-threaded GEMM.
+  static void gemm(
+      const bool transpose_a,
+      const bool transpose_b,
+      const int m,
+      const int n,
+      const int k,
+      const T alpha,
+      const T* A,
+      const int lda,
+      const T* B,
+      const int ldb,
+      const T beta,
+      T* C,
+      const int ldc) {
+    if (m <= 0 || n <= 0)
+      return;
+
+    MatrixMap c(C, m, n, Eigen::OuterStride<>(ldc));
+    if (k <= 0) {
+      Scale(beta, c);
+      return;
+    }
+
+    ConstMatrixMap a(A, transpose_a ? k : m, transpose_a ? m : k, Eigen::OuterStride<>(lda));
+    ConstMatrixMap b(B, transpose_b ? n : k, transpose_b ? k : n, Eigen::OuterStride<>(ldb));
+
+    if (transpose_a && transpose_b)
+      Product(a.transpose(), b.transpose(), alpha, beta, c);
+    else if (transpose_a)
+      Product(a.transpose(), b, alpha, beta, c);
+    else if (transpose_b)
+      Product(a, b.transpose(), alpha, beta, c);
+    else
+      Product(a, b, alpha, beta, c);
+  }
+
+  // Multi-threaded GEMM. The output matrix is partitioned along its larger dimension
+  // and each block is computed independently.
+  static void gemm(
+      const haste::v0::cpu::ParallelFor& parallel_for,
+      const bool transpose_a,
+      const bool transpose_b,
+      const int m,
+      const int n,
+      const int k,
+      const T alpha,
+      const T* A,
+      const int lda,
+      const T* B,
+      const int ldb,
+      const T beta,
+      T* C,
+      const int ldc) {
+    const int64_t flops = 2LL * std::max(k, 1);
+    if (n >= m) {
+      ParallelRange(parallel_for, n, flops * m, [&](int64_t begin, int64_t end) {
+        gemm(
+            transpose_a, transpose_b,
+            m, static_cast<int>(end - begin), k,
+            alpha,
+            A, lda,
+            transpose_b ? B + begin : B + begin * ldb, ldb,
+            beta,
+            C + begin * ldc, ldc);
+      });
+    } else {
+      ParallelRange(parallel_for, m, flops * n, [&](int64_t begin, int64_t end) {
+        gemm(
+            transpose_a, transpose_b,
+            static_cast<int>(end - begin), n, k,
+            alpha,
+            transpose_a ? A + begin * lda : A + begin, lda,
+            B, ldb,
+            beta,
+            C + begin, ldc);
+      });
+    }
+  }
+
+  private:
+    template<typename MatrixA, typename MatrixB>
+    static void Product(
+        const MatrixA& a,
+        const MatrixB& b,
+        const T alpha,
+        const T beta,
+        MatrixMap& c) {
+      Product(a, b, alpha, beta, c, std::is_same<T, AccT>());
+    }
+
+    // The operands are multiplied in their own precision.
+    template<typename MatrixA, typename MatrixB>
+    static void Product(
+        const MatrixA& a,
+        const MatrixB& b,
+        const T alpha,
+        const T beta,
+        MatrixMap& c,
+        std::true_type) {
+      // Don't read `C` when `beta` is zero; it may be uninitialized memory.
+      if (beta == static_cast<T>(0.0)) {
+        c.noalias() = alpha * a * b;
+      } else {
+        if (beta != static_cast<T>(1.0))
+          c *= beta;
+        c.noalias() += alpha * a * b;
+      }
+    }
+
+    // 16-bit operands are widened, multiplied and accumulated in single precision, and the
+    // result is rounded once when it's written back.
+    template<typename MatrixA, typename MatrixB>
+    static void Product(
+        const MatrixA& a,
+        const MatrixB& b,
+        const T alpha,
+        const T beta,
+        MatrixMap& c,
+        std::false_type) {
+      AccMatrix product = a.template cast<AccT>() * b.template cast<AccT>();
+      product *= static_cast<AccT>(alpha);
+      if (beta != static_cast<T>(0.0))
+        product += static_cast<AccT>(beta) * c.template cast<AccT>();
+      c = product.template cast<T>();
+    }
+
+    static void Scale(const T beta, MatrixMap& c) {
+      if (beta == static_cast<T>(0.0))
+        c.setZero();
+      else if (beta != static_cast<T>(1.0))
+        c *= beta;
+    }
+};
+
+// The left-hand side of GEMMs that are repeated with the same matrix, such as the recurrent
+// kernel at every time step, packed once into the panel layout that Eigen's GEMM kernel
+// reads. `cpu_blas::gemm` has Eigen repack both of its operands on every call; a product
+// with a packed matrix only packs its right-hand side, which is typically much smaller.
+// 16-bit matrices are widened to single precision when they're packed.
+//
+// The matrix is [blocks*rows,depth] and column-major, and is treated as `blocks` row blocks
+// of `rows` rows each (e.g. the four gates of an LSTM weight matrix). `gemm` computes the same
+// range of rows of every block, so a thread that owns a range of hidden units computes all
+// of their gates from a single packed copy of the right-hand side.
+template<typename T>
+class cpu_packed_lhs {
+  public:
+    using AccT = typename cpu_accumulator<T>::type;
+
+    cpu_packed_lhs(const int blocks, const int rows, const int depth)
+        : blocks_(blocks), rows_(rows), depth_(depth) {
+      Eigen::Index kc = depth;
+      Eigen::Index mc = static_cast<Eigen::Index>(blocks) * rows;
+      Eigen::Index nc = rows;
+      Eigen::internal::computeProductBlockingSizes<AccT, AccT>(kc, mc, nc);
+      kc_ = static_cast<int>(std::max<Eigen::Index>(1, kc));
+    }
+
+    // The size in bytes of the buffer that `Pack` fills. It doesn't have to be aligned.
+    int64_t bytes() const {
+      const int64_t elements =
+          (depth_ / kc_) * blocks_ * AlignedSize(static_cast<int64_t>(rows_) * kc_) +
+          blocks_ * AlignedSize(static_cast<int64_t>(rows_) * (depth_ % kc_));
+      return elements * static_cast<int64_t>(sizeof(AccT)) + kAlignment;
+    }
+
+    // Row ranges passed to `gemm` must start at a multiple of this, and must also end at one
+    // unless they end at `rows`.
+    static int row_alignment() {
+      return Traits::mr;
+    }
+
+    // Packs `A` (with leading dimension `lda`) into `buffer`. The result stays valid for as
+    // long as `A` isn't modified, and doesn't refer to `A`. If `transpose` is set, `A` holds
+    // the transpose of the matrix to pack, i.e. it's [depth,blocks*rows] and column-major.
+    //
+    // If `dropout_prob` is not 0, the packed copy has the DropConnect mask for `dropout_seed`
+    // applied (see `dropconnect::Apply`), so a masked matrix never has to be written out in
+    // its own layout first. The mask is indexed by each element's offset from `A`.
+    void Pack(
+        const haste::v0::cpu::ParallelFor& parallel_for,
+        const T* A,
+        const int lda,
+        void* buffer,
+        const bool transpose = false,
+        const float dropout_prob = 0.0f,
+        const uint64_t dropout_seed = 0) const {
+      AccT* packed = Align(buffer);
+      const int k_blocks = (depth_ + kc_ - 1) / kc_;
+      ParallelRange(parallel_for, static_cast<int64_t>(k_blocks) * blocks_, 2LL * rows_ * kc_, [&](int64_t begin, int64_t end) {
+        AccMatrix gathered;
+        for (int64_t i = begin; i < end; ++i) {
+          const int k = static_cast<int>(i / blocks_) * kc_;
+          const int block = static_cast<int>(i % blocks_);
+          const int depth = std::min(kc_, depth_ - k);
+          if (transpose || dropout_prob) {
+            Gather(A, lda, transpose, dropout_prob, dropout_seed, static_cast<int64_t>(block) * rows_, k, depth, gathered);
+            PackBlock(gathered.data(), rows_, depth, packed + Offset(k, block));
+          } else {
+            const T* a = A + static_cast<int64_t>(k) * lda + static_cast<int64_t>(block) * rows_;
+            PackBlock(a, lda, depth, packed + Offset(k, block), std::is_same<T, AccT>());
+          }
+        }
+      });
+    }
+
+    // Single-threaded GEMM with the packed matrix in `buffer`:
+    //   C[g*rows+i,j] = sum_k A[g*rows+i,k] * B[k,j]
+    // for every block g, begin <= i < end, and 0 <= j < n. `B` is [depth,n] and `C` is
+    // [blocks*rows,n], both column-major. If `accumulate` is set, the product is added to `C`
+    // instead.
+    void gemm(
+        const void* buffer,
+        const int begin,
+        const int end,
+        const int n,
+        const T* B,
+        const int ldb,
+        T* C,
+        const int ldc,
+        const bool accumulate = false) const {
+      const int m = end - begin;
+      if (m <= 0 || n <= 0)
+        return;
+      Product(Align(buffer), begin, m, n, B, ldb, C, ldc, accumulate, std::is_same<T, AccT>());
+    }
+
+  private:
+    using Traits = Eigen::internal::gebp_traits<AccT, AccT>;
+    using AccMatrix = Eigen::Matrix<AccT, Eigen::Dynamic, Eigen::Dynamic, Eigen::ColMajor>;
+    using LhsMapper = Eigen::internal::const_blas_data_mapper<AccT, Eigen::Index, Eigen::ColMajor>;
+    using RhsMapper = Eigen::internal::const_blas_data_mapper<AccT, Eigen::Index, Eigen::ColMajor>;
+    using ResMapper = Eigen::internal::blas_data_mapper<AccT, Eigen::Index, Eigen::ColMajor, Eigen::Unaligned, 1>;
+
+    // The kernel reads the packed panels with aligned loads, so every packed block starts on
+    // a boundary that's good for any packet size.
+    static const int kAlignment = 64;
+
+    static AccT* Align(const void* buffer) {
+      const uintptr_t address = reinterpret_cast<uintptr_t>(buffer);
+      return reinterpret_cast<AccT*>((address + kAlignment - 1) / kAlignment * kAlignment);
+    }
+
+    static int64_t AlignedSize(const int64_t size) {
+      const int64_t elements = kAlignment / sizeof(AccT);
+      return (size + elements - 1) / elements * elements;
+    }
+
+    // Offset of row block `block` of the depth block that starts at `k`. Depth blocks are
+    // `kc_` deep and stored one after another, each as `blocks` consecutive row blocks.
+    int64_t Offset(const int k, const int block) const {
+      const int depth = std::min(kc_, depth_ - k);
+      return (k / kc_) * blocks_ * AlignedSize(static_cast<int64_t>(rows_) * kc_) +
+             block * AlignedSize(static_cast<int64_t>(rows_) * depth);
+    }
+
+    // Copies rows [row, row+rows) and columns [k, k+depth) of the matrix that `Pack` packs
+    // into `gathered`, widened and with the DropConnect mask applied.
+    void Gather(
+        const T* A,
+        const int lda,
+        const bool transpose,
+        const float dropout_prob,
+        const uint64_t dropout_seed,
+        const int64_t row,
+        const int k,
+        const int depth,
+        AccMatrix& gathered) const {
+      // With `dropout_prob` = 1 every element is dropped, and a zero scale keeps 0 * inf from
+      // turning them into NaNs.
+      const AccT scale = dropout_prob < 1.0f ? static_cast<AccT>(1.0) / (static_cast<AccT>(1.0) - dropout_prob) : static_cast<AccT>(0.0);
+      gathered.resize(rows_, depth);
+      for (int j = 0; j < depth; ++j) {
+        for (int i = 0; i < rows_; ++i) {
+          const int64_t index = transpose
+              ? (row + i) * lda + k + j
+              : static_cast<int64_t>(k + j) * lda + row + i;
+          const AccT value = static_cast<AccT>(A[index]);
+          if (!dropout_prob)
+            gathered(i, j) = value;
+          else
+            gathered(i, j) = zoneout_keep(dropout_seed, index, dropout_prob) ? value * scale : static_cast<AccT>(0.0);
+        }
+      }
+    }
+
+    void PackBlock(const T* a, const int lda, const int depth, AccT* packed, std::true_type) const {
+      PackBlock(a, lda, depth, packed);
+    }
+
+    void PackBlock(const T* a, const int lda, const int depth, AccT* packed, std::false_type) const {
+      using Map = Eigen::Map<const Eigen::Matrix<T, Eigen::Dynamic, Eigen::Dynamic, Eigen::ColMajor>, Eigen::Unaligned, Eigen::OuterStride<>>;
+      const AccMatrix widened = Map(a, rows_, depth, Eigen::OuterStride<>(lda)).template cast<AccT>();
+      PackBlock(widened.data(), rows_, depth, packed);
+    }
+
+    void PackBlock(const AccT* a, const Eigen::Index lda, const int depth, AccT* packed) const {
+      Eigen::internal::gemm_pack_lhs<AccT, Eigen::Index, LhsMapper, Traits::mr, Traits::LhsProgress,
+          typename Traits::LhsPacket4Packing, Eigen::ColMajor> pack_lhs;
+      pack_lhs(packed, LhsMapper(a, lda), depth, rows_);
+    }
+
+    // The operands are multiplied in their own precision and the result is written (or
+    // added) to `C`.
+    void Product(const AccT* packed, const int begin, const int m, const int n,
+                 const T* B, const int ldb, T* C, const int ldc, const bool accumulate, std::true_type) const {
+      for (int block = 0; block < blocks_ && !accumulate; ++block)
+        Eigen::Map<AccMatrix, Eigen::Unaligned, Eigen::OuterStride<>>(
+            C + static_cast<int64_t>(block) * rows_ + begin, m, n, Eigen::OuterStride<>(ldc)).setZero();
+      Product(packed, begin, m, n, B, ldb, [&](int block) { return ResMapper(C + static_cast<int64_t>(block) * rows_ + begin, ldc); });
+    }
+
+    // 16-bit operands are widened, and the result is accumulated in single precision and
+    // rounded once when it's written back.
+    void Product(const AccT* packed, const int begin, const int m, const int n,
+                 const T* B, const int ldb, T* C, const int ldc, const bool accumulate, std::false_type) const {
+      using Map = Eigen::Map<const Eigen::Matrix<T, Eigen::Dynamic, Eigen::Dynamic, Eigen::ColMajor>, Eigen::Unaligned, Eigen::OuterStride<>>;
+      using MutableMap = Eigen::Map<Eigen::Matrix<T, Eigen::Dynamic, Eigen::Dynamic, Eigen::ColMajor>, Eigen::Unaligned, Eigen::OuterStride<>>;
+      const AccMatrix b = Map(B, depth_, n, Eigen::OuterStride<>(ldb)).template cast<AccT>();
+      AccMatrix c = AccMatrix::Zero(static_cast<Eigen::Index>(m) * blocks_, n);
+      for (int block = 0; block < blocks_ && accumulate; ++block)
+        c.middleRows(static_cast<Eigen::Index>(block) * m, m) =
+            Map(C + static_cast<int64_t>(block) * rows_ + begin, m, n, Eigen::OuterStride<>(ldc)).template cast<AccT>();
+      Product(packed, begin, m, n, b.data(), depth_, [&](int block) { return ResMapper(c.data() + static_cast<int64_t>(block) * m, c.rows()); });
+      for (int block = 0; block < blocks_; ++block)
+        MutableMap(C + static_cast<int64_t>(block) * rows_ + begin, m, n, Eigen::OuterStride<>(ldc)) =
+            c.middleRows(static_cast<Eigen::Index>(block) * m, m).template cast<T>();
+    }
+
+    // Adds the products of every block to the outputs that `result(block)` maps.
+    template<typename Result>
+    void Product(const AccT* packed, const int begin, const int m, const int n,
+                 const AccT* B, const Eigen::Index ldb, const Result& result) const {
+      Eigen::internal::gemm_pack_rhs<AccT, Eigen::Index, RhsMapper, Traits::nr, Eigen::ColMajor> pack_rhs;
+      Eigen::internal::gebp_kernel<AccT, AccT, Eigen::Index, ResMapper, Traits::mr, Traits::nr, false, false> gebp;
+
+      // The right-hand side is packed once per depth block and shared by every row block.
+      Eigen::Matrix<AccT, Eigen::Dynamic, 1> packed_b(static_cast<Eigen::Index>(std::min(kc_, depth_)) * n);
+      for (int k = 0; k < depth_; k += kc_) {
+        const int depth = std::min(kc_, depth_ - k);
+        pack_rhs(packed_b.data(), RhsMapper(B + k, ldb), depth, n);
+        for (int block = 0; block < blocks_; ++block)
+          gebp(result(block), packed + Offset(k, block) + static_cast<int64_t>(begin) * depth, packed_b.data(), m, depth, n, static_cast<AccT>(1));
+      }
+    }
+
+    int blocks_;
+    int rows_;
+    int depth_;
+    int kc_;
+};
+
+// Runs `fn(begin, end)` over hidden units [0, hidden_size) in ranges that start (and,
+// except for the last one, end) on the boundaries that `cpu_packed_lhs::gemm` requires.
+template<typename T, typename Fn>
+void ParallelUnits(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int hidden_size,
+    const int64_t cost_per_unit,
+    const Fn& fn) {
+  const int alignment = cpu_packed_lhs<T>::row_alignment();
+  const int64_t panels = (hidden_size + alignment - 1) / alignment;
+  ParallelRange(parallel_for, panels, cost_per_unit * alignment, [&](int64_t begin, int64_t end) {
+    fn(static_cast<int>(begin * alignment), static_cast<int>(std::min<int64_t>(hidden_size, end * alignment)));
+  });
+}
+
+// Returns `packed_R` if it's set, and otherwise packs the [H,H*gates] recurrent kernel `R`
+// into `storage` and returns that.
+template<typename T>
+const void* PackedRecurrentKernel(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int gates,
+    const int hidden_size,
+    const T* R,
+    const void* packed_R,
+    std::vector<uint8_t>& storage) {
+  if (packed_R)
+    return packed_R;
+  const cpu_packed_lhs<T> recurrent(gates, hidden_size, hidden_size);
+  storage.resize(recurrent.bytes());
+  recurrent.Pack(parallel_for, R, hidden_size * gates, storage.data());
+  return storage.data();
+}
+
+// Packs the transpose of the [H,H*gates] recurrent kernel `R` into `storage` and returns it,
+// for the backward passes to compute dh += R^T * v with
+// `cpu_packed_lhs<T>(1, hidden_size, hidden_size * gates)`. If `dropout_prob` is not 0, the
+// DropConnect mask for `dropout_seed` is applied as it's packed.
+template<typename T>
+const void* PackTransposedRecurrentKernel(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int gates,
+    const int hidden_size,
+    const T* R,
+    const float dropout_prob,
+    const uint64_t dropout_seed,
+    std::vector<uint8_t>& storage) {
+  const cpu_packed_lhs<T> recurrent(1, hidden_size, hidden_size * gates);
+  storage.resize(recurrent.bytes());
+  recurrent.Pack(parallel_for, R, hidden_size * gates, storage.data(), true, dropout_prob, dropout_seed);
+  return storage.data();
+}
+
+// Adds the [m,n] product A * B^T to `dR`, where `A` is [m,k] and `B` is [n,k], both
+// column-major. This is the GEMM that the backward passes accumulate the recurrent kernel
+// gradient with. If `dropout_prob` is not 0, `dR` is the gradient of a kernel that ran with
+// DropConnect, and each block of the product is multiplied by the mask for `dropout_seed`
+// (see `dropconnect::Apply`) as it's added, so the masked gradient never needs a buffer of
+// its own. Element (i,j) of `dR` uses element j*ldr+i of the mask.
+template<typename T>
+void RecurrentKernelGradient(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int m,
+    const int n,
+    const int k,
+    const T* A,
+    const int lda,
+    const T* B,
+    const int ldb,
+    T* dR,
+    const int ldr,
+    const float dropout_prob,
+    const uint64_t dropout_seed) {
+  using AccT = typename cpu_accumulator<T>::type;
+  if (!dropout_prob) {
+    cpu_blas<T>::gemm(parallel_for,
+        false, true,
+        m, n, k,
+        static_cast<T>(1.0),
+        A, lda,
+        B, ldb,
+        static_cast<T>(1.0),
+        dR, ldr);
+    return;
+  }
+
+  const AccT scale = dropout_prob < 1.0f ? static_cast<AccT>(1.0) / (static_cast<AccT>(1.0) - dropout_prob) : static_cast<AccT>(0.0);
+  ParallelRange(parallel_for, n, 2LL * std::max(k, 1) * m, [&](int64_t begin, int64_t end) {
+    const int columns = static_cast<int>(end - begin);
+    typename cpu_blas<T>::Matrix product(m, columns);
+    cpu_blas<T>::gemm(
+        false, true,
+        m, columns, k,
+        static_cast<T>(1.0),
+        A, lda,
+        B + begin, ldb,
+        static_cast<T>(0.0),
+        product.data(), m);
+    for (int j = 0; j < columns; ++j) {
+      for (int i = 0; i < m; ++i) {
+        const int64_t index = (begin + j) * ldr + i;
+        if (zoneout_keep(dropout_seed, index, dropout_prob))
+          dR[index] = static_cast<T>(static_cast<AccT>(dR[index]) + scale * static_cast<AccT>(product(i, j)));
+      }
+    }
+  });
+}
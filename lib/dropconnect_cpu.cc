@@ -0,0 +1,58 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include "haste/cpu/dropconnect.h"
+#include "inline_ops_cpu.h"
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace dropconnect {
+
+// DropConnect masks use the same counter-based generator as zoneout, so they match the
+// GPU implementation element for element.
+template<typename T>
+void Apply(
+    const int64_t size,
+    const float dropout_prob,
+    const uint64_t seed,
+    const T* x,
+    T* y,
+    const ParallelFor& parallel_for) {
+  typedef typename cpu_accumulator<T>::type AccT;
+
+  // With `dropout_prob` = 1 every element is dropped, and a zero scale keeps 0 * inf from
+  // turning them into NaNs.
+  const AccT scale = dropout_prob < 1.0f ? static_cast<AccT>(1.0) / (static_cast<AccT>(1.0) - dropout_prob) : static_cast<AccT>(0.0);
+  const int64_t blocks = (size + kChunkSize - 1) / kChunkSize;
+  ParallelRange(parallel_for, blocks, 16LL * kChunkSize, [&](int64_t begin, int64_t end) {
+    for (int64_t block = begin; block < end; ++block) {
+      const int64_t offset = block * kChunkSize;
+      const int n = static_cast<int>(std::min<int64_t>(kChunkSize, size - offset));
+      VectorMap<T>(y + offset, n) = (Widen<AccT>(ConstVectorMap<T>(x + offset, n))
+          * ZoneoutMask<AccT>(seed, offset, n, dropout_prob) * scale).template cast<T>();
+    }
+  });
+}
+
+template void Apply<float>(const int64_t, const float, const uint64_t, const float*, float*, const ParallelFor&);
+template void Apply<double>(const int64_t, const float, const uint64_t, const double*, double*, const ParallelFor&);
+template void Apply<Eigen::half>(const int64_t, const float, const uint64_t, const Eigen::half*, Eigen::half*, const ParallelFor&);
+template void Apply<Eigen::bfloat16>(const int64_t, const float, const uint64_t, const Eigen::bfloat16*, Eigen::bfloat16*, const ParallelFor&);
+
+}  // namespace dropconnect
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
@@ -0,0 +1,71 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include <algorithm>
+
+#include "haste.h"
+#include "inline_ops.h"
+#include "zoneout_ops.h"
+
+namespace {
+
+// DropConnect masks use the same counter-based generator as zoneout.
+template<typename T, typename AccT>
+__global__
+void DropConnect(
+    const int64_t size,
+    const float dropout_prob,
+    const uint64_t seed,
+    const AccT scale,
+    const T* x,
+    T* y) {
+  const int64_t stride = static_cast<int64_t>(blockDim.x) * gridDim.x;
+  for (int64_t i = static_cast<int64_t>(blockDim.x) * blockIdx.x + threadIdx.x; i < size; i += stride)
+    y[i] = zoneout_keep(seed, i, dropout_prob) ? static_cast<T>(static_cast<AccT>(x[i]) * scale) : static_cast<T>(0.0f);
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace dropconnect {
+
+template<typename T>
+void Apply(
+    const cudaStream_t& stream,
+    const int64_t size,
+    const float dropout_prob,
+    const uint64_t seed,
+    const T* x,
+    T* y) {
+  if (size <= 0)
+    return;
+
+  const int blockDim = 256;
+  const int gridDim = static_cast<int>(std::min<int64_t>((size + blockDim - 1) / blockDim, 4096));
+  // With `dropout_prob` = 1 every element is dropped and the scale is never used.
+  typedef typename accumulator<T>::type AccT;
+  const AccT scale = dropout_prob < 1.0f ? static_cast<AccT>(1.0) / (static_cast<AccT>(1.0) - dropout_prob) : static_cast<AccT>(0.0);
+  DropConnect<T, AccT><<<gridDim, blockDim, 0, stream>>>(size, dropout_prob, seed, scale, x, y);
+}
+
+template void Apply<float>(const cudaStream_t&, const int64_t, const float, const uint64_t, const float*, float*);
+template void Apply<double>(const cudaStream_t&, const int64_t, const float, const uint64_t, const double*, double*);
+template void Apply<__half>(const cudaStream_t&, const int64_t, const float, const uint64_t, const __half*, __half*);
+template void Apply<__nv_bfloat16>(const cudaStream_t&, const int64_t, const float, const uint64_t, const __nv_bfloat16*, __nv_bfloat16*);
+
+}  // namespace dropconnect
+}  // namespace v0
+}  // namespace haste
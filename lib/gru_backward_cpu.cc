@@ -0,0 +1,362 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include "cpu_blas.h"
+#include "haste/cpu/gru.h"
+#include "inline_ops_cpu.h"
+
+namespace {
+
+// Computes hidden units [begin, end) for every batch entry. Padding entries (see the
+// forward pass) carried their state forward unchanged, so their gradients pass straight
+// through and they contribute nothing to the parameter gradients.
+template<typename T, bool ApplyZoneout>
+void PointwiseOperations(const int batch_dim,
+                         const int hidden_dim,
+                         const int begin,
+                         const int end,
+                         const int t,
+                         const int64_t* sequence_length,
+                         const T* h,
+                         const T* v,
+                         const T* dh_new,
+                         T* dbx_out,
+                         T* dbr_out,
+                         T* dh_inout,
+                         T* dp_out,
+                         T* dq_out,
+                         const float zoneout_prob,
+                         const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
+  for (int col = 0; col < batch_dim; ++col) {
+    if (sequence_length && t >= sequence_length[col]) {
+      for (int row = begin; row < end; row += kChunkSize) {
+        const int size = std::min(kChunkSize, end - row);
+
+        const int64_t base_idx = static_cast<int64_t>(col) * hidden_dim + row;
+        const int64_t idx = static_cast<int64_t>(col) * (hidden_dim * 3) + row;
+
+        Slice(dh_inout, base_idx, size) += Slice(dh_new, base_idx, size);
+        for (int gate = 0; gate < 3; ++gate) {
+          Slice(dp_out, idx + gate * hidden_dim, size).setZero();
+          Slice(dq_out, idx + gate * hidden_dim, size).setZero();
+        }
+      }
+      continue;
+    }
+
+    for (int row = begin; row < end; row += kChunkSize) {
+      const int size = std::min(kChunkSize, end - row);
+
+      const int64_t base_idx = static_cast<int64_t>(col) * hidden_dim + row;
+      const int64_t stride4_base_idx = static_cast<int64_t>(col) * (hidden_dim * 4) + row;
+      const int64_t z_idx = stride4_base_idx + 0 * hidden_dim;
+      const int64_t r_idx = stride4_base_idx + 1 * hidden_dim;
+      const int64_t g_idx = stride4_base_idx + 2 * hidden_dim;
+      const int64_t q_g_idx = stride4_base_idx + 3 * hidden_dim;
+
+      const auto z = Slice(v, z_idx, size);
+      const auto r = Slice(v, r_idx, size);
+      const auto g = Slice(v, g_idx, size);
+      const auto q_g = Slice(v, q_g_idx, size);
+      const auto prev_h = Slice(h, base_idx, size);
+
+      Chunk<T> dh_total = Slice(dh_new, base_idx, size) + Slice(dh_inout, base_idx, size);
+
+      if (ApplyZoneout) {
+        const auto mask = ZoneoutMask<T>(zoneout_seed, base_idx, size, zoneout_prob);
+        Slice(dh_inout, base_idx, size) = (static_cast<T>(1.0) - mask) * dh_total;
+        dh_total *= mask;
+        Slice(dh_inout, base_idx, size) += z * dh_total;
+      } else {
+        Slice(dh_inout, base_idx, size) = z * dh_total;
+      }
+
+      const Chunk<T> dp_g = d_tanh(g) * (static_cast<T>(1.0) - z) * dh_total;
+      const Chunk<T> dq_g = dp_g * r;
+      const Chunk<T> dp_r = d_sigmoid(r) * dp_g * q_g;
+      const Chunk<T> dp_z = d_sigmoid(z) * (prev_h - g) * dh_total;
+
+      const int64_t idx = static_cast<int64_t>(col) * (hidden_dim * 3) + row;
+
+      Slice(dp_out, idx + 0 * hidden_dim, size) = dp_z;
+      Slice(dp_out, idx + 1 * hidden_dim, size) = dp_r;
+      Slice(dp_out, idx + 2 * hidden_dim, size) = dp_g;
+
+      Slice(dq_out, idx + 0 * hidden_dim, size) = dp_z;
+      Slice(dq_out, idx + 1 * hidden_dim, size) = dp_r;
+      Slice(dq_out, idx + 2 * hidden_dim, size) = dq_g;
+
+      Slice(dbx_out, row + 0 * hidden_dim, size) += dp_z;
+      Slice(dbx_out, row + 1 * hidden_dim, size) += dp_r;
+      Slice(dbx_out, row + 2 * hidden_dim, size) += dp_g;
+
+      Slice(dbr_out, row + 0 * hidden_dim, size) += dp_z;
+      Slice(dbr_out, row + 1 * hidden_dim, size) += dp_r;
+      Slice(dbr_out, row + 2 * hidden_dim, size) += dq_g;
+    }
+  }
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace gru {
+
+template<typename T>
+struct BackwardPass<T>::private_data {
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<uint8_t> packed_R;
+};
+
+template<typename T>
+BackwardPass<T>::BackwardPass(
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+}
+
+template<typename T>
+BackwardPass<T>::~BackwardPass() {
+  delete data_;
+}
+
+template<typename T>
+void BackwardPass<T>::Iterate(
+    const T* W,       // [C,H*3]
+    const T* R,       // [H,H*3]
+    const T* bx,      // [H*3]
+    const T* br,      // [H*3]
+    const T* x,       // [N,C]
+    const T* h,       // [N,H]
+    const T* v,       // [N,H*4]
+    const T* dh_new,  // [N,H]
+    T* dx,            // [N,C]
+    T* dW,            // [C,H*3]
+    T* dR,            // [H,H*3]
+    T* dbx,           // [H*3]
+    T* dbr,           // [H*3]
+    T* dh,            // [N,H]
+    T* dp,            // [N,H*3]
+    T* dq,            // [N,H*3]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
+  const T beta_assign = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  IterateInternal(
+      0,
+      nullptr,
+      PackTransposedRecurrentKernel(parallel_for, 3, hidden_size, R, 0.0f, 0, data_->packed_R),
+      h,
+      v,
+      dh_new,
+      dbx,
+      dbr,
+      dh,
+      dp,
+      dq,
+      zoneout_prob,
+      zoneout_seed);
+
+  if (dW) {
+    cpu_blas<T>::gemm(parallel_for,
+        false, true,
+        hidden_size * 3, input_size, batch_size,
+        alpha,
+        dp, hidden_size * 3,
+        x, input_size,
+        beta_sum,
+        dW, hidden_size * 3);
+  }
+
+  if (dx) {
+    cpu_blas<T>::gemm(parallel_for,
+        true, false,
+        input_size, batch_size, hidden_size * 3,
+        alpha,
+        W, hidden_size * 3,
+        dp, hidden_size * 3,
+        beta_assign,
+        dx, input_size);
+  }
+
+  if (dR) {
+    cpu_blas<T>::gemm(parallel_for,
+        false, true,
+        hidden_size * 3, hidden_size, batch_size,
+        alpha,
+        dq, hidden_size * 3,
+        h, hidden_size,
+        beta_sum,
+        dR, hidden_size * 3);
+  }
+}
+
+template<typename T>
+void BackwardPass<T>::IterateInternal(
+    const int t,
+    const int64_t* sequence_length,  // [N]
+    const void* packed_Rt,           // R^T packed by `PackTransposedRecurrentKernel`
+    const T* h,       // [N,H]
+    const T* v,       // [N,H*4]
+    const T* dh_new,  // [N,H]
+    T* dbx,           // [H*3]
+    T* dbr,           // [H*3]
+    T* dh,            // [N,H]
+    T* dp,            // [N,H*3]
+    T* dq,            // [N,H*3]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const int batch_size = data_->batch_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  const int64_t cost_per_unit = 3LL * batch_size * 16;
+  ParallelRange(parallel_for, hidden_size, cost_per_unit, [&](int64_t begin, int64_t end) {
+    if (zoneout_prob) {
+      PointwiseOperations<T, true>(batch_size, hidden_size, begin, end,
+          t, sequence_length, h, v, dh_new, dbx, dbr, dh, dp, dq, zoneout_prob, zoneout_seed);
+    } else {
+      PointwiseOperations<T, false>(batch_size, hidden_size, begin, end,
+          t, sequence_length, h, v, dh_new, dbx, dbr, dh, dp, dq, 0.0f, 0);
+    }
+  });
+
+  const cpu_packed_lhs<T> recurrent_t(1, hidden_size, hidden_size * 3);
+  ParallelUnits<T>(parallel_for, hidden_size, 2LL * hidden_size * 3 * batch_size, [&](int begin, int end) {
+    recurrent_t.gemm(packed_Rt, begin, end, batch_size, dq, hidden_size * 3, dh, hidden_size, true);
+  });
+}
+
+template<typename T>
+void BackwardPass<T>::Run(
+    const int steps,
+    const T* W,       // [C,H*3]
+    const T* R,       // [H,H*3]
+    const T* bx,      // [H*3]
+    const T* br,      // [H*3]
+    const T* x,       // [T,N,C]
+    const T* h,       // [T+1,N,H]
+    const T* v,       // [T,N,H*4]
+    const T* dh_new,  // [T+1,N,H]
+    T* dx,            // [T,N,C]
+    T* dW,            // [C,H*3]
+    T* dR,            // [H,H*3]
+    T* dbx,           // [H*3]
+    T* dbr,           // [H*3]
+    T* dh,            // [N,H]
+    T* dp,            // [T,N,H*3]
+    T* dq,            // [T,N,H*3]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const float dropout_prob,
+    const uint64_t dropout_seed) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
+  const T beta_assign = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  // Visit the time steps in the opposite order of the forward pass; see
+  // `ForwardPass::Run` for the state layout when `reverse` is set.
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  // Every step multiplies by the same R^T, so it's packed (with the DropConnect mask
+  // applied, if any) once for all of them.
+  const void* packed_Rt = PackTransposedRecurrentKernel(
+      parallel_for, 3, hidden_size, R, dropout_prob, dropout_seed, data_->packed_R);
+  for (int i = steps - 1; i >= 0; --i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const int in = reverse ? t + 1 : t;
+    const int out = reverse ? t : t + 1;
+    IterateInternal(
+        t,
+        sequence_length,
+        packed_Rt,
+        h + in * NH,
+        v + t * NH * 4,
+        dh_new + out * NH,
+        dbx,
+        dbr,
+        dh,
+        dp + t * NH * 3,
+        dq + t * NH * 3,
+        zoneout_prob,
+        zoneout_seed + t);
+  }
+
+  // The recurrent matrix sees the input state of every step: h[0:T], or h[1:T+1] in reverse.
+  const T* h_in = reverse ? h + NH : h;
+
+  if (dW) {
+    cpu_blas<T>::gemm(parallel_for,
+        false, true,
+        hidden_size * 3, input_size, batch_size * steps,
+        alpha,
+        dp, hidden_size * 3,
+        x, input_size,
+        beta_sum,
+        dW, hidden_size * 3);
+  }
+
+  // With DropConnect, the recurrent kernel gradient is masked as it's added.
+  if (dR) {
+    RecurrentKernelGradient(parallel_for,
+        hidden_size * 3, hidden_size, batch_size * steps,
+        dq, hidden_size * 3,
+        h_in, hidden_size,
+        dR, hidden_size * 3,
+        dropout_prob, dropout_seed);
+  }
+
+  if (dx) {
+    cpu_blas<T>::gemm(parallel_for,
+        true, false,
+        input_size, batch_size * steps, hidden_size * 3,
+        alpha,
+        W, hidden_size * 3,
+        dp, hidden_size * 3,
+        beta_assign,
+        dx, input_size);
+  }
+}
+
+template class BackwardPass<float>;
+template class BackwardPass<double>;
+
+}  // namespace gru
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
@@ -19,6 +19,7 @@
 #include "blas.h"
 #include "haste.h"
 #include "inline_ops.h"
+#include "zoneout_ops.h"
 
 namespace {
 
@@ -26,7 +27,7 @@ template<typename T, bool ApplyZoneout>
 __global__
 void PointwiseOperations(const int batch_dim,
                          const int hidden_dim,
-                         const T* h_t,
+                         const T* h,
                          const T* v,
                          const T* dh_new,
                          T* dbx_out,
@@ -34,7 +35,8 @@ void PointwiseOperations(const int batch_dim,
                          T* dh_inout,
                          T* dp_out,
                          T* dq_out,
-                         const T* zoneout_mask) {  // Zoneout mask (only used if ApplyZoneout==true)
+                         const float zoneout_prob,
+                         const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
   const int row = blockDim.x * blockIdx.x + threadIdx.x;
   const int col = blockDim.y * blockIdx.y + threadIdx.y;
 
@@ -42,7 +44,6 @@ void PointwiseOperations(const int batch_dim,
     return;
 
   const int base_idx = col * hidden_dim + row;
-  const int base_idx_t = row * batch_dim + col;
 
   T dh_total = dh_new[base_idx] + dh_inout[base_idx];
 
@@ -58,7 +59,7 @@ void PointwiseOperations(const int batch_dim,
   const T q_g = v[q_g_idx];
 
   if (ApplyZoneout) {
-    const T mask = zoneout_mask[base_idx];
+    const T mask = zoneout_keep(zoneout_seed, base_idx, zoneout_prob) ? static_cast<T>(1.0) : static_cast<T>(0.0);
     dh_inout[base_idx] = (static_cast<T>(1.0) - mask) * dh_total;
     dh_total = mask * dh_total;
     dh_inout[base_idx] += z * dh_total;
@@ -67,7 +68,7 @@ void PointwiseOperations(const int batch_dim,
   }
 
   const T dg = (static_cast<T>(1.0) - z) * dh_total;
-  const T dz = (h_t[base_idx_t] - g) * dh_total;
+  const T dz = (h[base_idx] - g) * dh_total;
   const T dp_g = d_tanh(g) * dg;
   const T dq_g = dp_g * r;
   const T dr = dp_g * q_g;
@@ -138,12 +139,12 @@ BackwardPass<T>::~BackwardPass() {
 
 template<typename T>
 void BackwardPass<T>::Iterate(
-    const T* W_t,     // [H*3,C]
-    const T* R_t,     // [H*3,H]
+    const T* W,       // [C,H*3]
+    const T* R,       // [H,H*3]
     const T* bx,      // [H*3]
     const T* br,      // [H*3]
-    const T* x_t,     // [C,N]
-    const T* h_t,     // [H,N]
+    const T* x,       // [N,C]
+    const T* h,       // [N,H]
     const T* v,       // [N,H*4]
     const T* dh_new,  // [N,H]
     T* dx,            // [N,C]
@@ -154,7 +155,8 @@ void BackwardPass<T>::Iterate(
     T* dh,            // [N,H]
     T* dp,            // [N,H*3]
     T* dq,            // [N,H*3]
-    const T* zoneout_mask) {  // [N,H]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
   const T alpha = static_cast<T>(1.0);
   const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
   const T beta_assign = static_cast<T>(0.0);
@@ -176,11 +178,11 @@ void BackwardPass<T>::Iterate(
       (hidden_size + blockDim.x - 1) / blockDim.x,
       (batch_size + blockDim.y - 1) / blockDim.y);
 
-  if (zoneout_mask) {
+  if (zoneout_prob) {
     PointwiseOperations<T, true><<<gridDim, blockDim, 0, stream1>>>(
         batch_size,
         hidden_size,
-        h_t,
+        h,
         v,
         dh_new,
         dbx,
@@ -188,13 +190,14 @@ void BackwardPass<T>::Iterate(
         dh,
         dp,
         dq,
-        zoneout_mask
+        zoneout_prob,
+        zoneout_seed
     );
   } else {
     PointwiseOperations<T, false><<<gridDim, blockDim, 0, stream1>>>(
         batch_size,
         hidden_size,
-        h_t,
+        h,
         v,
         dh_new,
         dbx,
@@ -202,7 +205,8 @@ void BackwardPass<T>::Iterate(
         dh,
         dp,
         dq,
-        nullptr
+        0.0f,
+        0
     );
   }
   cudaEventRecord(event, stream1);
@@ -211,45 +215,51 @@ void BackwardPass<T>::Iterate(
   // data dependency between its output (`dp`, `dq`) and the following matmuls.
   cudaStreamWaitEvent(stream2, event, 0);
 
-  cublasSetStream(blas_handle, stream1);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      hidden_size * 3, input_size, batch_size,
-      &alpha,
-      dp, hidden_size * 3,
-      x_t, batch_size,
-      &beta_sum,
-      dW, hidden_size * 3);
+  if (dW) {
+    cublasSetStream(blas_handle, stream1);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_N, CUBLAS_OP_T,
+        hidden_size * 3, input_size, batch_size,
+        &alpha,
+        dp, hidden_size * 3,
+        x, input_size,
+        &beta_sum,
+        dW, hidden_size * 3);
+  }
 
-  cublasSetStream(blas_handle, stream2);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      input_size, batch_size, hidden_size * 3,
-      &alpha,
-      W_t, input_size,
-      dp, hidden_size * 3,
-      &beta_assign,
-      dx, input_size);
+  if (dx) {
+    cublasSetStream(blas_handle, stream2);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_T, CUBLAS_OP_N,
+        input_size, batch_size, hidden_size * 3,
+        &alpha,
+        W, hidden_size * 3,
+        dp, hidden_size * 3,
+        &beta_assign,
+        dx, input_size);
+  }
 
-  cublasSetStream(blas_handle, stream2);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      hidden_size * 3, hidden_size, batch_size,
-      &alpha,
-      dq, hidden_size * 3,
-      h_t, batch_size,
-      &beta_sum,
-      dR, hidden_size * 3);
+  if (dR) {
+    cublasSetStream(blas_handle, stream2);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_N, CUBLAS_OP_T,
+        hidden_size * 3, hidden_size, batch_size,
+        &alpha,
+        dq, hidden_size * 3,
+        h, hidden_size,
+        &beta_sum,
+        dR, hidden_size * 3);
+  }
 
   // There's a data dependency between the output of this kernel (`dh`) and the input to
   // the pointwise op kernel above (`dh`). Make sure both kernels run on the same stream
   // to avoid explicit stream synchronization.
   cublasSetStream(blas_handle,  stream1);
   blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
+      CUBLAS_OP_T, CUBLAS_OP_N,
       hidden_size, batch_size, hidden_size * 3,
       &alpha,
-      R_t, hidden_size,
+      R, hidden_size * 3,
       dq, hidden_size * 3,
       &beta_sum,
       dh, hidden_size);
@@ -0,0 +1,416 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include <algorithm>
+#include <vector>
+
+#include "cpu_blas.h"
+#include "haste/cpu/gru.h"
+#include "inline_ops_cpu.h"
+#include "int8_cpu.h"
+
+namespace {
+
+// Computes hidden units [begin, end) for every batch entry. `h` and `h_out` may be
+// aliased. Batch entries whose `sequence_length` doesn't cover time step `t` are padding:
+// their state is carried forward unchanged.
+template<typename T, bool Training, bool ApplyZoneout>
+void PointwiseOperations(const int batch_dim,
+                         const int hidden_dim,
+                         const int begin,
+                         const int end,
+                         const int t,
+                         const int64_t* sequence_length,
+                         const T* Wx,
+                         const T* Rh,
+                         const T* bx,
+                         const T* br,
+                         const T* h,
+                         T* h_out,
+                         T* v_out,
+                         const float zoneout_prob,
+                         const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
+  for (int col = 0; col < batch_dim; ++col) {
+    if (sequence_length && t >= sequence_length[col]) {
+      const int64_t h_idx = static_cast<int64_t>(col) * hidden_dim + begin;
+      std::copy(h + h_idx, h + h_idx + (end - begin), h_out + h_idx);
+      continue;
+    }
+
+    for (int row = begin; row < end; row += kChunkSize) {
+      const int size = std::min(kChunkSize, end - row);
+
+      const int64_t weight_idx = static_cast<int64_t>(col) * (hidden_dim * 3) + row;
+
+      // Index into the `h` and `h_out` vectors (they have a stride of `hidden_dim`).
+      const int64_t output_idx = static_cast<int64_t>(col) * hidden_dim + row;
+
+      // Indicies into the Wx and Rh matrices (for each of the u, r, and e components).
+      const int64_t z_idx = weight_idx + 0 * hidden_dim;
+      const int64_t r_idx = weight_idx + 1 * hidden_dim;
+      const int64_t g_idx = weight_idx + 2 * hidden_dim;
+
+      // Indices into the bias vectors (for each of the u, r, and e components).
+      const int bz_idx = row + 0 * hidden_dim;
+      const int br_idx = row + 1 * hidden_dim;
+      const int bg_idx = row + 2 * hidden_dim;
+
+      const Chunk<T> z = (Slice(Wx, z_idx, size) + Slice(Rh, z_idx, size) + Slice(bx, bz_idx, size) + Slice(br, bz_idx, size)).logistic();
+      const Chunk<T> r = (Slice(Wx, r_idx, size) + Slice(Rh, r_idx, size) + Slice(bx, br_idx, size) + Slice(br, br_idx, size)).logistic();
+      const Chunk<T> q_g = Slice(Rh, g_idx, size) + Slice(br, bg_idx, size);
+      const Chunk<T> g = (Slice(Wx, g_idx, size) + r * q_g + Slice(bx, bg_idx, size)).tanh();
+
+      // Store internal activations if we're eventually going to backprop.
+      if (Training) {
+        const int64_t base_v_idx = static_cast<int64_t>(col) * (hidden_dim * 4) + row;
+        Slice(v_out, base_v_idx + 0 * hidden_dim, size) = z;
+        Slice(v_out, base_v_idx + 1 * hidden_dim, size) = r;
+        Slice(v_out, base_v_idx + 2 * hidden_dim, size) = g;
+        Slice(v_out, base_v_idx + 3 * hidden_dim, size) = q_g;
+      }
+
+      const auto prev_h = Slice(h, output_idx, size);
+      auto cur_h = Slice(h_out, output_idx, size);
+
+      if (ApplyZoneout) {
+        if (Training) {
+          const auto mask = ZoneoutMask<T>(zoneout_seed, output_idx, size, zoneout_prob);
+          cur_h = (z * prev_h + (static_cast<T>(1.0) - z) * g - prev_h) * mask + prev_h;
+        } else {
+          cur_h = static_cast<T>(zoneout_prob) * prev_h +
+                  static_cast<T>(1.0f - zoneout_prob) * (z * prev_h + (static_cast<T>(1.0) - z) * g);
+        }
+      } else {
+        cur_h = z * prev_h + (static_cast<T>(1.0) - z) * g;
+      }
+    }
+  }
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace gru {
+
+template<typename T>
+struct ForwardPass<T>::private_data {
+  bool training;
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<uint8_t> packed_R;
+};
+
+template<typename T>
+ForwardPass<T>::ForwardPass(
+    const bool training,
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->training = training;
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+}
+
+template<typename T>
+ForwardPass<T>::~ForwardPass() {
+  delete data_;
+}
+
+template<typename T>
+int64_t ForwardPass<T>::PackedRecurrentKernelSize() const {
+  return cpu_packed_lhs<T>(3, data_->hidden_size, data_->hidden_size).bytes();
+}
+
+template<typename T>
+void ForwardPass<T>::PackRecurrentKernel(
+    const T* R,
+    void* packed_R,
+    const float dropout_prob,
+    const uint64_t dropout_seed) {
+  const int hidden_size = data_->hidden_size;
+  cpu_packed_lhs<T>(3, hidden_size, hidden_size).Pack(
+      data_->parallel_for, R, hidden_size * 3, packed_R, false, dropout_prob, dropout_seed);
+}
+
+template<typename T>
+void ForwardPass<T>::Iterate(
+    const T* W,  // [C,H*3]
+    const T* R,  // [H,H*3]
+    const T* bx, // [H*3]
+    const T* br, // [H*3]
+    const T* x,  // [N,C]
+    const T* h,  // [N,H]
+    T* h_out,    // [N,H]
+    T* v_out,    // [N,H*4]
+    T* tmp_Wx,   // [N,H*3]
+    T* tmp_Rh,   // [N,H*3]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const void* packed_R) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+
+  cpu_blas<T>::gemm(data_->parallel_for,
+      false, false,
+      hidden_size * 3, batch_size, input_size,
+      alpha,
+      W, hidden_size * 3,
+      x, input_size,
+      beta,
+      tmp_Wx, hidden_size * 3);
+
+  IterateInternal(
+      0,
+      nullptr,
+      PackedRecurrentKernel(data_->parallel_for, 3, hidden_size, R, packed_R, data_->packed_R),
+      bx,
+      br,
+      h,
+      h_out,
+      v_out,
+      tmp_Wx,
+      tmp_Rh,
+      zoneout_prob,
+      zoneout_seed);
+}
+
+template<typename T>
+void ForwardPass<T>::IterateInternal(
+    const int t,
+    const int64_t* sequence_length,  // [N]
+    const void* packed_R,  // Packed recurrent weight matrix
+    const T* bx, // [H*3]
+    const T* br, // [H*3]
+    const T* h,  // [N,H]
+    T* h_out,    // [N,H]
+    T* v_out,    // [N,H*4]
+    T* tmp_Wx,   // [N,H*3]
+    T* tmp_Rh,   // [N,H*3]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const bool training = data_->training;
+  const int batch_size = data_->batch_size;
+  const int hidden_size = data_->hidden_size;
+  const cpu_packed_lhs<T> recurrent(3, hidden_size, hidden_size);
+
+  // See `lstm::ForwardPass::IterateInternal`: the recurrent matmul can only be fused into
+  // the per-thread pointwise pass when the hidden state is double buffered.
+  const bool fused = h != h_out;
+
+  if (!fused) {
+    ParallelUnits<T>(data_->parallel_for, hidden_size, 6LL * batch_size * hidden_size, [&](int begin, int end) {
+      recurrent.gemm(packed_R, begin, end, batch_size, h, hidden_size, tmp_Rh, hidden_size * 3);
+    });
+  }
+
+  const int64_t cost_per_unit = 3LL * batch_size * (2 * hidden_size + 16);
+  ParallelUnits<T>(data_->parallel_for, hidden_size, cost_per_unit, [&](int begin, int end) {
+    if (fused)
+      recurrent.gemm(packed_R, begin, end, batch_size, h, hidden_size, tmp_Rh, hidden_size * 3);
+
+    if (training) {
+      if (zoneout_prob) {
+        PointwiseOperations<T, true, true>(batch_size, hidden_size, begin, end,
+            t, sequence_length, tmp_Wx, tmp_Rh, bx, br, h, h_out, v_out, zoneout_prob, zoneout_seed);
+      } else {
+        PointwiseOperations<T, true, false>(batch_size, hidden_size, begin, end,
+            t, sequence_length, tmp_Wx, tmp_Rh, bx, br, h, h_out, v_out, 0.0f, 0);
+      }
+    } else {
+      if (zoneout_prob) {
+        PointwiseOperations<T, false, true>(batch_size, hidden_size, begin, end,
+            t, sequence_length, tmp_Wx, tmp_Rh, bx, br, h, h_out, nullptr, zoneout_prob, zoneout_seed);
+      } else {
+        PointwiseOperations<T, false, false>(batch_size, hidden_size, begin, end,
+            t, sequence_length, tmp_Wx, tmp_Rh, bx, br, h, h_out, nullptr, 0.0f, 0);
+      }
+    }
+  });
+}
+
+template<typename T>
+void ForwardPass<T>::Run(
+    const int steps,
+    const T* W,  // [C,H*3]
+    const T* R,  // [H,H*3]
+    const T* bx, // [H*3]
+    const T* br, // [H*3]
+    const T* x,  // [T,N,C]
+    T* h,        // [T+1,N,H]
+    T* v,        // [T,N,H*4]
+    T* tmp_Wx,   // [T,N,H*3]
+    T* tmp_Rh,   // [N,H*3]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const void* packed_R) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta = static_cast<T>(0.0);
+
+  const bool training = data_->training;
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+
+  // Input projection for every time step in one large GEMM.
+  cpu_blas<T>::gemm(data_->parallel_for,
+      false, false,
+      hidden_size * 3, steps * batch_size, input_size,
+      alpha,
+      W, hidden_size * 3,
+      x, input_size,
+      beta,
+      tmp_Wx, hidden_size * 3);
+
+  // Every step multiplies by the same R, so it's packed (at most) once for all of them.
+  packed_R = PackedRecurrentKernel(data_->parallel_for, 3, hidden_size, R, packed_R, data_->packed_R);
+
+  // Time step slots are assigned as in `lstm::ForwardPass::Run`: in reverse, step `t` reads
+  // its state from slot t+1 and writes it to slot t.
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  for (int i = 0; i < steps; ++i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const int in = reverse ? t + 1 : t;
+    const int out = reverse ? t : t + 1;
+    IterateInternal(
+        t,
+        sequence_length,
+        packed_R,
+        bx,
+        br,
+        h + in * NH,
+        h + out * NH,
+        training ? v + t * NH * 4 : nullptr,
+        tmp_Wx + t * NH * 3,
+        tmp_Rh,
+        zoneout_prob,
+        zoneout_seed + t);
+  }
+}
+
+template class ForwardPass<float>;
+template class ForwardPass<double>;
+
+template<typename T>
+struct QuantizedForwardPass<T>::private_data {
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<int8_t> x_q;
+  std::vector<float> x_scale;
+  std::vector<int8_t> h_q;
+  std::vector<float> h_scale;
+};
+
+template<typename T>
+QuantizedForwardPass<T>::QuantizedForwardPass(
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+  data_->h_q.resize(static_cast<int64_t>(batch_size) * hidden_size);
+  data_->h_scale.resize(batch_size);
+}
+
+template<typename T>
+QuantizedForwardPass<T>::~QuantizedForwardPass() {
+  delete data_;
+}
+
+template<typename T>
+void QuantizedForwardPass<T>::Run(
+    const int steps,
+    const int8_t* W_q,     // [H*3,C]
+    const float* W_scale,  // [H*3]
+    const int8_t* R_q,     // [H*3,H]
+    const float* R_scale,  // [H*3]
+    const T* bx,           // [H*3]
+    const T* br,           // [H*3]
+    const T* x,            // [T,N,C]
+    T* h,                  // [T+1,N,H]
+    T* tmp_Wx,             // [T,N,H*3]
+    T* tmp_Rh,             // [N,H*3]
+    const float zoneout_prob) {
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  // Input projection for every time step in one large product.
+  const int64_t columns = static_cast<int64_t>(steps) * batch_size;
+  data_->x_q.resize(columns * input_size);
+  data_->x_scale.resize(columns);
+  QuantizeRows(parallel_for, columns, input_size, x, data_->x_q.data(), data_->x_scale.data());
+  Int8Gemm(parallel_for, hidden_size * 3, columns, input_size,
+      W_q, W_scale, data_->x_q.data(), data_->x_scale.data(), tmp_Wx, hidden_size * 3);
+
+  int8_t* h_q = data_->h_q.data();
+  float* h_scale = data_->h_scale.data();
+
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  const int64_t cost_per_unit = 3LL * batch_size * (2 * hidden_size + 16);
+  for (int i = 0; i < steps; ++i) {
+    const T* h_in = h + i * NH;
+    T* h_out = h + (i + 1) * NH;
+    const T* step_Wx = tmp_Wx + i * NH * 3;
+
+    // Every thread reads all of the quantized state, so it's produced in its own pass.
+    QuantizeRows(parallel_for, batch_size, hidden_size, h_in, h_q, h_scale);
+
+    ParallelRange(parallel_for, hidden_size, cost_per_unit, [&](int64_t begin64, int64_t end64) {
+      const int begin = static_cast<int>(begin64);
+      const int end = static_cast<int>(end64);
+
+      for (int gate = 0; gate < 3; ++gate) {
+        const int row = gate * hidden_size;
+        Int8Gemm(row + begin, row + end, batch_size, hidden_size,
+            R_q, R_scale, h_q, h_scale, tmp_Rh, hidden_size * 3);
+      }
+
+      if (zoneout_prob) {
+        PointwiseOperations<T, false, true>(batch_size, hidden_size, begin, end,
+            0, nullptr, step_Wx, tmp_Rh, bx, br, h_in, h_out, nullptr, zoneout_prob, 0);
+      } else {
+        PointwiseOperations<T, false, false>(batch_size, hidden_size, begin, end,
+            0, nullptr, step_Wx, tmp_Rh, bx, br, h_in, h_out, nullptr, 0.0f, 0);
+      }
+    });
+  }
+}
+
+template class QuantizedForwardPass<float>;
+template class QuantizedForwardPass<double>;
+
+}  // namespace gru
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
@@ -19,6 +19,7 @@
 #include "blas.h"
 #include "haste.h"
 #include "inline_ops.h"
+#include "zoneout_ops.h"
 
 namespace {
 
@@ -34,7 +35,7 @@ void PointwiseOperations(const int batch_dim,
                          T* h_out,
                          T* v_out,
                          const float zoneout_prob,
-                         const T* zoneout_mask) {  // Zoneout mask (only used if ApplyZoneout==true)
+                         const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
   const int row = blockDim.x * blockIdx.x + threadIdx.x;
   const int col = blockDim.y * blockIdx.y + threadIdx.y;
 
@@ -73,7 +74,8 @@ void PointwiseOperations(const int batch_dim,
 
   if (ApplyZoneout) {
     if (Training) {
-      cur_h_value = (cur_h_value - h[output_idx]) * zoneout_mask[output_idx] + h[output_idx];
+      if (!zoneout_keep(zoneout_seed, output_idx, zoneout_prob))
+        cur_h_value = h[output_idx];
     } else {
       cur_h_value = (zoneout_prob * h[output_idx]) + ((1.0f - zoneout_prob) * cur_h_value);
     }
@@ -139,7 +141,7 @@ void ForwardPass<T>::Iterate(
     T* tmp_Wx,   // [N,H*3]
     T* tmp_Rh,   // [N,H*3]
     const float zoneout_prob,
-    const T* zoneout_mask) { // Zoneout mask [N,H]
+    const uint64_t zoneout_seed) {
   // Constants for GEMM
   static const T alpha = static_cast<T>(1.0);
   static const T beta = static_cast<T>(0.0);
@@ -186,7 +188,7 @@ void ForwardPass<T>::Iterate(
   cudaStreamWaitEvent(stream1, event, 0);
 
   if (training) {
-    if (zoneout_prob && zoneout_mask) {
+    if (zoneout_prob) {
       PointwiseOperations<T, true, true><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
           hidden_size,
@@ -198,7 +200,7 @@ void ForwardPass<T>::Iterate(
           h_out,
           v_out,
           zoneout_prob,
-          zoneout_mask);
+          zoneout_seed);
     } else {
       PointwiseOperations<T, true, false><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
@@ -211,10 +213,10 @@ void ForwardPass<T>::Iterate(
           h_out,
           v_out,
           0.0f,
-          nullptr);
+          0);
     }
   } else {
-    if (zoneout_prob && zoneout_mask) {
+    if (zoneout_prob) {
       PointwiseOperations<T, false, true><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
           hidden_size,
@@ -226,7 +228,7 @@ void ForwardPass<T>::Iterate(
           h_out,
           nullptr,
           zoneout_prob,
-          zoneout_mask);
+          zoneout_seed);
     } else {
       PointwiseOperations<T, false, false><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
@@ -239,7 +241,7 @@ void ForwardPass<T>::Iterate(
           h_out,
           nullptr,
           0.0f,
-          nullptr);
+          0);
     }
   }
 
@@ -17,7 +17,8 @@
 
 // GENERAL NOTES:
 // No pointers may be null unless otherwise specified.
-// All pointers are expected to point to device memory.
+// All pointers are expected to point to device memory, except for those passed to the
+// classes in `haste::v0::cpu` which must point to host memory.
 // The square brackets below describe tensor shapes, where
 //     T = number of RNN time steps
 //     N = batch size
@@ -29,3 +30,10 @@
 #include "haste/gru.h"
 #include "haste/layer_norm.h"
 #include "haste/layer_norm_lstm.h"
+#include "haste/dropconnect.h"
+#include "haste/cpu/lstm.h"
+#include "haste/cpu/gru.h"
+#include "haste/cpu/layer_norm.h"
+#include "haste/cpu/layer_norm_lstm.h"
+#include "haste/cpu/dropconnect.h"
+#include "haste/cpu/quantize.h"
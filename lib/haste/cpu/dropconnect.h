@@ -0,0 +1,46 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cstdint>
+
+#include "haste/cpu/parallel.h"
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace dropconnect {
+
+// CPU implementation of `haste::v0::dropconnect::Apply`. Both pointers must point to host
+// memory, and the masks are identical to the GPU implementation's for the same seed.
+//
+// x: [size]
+// y: [size]; may be the same as `x`.
+// parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+//     OpenMP is used.
+template<typename T>
+void Apply(
+    const int64_t size,
+    const float dropout_prob,
+    const uint64_t seed,
+    const T* x,
+    T* y,
+    const ParallelFor& parallel_for = ParallelFor());
+
+}  // namespace dropconnect
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
@@ -0,0 +1,404 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cstdint>
+
+#include "haste/cpu/parallel.h"
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace gru {
+
+// CPU implementation of `haste::v0::gru::ForwardPass`. All pointers must point to host
+// memory. Tensor layouts, including the contents of `v`, are identical to the GPU
+// implementation so the two may be used interchangeably.
+template<typename T>
+class ForwardPass {
+  public:
+    // training: `true` if the caller intends to perform a backward pass to compute gradients.
+    // batch_size: the number of training/inference inputs provided in each tensor.
+    // input_size: the dimension of each input vector.
+    // hidden_size: the expected dimension of each output vector.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    ForwardPass(
+        const bool training,
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~ForwardPass();
+
+    // The size in bytes of the buffer that `PackRecurrentKernel` fills.
+    int64_t PackedRecurrentKernelSize() const;
+
+    // Packs the recurrent weight matrix into the layout that the recurrent matmul of each
+    // time step reads. `Run` packs `R` once per call unless it's given a packed copy, so
+    // callers that run the same weights many times (e.g. in inference) can pack them once
+    // and reuse the result for as long as `R` doesn't change.
+    //
+    // R: [H,H*3] the recurrent weight matrix.
+    // packed_R: [PackedRecurrentKernelSize() bytes] the packed matrix. It doesn't refer to
+    //     `R` and has no alignment requirements.
+    // dropout_prob: if not 0, the DropConnect mask for `dropout_seed` is applied to the
+    //     packed copy, so passes given this copy run with DropConnect while `R` stays as it
+    //     is. The mask matches `dropconnect::Apply` on `R` with the same seed. Pass the same
+    //     values to `BackwardPass::Run`.
+    // dropout_seed: the seed of the DropConnect mask.
+    void PackRecurrentKernel(
+        const T* R,
+        void* packed_R,
+        const float dropout_prob = 0.0f,
+        const uint64_t dropout_seed = 0);
+
+    // Performs one forward iteration of the GRU cell.
+    //
+    // W: [C,H*3] the input weight matrix.
+    // R: [H,H*3] the recurrent weight matrix.
+    // bx: [H*3] the bias for the input weight matrix.
+    // br: [H*3] the bias for the recurrent weight matrix.
+    // x: [N,C] the GRU input for this iteration (N vectors, each with dimension C).
+    // h: [N,H] the t-1 iteration's `h_out` or the initial hidden state if this is the
+    //     t=0 iteration (typically zeros).
+    // h_out: [N,H] the GRU's output, and the input to the next iteration's `h`. This
+    //     pointer may be the same as `h`. Each iteration may reuse the same memory region.
+    // v: [N,H*4] if `training` is `false`, this can be a null pointer. If `training` is
+    //     `true`, this vector will contain intermediate activations for this iteration which
+    //     must be provided as-is to the corresponding backward iteration. The caller must
+    //     provide a new memory region for each iteration.
+    // tmp_Wx: [N,H*3] additional temporary work space required for this iteration. The caller
+    //     should not use the contents of this vector. The same memory region may be provided
+    //     for each iteration.
+    // tmp_Rh: [N,H*3] additional temporary work space required for this iteration. The caller
+    //     should not use the contents of this vector. The same memory region may be provided
+    //     for each iteration.
+    // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
+    //     activation being randomly zoned out. If zoneout was used during training, this
+    //     parameter must also be specified during inference with the same value.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The [N,H] mask is never stored: its
+    //     elements are regenerated from the seed by a counter-based generator wherever
+    //     they're needed. Only used in training mode. A different seed is typically used
+    //     for each iteration. Zoneout is disabled if `zoneout_prob` is 0.
+    // packed_R: (optional) `R` packed by `PackRecurrentKernel`. If null, `R` is packed into
+    //     internal storage on every call, so callers that iterate step by step with the
+    //     same weights (e.g. when decoding) should pack it once upfront.
+    void Iterate(
+        const T* W,
+        const T* R,
+        const T* bx,
+        const T* br,
+        const T* x,
+        const T* h,
+        T* h_out,
+        T* v_out,
+        T* tmp_Wx,
+        T* tmp_Rh,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const void* packed_R = nullptr);
+
+    // Runs the GRU over all time steps. The input projection for the whole sequence is
+    // computed with a single GEMM upfront; each step then fuses the recurrent matmul with
+    // the pointwise operations. Users should prefer calling `Run` over `Iterate` whenever
+    // possible.
+    //
+    // steps: the number of iterations to run (i.e. T).
+    // W: [C,H*3] the input weight matrix.
+    // R: [H,H*3] the recurrent weight matrix.
+    // bx: [H*3] the bias for the input weight matrix.
+    // br: [H*3] the bias for the recurrent weight matrix.
+    // x: [T,N,C] the GRU input for this iteration (N vectors, each with dimension C).
+    // h: [T+1,N,H] the hidden state vectors across all time steps. The t=0'th vector should
+    //      be set to the desired initial hidden state (typically zeros). The rest of the
+    //      vectors will be set by this function. `h[1:,:,:]` forms the output of this GRU
+    //      layer.
+    // v: [T,N,H*4] if `training` is `false`, this can be a null pointer. If `training` is
+    //     `true`, this parameter will contain intermediate activations which must be
+    //     provided as-is to `BackwardPass::Run` or manually unrolled for
+    //     `BackwardPass::Iterate`.
+    // tmp_Wx: [T,N,H*3] additional temporary work space required for this function. The
+    //     caller should not use the contents of this vector.
+    // tmp_Rh: [N,H*3] additional temporary work space required for this function. The
+    //     caller should not use the contents of this vector.
+    // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
+    //     activation being randomly zoned out. If zoneout was used during training, this
+    //     parameter must also be specified during inference with the same value.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The mask is never stored: time step t
+    //     regenerates its [N,H] slice from the seed `zoneout_seed + t` with a counter-based
+    //     generator. Only used in training mode. Zoneout is disabled if `zoneout_prob` is 0.
+    // sequence_length: [N] (optional) host array with the length of each sequence. Time
+    //     steps at or past the end of a sequence are treated as padding: its state is
+    //     carried forward unchanged, so `h[T]` holds the state at the end of each sequence.
+    // reverse: if `true`, runs the GRU backwards in time, from step T-1 down to 0, in
+    //     place. The initial state goes in `h[T]`, step t writes its output to `h[t]`, and
+    //     `h[0]` holds the final state. Outputs stay aligned with their inputs, so no
+    //     reversed copy of `x` is needed. Set `sequence_length` if the batch is padded so
+    //     that each sequence starts from its last valid step.
+    // packed_R: (optional) `R` packed by `PackRecurrentKernel`. If null, `R` is packed into
+    //     internal storage at the start of the call.
+    void Run(
+        const int steps,
+        const T* W,
+        const T* R,
+        const T* bx,
+        const T* br,
+        const T* x,
+        T* h,
+        T* v,
+        T* tmp_Wx,
+        T* tmp_Rh,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const void* packed_R = nullptr);
+
+  private:
+    void IterateInternal(
+        const int t,
+        const int64_t* sequence_length,
+        const void* packed_R,
+        const T* bx,
+        const T* br,
+        const T* h,
+        T* h_out,
+        T* v_out,
+        T* tmp_Wx,
+        T* tmp_Rh,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
+
+    struct private_data;
+    private_data* data_;
+};
+
+// CPU implementation of `haste::v0::gru::BackwardPass`. All pointers must point to host
+// memory.
+template<typename T>
+class BackwardPass {
+  public:
+    // batch_size: the number of training inputs provided in each tensor.
+    // input_size: the dimension of each input vector.
+    // hidden_size: the expected dimension of each output vector.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    BackwardPass(
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~BackwardPass();
+
+    // Performs one backward iteration of the GRU cell.
+    // Optional gradients may be nullptr, in which case they aren't computed.
+    //
+    // Note that BackwardPass must be iterated in the reverse order as ForwardPass.
+    // If ForwardPass iterates from 0 to T-1, BackwardPass needs to iterate from
+    // T-1 down to 0. When iteration numbers are described, they will be based on the
+    // iteration index (i.e., the T-1'th iteration of the forward pass is the last call
+    // to ForwardPass::Iterate, whereas it is the first call to BackwardPass::Iterate).
+    //
+    // W: [C,H*3] the input weight matrix.
+    // R: [H,H*3] the recurrent weight matrix.
+    // bx: [H*3] the bias vector for the input weight matrix.
+    // br: [H*3] the bias vector for the recurrent weight matrix.
+    // x: [N,C] the GRU input for this iteration.
+    // h: [N,H] the t-1 iteration's `h_out` or the initial hidden state if this is the t=0
+    //     iteration (typically zeros).
+    // v: [N,H*4] the same vector as returned by ForwardPass::Iterate on its corresponding
+    //     iteration.
+    // dh_new: [N,H] the gradient of `h_out` with respect to the loss at this iteration.
+    // dx: [N,C] (optional) the gradient of the input at this time step with respect to the loss.
+    // dW: [C,H*3] (optional) the gradient of the input weight matrix with respect to the loss.
+    // dR: [H,H*3] (optional) the gradient of the recurrent weight matrix with respect to the loss.
+    // dbx: [H*3] the gradient of the bias vector for the input weight matrix with respect to
+    //     the loss.
+    // dbr: [H*3] the gradient of the bias vector for the recurrent weight matrix with respect
+    //     to the loss.
+    // dh: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros
+    //     for the T-1'th iteration and the same pointer should be passed in for each
+    //     iteration. After a complete backward pass, this vector will contain the gradient
+    //     of the initial hidden state with respect to the loss.
+    // dp: [N,H*3] additional temporary work space required for this iteration. The caller
+    //     should not use the contents of this vector. The same memory region may be provided
+    //     for each iteration.
+    // dq: [N,H*3] additional temporary work space required for this iteration. The caller
+    //     should not use the contents of this vector. The same memory region may be provided
+    //     for each iteration.
+    // zoneout_prob: the value that was passed to the corresponding forward iteration. If it
+    //     is not 0, the zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to the corresponding forward iteration.
+    void Iterate(
+        const T* W,
+        const T* R,
+        const T* bx,
+        const T* br,
+        const T* x,
+        const T* h,
+        const T* v,
+        const T* dh_new,
+        T* dx,
+        T* dW,
+        T* dR,
+        T* dbx,
+        T* dbr,
+        T* dh,
+        T* dp,
+        T* dq,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
+
+    // Runs the GRU backward pass over all time steps. Users should prefer calling `Run`
+    // over `Iterate` whenever possible.
+    // Optional gradients may be nullptr, in which case they aren't computed.
+    //
+    // steps: the number of iterations to run (i.e. T).
+    // W: [C,H*3] the input weight matrix.
+    // R: [H,H*3] the recurrent weight matrix.
+    // bx: [H*3] the bias vector for the input weight matrix.
+    // br: [H*3] the bias vector for the recurrent weight matrix.
+    // x: [T,N,C] the GRU input.
+    // h: [T+1,N,H] the hidden state vectors after running `ForwardPass::Run`.
+    // v: [T,N,H*4] the same tensor that was passed to `ForwardPass::Run`.
+    // dh_new: [T+1,N,H] the gradient of the loss with respect to `h`.
+    // dx: [T,N,C] (optional) the gradient of the loss with respect to the input.
+    // dW: [C,H*3] (optional) the gradient of the loss with respect to the input weight matrix.
+    // dR: [H,H*3] (optional) the gradient of the loss with respect to the recurrent weight matrix.
+    // dbx: [H*3] the gradient of the loss with respect to the input bias vector.
+    // dbr: [H*3] the gradient of the loss with respect to the recurrent bias vector.
+    // dh: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros.
+    //     When this function returns, `dh` will contain the gradient of the loss with respect
+    //     to the initial hidden state.
+    // dp: [T,N,H*3] additional temporary work space required for this function. The caller
+    //     should not use the contents of this vector.
+    // dq: [T,N,H*3] additional temporary work space required for this function. The caller
+    //     should not use the contents of this vector.
+    // zoneout_prob: the value that was passed to `ForwardPass::Run`. If it is not 0, the
+    //     zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to `ForwardPass::Run`.
+    // sequence_length: [N] (optional) the same host array that was passed to
+    //     `ForwardPass::Run`. Gradients for the carried-forward states pass straight
+    //     through.
+    // reverse: must match the value passed to `ForwardPass::Run`. `dh_new` follows the
+    //     same layout as `h`.
+    // dropout_prob: the value that was passed to `ForwardPass::PackRecurrentKernel` for the
+    //     forward pass. If it is not 0, `R` is the recurrent weight matrix without
+    //     DropConnect: the mask is regenerated from `dropout_seed` and applied to `R` as it's
+    //     packed, and to `dR` as it's accumulated, so `dR` is the gradient of `R` itself.
+    // dropout_seed: the seed that was passed to `ForwardPass::PackRecurrentKernel`.
+    void Run(
+        const int steps,
+        const T* W,
+        const T* R,
+        const T* bx,
+        const T* br,
+        const T* x,
+        const T* h,
+        const T* v,
+        const T* dh_new,
+        T* dx,
+        T* dW,
+        T* dR,
+        T* dbx,
+        T* dbr,
+        T* dh,
+        T* dp,
+        T* dq,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const float dropout_prob = 0.0f,
+        const uint64_t dropout_seed = 0);
+
+  private:
+    void IterateInternal(
+        const int t,
+        const int64_t* sequence_length,
+        const void* packed_Rt,
+        const T* h,
+        const T* v,
+        const T* dh_new,
+        T* dbx,
+        T* dbr,
+        T* dh,
+        T* dp,
+        T* dq,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
+
+    struct private_data;
+    private_data* data_;
+};
+
+// Inference-only GRU with int8 weights. See `lstm::QuantizedForwardPass`: the kernels are
+// quantized per output channel, the inputs and the hidden state per vector, and the gate
+// pre-activations are dequantized to `T` just before the pointwise operations.
+template<typename T>
+class QuantizedForwardPass {
+  public:
+    // batch_size: the number of inference inputs provided in each tensor.
+    // input_size: the dimension of each input vector.
+    // hidden_size: the expected dimension of each output vector.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    QuantizedForwardPass(
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~QuantizedForwardPass();
+
+    // Runs the GRU over all time steps. Arguments not listed here are the same as for
+    // `ForwardPass::Run`.
+    //
+    // W_q: [H*3,C] the quantized input weight matrix.
+    // W_scale: [H*3] the scale of each output channel of `W_q`.
+    // R_q: [H*3,H] the quantized recurrent weight matrix.
+    // R_scale: [H*3] the scale of each output channel of `R_q`.
+    void Run(
+        const int steps,
+        const int8_t* W_q,
+        const float* W_scale,
+        const int8_t* R_q,
+        const float* R_scale,
+        const T* bx,
+        const T* br,
+        const T* x,
+        T* h,
+        T* tmp_Wx,
+        T* tmp_Rh,
+        const float zoneout_prob);
+
+  private:
+    struct private_data;
+    private_data* data_;
+};
+
+}  // namespace gru
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
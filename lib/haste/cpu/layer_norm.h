@@ -0,0 +1,117 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include "haste/cpu/parallel.h"
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+
+namespace layer_norm_lstm {
+template<typename T> class ForwardPass;
+template<typename T> class BackwardPass;
+}  // namespace layer_norm_lstm
+
+namespace layer_norm {
+
+// CPU implementation of `haste::v0::layer_norm::ForwardPass`. All pointers must point to
+// host memory. The cache layout is identical to the GPU implementation.
+template<typename T>
+class ForwardPass {
+  public:
+    // gamma: [H]
+    // beta: [H]
+    // cache: [N,2]
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    ForwardPass(
+        const int batch_size,
+        const int hidden_size,
+        const T* gamma,
+        const T* beta,
+        T* cache,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Computes the layer norm of an input tensor `x` over its innermost (fastest changing)
+    // dimension. The layer norm is defined as: \(\frac{x-\mu}{\sigma} \gamma + \beta\)
+    // where `\gamma` and `\beta` are trainable parameters.
+    //
+    // x: [N,H]
+    // y: [N,H]
+    void Run(const T* x, T* y);
+
+    void RunPartial(
+        const int minibatch,
+        const T* x,
+        T* y);
+
+  private:
+    // The LayerNormLSTM fuses its layer norms into the time loop and drives `cache_` and
+    // `partial_` directly.
+    friend class layer_norm_lstm::ForwardPass<T>;
+
+    const int batch_size_;
+    const int hidden_size_;
+    const T* gamma_;
+    const T* beta_;
+    T* cache_;
+    int partial_;
+    ParallelFor parallel_for_;
+};
+
+// CPU implementation of `haste::v0::layer_norm::BackwardPass`. All pointers must point to
+// host memory. `dx` may be the same as `dy` or as the `x` passed to the constructor.
+template<typename T>
+class BackwardPass {
+  public:
+    BackwardPass(
+        const int batch_size,
+        const int hidden_size,
+        const T* gamma,
+        const T* beta,
+        const T* x,
+        T* dgamma,
+        T* dbeta,
+        T* cache,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    void Run(const T* dy, T* dx);
+
+    void RunPartial(
+        const int minibatch,
+        const T* dy,
+        T* dx);
+
+  private:
+    friend class layer_norm_lstm::BackwardPass<T>;
+
+    const int batch_size_;
+    const int hidden_size_;
+    const T* gamma_;
+    const T* beta_;
+    const T* x_;
+    T* dgamma_;
+    T* dbeta_;
+    T* cache_;
+    int partial_;
+    ParallelFor parallel_for_;
+};
+
+}  // namespace layer_norm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
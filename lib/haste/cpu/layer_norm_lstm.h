@@ -0,0 +1,277 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cstdint>
+
+#include "haste/cpu/layer_norm.h"
+#include "haste/cpu/parallel.h"
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace layer_norm_lstm {
+
+// CPU implementation of `haste::v0::layer_norm_lstm::ForwardPass`. All pointers must point
+// to host memory. Tensor layouts, including the activation and layer norm caches, are
+// identical to the GPU implementation. The recurrent and cell state layer norms are fused
+// with the gate computations into a single pass over each batch entry.
+template<typename T>
+class ForwardPass {
+  public:
+    // training: `true` if the caller intends to perform a backward pass to compute gradients.
+    // batch_size: the number of training/inference inputs provided in each tensor.
+    // input_size: the dimension of each input vector.
+    // hidden_size: the expected dimension of each output vector.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    ForwardPass(
+        const bool training,
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~ForwardPass();
+
+    // The size in bytes of the buffer that `PackRecurrentKernel` fills.
+    int64_t PackedRecurrentKernelSize() const;
+
+    // Packs the recurrent weight matrix into the layout that the recurrent matmul of each
+    // time step reads. `Run` packs `R` once per call unless it's given a packed copy, so
+    // callers that run the same weights many times (e.g. in inference) can pack them once
+    // and reuse the result for as long as `R` doesn't change.
+    //
+    // R: [H,H*4] the recurrent weight matrix.
+    // packed_R: [PackedRecurrentKernelSize() bytes] the packed matrix. It doesn't refer to
+    //     `R` and has no alignment requirements.
+    // dropout_prob: if not 0, the DropConnect mask for `dropout_seed` is applied to the
+    //     packed copy, so passes given this copy run with DropConnect while `R` stays as it
+    //     is. The mask matches `dropconnect::Apply` on `R` with the same seed. Pass the same
+    //     values to `BackwardPass::Run`.
+    // dropout_seed: the seed of the DropConnect mask.
+    void PackRecurrentKernel(
+        const T* R,
+        void* packed_R,
+        const float dropout_prob = 0.0f,
+        const uint64_t dropout_seed = 0);
+
+    // Runs the LSTM over all time steps.
+    //
+    // steps: the number of iterations to run (i.e. T).
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
+    // b: [H*4] the bias vector.
+    // x: [T,N,C] the LSTM input for this iteration (N vectors, each with dimension C).
+    // h: [T+1,N,H] the hidden state vectors across all time steps. The t=0'th vector should
+    //      be set to the desired initial hidden state (typically zeros). The rest of the
+    //      vectors will be set by this function. `h[1:,:,:]` forms the output of this LSTM
+    //      layer.
+    // c: [T+1,N,H] the cell state vectors across all time steps. The t=0'th vector should be
+    //      set to the desired initial cell state (typically zeros). The rest of the vectors
+    //      will be set by this function.
+    // act_Wx: [T,N,H*4] the input projection before layer normalization.
+    // tmp_Rh: [N,H*4] additional temporary work space required for this iteration. The caller
+    //     should not use the contents of this vector. The same memory region may be provided
+    //     for each iteration.
+    // layer_norm1: the layer norm applied to `act_Wx` (batch size T*N, hidden size H*4).
+    // act_Wx_norm: [T,N,H*4] if `training` is `false`, this is scratch space and should not
+    //     be used by the caller. If `training` is `true`, this parameter will contain
+    //     intermediate activations which must be provided as-is to `BackwardPass::Run`.
+    // act_Rh: [T,N,H*4] the recurrent projection before layer normalization.
+    // layer_norm2: the layer norm applied to `act_Rh` (batch size T*N, hidden size H*4).
+    // layer_norm3: the layer norm applied to `c` (batch size T*N, hidden size H).
+    // act_c_norm: [T,N,H] the layer normalized cell state.
+    // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
+    //     activation being randomly zoned out. If zoneout was used during training, this
+    //     parameter must also be specified during inference with the same value.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The mask is never stored: time step t
+    //     regenerates its [N,H] slice from the seed `zoneout_seed + t` with a counter-based
+    //     generator. Only used in training mode. Zoneout is disabled if `zoneout_prob` is 0.
+    // sequence_length: [N] (optional) host array with the length of each sequence. Time
+    //     steps at or past the end of a sequence are treated as padding: its state is
+    //     carried forward unchanged, so `h[T]` and `c[T]` hold the state at the end of each
+    //     sequence.
+    // reverse: if `true`, runs the LSTM backwards in time, from step T-1 down to 0, in
+    //     place. The initial state goes in `h[T]` and `c[T]`, step t writes its output to
+    //     `h[t]`, and `h[0]` and `c[0]` hold the final state. The activations and layer
+    //     norm caches of step t stay at index t. Set `sequence_length` if the batch is
+    //     padded so that each sequence starts from its last valid step.
+    // packed_R: (optional) `R` packed by `PackRecurrentKernel`. If null, `R` is packed into
+    //     internal storage at the start of the call.
+    void Run(
+        const int steps,
+        const T* W,
+        const T* R,
+        const T* b,
+        const T* x,
+        T* h,
+        T* c,
+        T* act_Wx,
+        T* tmp_Rh,
+        layer_norm::ForwardPass<T>& layer_norm1,
+        T* act_Wx_norm,
+        T* act_Rh,
+        layer_norm::ForwardPass<T>& layer_norm2,
+        layer_norm::ForwardPass<T>& layer_norm3,
+        T* act_c_norm,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const void* packed_R = nullptr);
+
+  private:
+    void IterateInternal(
+        const int t,
+        const int64_t* sequence_length,
+        const void* packed_R,
+        const T* b,
+        const T* h,
+        const T* c,
+        T* h_out,
+        T* c_out,
+        T* v,
+        T* tmp_Rh,
+        T* act_Rh,
+        layer_norm::ForwardPass<T>& layer_norm2,
+        layer_norm::ForwardPass<T>& layer_norm3,
+        T* act_c_norm,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
+
+    struct private_data;
+    private_data* data_;
+};
+
+// CPU implementation of `haste::v0::layer_norm_lstm::BackwardPass`. All pointers must
+// point to host memory.
+template<typename T>
+class BackwardPass {
+  public:
+    // batch_size: the number of training inputs provided in each tensor.
+    // input_size: the dimension of each input vector.
+    // hidden_size: the expected dimension of each output vector.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    BackwardPass(
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~BackwardPass();
+
+    // Runs the LSTM backward pass over all time steps.
+    // Optional gradients may be nullptr, in which case they aren't computed.
+    //
+    // steps: the number of iterations to run (i.e. T).
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
+    // b: [H*4] the bias vector.
+    // x: [T,N,C] the LSTM input.
+    // h: [T+1,N,H] the hidden state vectors after running `ForwardPass::Run`.
+    // c: [T+1,N,H] the cell state vectors after running `ForwardPass::Run`.
+    // dh_new: [T+1,N,H] the gradient of the loss with respect to `h`.
+    // dc_new: [T+1,N,H] the gradient of the loss with respect to `c`.
+    // dx: [T,N,C] (optional) the gradient of the loss with respect to the input.
+    // dW: [C,H*4] (optional) the gradient of the loss with respect to the input weight matrix.
+    // dR: [H,H*4] (optional) the gradient of the loss with respect to the recurrent weight matrix.
+    // db: [H*4] the gradient of the loss with respect to the bias vector.
+    // dh: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros.
+    //     When this function returns, `dh` will contain the gradient of the loss with respect
+    //     to the initial hidden state.
+    // dc: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros.
+    //     When this function returns, `dc` will contain the gradient of the loss with respect
+    //     to the initial cell state.
+    // act_Wx, act_Wx_norm, act_Rh, act_c_norm: the same tensors that were passed to
+    //     `ForwardPass::Run`. Their contents are overwritten by this function.
+    // layer_norm1, layer_norm2, layer_norm3: the backward passes of the corresponding
+    //     forward layer norms; their `x` inputs are `act_Wx`, `act_Rh`, and `c[1:]`.
+    // zoneout_prob: the value that was passed to `ForwardPass::Run`. If it is not 0, the
+    //     zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to `ForwardPass::Run`.
+    // sequence_length: [N] (optional) the same host array that was passed to
+    //     `ForwardPass::Run`. Gradients for the carried-forward states pass straight
+    //     through.
+    // reverse: must match the value passed to `ForwardPass::Run`. `dh_new` and `dc_new`
+    //     follow the same layout as `h` and `c`.
+    // dropout_prob: the value that was passed to `ForwardPass::PackRecurrentKernel` for the
+    //     forward pass. If it is not 0, `R` is the recurrent weight matrix without
+    //     DropConnect: the mask is regenerated from `dropout_seed` and applied to `R` as it's
+    //     packed, and to `dR` as it's accumulated, so `dR` is the gradient of `R` itself.
+    // dropout_seed: the seed that was passed to `ForwardPass::PackRecurrentKernel`.
+    void Run(
+        const int steps,
+        const T* W,
+        const T* R,
+        const T* b,
+        const T* x,
+        const T* h,
+        const T* c,
+        const T* dh_new,
+        const T* dc_new,
+        T* dx,
+        T* dW,
+        T* dR,
+        T* db,
+        T* dh,
+        T* dc,
+        T* act_Wx,
+        layer_norm::BackwardPass<T>& layer_norm1,
+        T* act_Wx_norm,
+        T* act_Rh,
+        layer_norm::BackwardPass<T>& layer_norm2,
+        layer_norm::BackwardPass<T>& layer_norm3,
+        T* act_c_norm,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const float dropout_prob = 0.0f,
+        const uint64_t dropout_seed = 0);
+
+  private:
+    void IterateInternal(
+        const int t,
+        const int64_t* sequence_length,
+        const void* packed_Rt,
+        const T* c,
+        const T* c_new,
+        const T* dh_new,
+        const T* dc_new,
+        T* db,
+        T* dh,
+        T* dc,
+        T* v,
+        T* act_Rh,
+        layer_norm::BackwardPass<T>& layer_norm2,
+        layer_norm::BackwardPass<T>& layer_norm3,
+        T* act_c_norm,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
+
+    struct private_data;
+    private_data* data_;
+};
+
+}  // namespace layer_norm_lstm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
@@ -0,0 +1,559 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cstdint>
+
+#include "haste/cpu/parallel.h"
+
+// `T` may be `float`, `double`, `Eigen::half`, or `Eigen::bfloat16`. The 16-bit types are only
+// used for storage: the GEMMs accumulate and the pointwise operations compute in single
+// precision.
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace lstm {
+
+// CPU implementation of `haste::v0::lstm::ForwardPass`. All pointers must point to host
+// memory. Tensor layouts, including the contents of `v`, are identical to the GPU
+// implementation so the two may be used interchangeably.
+template<typename T>
+class ForwardPass {
+  public:
+    // training: `true` if the caller intends to perform a backward pass to compute gradients.
+    // batch_size: the number of training/inference inputs provided in each tensor.
+    // input_size: the dimension of each input vector.
+    // hidden_size: the expected dimension of each output vector.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    ForwardPass(
+        const bool training,
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~ForwardPass();
+
+    // The size in bytes of the buffer that `PackRecurrentKernel` fills.
+    int64_t PackedRecurrentKernelSize() const;
+
+    // Packs the recurrent weight matrix into the layout that the recurrent matmul of each
+    // time step reads. `Run` and `RunInference` pack `R` once per call unless they're given
+    // a packed copy, so callers that run the same weights many times (e.g. in inference)
+    // can pack them once and reuse the result for as long as `R` doesn't change. The packed
+    // layout only depends on `hidden_size`, so any pass with the same hidden size, including
+    // a `StackedForwardPass`, may use it.
+    //
+    // R: [H,H*4] the recurrent weight matrix.
+    // packed_R: [PackedRecurrentKernelSize() bytes] the packed matrix. It doesn't refer to
+    //     `R` and has no alignment requirements.
+    // dropout_prob: if not 0, the DropConnect mask for `dropout_seed` is applied to the
+    //     packed copy, so passes given this copy run with DropConnect while `R` stays as it
+    //     is. The mask matches `dropconnect::Apply` on `R` with the same seed. Pass the same
+    //     values to `BackwardPass::Run`.
+    // dropout_seed: the seed of the DropConnect mask.
+    void PackRecurrentKernel(
+        const T* R,
+        void* packed_R,
+        const float dropout_prob = 0.0f,
+        const uint64_t dropout_seed = 0);
+
+    // Performs one forward iteration of the LSTM cell.
+    //
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
+    // b: [H*4] the bias vector.
+    // x: [N,C] the LSTM input for this iteration (N vectors, each with dimension C).
+    // h: [N,H] the t-1 iteration's `h_out` or the initial hidden state if this is the
+    //     t=0 iteration (typically zeros).
+    // c: [N,H] the t-1 iteration's `c_out` or the initial cell state if this is the
+    //     t=0 iteration (typically zeros).
+    // h_out: [N,H] the LSTM's output, and the input to the next iteration's `h`. This
+    //     pointer may be the same as `h`. Each iteration may reuse the same memory region.
+    // c_out: [N,H] the LSTM's internal cell state after this iteration is complete. This
+    //     will become the input to the next iteration's `c`.
+    // v: [N,H*4] if `training` is `false`, this is scratch space and should not be used by
+    //     the caller. If `training` is `true`, this vector will contain intermediate
+    //     activations for this iteration which must be provided as-is to the corresponding
+    //     backward iteration. In either case, a new memory region must be provided for each
+    //     iteration.
+    // tmp_Rh: [N,H*4] additional temporary work space required for this iteration. The caller
+    //     should not use the contents of this vector. The same memory region may be provided
+    //     for each iteration.
+    // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
+    //     activation being randomly zoned out. If zoneout was used during training, this
+    //     parameter must also be specified during inference with the same value.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The [N,H] mask is never stored: its
+    //     elements are regenerated from the seed by a counter-based generator wherever
+    //     they're needed. Only used in training mode. A different seed is typically used
+    //     for each iteration. Zoneout is disabled if `zoneout_prob` is 0.
+    // packed_R: (optional) `R` packed by `PackRecurrentKernel`. If null, `R` is packed into
+    //     internal storage on every call, so callers that iterate step by step with the
+    //     same weights (e.g. when decoding) should pack it once upfront.
+    void Iterate(
+        const T* W,
+        const T* R,
+        const T* b,
+        const T* x,
+        const T* h,
+        const T* c,
+        T* h_out,
+        T* c_out,
+        T* v,
+        T* tmp_Rh,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const void* packed_R = nullptr);
+
+    // Runs the LSTM over all time steps. The input projection for the whole sequence is
+    // computed with a single GEMM upfront; each step then fuses the recurrent matmul with
+    // the pointwise operations. Users should prefer calling `Run` over `Iterate` whenever
+    // possible.
+    //
+    // steps: the number of iterations to run (i.e. T).
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
+    // b: [H*4] the bias vector.
+    // x: [T,N,C] the LSTM input for this iteration (N vectors, each with dimension C).
+    // h: [T+1,N,H] the hidden state vectors across all time steps. The t=0'th vector should
+    //      be set to the desired initial hidden state (typically zeros). The rest of the
+    //      vectors will be set by this function. `h[1:,:,:]` forms the output of this LSTM
+    //      layer.
+    // c: [T+1,N,H] the cell state vectors across all time steps. The t=0'th vector should be
+    //      set to the desired initial cell state (typically zeros). The rest of the vectors
+    //      will be set by this function.
+    // v: [T,N,H*4] if `training` is `false`, this is scratch space and should not be used by
+    //     the caller. If `training` is `true`, this parameter will contain intermediate
+    //     activations which must be provided as-is to `BackwardPass::Run` or manually urolled
+    //     for `BackwardPass::Iterate`.
+    // tmp_Rh: [N,H*4] additional temporary work space required for this iteration. The caller
+    //     should not use the contents of this vector. The same memory region may be provided
+    //     for each iteration.
+    // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
+    //     activation being randomly zoned out. If zoneout was used during training, this
+    //     parameter must also be specified during inference with the same value.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The mask is never stored: time step t
+    //     regenerates its [N,H] slice from the seed `zoneout_seed + t` with a counter-based
+    //     generator. Only used in training mode. Zoneout is disabled if `zoneout_prob` is 0.
+    // batch_sizes: [T] (optional) host array with the number of batch entries that are
+    //     still active at each time step. The batch must be sorted by decreasing sequence
+    //     length so that `batch_sizes` is non-increasing. Only the first `batch_sizes[t]`
+    //     entries are computed at step t; the others carry their state forward unchanged,
+    //     so `h[T]` and `c[T]` hold the state at the end of each sequence. If null, every
+    //     entry is computed at every step.
+    // sequence_length: [N] (optional) host array with the length of each sequence. Time
+    //     steps at or past the end of a sequence are treated as padding: its state is
+    //     carried forward unchanged. Unlike `batch_sizes`, the batch doesn't need to be
+    //     sorted, but every entry is computed at every step.
+    // reverse: if `true`, runs the LSTM backwards in time, from step T-1 down to 0, in
+    //     place. The initial state goes in `h[T]` and `c[T]`, step t writes its output to
+    //     `h[t]`, and `h[0]` and `c[0]` hold the final state. Outputs stay aligned with
+    //     their inputs, so no reversed copy of `x` is needed. Set `sequence_length` if the
+    //     batch is padded so that each sequence starts from its last valid step.
+    // batch_first: if `true`, `x`, `h`, `c`, and `v` are batch-major: [N,T,C], [N,T+1,H],
+    //     [N,T+1,H], and [N,T,H*4] respectively, with the time slots described above along
+    //     the second dimension. Each step then works on strided [N,...] slices, so batch-major
+    //     inputs and outputs don't have to be transposed.
+    // packed_R: (optional) `R` packed by `PackRecurrentKernel`. If null, `R` is packed into
+    //     internal storage at the start of the call.
+    void Run(
+        const int steps,
+        const T* W,
+        const T* R,
+        const T* b,
+        const T* x,
+        T* h,
+        T* c,
+        T* v,
+        T* tmp_Rh,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const int* batch_sizes = nullptr,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const bool batch_first = false,
+        const void* packed_R = nullptr);
+
+    // Runs the LSTM over all time steps in inference mode with scratch space that doesn't
+    // grow with the sequence length. Instead of one GEMM upfront, each step computes its
+    // own input projection in the same parallel region as the recurrent matmul, so `v`
+    // only holds a single step. Either state can also be kept in a two-slot ring buffer
+    // when only its final value is needed.
+    //
+    // steps, W, R, b, x, zoneout_prob, batch_sizes, sequence_length, reverse, batch_first,
+    //     packed_R: same as `Run`.
+    // h: [T+1,N,H] the hidden state vectors, laid out as in `Run` ([N,T+1,H] if
+    //     `batch_first` is `true`), if `keep_h` is `true`. Otherwise [2,N,H]: the initial
+    //     state goes in slot 0, consecutive steps alternate between the two slots, and the
+    //     final state ends up in slot `steps % 2`.
+    // c: [T+1,N,H] or [2,N,H] the cell state vectors, in the layout selected by `keep_c`.
+    // v: [N,H*4] scratch space. The caller should not use the contents of this vector.
+    // tmp_Rh: [N,H*4] scratch space. The caller should not use the contents of this vector.
+    void RunInference(
+        const int steps,
+        const T* W,
+        const T* R,
+        const T* b,
+        const T* x,
+        T* h,
+        T* c,
+        T* v,
+        T* tmp_Rh,
+        const float zoneout_prob,
+        const bool keep_h,
+        const bool keep_c,
+        const int* batch_sizes = nullptr,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const bool batch_first = false,
+        const void* packed_R = nullptr);
+
+  private:
+    void IterateInternal(
+        const int active_batch_size,
+        const int t,
+        const int64_t* sequence_length,
+        const int64_t state_stride,
+        const int64_t v_stride,
+        const void* packed_R,
+        const T* b,
+        const T* h,
+        const T* c,
+        T* h_out,
+        T* c_out,
+        T* v,
+        T* tmp_Rh,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
+
+    struct private_data;
+    private_data* data_;
+};
+
+// CPU implementation of `haste::v0::lstm::BackwardPass`. All pointers must point to host
+// memory.
+template<typename T>
+class BackwardPass {
+  public:
+    // batch_size: the number of training inputs provided in each tensor.
+    // input_size: the dimension of each input vector.
+    // hidden_size: the expected dimension of each output vector.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    BackwardPass(
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~BackwardPass();
+
+    // Performs one backward iteration of the LSTM cell.
+    // Optional gradients may be nullptr, in which case they aren't computed.
+    //
+    // Note that BackwardPass must be iterated in the reverse order as ForwardPass.
+    // If ForwardPass iterates from 0 to T-1, BackwardPass needs to iterate from
+    // T-1 down to 0. When iteration numbers are described, they will be based on the
+    // iteration index (i.e., the T-1'th iteration of the forward pass is the last call
+    // to ForwardPass::Iterate, whereas it is the first call to BackwardPass::Iterate).
+    //
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
+    // b: [H*4] the bias vector.
+    // x: [N,C] the LSTM input for this iteration.
+    // h: [N,H] the hidden state of the t'th iteration or the initial hidden state if this is
+    //     the t=0 iteration (typically zeros).
+    // c: [N,H] the t-1'th forward iteration's `c_out` or the initial cell state if this is
+    //     the t=0 iteration (typically zeros).
+    // c_new: [N,H] the t'th forward iteration's `c_out` vector.
+    // dh_new: [N,H] the gradient of the loss with respect to `h_out` at this iteration.
+    // dc_new: [N,H] the gradient of the loss with respect to `c_out` at this iteration.
+    // dx: [N,C] (optional) the gradient of the loss with respect to the input at this time step.
+    // dW: [C,H*4] (optional) the gradient of the loss with respect to the input weight matrix.
+    // dR: [H,H*4] (optional) the gradient of the loss with respect to the recurrent weight matrix.
+    // db: [H*4] (optional) the gradient of the loss with respect to the bias vector.
+    // dh: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros
+    //     for the T-1'th iteration and the same pointer should be passed in for each
+    //     iteration. After a complete backward pass, this vector will contain the gradient
+    //     of the loss with respect to the initial hidden state.
+    // dc: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros
+    //     for the T-1'th iteration and the same pointer should be passed in for each
+    //     iteration. After a complete backward pass, this vector will contain the gradient
+    //     of the loss with respect to the initial cell state.
+    // v: [N,H*4] the same tensor that was passed to `ForwardPass::Iterate` on its corresponding
+    //     iteration.
+    // zoneout_prob: the value that was passed to the corresponding forward iteration. If it
+    //     is not 0, the zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to the corresponding forward iteration.
+    void Iterate(
+        const T* W,
+        const T* R,
+        const T* b,
+        const T* x,
+        const T* h,
+        const T* c,
+        const T* c_new,
+        const T* dh_new,
+        const T* dc_new,
+        T* dx,
+        T* dW,
+        T* dR,
+        T* db,
+        T* dh,
+        T* dc,
+        T* v,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
+
+    // Runs the LSTM backward pass over all time steps. Users should prefer calling `Run`
+    // over `Iterate` whenever possible.
+    // Optional gradients may be nullptr, in which case they aren't computed.
+    //
+    // steps: the number of iterations to run (i.e. T).
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
+    // b: [H*4] the bias vector.
+    // x: [T,N,C] the LSTM input.
+    // h: [T+1,N,H] the hidden state vectors after running `ForwardPass::Run`.
+    // c: [T+1,N,H] the cell state vectors after running `ForwardPass::Run`.
+    // dh_new: [T+1,N,H] the gradient of the loss with respect to `h`.
+    // dc_new: [T+1,N,H] the gradient of the loss with respect to `c`.
+    // dx: [T,N,C] (optional) the gradient of the loss with respect to the input.
+    // dW: [C,H*4] (optional) the gradient of the loss with respect to the input weight matrix.
+    // dR: [H,H*4] (optional) the gradient of the loss with respect to the recurrent weight matrix.
+    // db: [H*4] (optional) the gradient of the loss with respect to the bias vector.
+    // dh: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros.
+    //     When this function returns, `dh` will contain the gradient of the loss with respect
+    //     to the initial hidden state.
+    // dc: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros.
+    //     When this function returns, `dc` will contain the gradient of the loss with respect
+    //     to the initial cell state.
+    // v: [T,N,H*4] the same tensor that was passed to `ForwardPass::Run`.
+    // zoneout_prob: the value that was passed to `ForwardPass::Run`. If it is not 0, the
+    //     zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to `ForwardPass::Run`.
+    // batch_sizes: [T] (optional) the same host array that was passed to
+    //     `ForwardPass::Run`. Gradients for the carried-forward states pass straight
+    //     through, and `v` is zeroed for inactive entries.
+    // sequence_length: [N] (optional) the same array that was passed to `ForwardPass::Run`.
+    // reverse: must match the value passed to `ForwardPass::Run`. `dh_new` and `dc_new`
+    //     follow the same layout as `h` and `c`.
+    // batch_first: must match the value passed to `ForwardPass::Run`. If `true`, `x` and
+    //     `dx` are [N,T,C], `h`, `c`, `dh_new`, and `dc_new` are [N,T+1,H], and `v` is
+    //     [N,T,H*4].
+    // dropout_prob: the value that was passed to `ForwardPass::PackRecurrentKernel` for the
+    //     forward pass. If it is not 0, `R` is the recurrent weight matrix without
+    //     DropConnect: the mask is regenerated from `dropout_seed` and applied to `R` as it's
+    //     packed, and to `dR` as it's accumulated, so `dR` is the gradient of `R` itself.
+    // dropout_seed: the seed that was passed to `ForwardPass::PackRecurrentKernel`.
+    void Run(
+        const int steps,
+        const T* W,
+        const T* R,
+        const T* b,
+        const T* x,
+        const T* h,
+        const T* c,
+        const T* dh_new,
+        const T* dc_new,
+        T* dx,
+        T* dW,
+        T* dR,
+        T* db,
+        T* dh,
+        T* dc,
+        T* v,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const int* batch_sizes = nullptr,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const bool batch_first = false,
+        const float dropout_prob = 0.0f,
+        const uint64_t dropout_seed = 0);
+
+  private:
+    void IterateInternal(
+        const int active_batch_size,
+        const int t,
+        const int64_t* sequence_length,
+        const int64_t state_stride,
+        const int64_t v_stride,
+        const void* packed_Rt,
+        const T* c,
+        const T* c_new,
+        const T* dh_new,
+        const T* dc_new,
+        T* dh,
+        T* dc,
+        T* v,
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
+
+    struct private_data;
+    private_data* data_;
+};
+
+// Runs a stack of LSTM layers, each taking the hidden state of the layer below as its
+// input, as a diagonal wavefront: while layer l computes time step t, layer l+1 computes
+// step t-1, layer l+2 step t-2, and so on. The steps on a diagonal don't depend on each
+// other, so they all share one parallel region instead of one region per layer and step.
+// This keeps every thread busy even when each step is a thin GEMM (small batches).
+//
+// In inference mode, only the last layer keeps its hidden state for every time step. The
+// layers below cycle through two slots, so no intermediate [T,N,H] sequences are ever
+// materialized.
+template<typename T>
+class StackedForwardPass {
+  public:
+    // training: `true` if the caller intends to perform a backward pass to compute gradients.
+    // num_layers: the number of layers in the stack.
+    // batch_size: the number of training/inference inputs provided in each tensor.
+    // input_size: the dimension of each input vector of the first layer.
+    // hidden_size: the dimension of the output vector of every layer.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    StackedForwardPass(
+        const bool training,
+        const int num_layers,
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~StackedForwardPass();
+
+    // Same as `ForwardPass::PackedRecurrentKernelSize` and `ForwardPass::PackRecurrentKernel`
+    // for the recurrent weight matrix of one layer.
+    int64_t PackedRecurrentKernelSize() const;
+    void PackRecurrentKernel(
+        const T* R,
+        void* packed_R,
+        const float dropout_prob = 0.0f,
+        const uint64_t dropout_seed = 0);
+
+    // Runs the stack over all time steps. Every array of pointers below has one entry per
+    // layer, starting with the first (bottom) layer.
+    //
+    // steps: the number of iterations to run (i.e. T).
+    // W: the input weight matrices, [C,H*4] for the first layer and [H,H*4] for the rest.
+    // R: the recurrent weight matrices, [H,H*4] each.
+    // b: the bias vectors, [H*4] each.
+    // x: [T,N,C] the input of the first layer.
+    // h: the hidden state vectors. In training mode, each layer's are [T+1,N,H] and laid out
+    //     as in `ForwardPass::Run`. In inference mode, this holds for the last layer only;
+    //     the others are [2,N,H] and store time step t in slot `t % 2`. Either way, the
+    //     initial state goes in slot 0 and `h[L-1][1:,:,:]` forms the output of the stack.
+    // c: the cell state vectors, [T+1,N,H] per layer in training mode and [2,N,H] per layer
+    //     (time step t in slot `t % 2`) in inference mode. The initial state goes in slot 0.
+    // v: the activations, [T,N,H*4] per layer in training mode, to be provided as-is to
+    //     each layer's `BackwardPass::Run`. In inference mode, [N,H*4] of scratch space per
+    //     layer.
+    // tmp_Rh: [N,H*4] of temporary work space per layer.
+    // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
+    //     activation being randomly zoned out. If zoneout was used during training, this
+    //     parameter must also be specified during inference with the same value.
+    // zoneout_seed: [L] host array with the zoneout seed of each layer, used as in
+    //     `ForwardPass::Run`. May be null if `training` is `false` or `zoneout_prob` is 0.
+    // sequence_length: [N] (optional) host array with the length of each sequence. Time
+    //     steps at or past the end of a sequence carry the state of every layer forward
+    //     unchanged, so the last slot holds the state at the end of each sequence.
+    // packed_R: (optional) the recurrent weight matrix of each layer packed by
+    //     `PackRecurrentKernel`. If null, every layer's `R` is packed into internal storage
+    //     at the start of the call.
+    void Run(
+        const int steps,
+        const T* const* W,
+        const T* const* R,
+        const T* const* b,
+        const T* x,
+        T* const* h,
+        T* const* c,
+        T* const* v,
+        T* const* tmp_Rh,
+        const float zoneout_prob,
+        const uint64_t* zoneout_seed,
+        const int64_t* sequence_length = nullptr,
+        const void* const* packed_R = nullptr);
+
+  private:
+    struct private_data;
+    private_data* data_;
+};
+
+// Inference-only LSTM with int8 weights. The kernels are quantized once per output channel
+// (see `quantize::Weights`); the inputs and the hidden state are quantized per vector
+// before each product. Both GEMMs multiply int8 values with int32 accumulation, and the
+// gate pre-activations are dequantized to `T` just before the pointwise operations, which
+// are the same as in `ForwardPass`. This cuts the weight memory that every time step
+// streams through by 4x compared to single precision.
+template<typename T>
+class QuantizedForwardPass {
+  public:
+    // batch_size: the number of inference inputs provided in each tensor.
+    // input_size: the dimension of each input vector.
+    // hidden_size: the expected dimension of each output vector.
+    // parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+    //     OpenMP is used.
+    QuantizedForwardPass(
+        const int batch_size,
+        const int input_size,
+        const int hidden_size,
+        const ParallelFor& parallel_for = ParallelFor());
+
+    // Releases internal resources.
+    ~QuantizedForwardPass();
+
+    // Runs the LSTM over all time steps. Arguments not listed here are the same as for
+    // `ForwardPass::Run`.
+    //
+    // W_q: [H*4,C] the quantized input weight matrix.
+    // W_scale: [H*4] the scale of each output channel of `W_q`.
+    // R_q: [H*4,H] the quantized recurrent weight matrix.
+    // R_scale: [H*4] the scale of each output channel of `R_q`.
+    // v: [T,N,H*4] scratch space; the caller should not use its contents.
+    void Run(
+        const int steps,
+        const int8_t* W_q,
+        const float* W_scale,
+        const int8_t* R_q,
+        const float* R_scale,
+        const T* b,
+        const T* x,
+        T* h,
+        T* c,
+        T* v,
+        T* tmp_Rh,
+        const float zoneout_prob,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false);
+
+  private:
+    struct private_data;
+    private_data* data_;
+};
+
+}  // namespace lstm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
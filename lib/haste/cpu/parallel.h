@@ -0,0 +1,41 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cstdint>
+#include <functional>
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+
+// Splits the half-open range [0, total) into disjoint, contiguous blocks and calls
+// `fn(begin, end)` once for each block. Blocks may be processed concurrently, but the
+// call must not return until all of them have completed. `cost_per_unit` is a rough
+// estimate of the number of arithmetic operations needed for each unit in the range and
+// may be used to pick a block size.
+//
+// This is the CPU counterpart of the cuBLAS handle taken by the GPU classes: it lets the
+// caller run haste on an existing thread pool (e.g. TensorFlow's intra-op pool or ATen's
+// `at::parallel_for`). An empty `ParallelFor` selects the built-in OpenMP implementation.
+using ParallelFor = std::function<void(
+    const int64_t total,
+    const int64_t cost_per_unit,
+    const std::function<void(int64_t, int64_t)>& fn)>;
+
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
@@ -0,0 +1,56 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cstdint>
+
+#include "haste/cpu/parallel.h"
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace quantize {
+
+// Quantizes a weight matrix for the int8 inference passes (e.g.
+// `cpu::lstm::QuantizedForwardPass`). Each output channel gets its own symmetric scale,
+// chosen so that its largest weight maps to +/-127:
+//
+//   W[k,j] ~= W_q[j,k] * scale[j]
+//
+// No calibration data is needed: the scales only depend on the trained weights. The
+// activations are quantized per vector when the passes run.
+//
+// input_dim: the number of rows of `W` (e.g. C for an input kernel, H for a recurrent one).
+// output_dim: the number of columns of `W` (e.g. H*4 for an LSTM).
+// W: [input_dim,output_dim] the weight matrix in the layout taken by the float passes.
+// W_q: [output_dim,input_dim] the quantized weights. Note the transpose: the weights of
+//     each output channel are contiguous.
+// scale: [output_dim] the scale of each output channel.
+// parallel_for: (optional) the thread pool to run on (see `ParallelFor`). If empty,
+//     OpenMP is used.
+template<typename T>
+void Weights(
+    const int input_dim,
+    const int output_dim,
+    const T* W,
+    int8_t* W_q,
+    float* scale,
+    const ParallelFor& parallel_for = ParallelFor());
+
+}  // namespace quantize
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
@@ -0,0 +1,50 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cstdint>
+#include <cuda_runtime_api.h>
+
+namespace haste {
+namespace v0 {
+namespace dropconnect {
+
+// Applies DropConnect to a weight matrix without materializing its mask. Element `i` of
+// the Bernoulli(1-dropout_prob) mask is regenerated from `seed` with a counter-based
+// generator, and kept elements are scaled by 1/(1-dropout_prob). The result is a linear
+// function of `x`, so applying it with the same seed to the gradient of the dropped-out
+// matrix yields the gradient of the original one. Nothing has to be kept between the
+// forward and the backward pass.
+//
+// dropout_prob: 0.0 <= dropout_prob <= 1.0; the probability of dropping each element.
+// seed: the seed of the mask.
+// x: [size]
+// y: [size]; may be the same as `x`.
+//
+// `T` may be `float`, `double`, `__half`, or `__nv_bfloat16`. 16-bit values are scaled in
+// single precision.
+template<typename T>
+void Apply(
+    const cudaStream_t& stream,
+    const int64_t size,
+    const float dropout_prob,
+    const uint64_t seed,
+    const T* x,
+    T* y);
+
+}  // namespace dropconnect
+}  // namespace v0
+}  // namespace haste
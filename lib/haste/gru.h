@@ -15,6 +15,7 @@
 
 #pragma once
 
+#include <cstdint>
 #include <cublas_v2.h>
 
 namespace haste {
@@ -64,9 +65,11 @@ class ForwardPass {
     // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
     //     activation being randomly zoned out. If zoneout was used during training, this
     //     parameter must also be specified during inference with the same value.
-    // zoneout_mask: [N,H] may be null to disable zoneout. This is a random binary mask
-    //     following a Bernoulli(1-zoneout_prob) distribution. A different mask is typically
-    //     used for each iteration.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The [N,H] mask is never stored: its
+    //     elements are regenerated from the seed by a counter-based generator wherever
+    //     they're needed. Only used in training mode. A different seed is typically used
+    //     for each iteration. Zoneout is disabled if `zoneout_prob` is 0.
     void Iterate(
         const T* W,
         const T* R,
@@ -79,7 +82,7 @@ class ForwardPass {
         T* tmp_Wx,
         T* tmp_Rh,
         const float zoneout_prob,
-        const T* zoneout_mask);
+        const uint64_t zoneout_seed);
 
   private:
     struct private_data;
@@ -104,6 +107,7 @@ class BackwardPass {
     ~BackwardPass();
 
     // Performs one backward iteration of the GRU cell.
+    // Optional gradients may be nullptr, in which case they aren't computed.
     //
     // Note that BackwardPass must be iterated in the reverse order as ForwardPass.
     // If ForwardPass iterates from 0 to T-1, BackwardPass needs to iterate from
@@ -111,19 +115,19 @@ class BackwardPass {
     // iteration index (i.e., the T-1'th iteration of the forward pass is the last call
     // to ForwardPass::Iterate, whereas it is the first call to BackwardPass::Iterate).
     //
-    // W_t: [H*3,C] the transpose of the input weight matrix.
-    // R_t: [H*3,H] the transpose of the recurrent weight matrix.
+    // W: [C,H*3] the input weight matrix.
+    // R: [H,H*3] the recurrent weight matrix.
     // bx: [H*3] the bias vector for the input weight matrix.
     // br: [H*3] the bias vector for the recurrent weight matrix.
-    // x_t: [C,N] the transpose of the GRU input for this iteration.
-    // h_t: [H,N] the transpose of the t-1 iteration's `h_out` or the initial hidden state
-    //     if this is the t=0 iteration (typically zeros).
+    // x: [N,C] the GRU input for this iteration.
+    // h: [N,H] the t-1 iteration's `h_out` or the initial hidden state if this is the t=0
+    //     iteration (typically zeros).
     // v: [N,H*4] the same vector as returned by ForwardPass::Iterate on its corresponding
     //     iteration.
     // dh_new: [N,H] the gradient of `h_out` with respect to the loss at this iteration.
-    // dx: [N,C] the gradient of the input at this time step with respect to the loss.
-    // dW: [C,H*3] the gradient of the input weight matrix with respect to the loss.
-    // dR: [H,H*3] the gradient of the recurrent weight matrix with respect to the loss.
+    // dx: [N,C] (optional) the gradient of the input at this time step with respect to the loss.
+    // dW: [C,H*3] (optional) the gradient of the input weight matrix with respect to the loss.
+    // dR: [H,H*3] (optional) the gradient of the recurrent weight matrix with respect to the loss.
     // dbx: [H*3] the gradient of the bias vector for the input weight matrix with respect to
     //     the loss.
     // dbr: [H*3] the gradient of the bias vector for the recurrent weight matrix with respect
@@ -138,15 +142,16 @@ class BackwardPass {
     // dq: [N,H*3] additional temporary work space required for this iteration. The caller
     //     should not use the contents of this vector. A new memory region must be provided
     //     for each iteration.
-    // zoneout_mask: [N,H] may be null if zoneout was disabled in the forward pass. This vector
-    //     must be the same as the one provided during the corresponding forward iteration.
+    // zoneout_prob: the value that was passed to the corresponding forward iteration. If it
+    //     is not 0, the zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to the corresponding forward iteration.
     void Iterate(
-        const T* W_t,
-        const T* R_t,
+        const T* W,
+        const T* R,
         const T* bx,
         const T* br,
-        const T* x_t,
-        const T* h_t,
+        const T* x,
+        const T* h,
         const T* v,
         const T* dh_new,
         T* dx,
@@ -157,7 +162,8 @@ class BackwardPass {
         T* dh,
         T* dp,
         T* dq,
-        const T* zoneout_mask);
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
 
   private:
     struct private_data;
@@ -15,6 +15,7 @@
 
 #pragma once
 
+#include <cstdint>
 #include <cublas_v2.h>
 
 namespace haste {
@@ -67,9 +68,10 @@ class ForwardPass {
     // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
     //     activation being randomly zoned out. If zoneout was used during training, this
     //     parameter must also be specified during inference with the same value.
-    // zoneout_mask: [T,N,H] may be null to disable zoneout. This is a random binary mask
-    //     following a Bernoulli(1-zoneout_prob) distribution. A different mask is typically
-    //     used for each iteration.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The mask is never stored: time step t
+    //     regenerates its [N,H] slice from the seed `zoneout_seed + t` with a counter-based
+    //     generator. Only used in training mode. Zoneout is disabled if `zoneout_prob` is 0.
     void Run(
         const int steps,
         const T* W,
@@ -87,7 +89,7 @@ class ForwardPass {
         layer_norm::ForwardPass<T>& layer_norm3,
         T* act_c_norm,
         const float zoneout_prob,
-        const T* zoneout_mask);
+        const uint64_t zoneout_seed);
 
   private:
     void IterateInternal(
@@ -104,7 +106,7 @@ class ForwardPass {
         layer_norm::ForwardPass<T>& layer_norm3,
         T* act_c_norm,
         const float zoneout_prob,
-        const T* zoneout_mask);
+        const uint64_t zoneout_seed);
 
     struct private_data;
     private_data* data_;
@@ -131,19 +133,20 @@ class BackwardPass {
     // per-step `Iterate` but requires that the entire input sequence be available upfront.
     // In some situations, this constraint may not be satisfiable (e.g. autoregressive models).
     // Users should prefer calling `Run` over `Iterate` whenever possible.
+    // Optional gradients may be nullptr, in which case they aren't computed.
     //
     // steps: the number of iterations to run (i.e. T).
-    // W_t: [H*4,C] the transpose of the input weight matrix.
-    // R_t: [H*4,H] the transpose of the recurrent weight matrix.
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
     // b: [H*4] the bias vector.
-    // x_t: [C,T,N] the transpose of the LSTM input for this iteration.
+    // x: [T,N,C] the LSTM input.
     // h: [T+1,N,H] the hidden state vectors after running `ForwardPass::Run`.
     // c: [T+1,N,H] the cell state vectors after running `ForwardPass::Run`.
     // dh_new: [T+1,N,H] the gradient of the loss with respect to `h`.
     // dc_new: [T+1,N,H] the gradient of the loss with respect to `c`.
-    // dx: [T,N,C] the gradient of the loss with respect to the input.
-    // dW: [C,H*4] the gradient of the loss with respect to the input weight matrix.
-    // dR: [H,H*4] the gradient of the loss with respect to the recurrent weight matrix.
+    // dx: [T,N,C] (optional) the gradient of the loss with respect to the input.
+    // dW: [C,H*4] (optional) the gradient of the loss with respect to the input weight matrix.
+    // dR: [H,H*4] (optional) the gradient of the loss with respect to the recurrent weight matrix.
     // db: [H*4] the gradient of the loss with respect to the bias vector.
     // dh: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros.
     //     When this function returns, `dh` will contain the gradient of the loss with respect
@@ -152,14 +155,15 @@ class BackwardPass {
     //     When this function returns, `dc` will contain the gradient of the loss with respect
     //     to the initial cell state.
     // v: [T,N,H*4] the same tensor that was passed to `ForwardPass::Run`.
-    // zoneout_mask: [T,N,H] may be null if zoneout was disabled in the forward pass. This
-    //     vector must be the same as the one provided during the forward pass.
+    // zoneout_prob: the value that was passed to `ForwardPass::Run`. If it is not 0, the
+    //     zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to `ForwardPass::Run`.
     void Run(
         const int steps,
-        const T* W_t,
-        const T* R_t,
+        const T* W,
+        const T* R,
         const T* b,
-        const T* x_t,
+        const T* x,
         const T* h,
         const T* c,
         const T* dh_new,
@@ -177,11 +181,12 @@ class BackwardPass {
         layer_norm::BackwardPass<T>& layer_norm2,
         layer_norm::BackwardPass<T>& layer_norm3,
         T* act_c_norm,
-        const T* zoneout_mask);
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
 
   private:
     void IterateInternal(
-        const T* R_t,
+        const T* R,
         const T* c,
         const T* c_new,
         const T* dh_new,
@@ -194,7 +199,8 @@ class BackwardPass {
         layer_norm::BackwardPass<T>& layer_norm2,
         layer_norm::BackwardPass<T>& layer_norm3,
         T* act_c_norm,
-        const T* zoneout_mask);
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
     struct private_data;
     private_data* data_;
 };
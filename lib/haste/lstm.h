@@ -15,7 +15,13 @@
 
 #pragma once
 
+#include <cstdint>
 #include <cublas_v2.h>
+#include <cuda_bf16.h>
+#include <cuda_fp16.h>
+
+// `T` may be `float`, `double`, `__half`, or `__nv_bfloat16`. The 16-bit types are only used
+// for storage: the GEMMs accumulate and the pointwise operations compute in single precision.
 
 namespace haste {
 namespace v0 {
@@ -65,9 +71,11 @@ class ForwardPass {
     // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
     //     activation being randomly zoned out. If zoneout was used during training, this
     //     parameter must also be specified during inference with the same value.
-    // zoneout_mask: [N,H] may be null to disable zoneout. This is a random binary mask
-    //     following a Bernoulli(1-zoneout_prob) distribution. A different mask is typically
-    //     used for each iteration.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The [N,H] mask is never stored: its
+    //     elements are regenerated from the seed by a counter-based generator wherever
+    //     they're needed. Only used in training mode. A different seed is typically used
+    //     for each iteration. Zoneout is disabled if `zoneout_prob` is 0.
     void Iterate(
         const T* W,
         const T* R,
@@ -80,7 +88,7 @@ class ForwardPass {
         T* v,
         T* tmp_Rh,
         const float zoneout_prob,
-        const T* zoneout_mask);
+        const uint64_t zoneout_seed);
 
     // Runs the LSTM over all time steps. This method is faster than using a per-step
     // `Iterate` but requires that the entire input sequence be available upfront. In some
@@ -109,9 +117,29 @@ class ForwardPass {
     // zoneout_prob: 0.0 <= zoneout_prob <= 1.0; specifies the probability of a hidden
     //     activation being randomly zoned out. If zoneout was used during training, this
     //     parameter must also be specified during inference with the same value.
-    // zoneout_mask: [T,N,H] may be null to disable zoneout. This is a random binary mask
-    //     following a Bernoulli(1-zoneout_prob) distribution. A different mask is typically
-    //     used for each iteration.
+    // zoneout_seed: seed of the random binary zoneout mask, which follows a
+    //     Bernoulli(1-zoneout_prob) distribution. The mask is never stored: time step t
+    //     regenerates its [N,H] slice from the seed `zoneout_seed + t` with a counter-based
+    //     generator. Only used in training mode. Zoneout is disabled if `zoneout_prob` is 0.
+    // batch_sizes: [T] (optional) host array with the number of batch entries that are
+    //     still active at each time step. The batch must be sorted by decreasing sequence
+    //     length so that `batch_sizes` is non-increasing. Only the first `batch_sizes[t]`
+    //     entries are computed at step t; the others carry their state forward unchanged,
+    //     so `h[T]` and `c[T]` hold the state at the end of each sequence. If null, every
+    //     entry is computed at every step.
+    // sequence_length: [N] (optional) device array with the length of each sequence. Time
+    //     steps at or past the end of a sequence are treated as padding: its state is
+    //     carried forward unchanged. Unlike `batch_sizes`, the batch doesn't need to be
+    //     sorted, but every entry is computed at every step.
+    // reverse: if `true`, runs the LSTM backwards in time, from step T-1 down to 0, in
+    //     place. The initial state goes in `h[T]` and `c[T]`, step t writes its output to
+    //     `h[t]`, and `h[0]` and `c[0]` hold the final state. Outputs stay aligned with
+    //     their inputs, so no reversed copy of `x` is needed. Set `sequence_length` if the
+    //     batch is padded so that each sequence starts from its last valid step.
+    // batch_first: if `true`, `x`, `h`, `c`, and `v` are batch-major: [N,T,C], [N,T+1,H],
+    //     [N,T+1,H], and [N,T,H*4] respectively, with the time slots described above along
+    //     the second dimension. Each step then works on strided [N,...] slices, so batch-major
+    //     inputs and outputs don't have to be transposed.
     void Run(
         const int steps,
         const T* W,
@@ -123,10 +151,19 @@ class ForwardPass {
         T* v,
         T* tmp_Rh,
         const float zoneout_prob,
-        const T* zoneout_mask);
+        const uint64_t zoneout_seed,
+        const int* batch_sizes = nullptr,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const bool batch_first = false);
 
   private:
     void IterateInternal(
+        const int active_batch_size,
+        const int t,
+        const int64_t* sequence_length,
+        const int state_stride,
+        const int v_stride,
         const T* R,
         const T* b,
         const T* h,
@@ -136,7 +173,7 @@ class ForwardPass {
         T* v,
         T* tmp_Rh,
         const float zoneout_prob,
-        const T* zoneout_mask);
+        const uint64_t zoneout_seed);
 
     struct private_data;
     private_data* data_;
@@ -160,6 +197,7 @@ class BackwardPass {
     ~BackwardPass();
 
     // Performs one backward iteration of the LSTM cell.
+    // Optional gradients may be nullptr, in which case they aren't computed.
     //
     // Note that BackwardPass must be iterated in the reverse order as ForwardPass.
     // If ForwardPass iterates from 0 to T-1, BackwardPass needs to iterate from
@@ -167,10 +205,10 @@ class BackwardPass {
     // iteration index (i.e., the T-1'th iteration of the forward pass is the last call
     // to ForwardPass::Iterate, whereas it is the first call to BackwardPass::Iterate).
     //
-    // W_t: [H*4,C] the transpose of the input weight matrix.
-    // R_t: [H*4,H] the transpose of the recurrent weight matrix.
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
     // b: [H*4] the bias vector.
-    // x_t: [C,N] the transpose of the LSTM input for this iteration.
+    // x: [N,C] the LSTM input for this iteration.
     // h: [N,H] the hidden state of the t'th iteration or the initial hidden state if this is
     //     the t=0 iteration (typically zeros).
     // c: [N,H] the t-1'th forward iteration's `c_out` or the initial cell state if this is
@@ -178,10 +216,10 @@ class BackwardPass {
     // c_new: [N,H] the t'th forward iteration's `c_out` vector.
     // dh_new: [N,H] the gradient of the loss with respect to `h_out` at this iteration.
     // dc_new: [N,H] the gradient of the loss with respect to `c_out` at this iteration.
-    // dx: [N,C] the gradient of the loss with respect to the input at this time step.
-    // dW: [C,H*4] the gradient of the loss with respect to the input weight matrix.
-    // dR: [H,H*4] the gradient of the loss with respect to the recurrent weight matrix.
-    // db: [H*4] the gradient of the loss with respect to the bias vector.
+    // dx: [N,C] (optional) the gradient of the loss with respect to the input at this time step.
+    // dW: [C,H*4] (optional) the gradient of the loss with respect to the input weight matrix.
+    // dR: [H,H*4] (optional) the gradient of the loss with respect to the recurrent weight matrix.
+    // db: [H*4] (optional) the gradient of the loss with respect to the bias vector.
     // dh: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros
     //     for the T-1'th iteration and the same pointer should be passed in for each
     //     iteration. After a complete backward pass, this vector will contain the gradient
@@ -192,13 +230,14 @@ class BackwardPass {
     //     of the loss with respect to the initial cell state.
     // v: [N,H*4] the same tensor that was passed to `ForwardPass::Iterate` on its corresponding
     //     iteration.
-    // zoneout_mask: [N,H] may be null if zoneout was disabled in the forward pass. This vector
-    //     must be the same as the one provided during the corresponding forward iteration.
+    // zoneout_prob: the value that was passed to the corresponding forward iteration. If it
+    //     is not 0, the zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to the corresponding forward iteration.
     void Iterate(
-        const T* W_t,
-        const T* R_t,
+        const T* W,
+        const T* R,
         const T* b,
-        const T* x_t,
+        const T* x,
         const T* h,
         const T* c,
         const T* c_new,
@@ -211,26 +250,28 @@ class BackwardPass {
         T* dh,
         T* dc,
         T* v,
-        const T* zoneout_mask);
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
 
     // Runs the LSTM backward pass over all time steps. This method is faster than using a
     // per-step `Iterate` but requires that the entire input sequence be available upfront.
     // In some situations, this constraint may not be satisfiable (e.g. autoregressive models).
     // Users should prefer calling `Run` over `Iterate` whenever possible.
+    // Optional gradients may be nullptr, in which case they aren't computed.
     //
     // steps: the number of iterations to run (i.e. T).
-    // W_t: [H*4,C] the transpose of the input weight matrix.
-    // R_t: [H*4,H] the transpose of the recurrent weight matrix.
+    // W: [C,H*4] the input weight matrix.
+    // R: [H,H*4] the recurrent weight matrix.
     // b: [H*4] the bias vector.
-    // x_t: [C,T,N] the transpose of the LSTM input for this iteration.
+    // x: [T,N,C] the LSTM input.
     // h: [T+1,N,H] the hidden state vectors after running `ForwardPass::Run`.
     // c: [T+1,N,H] the cell state vectors after running `ForwardPass::Run`.
     // dh_new: [T+1,N,H] the gradient of the loss with respect to `h`.
     // dc_new: [T+1,N,H] the gradient of the loss with respect to `c`.
-    // dx: [T,N,C] the gradient of the loss with respect to the input.
-    // dW: [C,H*4] the gradient of the loss with respect to the input weight matrix.
-    // dR: [H,H*4] the gradient of the loss with respect to the recurrent weight matrix.
-    // db: [H*4] the gradient of the loss with respect to the bias vector.
+    // dx: [T,N,C] (optional) the gradient of the loss with respect to the input.
+    // dW: [C,H*4] (optional) the gradient of the loss with respect to the input weight matrix.
+    // dR: [H,H*4] (optional) the gradient of the loss with respect to the recurrent weight matrix.
+    // db: [H*4] (optional) the gradient of the loss with respect to the bias vector.
     // dh: [N,H] NOTE: this is an input and output parameter. Should be initialized to zeros.
     //     When this function returns, `dh` will contain the gradient of the loss with respect
     //     to the initial hidden state.
@@ -238,14 +279,24 @@ class BackwardPass {
     //     When this function returns, `dc` will contain the gradient of the loss with respect
     //     to the initial cell state.
     // v: [T,N,H*4] the same tensor that was passed to `ForwardPass::Run`.
-    // zoneout_mask: [T,N,H] may be null if zoneout was disabled in the forward pass. This
-    //     vector must be the same as the one provided during the forward pass.
+    // zoneout_prob: the value that was passed to `ForwardPass::Run`. If it is not 0, the
+    //     zoneout mask is regenerated from `zoneout_seed`.
+    // zoneout_seed: the seed that was passed to `ForwardPass::Run`.
+    // batch_sizes: [T] (optional) the same host array that was passed to
+    //     `ForwardPass::Run`. Gradients for the carried-forward states pass straight
+    //     through, and `v` is zeroed for inactive entries.
+    // sequence_length: [N] (optional) the same array that was passed to `ForwardPass::Run`.
+    // reverse: must match the value passed to `ForwardPass::Run`. `dh_new` and `dc_new`
+    //     follow the same layout as `h` and `c`.
+    // batch_first: must match the value passed to `ForwardPass::Run`. If `true`, `x` and
+    //     `dx` are [N,T,C], `h`, `c`, `dh_new`, and `dc_new` are [N,T+1,H], and `v` is
+    //     [N,T,H*4].
     void Run(
         const int steps,
-        const T* W_t,
-        const T* R_t,
+        const T* W,
+        const T* R,
         const T* b,
-        const T* x_t,
+        const T* x,
         const T* h,
         const T* c,
         const T* dh_new,
@@ -257,20 +308,30 @@ class BackwardPass {
         T* dh,
         T* dc,
         T* v,
-        const T* zoneout_mask);
+        const float zoneout_prob,
+        const uint64_t zoneout_seed,
+        const int* batch_sizes = nullptr,
+        const int64_t* sequence_length = nullptr,
+        const bool reverse = false,
+        const bool batch_first = false);
 
   private:
     void IterateInternal(
-        const T* R_t,
+        const int active_batch_size,
+        const int t,
+        const int64_t* sequence_length,
+        const int state_stride,
+        const int v_stride,
+        const T* R,
         const T* c,
         const T* c_new,
         const T* dh_new,
         const T* dc_new,
-        T* db,
         T* dh,
         T* dc,
         T* v,
-        const T* zoneout_mask);
+        const float zoneout_prob,
+        const uint64_t zoneout_seed);
     struct private_data;
     private_data* data_;
 };
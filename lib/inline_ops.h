@@ -15,6 +15,25 @@
 
 #pragma once
 
+#include <cuda_bf16.h>
+#include <cuda_fp16.h>
+
+// Pointwise math on the 16-bit storage types is carried out in single precision.
+template<typename T>
+struct accumulator {
+  typedef T type;
+};
+
+template<>
+struct accumulator<__half> {
+  typedef float type;
+};
+
+template<>
+struct accumulator<__nv_bfloat16> {
+  typedef float type;
+};
+
 template<typename T>
 __device__ __forceinline__
 T sigmoid(const T x) {
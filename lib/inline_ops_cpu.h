@@ -0,0 +1,77 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include "cpu_blas.h"
+#include "zoneout_ops.h"
+
+// Pointwise operations on the CPU are written against Eigen arrays so that the
+// transcendental functions (`logistic`, `tanh`) are evaluated with packet math.
+
+template<typename T>
+using Vector = Eigen::Array<T, Eigen::Dynamic, 1>;
+
+template<typename T>
+using VectorMap = Eigen::Map<Vector<T>>;
+
+template<typename T>
+using ConstVectorMap = Eigen::Map<const Vector<T>>;
+
+// Pointwise kernels walk the hidden dimension in chunks of at most this many units so
+// that their temporaries live on the stack and stay in L1.
+constexpr int kChunkSize = 256;
+
+template<typename T>
+using Chunk = Eigen::Array<T, Eigen::Dynamic, 1, Eigen::ColMajor, kChunkSize, 1>;
+
+template<typename T>
+inline VectorMap<T> Slice(T* base, const int64_t offset, const int size) {
+  return VectorMap<T>(base + offset, size);
+}
+
+template<typename T>
+inline ConstVectorMap<T> Slice(const T* base, const int64_t offset, const int size) {
+  return ConstVectorMap<T>(base + offset, size);
+}
+
+// Widens a slice to the accumulator type (see `cpu_accumulator`). This is a no-op unless `x`
+// holds a 16-bit type. The result may refer to `x`, so it must not outlive the expression.
+template<typename AccT, typename Derived>
+inline auto Widen(const Eigen::ArrayBase<Derived>& x) -> decltype(x.template cast<AccT>()) {
+  return x.template cast<AccT>();
+}
+
+template<typename Derived>
+inline auto d_sigmoid(const Eigen::ArrayBase<Derived>& sigmoid_output)
+    -> decltype(sigmoid_output * (1 - sigmoid_output)) {
+  return sigmoid_output * (1 - sigmoid_output);
+}
+
+template<typename Derived>
+inline auto d_tanh(const Eigen::ArrayBase<Derived>& tanh_output)
+    -> decltype(1 - tanh_output * tanh_output) {
+  return 1 - tanh_output * tanh_output;
+}
+
+// Regenerates `size` consecutive elements of the zoneout mask for `seed`, starting at
+// element `index` (see `zoneout_keep`).
+template<typename T>
+inline Chunk<T> ZoneoutMask(const uint64_t seed, const int64_t index, const int size, const float zoneout_prob) {
+  Chunk<T> mask(size);
+  for (int i = 0; i < size; ++i)
+    mask[i] = zoneout_keep(seed, index + i, zoneout_prob) ? static_cast<T>(1.0) : static_cast<T>(0.0);
+  return mask;
+}
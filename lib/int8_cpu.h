@@ -0,0 +1,115 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+
+#include "cpu_blas.h"
+
+// Kernels shared by the int8 inference passes. Vectors are quantized symmetrically: a
+// vector `x` with scale `s` is stored as round(x / s) in [-127, 127], so that a product of
+// two quantized vectors only needs one multiplication by the product of their scales.
+
+// Returns the int32 dot product of two int8 vectors. The loop is simple enough for the
+// compiler to vectorize with widening multiply-adds.
+inline int32_t DotInt8(const int8_t* a, const int8_t* b, const int size) {
+  int32_t sum = 0;
+  for (int i = 0; i < size; ++i)
+    sum += static_cast<int32_t>(a[i]) * static_cast<int32_t>(b[i]);
+  return sum;
+}
+
+// Quantizes one vector with a scale derived from its largest magnitude. An all-zero vector
+// gets a scale of 0 and quantizes to zeros.
+template<typename T>
+void QuantizeVector(const int size, const T* x, int8_t* x_q, float& scale) {
+  float max_abs = 0.0f;
+  for (int i = 0; i < size; ++i)
+    max_abs = std::max(max_abs, std::abs(static_cast<float>(x[i])));
+
+  scale = max_abs / 127.0f;
+  const float inv_scale = max_abs > 0.0f ? 127.0f / max_abs : 0.0f;
+  for (int i = 0; i < size; ++i)
+    x_q[i] = static_cast<int8_t>(std::lrint(static_cast<float>(x[i]) * inv_scale));
+}
+
+// Quantizes the `rows` vectors of length `size` stored back to back in `x`, each with its
+// own scale.
+template<typename T>
+void QuantizeRows(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int64_t rows,
+    const int size,
+    const T* x,
+    int8_t* x_q,
+    float* scale) {
+  ParallelRange(parallel_for, rows, 3LL * size, [&](int64_t begin, int64_t end) {
+    for (int64_t row = begin; row < end; ++row)
+      QuantizeVector(size, x + row * size, x_q + row * size, scale[row]);
+  });
+}
+
+// Computes output channels [begin, end) of a quantized product and dequantizes them:
+//
+//   y[n*ldy + j] = w_scale[j] * x_scale[n] * dot(W_q[j,:], x_q[n,:])
+//
+// for each of the `cols` quantized input vectors in `x_q`. `W_q` has one row of `k`
+// weights per output channel (see `haste::v0::cpu::quantize::Weights`). The input vectors
+// are processed in blocks that stay in cache while every output channel is visited.
+template<typename T>
+void Int8Gemm(
+    const int begin,
+    const int end,
+    const int64_t cols,
+    const int k,
+    const int8_t* W_q,
+    const float* w_scale,
+    const int8_t* x_q,
+    const float* x_scale,
+    T* y,
+    const int ldy) {
+  const int64_t block = std::max<int64_t>(1, (32 * 1024) / std::max(k, 1));
+  for (int64_t col_begin = 0; col_begin < cols; col_begin += block) {
+    const int64_t col_end = std::min(cols, col_begin + block);
+    for (int j = begin; j < end; ++j) {
+      const int8_t* w = W_q + static_cast<int64_t>(j) * k;
+      for (int64_t n = col_begin; n < col_end; ++n) {
+        const int32_t dot = DotInt8(w, x_q + n * k, k);
+        y[n * ldy + j] = static_cast<T>(w_scale[j] * x_scale[n] * static_cast<float>(dot));
+      }
+    }
+  }
+}
+
+// Multi-threaded `Int8Gemm` over all `rows` output channels.
+template<typename T>
+void Int8Gemm(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int rows,
+    const int64_t cols,
+    const int k,
+    const int8_t* W_q,
+    const float* w_scale,
+    const int8_t* x_q,
+    const float* x_scale,
+    T* y,
+    const int ldy) {
+  ParallelRange(parallel_for, rows, 2LL * cols * std::max(k, 1), [&](int64_t begin, int64_t end) {
+    Int8Gemm(static_cast<int>(begin), static_cast<int>(end), cols, k, W_q, w_scale, x_q, x_scale, y, ldy);
+  });
+}
@@ -0,0 +1,139 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include <cassert>
+#include <mutex>
+
+#include "haste/cpu/layer_norm.h"
+#include "layer_norm_cpu.h"
+
+namespace {
+
+// Each block of rows accumulates its parameter gradients locally and adds them to the
+// shared outputs once at the end, instead of contending on every element.
+template<typename T, bool ApplyBeta>
+void LayerNormGrad(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int batch_size,
+    const int hidden_size,
+    const T* gamma,
+    const T* x,
+    const T* dy,
+    T* dgamma,
+    T* dbeta,
+    T* dx,
+    const T* cache) {
+  std::mutex mutex;
+  ParallelRange(parallel_for, batch_size, 16LL * hidden_size, [&](int64_t begin, int64_t end) {
+    Vector<T> local_dgamma = Vector<T>::Zero(hidden_size);
+    Vector<T> local_dbeta = Vector<T>::Zero(ApplyBeta ? hidden_size : 0);
+
+    for (int64_t batch = begin; batch < end; ++batch) {
+      LayerNormGradRow<T, ApplyBeta>(
+          hidden_size,
+          gamma,
+          x + batch * hidden_size,
+          dy + batch * hidden_size,
+          local_dgamma.data(),
+          local_dbeta.data(),
+          dx + batch * hidden_size,
+          cache + batch * 2);
+    }
+
+    std::lock_guard<std::mutex> lock(mutex);
+    Slice(dgamma, 0, hidden_size) += local_dgamma;
+    if (ApplyBeta)
+      Slice(dbeta, 0, hidden_size) += local_dbeta;
+  });
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace layer_norm {
+
+template<typename T>
+BackwardPass<T>::BackwardPass(
+    const int batch_size,
+    const int hidden_size,
+    const T* gamma,
+    const T* beta,
+    const T* x,
+    T* dgamma,
+    T* dbeta,
+    T* cache,
+    const ParallelFor& parallel_for)
+        : batch_size_(batch_size),
+          hidden_size_(hidden_size),
+          gamma_(gamma),
+          beta_(beta),
+          x_(x),
+          dgamma_(dgamma),
+          dbeta_(dbeta),
+          cache_(cache),
+          partial_(batch_size),
+          parallel_for_(parallel_for) {
+}
+
+template<typename T>
+void BackwardPass<T>::Run(const T* dy, T* dx) {
+  RunPartial(batch_size_, dy, dx);
+}
+
+template<typename T>
+void BackwardPass<T>::RunPartial(
+    const int minibatch,
+    const T* dy,
+    T* dx) {
+  assert(partial_ - minibatch >= 0);
+
+  if (beta_ && dbeta_) {
+    LayerNormGrad<T, true>(
+        parallel_for_,
+        minibatch,
+        hidden_size_,
+        gamma_,
+        x_ + (partial_ - minibatch) * hidden_size_,
+        dy,
+        dgamma_,
+        dbeta_,
+        dx,
+        cache_ + (partial_ - minibatch) * 2);
+  } else {
+    LayerNormGrad<T, false>(
+        parallel_for_,
+        minibatch,
+        hidden_size_,
+        gamma_,
+        x_ + (partial_ - minibatch) * hidden_size_,
+        dy,
+        dgamma_,
+        nullptr,
+        dx,
+        cache_ + (partial_ - minibatch) * 2);
+  }
+
+  partial_ -= minibatch;
+}
+
+template class BackwardPass<float>;
+template class BackwardPass<double>;
+
+}  // namespace layer_norm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
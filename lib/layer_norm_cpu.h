@@ -0,0 +1,116 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cmath>
+
+#include "inline_ops_cpu.h"
+
+// Row kernels shared by the CPU layer norm and the CPU LayerNormLSTM, which fuses them
+// into its time loop. Each call processes a single row of `hidden_size` elements.
+
+// Computes the mean and inverse standard deviation of `x` in a single pass over memory.
+// The moments of each chunk are computed while it's in L1 and then merged into the
+// running moments with the parallel form of Welford's algorithm (Chan et al.).
+template<typename T>
+void LayerNormMoments(const int hidden_size, const T* x, T& mean, T& invstd) {
+  T running_mean = static_cast<T>(0.0);
+  T running_m2 = static_cast<T>(0.0);
+  int count = 0;
+  for (int i = 0; i < hidden_size; i += kChunkSize) {
+    const int size = std::min(kChunkSize, hidden_size - i);
+    const auto chunk = Slice(x, i, size);
+    const T chunk_mean = chunk.mean();
+    const T chunk_m2 = (chunk - chunk_mean).square().sum();
+
+    const int total = count + size;
+    const T delta = chunk_mean - running_mean;
+    running_mean += delta * size / total;
+    running_m2 += chunk_m2 + delta * delta * (static_cast<T>(count) * size / total);
+    count = total;
+  }
+
+  mean = running_mean;
+  invstd = static_cast<T>(1.0) / std::sqrt(running_m2 / hidden_size + static_cast<T>(1e-5));
+}
+
+// `x` and `y` may be aliased.
+template<typename T, bool ApplyBeta>
+void LayerNormRow(
+    const int hidden_size,
+    const T* gamma,
+    const T* beta,
+    const T* x,
+    T* y,
+    T* cache) {
+  T mean, invstd;
+  LayerNormMoments(hidden_size, x, mean, invstd);
+
+  for (int i = 0; i < hidden_size; i += kChunkSize) {
+    const int size = std::min(kChunkSize, hidden_size - i);
+    if (ApplyBeta)
+      Slice(y, i, size) = (Slice(x, i, size) - mean) * invstd * Slice(gamma, i, size) + Slice(beta, i, size);
+    else
+      Slice(y, i, size) = (Slice(x, i, size) - mean) * invstd * Slice(gamma, i, size);
+  }
+
+  cache[0] = mean;
+  cache[1] = invstd;
+}
+
+// `dx` may be aliased with `x` or `dy`. The parameter gradients are accumulated into
+// `dgamma` and `dbeta`, which must not be shared with a concurrent caller.
+template<typename T, bool ApplyBeta>
+void LayerNormGradRow(
+    const int hidden_size,
+    const T* gamma,
+    const T* x,
+    const T* dy,
+    T* dgamma,
+    T* dbeta,
+    T* dx,
+    const T* cache) {
+  const T mean = cache[0];
+  const T invstd = cache[1];
+
+  T dsigma_tmp = static_cast<T>(0.0);
+  T dmu1_tmp = static_cast<T>(0.0);
+  T dmu2_tmp = static_cast<T>(0.0);
+  for (int i = 0; i < hidden_size; i += kChunkSize) {
+    const int size = std::min(kChunkSize, hidden_size - i);
+    const Chunk<T> centered_x = Slice(x, i, size) - mean;
+    const auto cur_dy = Slice(dy, i, size);
+    const Chunk<T> db = Slice(gamma, i, size) * cur_dy;
+
+    Slice(dgamma, i, size) += centered_x * invstd * cur_dy;
+    if (ApplyBeta)
+      Slice(dbeta, i, size) += cur_dy;
+
+    dsigma_tmp += (centered_x * db).sum();
+    dmu1_tmp += centered_x.sum();
+    dmu2_tmp += db.sum();
+  }
+
+  const T dsigma = static_cast<T>(-0.5) * dsigma_tmp * invstd * invstd * invstd;
+  const T dmu = (static_cast<T>(-2.0) * dmu1_tmp * dsigma / hidden_size) - (dmu2_tmp * invstd);
+
+  for (int i = 0; i < hidden_size; i += kChunkSize) {
+    const int size = std::min(kChunkSize, hidden_size - i);
+    Slice(dx, i, size) = (static_cast<T>(2.0) * dsigma / hidden_size) * (Slice(x, i, size) - mean) +
+                         invstd * Slice(gamma, i, size) * Slice(dy, i, size) +
+                         dmu / hidden_size;
+  }
+}
@@ -0,0 +1,113 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include <cassert>
+
+#include "haste/cpu/layer_norm.h"
+#include "layer_norm_cpu.h"
+
+namespace {
+
+template<typename T, bool ApplyBeta>
+void LayerNorm(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int batch_size,
+    const int hidden_size,
+    const T* gamma,
+    const T* beta,
+    const T* x,
+    T* y,
+    T* cache) {
+  ParallelRange(parallel_for, batch_size, 8LL * hidden_size, [&](int64_t begin, int64_t end) {
+    for (int64_t batch = begin; batch < end; ++batch) {
+      LayerNormRow<T, ApplyBeta>(
+          hidden_size,
+          gamma,
+          beta,
+          x + batch * hidden_size,
+          y + batch * hidden_size,
+          cache + batch * 2);
+    }
+  });
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace layer_norm {
+
+template<typename T>
+ForwardPass<T>::ForwardPass(
+    const int batch_size,
+    const int hidden_size,
+    const T* gamma,
+    const T* beta,
+    T* cache,
+    const ParallelFor& parallel_for)
+        : batch_size_(batch_size),
+          hidden_size_(hidden_size),
+          gamma_(gamma),
+          beta_(beta),
+          cache_(cache),
+          partial_(0),
+          parallel_for_(parallel_for) {
+}
+
+template<typename T>
+void ForwardPass<T>::Run(const T* x, T* y) {
+  RunPartial(batch_size_, x, y);
+}
+
+template<typename T>
+void ForwardPass<T>::RunPartial(
+    const int minibatch,
+    const T* x,
+    T* y) {
+  assert(partial_ + minibatch <= batch_size_);
+
+  if (beta_) {
+    LayerNorm<T, true>(
+        parallel_for_,
+        minibatch,
+        hidden_size_,
+        gamma_,
+        beta_,
+        x,
+        y,
+        cache_ + partial_ * 2);
+  } else {
+    LayerNorm<T, false>(
+        parallel_for_,
+        minibatch,
+        hidden_size_,
+        gamma_,
+        nullptr,
+        x,
+        y,
+        cache_ + partial_ * 2);
+  }
+
+  partial_ += minibatch;
+}
+
+template class ForwardPass<float>;
+template class ForwardPass<double>;
+
+}  // namespace layer_norm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
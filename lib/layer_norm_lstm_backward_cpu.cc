@@ -0,0 +1,409 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include <mutex>
+
+#include "cpu_blas.h"
+#include "haste/cpu/layer_norm_lstm.h"
+#include "inline_ops_cpu.h"
+#include "layer_norm_cpu.h"
+
+namespace {
+
+// Parameter gradients accumulated by one block of batch entries. They're added to the
+// outputs once per block rather than once per element.
+template<typename T>
+struct LocalGrads {
+  explicit LocalGrads(const int hidden_size)
+      : db(Vector<T>::Zero(hidden_size * 4)),
+        dgamma_Rh(Vector<T>::Zero(hidden_size * 4)),
+        dgamma_c(Vector<T>::Zero(hidden_size)),
+        dbeta_c(Vector<T>::Zero(hidden_size)) {}
+
+  Vector<T> db;
+  Vector<T> dgamma_Rh;
+  Vector<T> dgamma_c;
+  Vector<T> dbeta_c;
+};
+
+// Computes one backward time step for a single batch entry. On return, `v` holds the
+// gradient with respect to the pre-activation gates, `act_Rh` holds the gradient with
+// respect to the un-normalized recurrent projection, and `act_c_norm` has been clobbered.
+template<typename T, bool ApplyZoneout, bool ApplyBeta>
+void ComputeRow(
+    const int hidden_size,
+    const T* gamma_Rh,   // [H*4]
+    const T* gamma_c,    // [H]
+    const T* c,          // [H]
+    const T* c_new,      // [H] (the input to `layer_norm3`)
+    const T* dh_new,     // [H]
+    const T* dc_new,     // [H]
+    T* dh_inout,         // [H]
+    T* dc_inout,         // [H]
+    T* v,                // [H*4]
+    T* act_Rh,           // [H*4] (the input to `layer_norm2`)
+    T* act_c_norm,       // [H]
+    const T* cache_Rh,   // [2]
+    const T* cache_c,    // [2]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int64_t zoneout_index,  // Index of this row's first mask element in [N,H]
+    LocalGrads<T>& grads) {
+  // Gradient through h = o * tanh(layer_norm(c)).
+  for (int row = 0; row < hidden_size; row += kChunkSize) {
+    const int size = std::min(kChunkSize, hidden_size - row);
+    const int o_idx = row + 3 * hidden_size;
+
+    Chunk<T> dh_total = Slice(dh_new, row, size) + Slice(dh_inout, row, size);
+    if (ApplyZoneout) {
+      const auto mask = ZoneoutMask<T>(zoneout_seed, zoneout_index + row, size, zoneout_prob);
+      Slice(dh_inout, row, size) = (static_cast<T>(1.0) - mask) * dh_total;
+      dh_total *= mask;
+    } else {
+      Slice(dh_inout, row, size).setZero();
+    }
+
+    const Chunk<T> c_tanh = Slice(act_c_norm, row, size).tanh();
+    const Chunk<T> o = Slice(v, o_idx, size);
+
+    Slice(act_c_norm, row, size) = d_tanh(c_tanh) * o * dh_total;
+    Slice(v, o_idx, size) = d_sigmoid(o) * c_tanh * dh_total;
+  }
+
+  LayerNormGradRow<T, ApplyBeta>(
+      hidden_size,
+      gamma_c,
+      c_new,
+      act_c_norm,
+      grads.dgamma_c.data(),
+      grads.dbeta_c.data(),
+      act_c_norm,
+      cache_c);
+
+  for (int row = 0; row < hidden_size; row += kChunkSize) {
+    const int size = std::min(kChunkSize, hidden_size - row);
+    const int i_idx = row + 0 * hidden_size;
+    const int g_idx = row + 1 * hidden_size;
+    const int f_idx = row + 2 * hidden_size;
+    const int o_idx = row + 3 * hidden_size;
+
+    const Chunk<T> i = Slice(v, i_idx, size);
+    const Chunk<T> g = Slice(v, g_idx, size);
+    const Chunk<T> f = Slice(v, f_idx, size);
+
+    const Chunk<T> dc_total =
+        Slice(dc_new, row, size) + Slice(dc_inout, row, size) + Slice(act_c_norm, row, size);
+
+    Slice(v, i_idx, size) = d_sigmoid(i) * g * dc_total;
+    Slice(v, g_idx, size) = d_tanh(g) * i * dc_total;
+    Slice(v, f_idx, size) = d_sigmoid(f) * Slice(c, row, size) * dc_total;
+    Slice(dc_inout, row, size) = f * dc_total;
+
+    grads.db.segment(i_idx, size) += Slice(v, i_idx, size);
+    grads.db.segment(g_idx, size) += Slice(v, g_idx, size);
+    grads.db.segment(f_idx, size) += Slice(v, f_idx, size);
+    grads.db.segment(o_idx, size) += Slice(v, o_idx, size);
+  }
+
+  LayerNormGradRow<T, false>(
+      hidden_size * 4,
+      gamma_Rh,
+      act_Rh,
+      v,
+      grads.dgamma_Rh.data(),
+      nullptr,
+      act_Rh,
+      cache_Rh);
+}
+
+// Padding entries (see the forward pass) carried their state forward unchanged, so their
+// gradients pass straight through and they contribute nothing to the parameter gradients.
+template<typename T, bool ApplyZoneout, bool ApplyBeta>
+void ComputeRows(
+    const int begin,
+    const int end,
+    const int hidden_size,
+    const int t,
+    const int64_t* sequence_length,
+    const T* gamma_Rh,
+    const T* gamma_c,
+    const T* c,
+    const T* c_new,
+    const T* dh_new,
+    const T* dc_new,
+    T* dh,
+    T* dc,
+    T* v,
+    T* act_Rh,
+    T* act_c_norm,
+    const T* cache_Rh,
+    const T* cache_c,
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    LocalGrads<T>& grads) {
+  const int64_t H = hidden_size;
+  for (int64_t n = begin; n < end; ++n) {
+    if (sequence_length && t >= sequence_length[n]) {
+      Slice(dh, n * H, hidden_size) += Slice(dh_new, n * H, hidden_size);
+      Slice(dc, n * H, hidden_size) += Slice(dc_new, n * H, hidden_size);
+      Slice(v, n * H * 4, hidden_size * 4).setZero();
+      Slice(act_Rh, n * H * 4, hidden_size * 4).setZero();
+      continue;
+    }
+
+    ComputeRow<T, ApplyZoneout, ApplyBeta>(
+        hidden_size,
+        gamma_Rh,
+        gamma_c,
+        c + n * H,
+        c_new + n * H,
+        dh_new + n * H,
+        dc_new + n * H,
+        dh + n * H,
+        dc + n * H,
+        v + n * H * 4,
+        act_Rh + n * H * 4,
+        act_c_norm + n * H,
+        cache_Rh + n * 2,
+        cache_c + n * 2,
+        zoneout_prob,
+        zoneout_seed,
+        n * H,
+        grads);
+  }
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace layer_norm_lstm {
+
+template<typename T>
+struct BackwardPass<T>::private_data {
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<uint8_t> packed_R;
+};
+
+template<typename T>
+BackwardPass<T>::BackwardPass(
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+}
+
+template<typename T>
+BackwardPass<T>::~BackwardPass() {
+  delete data_;
+}
+
+template<typename T>
+void BackwardPass<T>::IterateInternal(
+    const int t,
+    const int64_t* sequence_length,  // [N]
+    const void* packed_Rt,           // R^T packed by `PackTransposedRecurrentKernel`
+    const T* c,       // [N,H]
+    const T* c_new,   // [N,H]
+    const T* dh_new,  // [N,H]
+    const T* dc_new,  // [N,H]
+    T* db,            // [H*4]
+    T* dh,            // [N,H]
+    T* dc,            // [N,H]
+    T* v,             // [N,H*4]
+    T* act_Rh,
+    layer_norm::BackwardPass<T>& layer_norm2,
+    layer_norm::BackwardPass<T>& layer_norm3,
+    T* act_c_norm,
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const int batch_size = data_->batch_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  layer_norm2.partial_ -= batch_size;
+  layer_norm3.partial_ -= batch_size;
+
+  const T* gamma_Rh = layer_norm2.gamma_;
+  const T* gamma_c = layer_norm3.gamma_;
+  // See `ForwardPass::IterateInternal`.
+  const int64_t cache_offset = static_cast<int64_t>(t) * batch_size * 2;
+  const T* cache_Rh = layer_norm2.cache_ + cache_offset;
+  const T* cache_c = layer_norm3.cache_ + cache_offset;
+  T* dgamma_Rh = layer_norm2.dgamma_;
+  T* dgamma_c = layer_norm3.dgamma_;
+  T* dbeta_c = layer_norm3.dbeta_;
+  const bool apply_beta = layer_norm3.beta_ && layer_norm3.dbeta_;
+
+  std::mutex mutex;
+  const int64_t cost_per_row = 4LL * hidden_size * 48;
+  ParallelRange(parallel_for, batch_size, cost_per_row, [&](int64_t begin64, int64_t end64) {
+    const int begin = static_cast<int>(begin64);
+    const int end = static_cast<int>(end64);
+    LocalGrads<T> grads(hidden_size);
+
+#define HASTE_COMPUTE_ROWS(ZONEOUT, BETA)                                    \
+    ComputeRows<T, ZONEOUT, BETA>(                                           \
+        begin, end, hidden_size, t, sequence_length, gamma_Rh, gamma_c, c, c_new, dh_new,        \
+        dc_new, dh, dc, v, act_Rh, act_c_norm, cache_Rh, cache_c,            \
+        zoneout_prob, zoneout_seed, grads)
+
+    if (zoneout_prob) {
+      if (apply_beta) HASTE_COMPUTE_ROWS(true, true);
+      else            HASTE_COMPUTE_ROWS(true, false);
+    } else {
+      if (apply_beta) HASTE_COMPUTE_ROWS(false, true);
+      else            HASTE_COMPUTE_ROWS(false, false);
+    }
+
+#undef HASTE_COMPUTE_ROWS
+
+    std::lock_guard<std::mutex> lock(mutex);
+    Slice(db, 0, hidden_size * 4) += grads.db;
+    Slice(dgamma_Rh, 0, hidden_size * 4) += grads.dgamma_Rh;
+    Slice(dgamma_c, 0, hidden_size) += grads.dgamma_c;
+    if (apply_beta)
+      Slice(dbeta_c, 0, hidden_size) += grads.dbeta_c;
+  });
+
+  const cpu_packed_lhs<T> recurrent_t(1, hidden_size, hidden_size * 4);
+  ParallelUnits<T>(parallel_for, hidden_size, 2LL * hidden_size * 4 * batch_size, [&](int begin, int end) {
+    recurrent_t.gemm(packed_Rt, begin, end, batch_size, act_Rh, hidden_size * 4, dh, hidden_size, true);
+  });
+}
+
+template<typename T>
+void BackwardPass<T>::Run(
+    const int steps,
+    const T* W,       // [C,H*4]
+    const T* R,       // [H,H*4]
+    const T* b,       // [H*4]
+    const T* x,       // [T,N,C]
+    const T* h,       // [T+1,N,H]
+    const T* c,       // [T+1,N,H]
+    const T* dh_new,  // [T+1,N,H]
+    const T* dc_new,  // [T+1,N,H]
+    T* dx,            // [T,N,C]
+    T* dW,            // [C,H*4]
+    T* dR,            // [H,H*4]
+    T* db,            // [H*4]
+    T* dh,            // [N,H]
+    T* dc,            // [N,H]
+    T* act_Wx,        // [T,N,H*4]
+    layer_norm::BackwardPass<T>& layer_norm1,
+    T* act_Wx_norm,   // [T,N,H*4]
+    T* act_Rh,
+    layer_norm::BackwardPass<T>& layer_norm2,
+    layer_norm::BackwardPass<T>& layer_norm3,
+    T* act_c_norm,
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const float dropout_prob,
+    const uint64_t dropout_seed) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
+  const T beta_assign = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  // Visit the time steps in the opposite order of the forward pass; see
+  // `ForwardPass::Run` for the state layout when `reverse` is set.
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  // Every step multiplies by the same R^T, so it's packed (with the DropConnect mask
+  // applied, if any) once for all of them.
+  const void* packed_Rt = PackTransposedRecurrentKernel(
+      parallel_for, 4, hidden_size, R, dropout_prob, dropout_seed, data_->packed_R);
+  for (int i = steps - 1; i >= 0; --i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const int in = reverse ? t + 1 : t;
+    const int out = reverse ? t : t + 1;
+    IterateInternal(
+        t,
+        sequence_length,
+        packed_Rt,
+        c + in * NH,
+        c + out * NH,
+        dh_new + out * NH,
+        dc_new + out * NH,
+        db,
+        dh,
+        dc,
+        act_Wx_norm + t * NH * 4,
+        act_Rh + t * NH * 4,
+        layer_norm2,
+        layer_norm3,
+        act_c_norm + t * NH,
+        zoneout_prob,
+        zoneout_seed + t);
+  }
+
+  // The recurrent matrix sees the input state of every step: h[0:T], or h[1:T+1] in reverse.
+  const T* h_in = reverse ? h + NH : h;
+
+  layer_norm1.Run(act_Wx_norm, act_Wx);
+
+  if (dW) {
+    cpu_blas<T>::gemm(parallel_for,
+        false, true,
+        hidden_size * 4, input_size, batch_size * steps,
+        alpha,
+        act_Wx, hidden_size * 4,
+        x, input_size,
+        beta_sum,
+        dW, hidden_size * 4);
+  }
+
+  // With DropConnect, the recurrent kernel gradient is masked as it's added.
+  if (dR) {
+    RecurrentKernelGradient(parallel_for,
+        hidden_size * 4, hidden_size, batch_size * steps,
+        act_Rh, hidden_size * 4,
+        h_in, hidden_size,
+        dR, hidden_size * 4,
+        dropout_prob, dropout_seed);
+  }
+
+  if (dx) {
+    cpu_blas<T>::gemm(parallel_for,
+        true, false,
+        input_size, steps * batch_size, hidden_size * 4,
+        alpha,
+        W, hidden_size * 4,
+        act_Wx, hidden_size * 4,
+        beta_assign,
+        dx, input_size);
+  }
+}
+
+template class BackwardPass<float>;
+template class BackwardPass<double>;
+
+}  // namespace layer_norm_lstm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
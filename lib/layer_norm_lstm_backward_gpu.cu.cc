@@ -21,6 +21,7 @@
 #include "blas.h"
 #include "haste.h"
 #include "inline_ops.h"
+#include "zoneout_ops.h"
 
 namespace {
 
@@ -34,7 +35,8 @@ void ComputeOutputGrad(
     T* dh_inout,
     T* dlayer_norm,
     T* v,
-    const T* zoneout_mask) {
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
   const int row = blockDim.x * blockIdx.x + threadIdx.x;
   const int col = blockDim.y * blockIdx.y + threadIdx.y;
 
@@ -47,7 +49,7 @@ void ComputeOutputGrad(
 
   T dh_total = dh_new[base_idx] + dh_inout[base_idx];
   if (ApplyZoneout) {
-    const T mask = zoneout_mask[base_idx];
+    const T mask = zoneout_keep(zoneout_seed, base_idx, zoneout_prob) ? static_cast<T>(1.0) : static_cast<T>(0.0);
     dh_inout[base_idx] = (static_cast<T>(1.0) - mask) * dh_total;
     dh_total = mask * dh_total;
   } else {
@@ -163,7 +165,7 @@ BackwardPass<T>::~BackwardPass() {
 
 template<typename T>
 void BackwardPass<T>::IterateInternal(
-    const T* R_t,     // [H*4,H]
+    const T* R,       // [H,H*4]
     const T* c,       // [N,H]
     const T* c_new,   // [N,H]
     const T* dh_new,  // [N,H]
@@ -176,7 +178,8 @@ void BackwardPass<T>::IterateInternal(
     layer_norm::BackwardPass<T>& layer_norm2,
     layer_norm::BackwardPass<T>& layer_norm3,
     T* act_c_norm,
-    const T* zoneout_mask) {
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
   const T alpha = static_cast<T>(1.0);
   const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
 
@@ -192,7 +195,7 @@ void BackwardPass<T>::IterateInternal(
       (hidden_size + blockDim.x - 1) / blockDim.x,
       (batch_size + blockDim.y - 1) / blockDim.y);
 
-  if (zoneout_mask) {
+  if (zoneout_prob) {
     ComputeOutputGrad<T, true><<<gridDim, blockDim, 0, stream1>>>(
         batch_size,
         hidden_size,
@@ -201,7 +204,8 @@ void BackwardPass<T>::IterateInternal(
         dh,
         act_c_norm,
         v,
-        zoneout_mask);
+        zoneout_prob,
+        zoneout_seed);
   } else {
     ComputeOutputGrad<T, false><<<gridDim, blockDim, 0, stream1>>>(
         batch_size,
@@ -211,7 +215,8 @@ void BackwardPass<T>::IterateInternal(
         dh,
         act_c_norm,
         v,
-        nullptr);
+        0.0f,
+        0);
   }
   layer_norm3.RunPartial(stream1, batch_size, act_c_norm, act_c_norm);
   PointwiseOperations<T><<<gridDim, blockDim, 0, stream1>>>(
@@ -231,10 +236,10 @@ void BackwardPass<T>::IterateInternal(
   cublasSetStream(blas_handle, stream1);
   layer_norm2.RunPartial(stream1, batch_size, v, act_Rh);
   blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
+      CUBLAS_OP_T, CUBLAS_OP_N,
       hidden_size, batch_size, hidden_size * 4,
       &alpha,
-      R_t, hidden_size,
+      R, hidden_size * 4,
       act_Rh, hidden_size * 4,
       &beta_sum,
       dh, hidden_size);
@@ -243,10 +248,10 @@ void BackwardPass<T>::IterateInternal(
 template<typename T>
 void BackwardPass<T>::Run(
     const int steps,
-    const T* W_t,     // [H*4,C]
-    const T* R_t,     // [H*4,H]
+    const T* W,       // [C,H*4]
+    const T* R,       // [H,H*4]
     const T* b,       // [H*4]
-    const T* x_t,     // [C,T,N]
+    const T* x,       // [T,N,C]
     const T* h,       // [T+1,N,H]
     const T* c,       // [T+1,N,H]
     const T* dh_new,  // [T+1,N,H]
@@ -264,7 +269,8 @@ void BackwardPass<T>::Run(
     layer_norm::BackwardPass<T>& layer_norm2,
     layer_norm::BackwardPass<T>& layer_norm3,
     T* act_c_norm,
-    const T* zoneout_mask) {
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
   const T alpha = static_cast<T>(1.0);
   const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
   const T beta_assign = static_cast<T>(0.0);
@@ -284,7 +290,7 @@ void BackwardPass<T>::Run(
   const int NH = batch_size * hidden_size;
   for (int i = steps - 1; i >= 0; --i) {
     IterateInternal(
-        R_t,
+        R,
         c + i * NH,
         c + (i + 1) * NH,
         dh_new + (i + 1) * NH,
@@ -297,42 +303,49 @@ void BackwardPass<T>::Run(
         layer_norm2,
         layer_norm3,
         act_c_norm + i * NH,
-        zoneout_mask ? zoneout_mask + i * NH : nullptr);
+        zoneout_prob,
+        zoneout_seed + i);
   }
   cudaEventRecord(event, stream1);
 
   cudaStreamWaitEvent(stream2, event, 0);
   layer_norm1.Run(stream2, act_Wx_norm, act_Wx);
-  cublasSetStream(blas_handle, stream2);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      hidden_size * 4, input_size, batch_size * steps,
-      &alpha,
-      act_Wx, hidden_size * 4,
-      x_t, batch_size * steps,
-      &beta_sum,
-      dW, hidden_size * 4);
+  if (dW) {
+    cublasSetStream(blas_handle, stream2);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_N, CUBLAS_OP_T,
+        hidden_size * 4, input_size, batch_size * steps,
+        &alpha,
+        act_Wx, hidden_size * 4,
+        x, input_size,
+        &beta_sum,
+        dW, hidden_size * 4);
+  }
 
   cudaStreamWaitEvent(stream3, event, 0);
-  cublasSetStream(blas_handle, stream1);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_T,
-      hidden_size * 4, hidden_size, batch_size * steps,
-      &alpha,
-      act_Rh, hidden_size * 4,
-      h, hidden_size,
-      &beta_sum,
-      dR, hidden_size * 4);
+  if (dR) {
+    cublasSetStream(blas_handle, stream1);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_N, CUBLAS_OP_T,
+        hidden_size * 4, hidden_size, batch_size * steps,
+        &alpha,
+        act_Rh, hidden_size * 4,
+        h, hidden_size,
+        &beta_sum,
+        dR, hidden_size * 4);
+  }
 
-  cublasSetStream(blas_handle, stream2);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      input_size, steps * batch_size, hidden_size * 4,
-      &alpha,
-      W_t, input_size,
-      act_Wx, hidden_size * 4,
-      &beta_assign,
-      dx, input_size);
+  if (dx) {
+    cublasSetStream(blas_handle, stream2);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_T, CUBLAS_OP_N,
+        input_size, steps * batch_size, hidden_size * 4,
+        &alpha,
+        W, hidden_size * 4,
+        act_Wx, hidden_size * 4,
+        &beta_assign,
+        dx, input_size);
+  }
 
   cublasSetStream(blas_handle, save_stream);
 }
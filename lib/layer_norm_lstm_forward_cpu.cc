@@ -0,0 +1,357 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include <algorithm>
+#include <vector>
+
+#include "cpu_blas.h"
+#include "haste/cpu/layer_norm_lstm.h"
+#include "inline_ops_cpu.h"
+#include "layer_norm_cpu.h"
+
+namespace {
+
+// Computes one time step for a single batch entry: layer norm of the recurrent
+// projection, gate activations, cell state, layer norm of the cell state, and output.
+// `h` and `h_out` may be aliased, as may `c` and `c_out`.
+template<typename T, bool Training, bool ApplyZoneout, bool ApplyBeta>
+void ComputeRow(
+    const int hidden_size,
+    const T* gamma_Rh,   // [H*4]
+    const T* gamma_c,    // [H]
+    const T* beta_c,     // [H]
+    const T* Wx,         // Layer normalized input projection [H*4]
+    const T* Rh,         // Recurrent projection [H*4]
+    const T* b,          // [H*4]
+    const T* h,          // [H]
+    const T* c,          // [H]
+    T* h_out,            // [H]
+    T* c_out,            // [H]
+    T* v_out,            // [H*4]
+    T* tmp_Rh,           // [H*4]
+    T* act_c_norm,       // [H]
+    T* cache_Rh,         // [2]
+    T* cache_c,          // [2]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int64_t zoneout_index) {  // Index of this row's first mask element in [N,H]
+  LayerNormRow<T, false>(hidden_size * 4, gamma_Rh, nullptr, Rh, tmp_Rh, cache_Rh);
+
+  for (int row = 0; row < hidden_size; row += kChunkSize) {
+    const int size = std::min(kChunkSize, hidden_size - row);
+    const int i_idx = row + 0 * hidden_size;
+    const int g_idx = row + 1 * hidden_size;
+    const int f_idx = row + 2 * hidden_size;
+    const int o_idx = row + 3 * hidden_size;
+
+    // In inference mode, `v_out` is the normalized input projection for this step and is
+    // free to be overwritten.
+    auto i = Slice(v_out, i_idx, size);
+    auto g = Slice(v_out, g_idx, size);
+    auto f = Slice(v_out, f_idx, size);
+    auto o = Slice(v_out, o_idx, size);
+
+    i = (Slice(Wx, i_idx, size) + Slice(tmp_Rh, i_idx, size) + Slice(b, i_idx, size)).logistic();
+    g = (Slice(Wx, g_idx, size) + Slice(tmp_Rh, g_idx, size) + Slice(b, g_idx, size)).tanh();
+    f = (Slice(Wx, f_idx, size) + Slice(tmp_Rh, f_idx, size) + Slice(b, f_idx, size)).logistic();
+    o = (Slice(Wx, o_idx, size) + Slice(tmp_Rh, o_idx, size) + Slice(b, o_idx, size)).logistic();
+
+    Slice(c_out, row, size) = f * Slice(c, row, size) + i * g;
+  }
+
+  LayerNormRow<T, ApplyBeta>(hidden_size, gamma_c, beta_c, c_out, act_c_norm, cache_c);
+
+  for (int row = 0; row < hidden_size; row += kChunkSize) {
+    const int size = std::min(kChunkSize, hidden_size - row);
+    const auto o = Slice(v_out, row + 3 * hidden_size, size);
+    const auto prev_h = Slice(h, row, size);
+    auto cur_h = Slice(h_out, row, size);
+
+    if (ApplyZoneout) {
+      if (Training) {
+        const auto mask = ZoneoutMask<T>(zoneout_seed, zoneout_index + row, size, zoneout_prob);
+        cur_h = (o * Slice(act_c_norm, row, size).tanh() - prev_h) * mask + prev_h;
+      } else {
+        cur_h = static_cast<T>(zoneout_prob) * prev_h +
+                static_cast<T>(1.0f - zoneout_prob) * (o * Slice(act_c_norm, row, size).tanh());
+      }
+    } else {
+      cur_h = o * Slice(act_c_norm, row, size).tanh();
+    }
+  }
+}
+
+// Batch entries whose `sequence_length` doesn't cover time step `t` are padding: their
+// state is carried forward unchanged.
+template<typename T, bool Training, bool ApplyZoneout, bool ApplyBeta>
+void ComputeRows(
+    const int begin,
+    const int end,
+    const int hidden_size,
+    const int t,
+    const int64_t* sequence_length,
+    const T* gamma_Rh,
+    const T* gamma_c,
+    const T* beta_c,
+    const T* Wx,
+    const T* Rh,
+    const T* b,
+    const T* h,
+    const T* c,
+    T* h_out,
+    T* c_out,
+    T* v_out,
+    T* tmp_Rh,
+    T* act_c_norm,
+    T* cache_Rh,
+    T* cache_c,
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const int64_t H = hidden_size;
+  for (int64_t n = begin; n < end; ++n) {
+    if (sequence_length && t >= sequence_length[n]) {
+      std::copy(h + n * H, h + (n + 1) * H, h_out + n * H);
+      std::copy(c + n * H, c + (n + 1) * H, c_out + n * H);
+      std::fill(cache_Rh + n * 2, cache_Rh + (n + 1) * 2, static_cast<T>(0.0));
+      std::fill(cache_c + n * 2, cache_c + (n + 1) * 2, static_cast<T>(0.0));
+      continue;
+    }
+
+    ComputeRow<T, Training, ApplyZoneout, ApplyBeta>(
+        hidden_size,
+        gamma_Rh,
+        gamma_c,
+        beta_c,
+        Wx + n * H * 4,
+        Rh + n * H * 4,
+        b,
+        h + n * H,
+        c + n * H,
+        h_out + n * H,
+        c_out + n * H,
+        v_out + n * H * 4,
+        tmp_Rh + n * H * 4,
+        act_c_norm + n * H,
+        cache_Rh + n * 2,
+        cache_c + n * 2,
+        zoneout_prob,
+        zoneout_seed,
+        n * H);
+  }
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace layer_norm_lstm {
+
+template<typename T>
+struct ForwardPass<T>::private_data {
+  bool training;
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<uint8_t> packed_R;
+};
+
+template<typename T>
+ForwardPass<T>::ForwardPass(
+    const bool training,
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->training = training;
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+}
+
+template<typename T>
+ForwardPass<T>::~ForwardPass() {
+  delete data_;
+}
+
+template<typename T>
+int64_t ForwardPass<T>::PackedRecurrentKernelSize() const {
+  return cpu_packed_lhs<T>(4, data_->hidden_size, data_->hidden_size).bytes();
+}
+
+template<typename T>
+void ForwardPass<T>::PackRecurrentKernel(
+    const T* R,
+    void* packed_R,
+    const float dropout_prob,
+    const uint64_t dropout_seed) {
+  const int hidden_size = data_->hidden_size;
+  cpu_packed_lhs<T>(4, hidden_size, hidden_size).Pack(
+      data_->parallel_for, R, hidden_size * 4, packed_R, false, dropout_prob, dropout_seed);
+}
+
+template<typename T>
+void ForwardPass<T>::IterateInternal(
+    const int t,
+    const int64_t* sequence_length,  // [N]
+    const void* packed_R,  // Packed weight matrix for recurrent state (Rh)
+    const T* b,  // Bias for gates (Wx + Rh + b) [H*4]
+    const T* h,  // Recurrent state [N,H]
+    const T* c,  // Cell state [N,H]
+    T* h_out,    // Output recurrent state [N,H]
+    T* c_out,    // Output cell state [N,H]
+    T* v,        // Output vector (Wx + Rh + b) [N,H*4]
+    T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
+    T* act_Rh,
+    layer_norm::ForwardPass<T>& layer_norm2,
+    layer_norm::ForwardPass<T>& layer_norm3,
+    T* act_c_norm,
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const bool training = data_->training;
+  const int batch_size = data_->batch_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+  const cpu_packed_lhs<T> recurrent(4, hidden_size, hidden_size);
+
+  ParallelUnits<T>(parallel_for, hidden_size, 8LL * batch_size * hidden_size, [&](int begin, int end) {
+    recurrent.gemm(packed_R, begin, end, batch_size, h, hidden_size, act_Rh, hidden_size * 4);
+  });
+
+  const T* gamma_Rh = layer_norm2.gamma_;
+  const T* gamma_c = layer_norm3.gamma_;
+  const T* beta_c = layer_norm3.beta_;
+  // The caches are indexed by time step rather than by `partial_` so that a reverse pass
+  // leaves them in the same order as the activations.
+  const int64_t cache_offset = static_cast<int64_t>(t) * batch_size * 2;
+  T* cache_Rh = layer_norm2.cache_ + cache_offset;
+  T* cache_c = layer_norm3.cache_ + cache_offset;
+  const bool apply_zoneout = zoneout_prob;
+
+  // The layer norms need entire rows, so work is split across batch entries here.
+  const int64_t cost_per_row = 4LL * hidden_size * 32;
+  ParallelRange(parallel_for, batch_size, cost_per_row, [&](int64_t begin64, int64_t end64) {
+    const int begin = static_cast<int>(begin64);
+    const int end = static_cast<int>(end64);
+
+#define HASTE_COMPUTE_ROWS(TRAINING, ZONEOUT, BETA)                          \
+    ComputeRows<T, TRAINING, ZONEOUT, BETA>(                                 \
+        begin, end, hidden_size, t, sequence_length, gamma_Rh, gamma_c, beta_c, v, act_Rh, b,   \
+        h, c, h_out, c_out, v, tmp_Rh, act_c_norm, cache_Rh, cache_c,       \
+        zoneout_prob, zoneout_seed)
+
+    if (training) {
+      if (apply_zoneout) {
+        if (beta_c) HASTE_COMPUTE_ROWS(true, true, true);
+        else        HASTE_COMPUTE_ROWS(true, true, false);
+      } else {
+        if (beta_c) HASTE_COMPUTE_ROWS(true, false, true);
+        else        HASTE_COMPUTE_ROWS(true, false, false);
+      }
+    } else {
+      if (apply_zoneout) {
+        if (beta_c) HASTE_COMPUTE_ROWS(false, true, true);
+        else        HASTE_COMPUTE_ROWS(false, true, false);
+      } else {
+        if (beta_c) HASTE_COMPUTE_ROWS(false, false, true);
+        else        HASTE_COMPUTE_ROWS(false, false, false);
+      }
+    }
+
+#undef HASTE_COMPUTE_ROWS
+  });
+
+  layer_norm2.partial_ += batch_size;
+  layer_norm3.partial_ += batch_size;
+}
+
+template<typename T>
+void ForwardPass<T>::Run(
+    const int steps,
+    const T* W,  // Weight matrix for input (Wx) [C,H*4]
+    const T* R,  // Weight matrix for recurrent state (Rh) [H,H*4]
+    const T* b,  // Bias for gates (Wx + Rh + b) [H*4]
+    const T* x,  // Input vector [T,N,C]
+    T* h,        // Recurrent state [T+1,N,H]
+    T* c,        // Cell state [T+1,N,H]
+    T* act_Wx,   // Output vector (Wx + Rh + b) [T,N,H*4]
+    T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
+    layer_norm::ForwardPass<T>& layer_norm1,
+    T* act_Wx_norm,
+    T* act_Rh,
+    layer_norm::ForwardPass<T>& layer_norm2,
+    layer_norm::ForwardPass<T>& layer_norm3,
+    T* act_c_norm,
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const void* packed_R) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+
+  // Every step multiplies by the same R, so it's packed (at most) once for all of them.
+  packed_R = PackedRecurrentKernel(data_->parallel_for, 4, hidden_size, R, packed_R, data_->packed_R);
+
+  cpu_blas<T>::gemm(data_->parallel_for,
+      false, false,
+      hidden_size * 4, steps * batch_size, input_size,
+      alpha,
+      W, hidden_size * 4,
+      x, input_size,
+      beta,
+      act_Wx, hidden_size * 4);
+  layer_norm1.Run(act_Wx, act_Wx_norm);
+
+  // Time step slots are assigned as in `lstm::ForwardPass::Run`: in reverse, step `t` reads
+  // its state from slot t+1 and writes it to slot t.
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  for (int i = 0; i < steps; ++i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const int in = reverse ? t + 1 : t;
+    const int out = reverse ? t : t + 1;
+    IterateInternal(
+        t,
+        sequence_length,
+        packed_R,
+        b,
+        h + in * NH,
+        c + in * NH,
+        h + out * NH,
+        c + out * NH,
+        act_Wx_norm + t * NH * 4,
+        tmp_Rh,
+        act_Rh + t * NH * 4,
+        layer_norm2,
+        layer_norm3,
+        act_c_norm + t * NH,
+        zoneout_prob,
+        zoneout_seed + t);
+  }
+}
+
+template class ForwardPass<float>;
+template class ForwardPass<double>;
+
+}  // namespace layer_norm_lstm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
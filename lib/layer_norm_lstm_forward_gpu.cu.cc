@@ -19,6 +19,7 @@
 #include "blas.h"
 #include "haste.h"
 #include "inline_ops.h"
+#include "zoneout_ops.h"
 
 namespace {
 
@@ -82,7 +83,7 @@ void ComputeCellOutput(
     const T* v,
     T* h_out,     // Output recurrent state
     const float zoneout_prob,
-    const T* zoneout_mask) {  // Zoneout mask (only used if ApplyZoneout==true)
+    const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
   const int row = blockDim.x * blockIdx.x + threadIdx.x;
   const int col = blockDim.y * blockIdx.y + threadIdx.y;
 
@@ -99,7 +100,8 @@ void ComputeCellOutput(
 
   if (ApplyZoneout) {
     if (Training) {
-      cur_h_value = (cur_h_value - h[output_idx]) * zoneout_mask[output_idx] + h[output_idx];
+      if (!zoneout_keep(zoneout_seed, output_idx, zoneout_prob))
+        cur_h_value = h[output_idx];
     } else {
       cur_h_value = (zoneout_prob * h[output_idx]) + ((1.0f - zoneout_prob) * cur_h_value);
     }
@@ -173,7 +175,7 @@ void ForwardPass<T>::IterateInternal(
     layer_norm::ForwardPass<T>& layer_norm3,
     T* act_c_norm,
     const float zoneout_prob,
-    const T* zoneout_mask) { // Zoneout mask [N,H]
+    const uint64_t zoneout_seed) {
   static const T alpha = static_cast<T>(1.0);
   static const T beta = static_cast<T>(0.0);
 
@@ -213,7 +215,7 @@ void ForwardPass<T>::IterateInternal(
         c_out,
         v);
     layer_norm3.RunPartial(stream1, batch_size, c_out, act_c_norm);
-    if (zoneout_prob && zoneout_mask) {
+    if (zoneout_prob) {
       ComputeCellOutput<T, true, true><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
           hidden_size,
@@ -222,7 +224,7 @@ void ForwardPass<T>::IterateInternal(
           v,
           h_out,
           zoneout_prob,
-          zoneout_mask);
+          zoneout_seed);
     } else {
       ComputeCellOutput<T, true, false><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
@@ -232,7 +234,7 @@ void ForwardPass<T>::IterateInternal(
           v,
           h_out,
           0.0f,
-          nullptr);
+          0);
     }
   } else {
     ComputeCellState<T, false><<<gridDim, blockDim, 0, stream1>>>(
@@ -245,7 +247,7 @@ void ForwardPass<T>::IterateInternal(
         c_out,
         v);
     layer_norm3.RunPartial(stream1, batch_size, c_out, act_c_norm);
-    if (zoneout_prob && zoneout_mask) {
+    if (zoneout_prob) {
       ComputeCellOutput<T, false, true><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
           hidden_size,
@@ -254,7 +256,7 @@ void ForwardPass<T>::IterateInternal(
           v,
           h_out,
           zoneout_prob,
-          zoneout_mask);
+          zoneout_seed);
     } else {
       ComputeCellOutput<T, false, false><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
@@ -264,7 +266,7 @@ void ForwardPass<T>::IterateInternal(
           v,
           h_out,
           0.0f,
-          nullptr);
+          0);
     }
   }
 }
@@ -287,7 +289,7 @@ void ForwardPass<T>::Run(
     layer_norm::ForwardPass<T>& layer_norm3,
     T* act_c_norm,
     const float zoneout_prob,
-    const T* zoneout_mask) { // Zoneout mask [T,N,H]
+    const uint64_t zoneout_seed) {
   static const T alpha = static_cast<T>(1.0);
   static const T beta = static_cast<T>(0.0);
 
@@ -327,7 +329,7 @@ void ForwardPass<T>::Run(
         layer_norm3,
         act_c_norm + i * NH,
         zoneout_prob,
-        zoneout_mask ? zoneout_mask + i * NH : nullptr);
+        zoneout_seed + i);
   }
 
   cublasSetStream(blas_handle, save_stream);
@@ -0,0 +1,429 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include "cpu_blas.h"
+#include "haste/cpu/lstm.h"
+#include "inline_ops_cpu.h"
+
+namespace {
+
+// Computes hidden units [begin, end) for every batch entry. Padding entries (see the
+// forward pass) carried their state forward unchanged, so their gradients pass straight
+// through. Consecutive batch entries are `state_stride` elements apart in `c`, `c_new`,
+// `dh_new`, and `dc_new`, and `v_stride` elements apart in `v` and `dv_out`; `dh_inout`
+// and `dc_inout` are dense.
+template<typename T, bool ApplyZoneout>
+void PointwiseOperations(const int batch_dim,
+                         const int active_batch_dim,
+                         const int hidden_dim,
+                         const int begin,
+                         const int end,
+                         const int t,
+                         const int64_t* sequence_length,
+                         const int64_t state_stride,
+                         const int64_t v_stride,
+                         const T* c,
+                         const T* v,
+                         const T* c_new,
+                         const T* dh_new,
+                         const T* dc_new,
+                         T* dh_inout,
+                         T* dc_inout,
+                         T* dv_out,
+                         const float zoneout_prob,
+                         const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
+  // 16-bit types are only used for storage; the math is done in single precision.
+  typedef typename cpu_accumulator<T>::type AccT;
+
+  for (int col = 0; col < batch_dim; ++col) {
+    if (col >= active_batch_dim || (sequence_length && t >= sequence_length[col])) {
+      for (int row = begin; row < end; row += kChunkSize) {
+        const int size = std::min(kChunkSize, end - row);
+
+        const int64_t base_idx = static_cast<int64_t>(col) * hidden_dim + row;
+        const int64_t state_idx = col * state_stride + row;
+        const int64_t stride4_base_idx = col * v_stride + row;
+
+        Slice(dh_inout, base_idx, size) = (Widen<AccT>(Slice(dh_inout, base_idx, size)) + Widen<AccT>(Slice(dh_new, state_idx, size))).template cast<T>();
+        Slice(dc_inout, base_idx, size) = (Widen<AccT>(Slice(dc_inout, base_idx, size)) + Widen<AccT>(Slice(dc_new, state_idx, size))).template cast<T>();
+        for (int gate = 0; gate < 4; ++gate)
+          Slice(dv_out, stride4_base_idx + gate * hidden_dim, size).setZero();
+      }
+      continue;
+    }
+
+    for (int row = begin; row < end; row += kChunkSize) {
+      const int size = std::min(kChunkSize, end - row);
+
+      const int64_t base_idx = static_cast<int64_t>(col) * hidden_dim + row;
+      const int64_t state_idx = col * state_stride + row;
+      const int64_t stride4_base_idx = col * v_stride + row;
+      const int64_t i_idx = stride4_base_idx + 0 * hidden_dim;
+      const int64_t g_idx = stride4_base_idx + 1 * hidden_dim;
+      const int64_t f_idx = stride4_base_idx + 2 * hidden_dim;
+      const int64_t o_idx = stride4_base_idx + 3 * hidden_dim;
+
+      const Chunk<AccT> i = Widen<AccT>(Slice(v, i_idx, size));
+      const Chunk<AccT> g = Widen<AccT>(Slice(v, g_idx, size));
+      const Chunk<AccT> f = Widen<AccT>(Slice(v, f_idx, size));
+      const Chunk<AccT> o = Widen<AccT>(Slice(v, o_idx, size));
+
+      Chunk<AccT> dc_total = Widen<AccT>(Slice(dc_new, state_idx, size)) + Widen<AccT>(Slice(dc_inout, base_idx, size));
+      Chunk<AccT> dh_total = Widen<AccT>(Slice(dh_new, state_idx, size)) + Widen<AccT>(Slice(dh_inout, base_idx, size));
+      const Chunk<AccT> c_tanh = Widen<AccT>(Slice(c_new, state_idx, size)).tanh();
+
+      if (ApplyZoneout) {
+        const auto mask = ZoneoutMask<AccT>(zoneout_seed, base_idx, size, zoneout_prob);
+        Slice(dh_inout, base_idx, size) = ((static_cast<AccT>(1.0) - mask) * dh_total).template cast<T>();
+        dh_total *= mask;
+      } else {
+        Slice(dh_inout, base_idx, size).setZero();
+      }
+
+      dc_total += d_tanh(c_tanh) * o * dh_total;
+
+      const Chunk<AccT> dv_i = d_sigmoid(i) * g * dc_total;
+      const Chunk<AccT> dv_g = d_tanh(g) * i * dc_total;
+      const Chunk<AccT> dv_f = d_sigmoid(f) * Widen<AccT>(Slice(c, state_idx, size)) * dc_total;
+      const Chunk<AccT> dv_o = d_sigmoid(o) * c_tanh * dh_total;
+
+      Slice(dc_inout, base_idx, size) = (f * dc_total).template cast<T>();
+
+      Slice(dv_out, i_idx, size) = dv_i.template cast<T>();
+      Slice(dv_out, g_idx, size) = dv_g.template cast<T>();
+      Slice(dv_out, f_idx, size) = dv_f.template cast<T>();
+      Slice(dv_out, o_idx, size) = dv_o.template cast<T>();
+    }
+  }
+}
+
+// Adds the sum of the `cols` columns of `dv` to `db`. Each thread owns a block of rows and
+// keeps its running sums in the accumulator type, so the bias gradient is rounded to `T`
+// only once.
+template<typename T>
+void BiasGradient(
+    const haste::v0::cpu::ParallelFor& parallel_for,
+    const int rows,
+    const int64_t cols,
+    const T* dv,
+    T* db) {
+  typedef typename cpu_accumulator<T>::type AccT;
+
+  ParallelRange(parallel_for, rows, cols, [&](int64_t begin, int64_t end) {
+    for (int64_t row = begin; row < end; row += kChunkSize) {
+      const int size = static_cast<int>(std::min<int64_t>(kChunkSize, end - row));
+      Chunk<AccT> sum = Widen<AccT>(Slice(db, row, size));
+      for (int64_t col = 0; col < cols; ++col)
+        sum += Widen<AccT>(Slice(dv, col * rows + row, size));
+      Slice(db, row, size) = sum.template cast<T>();
+    }
+  });
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace lstm {
+
+template<typename T>
+struct BackwardPass<T>::private_data {
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<uint8_t> packed_R;
+};
+
+template<typename T>
+BackwardPass<T>::BackwardPass(
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+}
+
+template<typename T>
+BackwardPass<T>::~BackwardPass() {
+  delete data_;
+}
+
+template<typename T>
+void BackwardPass<T>::Iterate(
+    const T* W,       // [C,H*4]
+    const T* R,       // [H,H*4]
+    const T* b,       // [H*4]
+    const T* x,       // [N,C]
+    const T* h,       // [N,H]
+    const T* c,       // [N,H]
+    const T* c_new,   // [N,H]
+    const T* dh_new,  // [N,H]
+    const T* dc_new,  // [N,H]
+    T* dx,            // [N,C]
+    T* dW,            // [C,H*4]
+    T* dR,            // [H,H*4]
+    T* db,            // [H*4]
+    T* dh,            // [N,H]
+    T* dc,            // [N,H]
+    T* v,             // [N,H*4]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
+  const T beta_assign = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  IterateInternal(
+      batch_size,
+      0,
+      nullptr,
+      hidden_size,
+      hidden_size * 4,
+      PackTransposedRecurrentKernel(parallel_for, 4, hidden_size, R, 0.0f, 0, data_->packed_R),
+      c,
+      c_new,
+      dh_new,
+      dc_new,
+      dh,
+      dc,
+      v,
+      zoneout_prob,
+      zoneout_seed);
+
+  if (db)
+    BiasGradient(parallel_for, hidden_size * 4, batch_size, v, db);
+
+  if (dx) {
+    cpu_blas<T>::gemm(parallel_for,
+        true, false,
+        input_size, batch_size, hidden_size * 4,
+        alpha,
+        W, hidden_size * 4,
+        v, hidden_size * 4,
+        beta_assign,
+        dx, input_size);
+  }
+
+  if (dR) {
+    cpu_blas<T>::gemm(parallel_for,
+        false, true,
+        hidden_size * 4, hidden_size, batch_size,
+        alpha,
+        v, hidden_size * 4,
+        h, hidden_size,
+        beta_sum,
+        dR, hidden_size * 4);
+  }
+
+  if (dW) {
+    cpu_blas<T>::gemm(parallel_for,
+        false, true,
+        hidden_size * 4, input_size, batch_size,
+        alpha,
+        v, hidden_size * 4,
+        x, input_size,
+        beta_sum,
+        dW, hidden_size * 4);
+  }
+}
+
+template<typename T>
+void BackwardPass<T>::IterateInternal(
+    const int active_batch_size,
+    const int t,
+    const int64_t* sequence_length,
+    const int64_t state_stride,  // Distance between batch entries of c, dh_new, and dc_new
+    const int64_t v_stride,      // Distance between batch entries of v
+    const void* packed_Rt,       // R^T packed by `PackTransposedRecurrentKernel`
+    const T* c,       // [N,H]
+    const T* c_new,   // [N,H]
+    const T* dh_new,  // [N,H]
+    const T* dc_new,  // [N,H]
+    T* dh,            // [N,H]
+    T* dc,            // [N,H]
+    T* v,             // [N,H*4]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const int batch_size = data_->batch_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  const int64_t cost_per_unit = 4LL * batch_size * 16;
+  ParallelRange(parallel_for, hidden_size, cost_per_unit, [&](int64_t begin, int64_t end) {
+    if (zoneout_prob) {
+      PointwiseOperations<T, true>(batch_size, active_batch_size, hidden_size, begin, end,
+          t, sequence_length, state_stride, v_stride, c, v, c_new, dh_new, dc_new, dh, dc, v, zoneout_prob, zoneout_seed);
+    } else {
+      PointwiseOperations<T, false>(batch_size, active_batch_size, hidden_size, begin, end,
+          t, sequence_length, state_stride, v_stride, c, v, c_new, dh_new, dc_new, dh, dc, v, 0.0f, 0);
+    }
+  });
+
+  const cpu_packed_lhs<T> recurrent_t(1, hidden_size, hidden_size * 4);
+  ParallelUnits<T>(parallel_for, hidden_size, 2LL * hidden_size * 4 * active_batch_size, [&](int begin, int end) {
+    recurrent_t.gemm(packed_Rt, begin, end, active_batch_size, v, v_stride, dh, hidden_size, true);
+  });
+}
+
+template<typename T>
+void BackwardPass<T>::Run(
+    const int steps,
+    const T* W,       // [C,H*4]
+    const T* R,       // [H,H*4]
+    const T* b,       // [H*4]
+    const T* x,       // [T,N,C] or [N,T,C]
+    const T* h,       // [T+1,N,H] or [N,T+1,H]
+    const T* c,       // [T+1,N,H] or [N,T+1,H]
+    const T* dh_new,  // [T+1,N,H] or [N,T+1,H]
+    const T* dc_new,  // [T+1,N,H] or [N,T+1,H]
+    T* dx,            // [T,N,C] or [N,T,C]
+    T* dW,            // [C,H*4]
+    T* dR,            // [H,H*4]
+    T* db,            // [H*4]
+    T* dh,            // [N,H]
+    T* dc,            // [N,H]
+    T* v,             // [T,N,H*4] or [N,T,H*4]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int* batch_sizes,  // [T]
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const bool batch_first,
+    const float dropout_prob,
+    const uint64_t dropout_seed) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
+  const T beta_assign = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  // Visit the time steps in the opposite order of the forward pass; see `ForwardPass::Run`
+  // for the state layout when `reverse` or `batch_first` is set.
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  const int64_t slot_offset = batch_first ? hidden_size : NH;
+  const int64_t step_offset = batch_first ? hidden_size * 4 : NH * 4;
+  const int64_t state_stride = batch_first ? static_cast<int64_t>(steps + 1) * hidden_size : hidden_size;
+  const int64_t v_stride = batch_first ? static_cast<int64_t>(steps) * hidden_size * 4 : hidden_size * 4;
+  // Every step multiplies by the same R^T, so it's packed (with the DropConnect mask
+  // applied, if any) once for all of them.
+  const void* packed_Rt = PackTransposedRecurrentKernel(
+      parallel_for, 4, hidden_size, R, dropout_prob, dropout_seed, data_->packed_R);
+  for (int i = steps - 1; i >= 0; --i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const int in = reverse ? t + 1 : t;
+    const int out = reverse ? t : t + 1;
+    IterateInternal(
+        batch_sizes ? batch_sizes[t] : batch_size,
+        t,
+        sequence_length,
+        state_stride,
+        v_stride,
+        packed_Rt,
+        c + in * slot_offset,
+        c + out * slot_offset,
+        dh_new + out * slot_offset,
+        dc_new + out * slot_offset,
+        dh,
+        dc,
+        v + t * step_offset,
+        zoneout_prob,
+        zoneout_seed + t);
+  }
+
+  // Padding entries have a zero `v`, so the bias gradient is reduced over every column in
+  // one pass instead of being accumulated at each time step.
+  if (db)
+    BiasGradient(parallel_for, hidden_size * 4, static_cast<int64_t>(batch_size) * steps, v, db);
+
+  // The recurrent matrix sees the input state of every step: h[0:T], or h[1:T+1] in reverse.
+  // `x`, `v`, and `dx` have their rows in the same order in either layout, so the other
+  // GEMMs cover every time step at once regardless.
+  const T* h_in = reverse ? h + slot_offset : h;
+
+  if (dW) {
+    cpu_blas<T>::gemm(parallel_for,
+        false, true,
+        hidden_size * 4, input_size, batch_size * steps,
+        alpha,
+        v, hidden_size * 4,
+        x, input_size,
+        beta_sum,
+        dW, hidden_size * 4);
+  }
+
+  // With DropConnect, each piece of the recurrent kernel gradient is masked as it's added.
+  if (dR && !batch_first) {
+    RecurrentKernelGradient(parallel_for,
+        hidden_size * 4, hidden_size, batch_size * steps,
+        v, hidden_size * 4,
+        h_in, hidden_size,
+        dR, hidden_size * 4,
+        dropout_prob, dropout_seed);
+  } else if (dR && steps <= batch_size) {
+    // Batch-major, each sequence's extra state slot breaks up the rows of `h_in`, so dR is
+    // accumulated in pieces: one per time step here...
+    for (int t = 0; t < steps; ++t) {
+      RecurrentKernelGradient(parallel_for,
+          hidden_size * 4, hidden_size, batch_size,
+          v + t * step_offset, v_stride,
+          h_in + t * slot_offset, state_stride,
+          dR, hidden_size * 4,
+          dropout_prob, dropout_seed);
+    }
+  } else if (dR) {
+    // ...or one per batch entry, whichever makes fewer, larger GEMMs.
+    for (int n = 0; n < batch_size; ++n) {
+      RecurrentKernelGradient(parallel_for,
+          hidden_size * 4, hidden_size, steps,
+          v + n * v_stride, hidden_size * 4,
+          h_in + n * state_stride, hidden_size,
+          dR, hidden_size * 4,
+          dropout_prob, dropout_seed);
+    }
+  }
+
+  if (dx) {
+    cpu_blas<T>::gemm(parallel_for,
+        true, false,
+        input_size, steps * batch_size, hidden_size * 4,
+        alpha,
+        W, hidden_size * 4,
+        v, hidden_size * 4,
+        beta_assign,
+        dx, input_size);
+  }
+}
+
+template class BackwardPass<float>;
+template class BackwardPass<double>;
+template class BackwardPass<Eigen::half>;
+template class BackwardPass<Eigen::bfloat16>;
+
+}  // namespace lstm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
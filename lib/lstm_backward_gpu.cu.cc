@@ -21,78 +21,136 @@
 #include "blas.h"
 #include "haste.h"
 #include "inline_ops.h"
+#include "zoneout_ops.h"
 
 namespace {
 
+// Padding entries (see the forward pass) carried their state forward unchanged, so their
+// gradients pass straight through. Consecutive batch entries are `state_stride` elements
+// apart in `c`, `c_new`, `dh_new`, and `dc_new`, and `v_stride` elements apart in `v` and
+// `dv_out`; `dh_inout` and `dc_inout` are dense.
 template<typename T, bool ApplyZoneout>
 __global__
 void PointwiseOperations(const int batch_dim,
+                         const int active_batch_dim,
                          const int hidden_dim,
+                         const int t,
+                         const int64_t* sequence_length,
+                         const int state_stride,
+                         const int v_stride,
                          const T* c,
                          const T* v,
                          const T* c_new,
                          const T* dh_new,
                          const T* dc_new,
-                         T* db_out,
                          T* dh_inout,
                          T* dc_inout,
                          T* dv_out,
-                         const T* zoneout_mask) {  // Zoneout mask (only used if ApplyZoneout==true)
+                         const float zoneout_prob,
+                         const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
   const int row = blockDim.x * blockIdx.x + threadIdx.x;
   const int col = blockDim.y * blockIdx.y + threadIdx.y;
 
   if (row >= hidden_dim || col >= batch_dim)
     return;
 
+  // 16-bit types are only used for storage; the math is done in single precision.
+  typedef typename accumulator<T>::type AccT;
+
   const int base_idx = col * hidden_dim + row;
+  const int state_idx = col * state_stride + row;
+  const int stride4_base_idx = col * v_stride + row;
+
+  if (col >= active_batch_dim || (sequence_length && t >= sequence_length[col])) {
+    dh_inout[base_idx] = static_cast<T>(static_cast<AccT>(dh_inout[base_idx]) + static_cast<AccT>(dh_new[state_idx]));
+    dc_inout[base_idx] = static_cast<T>(static_cast<AccT>(dc_inout[base_idx]) + static_cast<AccT>(dc_new[state_idx]));
+    for (int gate = 0; gate < 4; ++gate)
+      dv_out[stride4_base_idx + gate * hidden_dim] = static_cast<T>(0.0f);
+    return;
+  }
 
-        T dc_total = dc_new[base_idx] + dc_inout[base_idx];
-        T dh_total = dh_new[base_idx] + dh_inout[base_idx];
-  const T c_tanh = tanh(c_new[base_idx]);
+        AccT dc_total = static_cast<AccT>(dc_new[state_idx]) + static_cast<AccT>(dc_inout[base_idx]);
+        AccT dh_total = static_cast<AccT>(dh_new[state_idx]) + static_cast<AccT>(dh_inout[base_idx]);
+  const AccT c_tanh = tanh(static_cast<AccT>(c_new[state_idx]));
 
-  const int stride4_base_idx = col * (hidden_dim * 4) + row;
   const int i_idx = stride4_base_idx + 0 * hidden_dim;
   const int g_idx = stride4_base_idx + 1 * hidden_dim;
   const int f_idx = stride4_base_idx + 2 * hidden_dim;
   const int o_idx = stride4_base_idx + 3 * hidden_dim;
 
-  const T i = v[i_idx];
-  const T g = v[g_idx];
-  const T f = v[f_idx];
-  const T o = v[o_idx];
+  const AccT i = static_cast<AccT>(v[i_idx]);
+  const AccT g = static_cast<AccT>(v[g_idx]);
+  const AccT f = static_cast<AccT>(v[f_idx]);
+  const AccT o = static_cast<AccT>(v[o_idx]);
 
   if (ApplyZoneout) {
-    const T mask = zoneout_mask[base_idx];
-    dh_inout[base_idx] = (static_cast<T>(1.0) - mask) * dh_total;
+    const AccT mask = zoneout_keep(zoneout_seed, base_idx, zoneout_prob) ? static_cast<AccT>(1.0) : static_cast<AccT>(0.0);
+    dh_inout[base_idx] = static_cast<T>((static_cast<AccT>(1.0) - mask) * dh_total);
     dh_total = mask * dh_total;
   } else {
-    dh_inout[base_idx] = static_cast<T>(0.0);
+    dh_inout[base_idx] = static_cast<T>(0.0f);
   }
 
-  const T do_ = c_tanh * dh_total;
-  const T dc_tanh = o * dh_total;
-          dc_total += d_tanh(c_tanh) * dc_tanh;
-  const T df = c[base_idx] * dc_total;
-  const T dc = f * dc_total;
-  const T di = g * dc_total;
-  const T dg = i * dc_total;
-  const T dv_g = d_tanh(g) * dg;
-  const T dv_o = d_sigmoid(o) * do_;
-  const T dv_i = d_sigmoid(i) * di;
-  const T dv_f = d_sigmoid(f) * df;
-
-  // TODO: performance optimization opportunity on this reduce operation.
-  atomicAdd(&db_out[row + 0 * hidden_dim], dv_i);
-  atomicAdd(&db_out[row + 1 * hidden_dim], dv_g);
-  atomicAdd(&db_out[row + 2 * hidden_dim], dv_f);
-  atomicAdd(&db_out[row + 3 * hidden_dim], dv_o);
-
-  dc_inout[base_idx] = dc;
-
-  dv_out[i_idx] = dv_i;
-  dv_out[g_idx] = dv_g;
-  dv_out[f_idx] = dv_f;
-  dv_out[o_idx] = dv_o;
+  const AccT do_ = c_tanh * dh_total;
+  const AccT dc_tanh = o * dh_total;
+             dc_total += d_tanh(c_tanh) * dc_tanh;
+  const AccT df = static_cast<AccT>(c[state_idx]) * dc_total;
+  const AccT dc = f * dc_total;
+  const AccT di = g * dc_total;
+  const AccT dg = i * dc_total;
+  const AccT dv_g = d_tanh(g) * dg;
+  const AccT dv_o = d_sigmoid(o) * do_;
+  const AccT dv_i = d_sigmoid(i) * di;
+  const AccT dv_f = d_sigmoid(f) * df;
+
+  dc_inout[base_idx] = static_cast<T>(dc);
+
+  dv_out[i_idx] = static_cast<T>(dv_i);
+  dv_out[g_idx] = static_cast<T>(dv_g);
+  dv_out[f_idx] = static_cast<T>(dv_f);
+  dv_out[o_idx] = static_cast<T>(dv_o);
+}
+
+// Adds the sum of the `cols` columns of `dv` to `db_out`. Each block reduces 32 rows: its
+// threads stride over the columns and combine their partial sums in shared memory, so
+// there are no atomics and the sum is kept in single precision for the 16-bit types.
+template<typename T>
+__global__
+void BiasGradient(const int rows,
+                  const int cols,
+                  const T* dv,
+                  T* db_out) {
+  typedef typename accumulator<T>::type AccT;
+  __shared__ AccT partial_sums[32][33];
+
+  const int row = blockDim.x * blockIdx.x + threadIdx.x;
+
+  AccT sum = static_cast<AccT>(0.0);
+  if (row < rows) {
+    for (int col = threadIdx.y; col < cols; col += blockDim.y)
+      sum += static_cast<AccT>(dv[static_cast<int64_t>(col) * rows + row]);
+  }
+  partial_sums[threadIdx.y][threadIdx.x] = sum;
+  __syncthreads();
+
+  if (threadIdx.y || row >= rows)
+    return;
+
+  for (int i = 1; i < blockDim.y; ++i)
+    sum += partial_sums[i][threadIdx.x];
+  db_out[row] = static_cast<T>(static_cast<AccT>(db_out[row]) + sum);
+}
+
+template<typename T>
+void LaunchBiasGradient(
+    const cudaStream_t& stream,
+    const int rows,
+    const int cols,
+    const T* dv,
+    T* db) {
+  const dim3 blockDim(32, 32);
+  const dim3 gridDim((rows + blockDim.x - 1) / blockDim.x);
+  BiasGradient<T><<<gridDim, blockDim, 0, stream>>>(rows, cols, dv, db);
 }
 
 }  // anonymous namespace
@@ -141,10 +199,10 @@ BackwardPass<T>::~BackwardPass() {
 
 template<typename T>
 void BackwardPass<T>::Iterate(
-    const T* W_t,     // [H*4,C]
-    const T* R_t,     // [H*4,H]
+    const T* W,       // [C,H*4]
+    const T* R,       // [H,H*4]
     const T* b,       // [H*4]
-    const T* x_t,     // [C,N]
+    const T* x,       // [N,C]
     const T* h,       // [N,H]
     const T* c,       // [N,H]
     const T* c_new,   // [N,H]
@@ -157,7 +215,8 @@ void BackwardPass<T>::Iterate(
     T* dh,            // [N,H]
     T* dc,            // [N,H]
     T* v,             // [N,H*4]
-    const T* zoneout_mask) {
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
   const T alpha = static_cast<T>(1.0);
   const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
   const T beta_assign = static_cast<T>(0.0);
@@ -174,67 +233,86 @@ void BackwardPass<T>::Iterate(
   cublasGetStream(blas_handle, &save_stream);
 
   IterateInternal(
-      R_t,
+      batch_size,
+      0,
+      nullptr,
+      hidden_size,
+      hidden_size * 4,
+      R,
       c,
       c_new,
       dh_new,
       dc_new,
-      db,
       dh,
       dc,
       v,
-      zoneout_mask);
+      zoneout_prob,
+      zoneout_seed);
 
   // Wait for pointwise operations to complete since there's a
   // data dependency between its output (`v`) and the following matmuls.
   cudaStreamWaitEvent(stream2, event, 0);
   cudaStreamWaitEvent(stream3, event, 0);
 
-  cublasSetStream(blas_handle, stream2);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      input_size, batch_size, hidden_size * 4,
-      &alpha,
-      W_t, input_size,
-      v, hidden_size * 4,
-      &beta_assign,
-      dx, input_size);
+  if (db)
+    LaunchBiasGradient(stream2, hidden_size * 4, batch_size, v, db);
+
+  if (dx) {
+    cublasSetStream(blas_handle, stream2);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_T, CUBLAS_OP_N,
+        input_size, batch_size, hidden_size * 4,
+        &alpha,
+        W, hidden_size * 4,
+        v, hidden_size * 4,
+        &beta_assign,
+        dx, input_size);
+  }
 
-  cublasSetStream(blas_handle, stream3);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_T,
-      hidden_size * 4, hidden_size, batch_size,
-      &alpha,
-      v, hidden_size * 4,
-      h, hidden_size,
-      &beta_sum,
-      dR, hidden_size * 4);
+  if (dR) {
+    cublasSetStream(blas_handle, stream3);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_N, CUBLAS_OP_T,
+        hidden_size * 4, hidden_size, batch_size,
+        &alpha,
+        v, hidden_size * 4,
+        h, hidden_size,
+        &beta_sum,
+        dR, hidden_size * 4);
+  }
 
-  cublasSetStream(blas_handle, stream3);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      hidden_size * 4, input_size, batch_size,
-      &alpha,
-      v, hidden_size * 4,
-      x_t, batch_size,
-      &beta_sum,
-      dW, hidden_size * 4);
+  if (dW) {
+    cublasSetStream(blas_handle, stream3);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_N, CUBLAS_OP_T,
+        hidden_size * 4, input_size, batch_size,
+        &alpha,
+        v, hidden_size * 4,
+        x, input_size,
+        &beta_sum,
+        dW, hidden_size * 4);
+  }
 
   cublasSetStream(blas_handle, save_stream);
 }
 
 template<typename T>
 void BackwardPass<T>::IterateInternal(
-    const T* R_t,     // [H*4,H]
+    const int active_batch_size,
+    const int t,
+    const int64_t* sequence_length,
+    const int state_stride,  // Distance between batch entries of c, dh_new, and dc_new
+    const int v_stride,      // Distance between batch entries of v
+    const T* R,       // [H,H*4]
     const T* c,       // [N,H]
     const T* c_new,   // [N,H]
     const T* dh_new,  // [N,H]
     const T* dc_new,  // [N,H]
-    T* db,            // [H*4]
     T* dh,            // [N,H]
     T* dc,            // [N,H]
     T* v,             // [N,H*4]
-    const T* zoneout_mask) {
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
   const T alpha = static_cast<T>(1.0);
   const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
 
@@ -250,35 +328,45 @@ void BackwardPass<T>::IterateInternal(
       (hidden_size + blockDim.x - 1) / blockDim.x,
       (batch_size + blockDim.y - 1) / blockDim.y);
 
-  if (zoneout_mask) {
+  if (zoneout_prob) {
     PointwiseOperations<T, true><<<gridDim, blockDim, 0, stream1>>>(
         batch_size,
+        active_batch_size,
         hidden_size,
+        t,
+        sequence_length,
+        state_stride,
+        v_stride,
         c,
         v,
         c_new,
         dh_new,
         dc_new,
-        db,
         dh,
         dc,
         v,
-        zoneout_mask
+        zoneout_prob,
+        zoneout_seed
     );
   } else {
     PointwiseOperations<T, false><<<gridDim, blockDim, 0, stream1>>>(
         batch_size,
+        active_batch_size,
         hidden_size,
+        t,
+        sequence_length,
+        state_stride,
+        v_stride,
         c,
         v,
         c_new,
         dh_new,
         dc_new,
-        db,
         dh,
         dc,
         v,
-        nullptr
+        0.0f,
+        0
     );
   }
 
@@ -287,11 +375,11 @@ void BackwardPass<T>::IterateInternal(
 
   cublasSetStream(blas_handle, stream1);
   blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      hidden_size, batch_size, hidden_size * 4,
+      CUBLAS_OP_T, CUBLAS_OP_N,
+      hidden_size, active_batch_size, hidden_size * 4,
       &alpha,
-      R_t, hidden_size,
-      v, hidden_size * 4,
+      R, hidden_size * 4,
+      v, v_stride,
       &beta_sum,
       dh, hidden_size);
 }
@@ -299,22 +387,27 @@ void BackwardPass<T>::IterateInternal(
 template<typename T>
 void BackwardPass<T>::Run(
     const int steps,
-    const T* W_t,     // [H*4,C]
-    const T* R_t,     // [H*4,H]
+    const T* W,       // [C,H*4]
+    const T* R,       // [H,H*4]
     const T* b,       // [H*4]
-    const T* x_t,     // [C,T,N]
-    const T* h,       // [T+1,N,H]
-    const T* c,       // [T+1,N,H]
-    const T* dh_new,  // [T+1,N,H]
-    const T* dc_new,  // [T+1,N,H]
-    T* dx,            // [T,N,C]
+    const T* x,       // [T,N,C] or [N,T,C]
+    const T* h,       // [T+1,N,H] or [N,T+1,H]
+    const T* c,       // [T+1,N,H] or [N,T+1,H]
+    const T* dh_new,  // [T+1,N,H] or [N,T+1,H]
+    const T* dc_new,  // [T+1,N,H] or [N,T+1,H]
+    T* dx,            // [T,N,C] or [N,T,C]
     T* dW,            // [C,H*4]
     T* dR,            // [H,H*4]
     T* db,            // [H*4]
     T* dh,            // [N,H]
     T* dc,            // [N,H]
-    T* v,            // [T,N,H*4]
-    const T* zoneout_mask) {
+    T* v,            // [T,N,H*4] or [N,T,H*4]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int* batch_sizes,  // [T]
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const bool batch_first) {
   const T alpha = static_cast<T>(1.0);
   const T beta_sum = static_cast<T>(1.0);  // Accumulate into output matrix!
   const T beta_assign = static_cast<T>(0.0);
@@ -331,59 +424,118 @@ void BackwardPass<T>::Run(
   cudaStream_t save_stream;
   cublasGetStream(blas_handle, &save_stream);
 
+  // Visit the time steps in the opposite order of the forward pass; see `ForwardPass::Run`
+  // for the state layout when `reverse` or `batch_first` is set.
   const int NH = batch_size * hidden_size;
+  const int slot_offset = batch_first ? hidden_size : NH;
+  const int step_offset = batch_first ? hidden_size * 4 : NH * 4;
+  const int state_stride = batch_first ? (steps + 1) * hidden_size : hidden_size;
+  const int v_stride = batch_first ? steps * hidden_size * 4 : hidden_size * 4;
   for (int i = steps - 1; i >= 0; --i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const int in = reverse ? t + 1 : t;
+    const int out = reverse ? t : t + 1;
     IterateInternal(
-        R_t,
-        c + i * NH,
-        c + (i + 1) * NH,
-        dh_new + (i + 1) * NH,
-        dc_new + (i + 1) * NH,
-        db,
+        batch_sizes ? batch_sizes[t] : batch_size,
+        t,
+        sequence_length,
+        state_stride,
+        v_stride,
+        R,
+        c + in * slot_offset,
+        c + out * slot_offset,
+        dh_new + out * slot_offset,
+        dc_new + out * slot_offset,
         dh,
         dc,
-        v + i * NH * 4,
-        zoneout_mask ? zoneout_mask + i * NH : nullptr);
+        v + t * step_offset,
+        zoneout_prob,
+        zoneout_seed + t);
   }
   cudaEventRecord(event, stream1);
 
+  // Padding entries have a zero `v`, so the bias gradient is reduced over every column in
+  // one pass instead of being accumulated at each time step.
+  cudaStreamWaitEvent(stream3, event, 0);
+  if (db)
+    LaunchBiasGradient(stream3, hidden_size * 4, batch_size * steps, v, db);
+
   cudaStreamWaitEvent(stream2, event, 0);
-  cublasSetStream(blas_handle, stream2);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      hidden_size * 4, input_size, batch_size * steps,
-      &alpha,
-      v, hidden_size * 4,
-      x_t, batch_size * steps,
-      &beta_sum,
-      dW, hidden_size * 4);
+  if (dW) {
+    cublasSetStream(blas_handle, stream2);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_N, CUBLAS_OP_T,
+        hidden_size * 4, input_size, batch_size * steps,
+        &alpha,
+        v, hidden_size * 4,
+        x, input_size,
+        &beta_sum,
+        dW, hidden_size * 4);
+  }
 
-  cudaStreamWaitEvent(stream3, event, 0);
-  cublasSetStream(blas_handle, stream1);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_T,
-      hidden_size * 4, hidden_size, batch_size * steps,
-      &alpha,
-      v, hidden_size * 4,
-      h, hidden_size,
-      &beta_sum,
-      dR, hidden_size * 4);
+  // The recurrent matrix sees the input state of every step: h[0:T], or h[1:T+1] in reverse.
+  // `x`, `v`, and `dx` have their rows in the same order in either layout, so the other
+  // GEMMs cover every time step at once regardless.
+  const T* h_in = reverse ? h + slot_offset : h;
+
+  if (dR && !batch_first) {
+    cublasSetStream(blas_handle, stream1);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_N, CUBLAS_OP_T,
+        hidden_size * 4, hidden_size, batch_size * steps,
+        &alpha,
+        v, hidden_size * 4,
+        h_in, hidden_size,
+        &beta_sum,
+        dR, hidden_size * 4);
+  } else if (dR && steps <= batch_size) {
+    // Batch-major, each sequence's extra state slot breaks up the rows of `h_in`, so dR is
+    // accumulated in pieces: one per time step here...
+    cublasSetStream(blas_handle, stream1);
+    for (int t = 0; t < steps; ++t) {
+      blas<T>::gemm(blas_handle,
+          CUBLAS_OP_N, CUBLAS_OP_T,
+          hidden_size * 4, hidden_size, batch_size,
+          &alpha,
+          v + t * step_offset, v_stride,
+          h_in + t * slot_offset, state_stride,
+          &beta_sum,
+          dR, hidden_size * 4);
+    }
+  } else if (dR) {
+    // ...or one per batch entry, whichever makes fewer, larger GEMMs.
+    cublasSetStream(blas_handle, stream1);
+    for (int n = 0; n < batch_size; ++n) {
+      blas<T>::gemm(blas_handle,
+          CUBLAS_OP_N, CUBLAS_OP_T,
+          hidden_size * 4, hidden_size, steps,
+          &alpha,
+          v + n * v_stride, hidden_size * 4,
+          h_in + n * state_stride, hidden_size,
+          &beta_sum,
+          dR, hidden_size * 4);
+    }
+  }
 
-  cublasSetStream(blas_handle, stream1);
-  blas<T>::gemm(blas_handle,
-      CUBLAS_OP_N, CUBLAS_OP_N,
-      input_size, steps * batch_size, hidden_size * 4,
-      &alpha,
-      W_t, input_size,
-      v, hidden_size * 4,
-      &beta_assign,
-      dx, input_size);
+  if (dx) {
+    cublasSetStream(blas_handle, stream1);
+    blas<T>::gemm(blas_handle,
+        CUBLAS_OP_T, CUBLAS_OP_N,
+        input_size, steps * batch_size, hidden_size * 4,
+        &alpha,
+        W, hidden_size * 4,
+        v, hidden_size * 4,
+        &beta_assign,
+        dx, input_size);
+  }
 
   cublasSetStream(blas_handle, save_stream);
 }
 
 template struct BackwardPass<float>;
 template struct BackwardPass<double>;
+template struct BackwardPass<__half>;
+template struct BackwardPass<__nv_bfloat16>;
 
 }  // namespace lstm
 }  // namespace v0
@@ -0,0 +1,704 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include <algorithm>
+#include <vector>
+
+#include "cpu_blas.h"
+#include "haste/cpu/lstm.h"
+#include "inline_ops_cpu.h"
+#include "int8_cpu.h"
+
+namespace {
+
+// Computes hidden units [begin, end) for every batch entry. `Wx` and `v_out` may be
+// aliased, as may `h` and `h_out`, and `c` and `c_out`. Batch entries at or past
+// `active_batch_dim`, or whose `sequence_length` doesn't cover time step `t`, are padding:
+// their state is carried forward unchanged. Consecutive batch entries are `h_stride`,
+// `c_stride`, and `v_stride` elements apart in the hidden state, cell state, and
+// activation matrices; `Rh` is dense.
+template<typename T, bool Training, bool ApplyZoneout>
+void PointwiseOperations(const int batch_dim,
+                         const int active_batch_dim,
+                         const int hidden_dim,
+                         const int begin,
+                         const int end,
+                         const int t,
+                         const int64_t* sequence_length,
+                         const int64_t h_stride,
+                         const int64_t c_stride,
+                         const int64_t v_stride,
+                         const T* Wx,  // Precomputed (Wx) vector
+                         const T* Rh,  // Precomputed (Rh) vector
+                         const T* b,   // Bias for gates
+                         const T* h,   // Input recurrent state
+                         const T* c,   // Input cell state
+                         T* h_out,     // Output recurrent state
+                         T* c_out,     // Output cell state
+                         T* v_out,     // Output activations (scratch space if Training==false)
+                         const float zoneout_prob,
+                         const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
+  typedef typename cpu_accumulator<T>::type AccT;
+
+  for (int col = 0; col < batch_dim; ++col) {
+    if (col >= active_batch_dim || (sequence_length && t >= sequence_length[col])) {
+      const int64_t h_idx = col * h_stride + begin;
+      const int64_t c_idx = col * c_stride + begin;
+      std::copy(h + h_idx, h + h_idx + (end - begin), h_out + h_idx);
+      std::copy(c + c_idx, c + c_idx + (end - begin), c_out + c_idx);
+      continue;
+    }
+
+    for (int row = begin; row < end; row += kChunkSize) {
+      const int size = std::min(kChunkSize, end - row);
+
+      // Base indices into the Wx (and v) and Rh matrices.
+      const int64_t weight_idx = col * v_stride + row;
+      const int64_t rh_idx = static_cast<int64_t>(col) * (hidden_dim * 4) + row;
+
+      // Base indices into the state matrices. The zoneout mask is indexed as if the state
+      // were dense so that it doesn't depend on the layout.
+      const int64_t h_idx = col * h_stride + row;
+      const int64_t c_idx = col * c_stride + row;
+      const int64_t mask_idx = static_cast<int64_t>(col) * hidden_dim + row;
+
+      const int64_t i_idx = weight_idx + 0 * hidden_dim;
+      const int64_t g_idx = weight_idx + 1 * hidden_dim;
+      const int64_t f_idx = weight_idx + 2 * hidden_dim;
+      const int64_t o_idx = weight_idx + 3 * hidden_dim;
+
+      // 16-bit types are only used for storage; the math is done in single precision.
+      const Chunk<AccT> i = (Widen<AccT>(Slice(Wx, i_idx, size)) + Widen<AccT>(Slice(Rh, rh_idx + 0 * hidden_dim, size)) + Widen<AccT>(Slice(b, row + 0 * hidden_dim, size))).logistic();
+      const Chunk<AccT> g = (Widen<AccT>(Slice(Wx, g_idx, size)) + Widen<AccT>(Slice(Rh, rh_idx + 1 * hidden_dim, size)) + Widen<AccT>(Slice(b, row + 1 * hidden_dim, size))).tanh();
+      const Chunk<AccT> f = (Widen<AccT>(Slice(Wx, f_idx, size)) + Widen<AccT>(Slice(Rh, rh_idx + 2 * hidden_dim, size)) + Widen<AccT>(Slice(b, row + 2 * hidden_dim, size))).logistic();
+      const Chunk<AccT> o = (Widen<AccT>(Slice(Wx, o_idx, size)) + Widen<AccT>(Slice(Rh, rh_idx + 3 * hidden_dim, size)) + Widen<AccT>(Slice(b, row + 3 * hidden_dim, size))).logistic();
+
+      // The activations are always written to `v_out`: they're needed for the backward
+      // pass when training and the memory is otherwise free to use as scratch space.
+      Slice(v_out, i_idx, size) = i.template cast<T>();
+      Slice(v_out, g_idx, size) = g.template cast<T>();
+      Slice(v_out, f_idx, size) = f.template cast<T>();
+      Slice(v_out, o_idx, size) = o.template cast<T>();
+
+      const Chunk<AccT> cur_c = f * Widen<AccT>(Slice(c, c_idx, size)) + i * g;
+      Chunk<AccT> cur_h = o * cur_c.tanh();
+
+      // Compile-time constant branch should be eliminated by compiler so we have
+      // straight-through code.
+      if (ApplyZoneout) {
+        const Chunk<AccT> prev_h = Widen<AccT>(Slice(h, h_idx, size));
+        if (Training) {
+          const auto mask = ZoneoutMask<AccT>(zoneout_seed, mask_idx, size, zoneout_prob);
+          cur_h = (cur_h - prev_h) * mask + prev_h;
+        } else {
+          cur_h = static_cast<AccT>(zoneout_prob) * prev_h +
+                  static_cast<AccT>(1.0f - zoneout_prob) * cur_h;
+        }
+      }
+
+      Slice(c_out, c_idx, size) = cur_c.template cast<T>();
+      Slice(h_out, h_idx, size) = cur_h.template cast<T>();
+    }
+  }
+}
+
+}  // anonymous namespace
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace lstm {
+
+template<typename T>
+struct ForwardPass<T>::private_data {
+  bool training;
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<uint8_t> packed_R;
+};
+
+template<typename T>
+ForwardPass<T>::ForwardPass(
+    const bool training,
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->training = training;
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+}
+
+template<typename T>
+ForwardPass<T>::~ForwardPass() {
+  delete data_;
+}
+
+template<typename T>
+int64_t ForwardPass<T>::PackedRecurrentKernelSize() const {
+  return cpu_packed_lhs<T>(4, data_->hidden_size, data_->hidden_size).bytes();
+}
+
+template<typename T>
+void ForwardPass<T>::PackRecurrentKernel(
+    const T* R,
+    void* packed_R,
+    const float dropout_prob,
+    const uint64_t dropout_seed) {
+  const int hidden_size = data_->hidden_size;
+  cpu_packed_lhs<T>(4, hidden_size, hidden_size).Pack(
+      data_->parallel_for, R, hidden_size * 4, packed_R, false, dropout_prob, dropout_seed);
+}
+
+template<typename T>
+void ForwardPass<T>::Iterate(
+    const T* W,  // Weight matrix for input (Wx) [C,H*4]
+    const T* R,  // Weight matrix for recurrent state (Rh) [H,H*4]
+    const T* b,  // Bias for gates (Wx + Rh + b) [H*4]
+    const T* x,  // Input vector [N,C]
+    const T* h,  // Recurrent state [N,H]
+    const T* c,  // Cell state [N,H]
+    T* h_out,    // Output recurrent state [N,H]
+    T* c_out,    // Output cell state [N,H]
+    T* v,        // Output vector (Wx + Rh + b) [N,H*4]
+    T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const void* packed_R) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+
+  cpu_blas<T>::gemm(data_->parallel_for,
+      false, false,
+      hidden_size * 4, batch_size, input_size,
+      alpha,
+      W, hidden_size * 4,
+      x, input_size,
+      beta,
+      v, hidden_size * 4);
+
+  IterateInternal(
+      batch_size,
+      0,
+      nullptr,
+      hidden_size,
+      hidden_size * 4,
+      PackedRecurrentKernel(data_->parallel_for, 4, hidden_size, R, packed_R, data_->packed_R),
+      b,
+      h,
+      c,
+      h_out,
+      c_out,
+      v,
+      tmp_Rh,
+      zoneout_prob,
+      zoneout_seed);
+}
+
+template<typename T>
+void ForwardPass<T>::IterateInternal(
+    const int active_batch_size,
+    const int t,
+    const int64_t* sequence_length,
+    const int64_t state_stride,  // Distance between batch entries of h and c
+    const int64_t v_stride,      // Distance between batch entries of v
+    const void* packed_R,        // Packed weight matrix for recurrent state (Rh)
+    const T* b,  // Bias for gates (Wx + Rh + b) [H*4]
+    const T* h,  // Recurrent state [N,H]
+    const T* c,  // Cell state [N,H]
+    T* h_out,    // Output recurrent state [N,H]
+    T* c_out,    // Output cell state [N,H]
+    T* v,        // Output vector (Wx + Rh + b) [N,H*4]
+    T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed) {
+  const bool training = data_->training;
+  const int batch_size = data_->batch_size;
+  const int hidden_size = data_->hidden_size;
+  const cpu_packed_lhs<T> recurrent(4, hidden_size, hidden_size);
+
+  // `h` may alias `h_out`, so every thread has to finish reading `h` for the recurrent
+  // matmul before any thread writes its outputs. Unless the hidden state is double
+  // buffered by the caller (as in `Run`), fall back to computing Rh in its own pass.
+  const bool fused = h != h_out;
+
+  if (!fused) {
+    ParallelUnits<T>(data_->parallel_for, hidden_size, 8LL * active_batch_size * hidden_size, [&](int begin, int end) {
+      recurrent.gemm(packed_R, begin, end, active_batch_size, h, state_stride, tmp_Rh, hidden_size * 4);
+    });
+  }
+
+  // Each thread owns a contiguous block of hidden units: it computes the rows of Rh for
+  // all four gates of those units and then immediately applies the pointwise operations
+  // while the results are still in cache.
+  const int64_t cost_per_unit = 4LL * active_batch_size * (2 * hidden_size + 16);
+  ParallelUnits<T>(data_->parallel_for, hidden_size, cost_per_unit, [&](int begin, int end) {
+    if (fused)
+      recurrent.gemm(packed_R, begin, end, active_batch_size, h, state_stride, tmp_Rh, hidden_size * 4);
+
+    if (training) {
+      if (zoneout_prob) {
+        PointwiseOperations<T, true, true>(batch_size, active_batch_size, hidden_size, begin, end,
+            t, sequence_length, state_stride, state_stride, v_stride, v, tmp_Rh, b, h, c, h_out, c_out, v, zoneout_prob, zoneout_seed);
+      } else {
+        PointwiseOperations<T, true, false>(batch_size, active_batch_size, hidden_size, begin, end,
+            t, sequence_length, state_stride, state_stride, v_stride, v, tmp_Rh, b, h, c, h_out, c_out, v, 0.0f, 0);
+      }
+    } else {
+      if (zoneout_prob) {
+        PointwiseOperations<T, false, true>(batch_size, active_batch_size, hidden_size, begin, end,
+            t, sequence_length, state_stride, state_stride, v_stride, v, tmp_Rh, b, h, c, h_out, c_out, v, zoneout_prob, zoneout_seed);
+      } else {
+        PointwiseOperations<T, false, false>(batch_size, active_batch_size, hidden_size, begin, end,
+            t, sequence_length, state_stride, state_stride, v_stride, v, tmp_Rh, b, h, c, h_out, c_out, v, 0.0f, 0);
+      }
+    }
+  });
+}
+
+template<typename T>
+void ForwardPass<T>::Run(
+    const int steps,
+    const T* W,  // Weight matrix for input (Wx) [C,H*4]
+    const T* R,  // Weight matrix for recurrent state (Rh) [H,H*4]
+    const T* b,  // Bias for gates (Wx + Rh + b) [H*4]
+    const T* x,  // Input vector [T,N,C] or [N,T,C]
+    T* h,        // Recurrent state [T+1,N,H] or [N,T+1,H]
+    T* c,        // Cell state [T+1,N,H] or [N,T+1,H]
+    T* v,        // Output vector (Wx + Rh + b) [T,N,H*4] or [N,T,H*4]
+    T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
+    const float zoneout_prob,
+    const uint64_t zoneout_seed,
+    const int* batch_sizes,  // Active batch entries per time step [T]
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const bool batch_first,
+    const void* packed_R) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+
+  // Every step multiplies by the same R, so it's packed (at most) once for all of them.
+  packed_R = PackedRecurrentKernel(data_->parallel_for, 4, hidden_size, R, packed_R, data_->packed_R);
+
+  // Input projection for every time step in one large GEMM. The rows of `v` come out in
+  // the same order as those of `x`, so this is the same for either layout.
+  cpu_blas<T>::gemm(data_->parallel_for,
+      false, false,
+      hidden_size * 4, steps * batch_size, input_size,
+      alpha,
+      W, hidden_size * 4,
+      x, input_size,
+      beta,
+      v, hidden_size * 4);
+
+  // In reverse, time step `t` reads its state from slot t+1 and writes it to slot t, so the
+  // outputs stay aligned with the inputs and the initial state lives in the last slot.
+  // Batch-major slots and steps are strided [N,H] and [N,H*4] matrices.
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  const int64_t slot_offset = batch_first ? hidden_size : NH;
+  const int64_t step_offset = batch_first ? hidden_size * 4 : NH * 4;
+  const int64_t state_stride = batch_first ? static_cast<int64_t>(steps + 1) * hidden_size : hidden_size;
+  const int64_t v_stride = batch_first ? static_cast<int64_t>(steps) * hidden_size * 4 : hidden_size * 4;
+  for (int i = 0; i < steps; ++i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const int in = reverse ? t + 1 : t;
+    const int out = reverse ? t : t + 1;
+    IterateInternal(
+        batch_sizes ? batch_sizes[t] : batch_size,
+        t,
+        sequence_length,
+        state_stride,
+        v_stride,
+        packed_R,
+        b,
+        h + in * slot_offset,
+        c + in * slot_offset,
+        h + out * slot_offset,
+        c + out * slot_offset,
+        v + t * step_offset,
+        tmp_Rh,
+        zoneout_prob,
+        zoneout_seed + t);
+  }
+}
+
+template<typename T>
+void ForwardPass<T>::RunInference(
+    const int steps,
+    const T* W,  // Weight matrix for input (Wx) [C,H*4]
+    const T* R,  // Weight matrix for recurrent state (Rh) [H,H*4]
+    const T* b,  // Bias for gates (Wx + Rh + b) [H*4]
+    const T* x,  // Input vector [T,N,C] or [N,T,C]
+    T* h,        // Recurrent state [T+1,N,H], [N,T+1,H], or [2,N,H]
+    T* c,        // Cell state [T+1,N,H], [N,T+1,H], or [2,N,H]
+    T* v,        // Temporary storage for the gates of one step [N,H*4]
+    T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
+    const float zoneout_prob,
+    const bool keep_h,
+    const bool keep_c,
+    const int* batch_sizes,  // Active batch entries per time step [T]
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const bool batch_first,
+    const void* packed_R) {
+  const T alpha = static_cast<T>(1.0);
+  const T beta = static_cast<T>(0.0);
+
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  const cpu_packed_lhs<T> recurrent(4, hidden_size, hidden_size);
+  packed_R = PackedRecurrentKernel(data_->parallel_for, 4, hidden_size, R, packed_R, data_->packed_R);
+
+  // Offset of the state before iteration `i`. Kept states follow the layout of `Run`; the
+  // others alternate between two dense slots.
+  auto slot = [&](const bool keep, const int i) -> int64_t {
+    if (!keep)
+      return (i % 2) * NH;
+    return (reverse ? steps - i : i) * (batch_first ? hidden_size : NH);
+  };
+  const int64_t x_stride = batch_first ? static_cast<int64_t>(steps) * input_size : input_size;
+  const int64_t kept_stride = batch_first ? static_cast<int64_t>(steps + 1) * hidden_size : hidden_size;
+  const int64_t h_stride = keep_h ? kept_stride : hidden_size;
+  const int64_t c_stride = keep_c ? kept_stride : hidden_size;
+
+  for (int i = 0; i < steps; ++i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const int active_batch_size = batch_sizes ? batch_sizes[t] : batch_size;
+    const T* x_t = x + t * (batch_first ? input_size : static_cast<int64_t>(batch_size) * input_size);
+    const T* h_in = h + slot(keep_h, i);
+    const T* c_in = c + slot(keep_c, i);
+    T* h_out = h + slot(keep_h, i + 1);
+    T* c_out = c + slot(keep_c, i + 1);
+
+    // The thread that owns a block of hidden units computes the rows of Wx and Rh for all
+    // four gates of those units and then applies the pointwise operations, so each step is
+    // a single parallel region.
+    const int64_t cost_per_unit = 4LL * active_batch_size * (2 * (input_size + hidden_size) + 16);
+    ParallelUnits<T>(data_->parallel_for, hidden_size, cost_per_unit, [&](int begin, int end) {
+      for (int gate = 0; gate < 4; ++gate) {
+        const int row = gate * hidden_size + begin;
+        cpu_blas<T>::gemm(
+            false, false,
+            end - begin, active_batch_size, input_size,
+            alpha,
+            W + row, hidden_size * 4,
+            x_t, x_stride,
+            beta,
+            v + row, hidden_size * 4);
+      }
+      recurrent.gemm(packed_R, begin, end, active_batch_size, h_in, h_stride, tmp_Rh, hidden_size * 4);
+
+      if (zoneout_prob) {
+        PointwiseOperations<T, false, true>(batch_size, active_batch_size, hidden_size, begin, end,
+            t, sequence_length, h_stride, c_stride, hidden_size * 4, v, tmp_Rh, b, h_in, c_in, h_out, c_out, v, zoneout_prob, 0);
+      } else {
+        PointwiseOperations<T, false, false>(batch_size, active_batch_size, hidden_size, begin, end,
+            t, sequence_length, h_stride, c_stride, hidden_size * 4, v, tmp_Rh, b, h_in, c_in, h_out, c_out, v, 0.0f, 0);
+      }
+    });
+  }
+}
+
+template class ForwardPass<float>;
+template class ForwardPass<double>;
+template class ForwardPass<Eigen::half>;
+template class ForwardPass<Eigen::bfloat16>;
+
+template<typename T>
+struct StackedForwardPass<T>::private_data {
+  bool training;
+  int num_layers;
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<std::vector<uint8_t>> packed_R;
+};
+
+template<typename T>
+StackedForwardPass<T>::StackedForwardPass(
+    const bool training,
+    const int num_layers,
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->training = training;
+  data_->num_layers = num_layers;
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+}
+
+template<typename T>
+StackedForwardPass<T>::~StackedForwardPass() {
+  delete data_;
+}
+
+template<typename T>
+int64_t StackedForwardPass<T>::PackedRecurrentKernelSize() const {
+  return cpu_packed_lhs<T>(4, data_->hidden_size, data_->hidden_size).bytes();
+}
+
+template<typename T>
+void StackedForwardPass<T>::PackRecurrentKernel(
+    const T* R,
+    void* packed_R,
+    const float dropout_prob,
+    const uint64_t dropout_seed) {
+  const int hidden_size = data_->hidden_size;
+  cpu_packed_lhs<T>(4, hidden_size, hidden_size).Pack(
+      data_->parallel_for, R, hidden_size * 4, packed_R, false, dropout_prob, dropout_seed);
+}
+
+template<typename T>
+void StackedForwardPass<T>::Run(
+    const int steps,
+    const T* const* W,  // Weight matrix for input (Wx) per layer [C,H*4] or [H,H*4]
+    const T* const* R,  // Weight matrix for recurrent state (Rh) per layer [H,H*4]
+    const T* const* b,  // Bias for gates (Wx + Rh + b) per layer [H*4]
+    const T* x,         // Input vector of the first layer [T,N,C]
+    T* const* h,        // Recurrent state per layer [T+1,N,H] or [2,N,H]
+    T* const* c,        // Cell state per layer [T+1,N,H] or [2,N,H]
+    T* const* v,        // Output vector (Wx + Rh + b) per layer [T,N,H*4] or [N,H*4]
+    T* const* tmp_Rh,   // Temporary storage for Rh vector per layer [N,H*4]
+    const float zoneout_prob,
+    const uint64_t* zoneout_seed,    // Zoneout mask seed per layer
+    const int64_t* sequence_length,  // [N]
+    const void* const* packed_R) {   // Packed weight matrix for recurrent state (Rh) per layer
+  const T alpha = static_cast<T>(1.0);
+  const T beta = static_cast<T>(0.0);
+
+  const bool training = data_->training;
+  const int num_layers = data_->num_layers;
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  const bool apply_zoneout = zoneout_prob;
+  const cpu_packed_lhs<T> recurrent(4, hidden_size, hidden_size);
+
+  data_->packed_R.resize(num_layers);
+  std::vector<const void*> layer_R(num_layers);
+  for (int layer = 0; layer < num_layers; ++layer) {
+    layer_R[layer] = PackedRecurrentKernel(
+        data_->parallel_for, 4, hidden_size, R[layer], packed_R ? packed_R[layer] : nullptr, data_->packed_R[layer]);
+  }
+
+  // Slot of time step `i` in a layer's hidden or cell state buffer.
+  auto h_slot = [&](const int layer, const int i) -> int64_t {
+    return (training || layer == num_layers - 1) ? i : i % 2;
+  };
+  auto c_slot = [&](const int i) -> int64_t {
+    return training ? i : i % 2;
+  };
+
+  // Computes hidden units [begin, end) of `layer` at time step `t`. The thread that owns a
+  // block of units computes the rows of Wx and Rh for all four gates of those units and
+  // then applies the pointwise operations, so nothing has to wait for other threads.
+  auto step = [&](const int layer, const int t, const int begin, const int end) {
+    const int layer_input_size = layer ? hidden_size : input_size;
+    const T* layer_x = layer ? h[layer - 1] + h_slot(layer - 1, t + 1) * NH : x + t * batch_size * input_size;
+    const T* h_in = h[layer] + h_slot(layer, t) * NH;
+    const T* c_in = c[layer] + c_slot(t) * NH;
+    T* h_out = h[layer] + h_slot(layer, t + 1) * NH;
+    T* c_out = c[layer] + c_slot(t + 1) * NH;
+    T* layer_v = training ? v[layer] + t * NH * 4 : v[layer];
+    const uint64_t seed = (training && apply_zoneout) ? zoneout_seed[layer] + t : 0;
+
+    for (int gate = 0; gate < 4; ++gate) {
+      const int row = gate * hidden_size + begin;
+      cpu_blas<T>::gemm(
+          false, false,
+          end - begin, batch_size, layer_input_size,
+          alpha,
+          W[layer] + row, hidden_size * 4,
+          layer_x, layer_input_size,
+          beta,
+          layer_v + row, hidden_size * 4);
+    }
+    recurrent.gemm(layer_R[layer], begin, end, batch_size, h_in, hidden_size, tmp_Rh[layer], hidden_size * 4);
+
+    if (training) {
+      if (apply_zoneout) {
+        PointwiseOperations<T, true, true>(batch_size, batch_size, hidden_size, begin, end,
+            t, sequence_length, hidden_size, hidden_size, hidden_size * 4, layer_v, tmp_Rh[layer], b[layer], h_in, c_in, h_out, c_out, layer_v,
+            zoneout_prob, seed);
+      } else {
+        PointwiseOperations<T, true, false>(batch_size, batch_size, hidden_size, begin, end,
+            t, sequence_length, hidden_size, hidden_size, hidden_size * 4, layer_v, tmp_Rh[layer], b[layer], h_in, c_in, h_out, c_out, layer_v,
+            0.0f, 0);
+      }
+    } else {
+      if (apply_zoneout) {
+        PointwiseOperations<T, false, true>(batch_size, batch_size, hidden_size, begin, end,
+            t, sequence_length, hidden_size, hidden_size, hidden_size * 4, layer_v, tmp_Rh[layer], b[layer], h_in, c_in, h_out, c_out, layer_v,
+            zoneout_prob, seed);
+      } else {
+        PointwiseOperations<T, false, false>(batch_size, batch_size, hidden_size, begin, end,
+            t, sequence_length, hidden_size, hidden_size, hidden_size * 4, layer_v, tmp_Rh[layer], b[layer], h_in, c_in, h_out, c_out, layer_v,
+            0.0f, 0);
+      }
+    }
+  };
+
+  // Diagonal `d` holds time step d-l of every layer l for which that step exists. In
+  // inference mode, a layer writes slot (t+1) % 2 while the layer above reads slot t % 2
+  // on the same diagonal, so the two-slot buffers never race. Each layer's units are handed
+  // out in panels that line up with its packed recurrent kernel.
+  const int alignment = cpu_packed_lhs<T>::row_alignment();
+  const int panels = (hidden_size + alignment - 1) / alignment;
+  const int64_t cost_per_panel = 4LL * alignment * batch_size * (2 * (std::max(input_size, hidden_size) + hidden_size) + 16);
+  for (int d = 0; d < steps + num_layers - 1; ++d) {
+    const int first = std::max(0, d - steps + 1);
+    const int last = std::min(num_layers - 1, d);
+    const int64_t total = static_cast<int64_t>(last - first + 1) * panels;
+    ParallelRange(data_->parallel_for, total, cost_per_panel, [&](int64_t begin, int64_t end) {
+      while (begin < end) {
+        const int layer = first + static_cast<int>(begin / panels);
+        const int panel_begin = static_cast<int>(begin % panels);
+        const int panel_end = static_cast<int>(std::min<int64_t>(panels, panel_begin + end - begin));
+        step(layer, d - layer, panel_begin * alignment, std::min(hidden_size, panel_end * alignment));
+        begin += panel_end - panel_begin;
+      }
+    });
+  }
+}
+
+template class StackedForwardPass<float>;
+template class StackedForwardPass<double>;
+template class StackedForwardPass<Eigen::half>;
+template class StackedForwardPass<Eigen::bfloat16>;
+
+template<typename T>
+struct QuantizedForwardPass<T>::private_data {
+  int batch_size;
+  int input_size;
+  int hidden_size;
+  ParallelFor parallel_for;
+  std::vector<int8_t> x_q;
+  std::vector<float> x_scale;
+  std::vector<int8_t> h_q;
+  std::vector<float> h_scale;
+};
+
+template<typename T>
+QuantizedForwardPass<T>::QuantizedForwardPass(
+    const int batch_size,
+    const int input_size,
+    const int hidden_size,
+    const ParallelFor& parallel_for) : data_(new private_data) {
+  data_->batch_size = batch_size;
+  data_->input_size = input_size;
+  data_->hidden_size = hidden_size;
+  data_->parallel_for = parallel_for;
+  data_->h_q.resize(static_cast<int64_t>(batch_size) * hidden_size);
+  data_->h_scale.resize(batch_size);
+}
+
+template<typename T>
+QuantizedForwardPass<T>::~QuantizedForwardPass() {
+  delete data_;
+}
+
+template<typename T>
+void QuantizedForwardPass<T>::Run(
+    const int steps,
+    const int8_t* W_q,      // Quantized input weight matrix [H*4,C]
+    const float* W_scale,   // [H*4]
+    const int8_t* R_q,      // Quantized recurrent weight matrix [H*4,H]
+    const float* R_scale,   // [H*4]
+    const T* b,             // Bias for gates (Wx + Rh + b) [H*4]
+    const T* x,             // Input vector [T,N,C]
+    T* h,                   // Recurrent state [T+1,N,H]
+    T* c,                   // Cell state [T+1,N,H]
+    T* v,                   // Scratch space for (Wx + Rh + b) [T,N,H*4]
+    T* tmp_Rh,              // Temporary storage for Rh vector [N,H*4]
+    const float zoneout_prob,
+    const int64_t* sequence_length,  // [N]
+    const bool reverse) {
+  const int batch_size = data_->batch_size;
+  const int input_size = data_->input_size;
+  const int hidden_size = data_->hidden_size;
+  const ParallelFor& parallel_for = data_->parallel_for;
+
+  // Input projection for every time step in one large product.
+  const int64_t columns = static_cast<int64_t>(steps) * batch_size;
+  data_->x_q.resize(columns * input_size);
+  data_->x_scale.resize(columns);
+  QuantizeRows(parallel_for, columns, input_size, x, data_->x_q.data(), data_->x_scale.data());
+  Int8Gemm(parallel_for, hidden_size * 4, columns, input_size,
+      W_q, W_scale, data_->x_q.data(), data_->x_scale.data(), v, hidden_size * 4);
+
+  int8_t* h_q = data_->h_q.data();
+  float* h_scale = data_->h_scale.data();
+
+  // Time step slots are assigned as in `ForwardPass::Run`.
+  const int64_t NH = static_cast<int64_t>(batch_size) * hidden_size;
+  const int64_t cost_per_unit = 4LL * batch_size * (2 * hidden_size + 16);
+  for (int i = 0; i < steps; ++i) {
+    const int t = reverse ? steps - 1 - i : i;
+    const T* h_in = h + (reverse ? t + 1 : t) * NH;
+    const T* c_in = c + (reverse ? t + 1 : t) * NH;
+    T* h_out = h + (reverse ? t : t + 1) * NH;
+    T* c_out = c + (reverse ? t : t + 1) * NH;
+    T* step_v = v + t * NH * 4;
+
+    // Every thread reads all of the quantized state, so it's produced in its own pass.
+    QuantizeRows(parallel_for, batch_size, hidden_size, h_in, h_q, h_scale);
+
+    ParallelRange(parallel_for, hidden_size, cost_per_unit, [&](int64_t begin64, int64_t end64) {
+      const int begin = static_cast<int>(begin64);
+      const int end = static_cast<int>(end64);
+
+      for (int gate = 0; gate < 4; ++gate) {
+        const int row = gate * hidden_size;
+        Int8Gemm(row + begin, row + end, batch_size, hidden_size,
+            R_q, R_scale, h_q, h_scale, tmp_Rh, hidden_size * 4);
+      }
+
+      if (zoneout_prob) {
+        PointwiseOperations<T, false, true>(batch_size, batch_size, hidden_size, begin, end,
+            t, sequence_length, hidden_size, hidden_size, hidden_size * 4, step_v, tmp_Rh, b, h_in, c_in, h_out, c_out, step_v, zoneout_prob, 0);
+      } else {
+        PointwiseOperations<T, false, false>(batch_size, batch_size, hidden_size, begin, end,
+            t, sequence_length, hidden_size, hidden_size, hidden_size * 4, step_v, tmp_Rh, b, h_in, c_in, h_out, c_out, step_v, 0.0f, 0);
+      }
+    });
+  }
+}
+
+template class QuantizedForwardPass<float>;
+template class QuantizedForwardPass<double>;
+
+}  // namespace lstm
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
@@ -19,15 +19,25 @@
 #include "blas.h"
 #include "haste.h"
 #include "inline_ops.h"
+#include "zoneout_ops.h"
 
 namespace {
 
 // `h` and `h_out` may be aliased.
 // `c` and `c_out` may be aliased.
+// Batch entries at or past `active_batch_dim`, or whose `sequence_length` doesn't cover
+// time step `t`, are padding: their state is carried forward unchanged.
+// Consecutive batch entries are `state_stride` elements apart in the state matrices and
+// `v_stride` elements apart in `Wx` and `v_out`; `Rh` is dense.
 template<typename T, bool Training, bool ApplyZoneout>
 __global__
 void PointwiseOperations(const int batch_dim,
+                         const int active_batch_dim,
                          const int hidden_dim,
+                         const int t,
+                         const int64_t* sequence_length,
+                         const int state_stride,
+                         const int v_stride,
                          const T* Wx,  // Precomputed (Wx) vector
                          const T* Rh,  // Precomputed (Rh) vector
                          const T* b,   // Bias for gates
@@ -37,7 +47,7 @@ void PointwiseOperations(const int batch_dim,
                          T* c_out,     // Output cell state
                          T* v_out,     // Output vector v (Wx + Rh + b) (only used if Training==true)
                          const float zoneout_prob,
-                         const T* zoneout_mask) {  // Zoneout mask (only used if ApplyZoneout==true)
+                         const uint64_t zoneout_seed) {  // Zoneout mask seed (only used if ApplyZoneout==true)
   // We're in column-major order here, so increase x => increase row.
   const int row = blockDim.x * blockIdx.x + threadIdx.x;
   const int col = blockDim.y * blockIdx.y + threadIdx.y;
@@ -45,45 +55,59 @@ void PointwiseOperations(const int batch_dim,
   if (row >= hidden_dim || col >= batch_dim)
     return;
 
-  // Base index into the Wx and Rh matrices.
-  const int weight_idx = col * (hidden_dim * 4) + row;
+  // Base indices into the Wx (and v) and Rh matrices.
+  const int weight_idx = col * v_stride + row;
+  const int rh_idx = col * (hidden_dim * 4) + row;
 
-  // Base index into the output matrix. This is different from `weight_idx` because
-  // the number of rows are different between the two sets of matrices.
-  const int output_idx = col * hidden_dim + row;
+  // Base index into the state matrices. This is different from `weight_idx` because
+  // the number of rows are different between the two sets of matrices. The zoneout mask
+  // is indexed as if the state were dense so that it doesn't depend on the layout.
+  const int output_idx = col * state_stride + row;
+  const int mask_idx = col * hidden_dim + row;
+
+  if (col >= active_batch_dim || (sequence_length && t >= sequence_length[col])) {
+    c_out[output_idx] = c[output_idx];
+    h_out[output_idx] = h[output_idx];
+    return;
+  }
 
   const int i_idx = weight_idx + 0 * hidden_dim;
   const int g_idx = weight_idx + 1 * hidden_dim;
   const int f_idx = weight_idx + 2 * hidden_dim;
   const int o_idx = weight_idx + 3 * hidden_dim;
 
-  const T i = sigmoid(Wx[i_idx] + Rh[i_idx] + b[row + 0 * hidden_dim]);
-  const T g = tanh   (Wx[g_idx] + Rh[g_idx] + b[row + 1 * hidden_dim]);
-  const T f = sigmoid(Wx[f_idx] + Rh[f_idx] + b[row + 2 * hidden_dim]);
-  const T o = sigmoid(Wx[o_idx] + Rh[o_idx] + b[row + 3 * hidden_dim]);
+  // 16-bit types are only used for storage; the math is done in single precision.
+  typedef typename accumulator<T>::type AccT;
+
+  const AccT i = sigmoid(static_cast<AccT>(Wx[i_idx]) + static_cast<AccT>(Rh[rh_idx + 0 * hidden_dim]) + static_cast<AccT>(b[row + 0 * hidden_dim]));
+  const AccT g = tanh   (static_cast<AccT>(Wx[g_idx]) + static_cast<AccT>(Rh[rh_idx + 1 * hidden_dim]) + static_cast<AccT>(b[row + 1 * hidden_dim]));
+  const AccT f = sigmoid(static_cast<AccT>(Wx[f_idx]) + static_cast<AccT>(Rh[rh_idx + 2 * hidden_dim]) + static_cast<AccT>(b[row + 2 * hidden_dim]));
+  const AccT o = sigmoid(static_cast<AccT>(Wx[o_idx]) + static_cast<AccT>(Rh[rh_idx + 3 * hidden_dim]) + static_cast<AccT>(b[row + 3 * hidden_dim]));
 
   // Compile-time constant branch should be eliminated by compiler so we have
   // straight-through code.
   if (Training) {
-    v_out[i_idx] = i;
-    v_out[g_idx] = g;
-    v_out[f_idx] = f;
-    v_out[o_idx] = o;
+    v_out[i_idx] = static_cast<T>(i);
+    v_out[g_idx] = static_cast<T>(g);
+    v_out[f_idx] = static_cast<T>(f);
+    v_out[o_idx] = static_cast<T>(o);
   }
 
-  T cur_c_value = (f * c[output_idx]) + (i * g);
-  T cur_h_value = o * tanh(cur_c_value);
+  const AccT prev_h_value = static_cast<AccT>(h[output_idx]);
+  AccT cur_c_value = (f * static_cast<AccT>(c[output_idx])) + (i * g);
+  AccT cur_h_value = o * tanh(cur_c_value);
 
   if (ApplyZoneout) {
     if (Training) {
-      cur_h_value = (cur_h_value - h[output_idx]) * zoneout_mask[output_idx] + h[output_idx];
+      if (!zoneout_keep(zoneout_seed, mask_idx, zoneout_prob))
+        cur_h_value = prev_h_value;
     } else {
-      cur_h_value = (zoneout_prob * h[output_idx]) + ((1.0f - zoneout_prob) * cur_h_value);
+      cur_h_value = (zoneout_prob * prev_h_value) + ((1.0f - zoneout_prob) * cur_h_value);
     }
   }
 
-  c_out[output_idx] = cur_c_value;
-  h_out[output_idx] = cur_h_value;
+  c_out[output_idx] = static_cast<T>(cur_c_value);
+  h_out[output_idx] = static_cast<T>(cur_h_value);
 }
 
 }  // anonymous namespace
@@ -149,7 +173,7 @@ void ForwardPass<T>::Iterate(
     T* v,        // Output vector (Wx + Rh + b) [N,H*4]
     T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
     const float zoneout_prob,
-    const T* zoneout_mask) { // Zoneout mask [N,H]
+    const uint64_t zoneout_seed) {
   // Constants for GEMM
   static const T alpha = static_cast<T>(1.0);
   static const T beta = static_cast<T>(0.0);
@@ -176,6 +200,11 @@ void ForwardPass<T>::Iterate(
   cudaEventRecord(event, stream2);
 
   IterateInternal(
+      batch_size,
+      0,
+      nullptr,
+      hidden_size,
+      hidden_size * 4,
       R,
       b,
       h,
@@ -185,13 +214,18 @@ void ForwardPass<T>::Iterate(
       v,
       tmp_Rh,
       zoneout_prob,
-      zoneout_mask);
+      zoneout_seed);
 
   cublasSetStream(blas_handle, save_stream);
 }
 
 template<typename T>
 void ForwardPass<T>::IterateInternal(
+    const int active_batch_size,
+    const int t,
+    const int64_t* sequence_length,
+    const int state_stride,  // Distance between batch entries of h and c
+    const int v_stride,      // Distance between batch entries of v
     const T* R,  // Weight matrix for recurrent state (Rh) [H,H*4]
     const T* b,  // Bias for gates (Wx + Rh + b) [H*4]
     const T* h,  // Recurrent state [N,H]
@@ -201,7 +235,7 @@ void ForwardPass<T>::IterateInternal(
     T* v,        // Output vector (Wx + Rh + b) [N,H*4]
     T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
     const float zoneout_prob,
-    const T* zoneout_mask) { // Zoneout mask [N,H]
+    const uint64_t zoneout_seed) {
   static const T alpha = static_cast<T>(1.0);
   static const T beta = static_cast<T>(0.0);
 
@@ -215,10 +249,10 @@ void ForwardPass<T>::IterateInternal(
   cublasSetStream(blas_handle, stream1);
   blas<T>::gemm(blas_handle,
       CUBLAS_OP_N, CUBLAS_OP_N,
-      hidden_size * 4, batch_size, hidden_size,
+      hidden_size * 4, active_batch_size, hidden_size,
       &alpha,
       R, hidden_size * 4,
-      h, hidden_size,
+      h, state_stride,
       &beta,
       tmp_Rh, hidden_size * 4);
 
@@ -231,10 +265,15 @@ void ForwardPass<T>::IterateInternal(
       (batch_size + blockDim.y - 1) / blockDim.y);
 
   if (training) {
-    if (zoneout_prob && zoneout_mask) {
+    if (zoneout_prob) {
       PointwiseOperations<T, true, true><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
+          active_batch_size,
           hidden_size,
+          t,
+          sequence_length,
+          state_stride,
+          v_stride,
           v,
           tmp_Rh,
           b,
@@ -244,11 +283,16 @@ void ForwardPass<T>::IterateInternal(
           c_out,
           v,
           zoneout_prob,
-          zoneout_mask);
+          zoneout_seed);
     } else {
       PointwiseOperations<T, true, false><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
+          active_batch_size,
           hidden_size,
+          t,
+          sequence_length,
+          state_stride,
+          v_stride,
           v,
           tmp_Rh,
           b,
@@ -258,13 +302,18 @@ void ForwardPass<T>::IterateInternal(
           c_out,
           v,
           0.0f,
-          nullptr);
+          0);
     }
   } else {
-    if (zoneout_prob && zoneout_mask) {
+    if (zoneout_prob) {
       PointwiseOperations<T, false, true><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
+          active_batch_size,
           hidden_size,
+          t,
+          sequence_length,
+          state_stride,
+          v_stride,
           v,
           tmp_Rh,
           b,
@@ -274,11 +323,16 @@ void ForwardPass<T>::IterateInternal(
           c_out,
           nullptr,
           zoneout_prob,
-          zoneout_mask);
+          zoneout_seed);
     } else {
       PointwiseOperations<T, false, false><<<gridDim, blockDim, 0, stream1>>>(
           batch_size,
+          active_batch_size,
           hidden_size,
+          t,
+          sequence_length,
+          state_stride,
+          v_stride,
           v,
           tmp_Rh,
           b,
@@ -288,7 +342,7 @@ void ForwardPass<T>::IterateInternal(
           c_out,
           nullptr,
           0.0f,
-          nullptr);
+          0);
     }
   }
 }
@@ -299,13 +353,17 @@ void ForwardPass<T>::Run(
     const T* W,  // Weight matrix for input (Wx) [C,H*4]
     const T* R,  // Weight matrix for recurrent state (Rh) [H,H*4]
     const T* b,  // Bias for gates (Wx + Rh + b) [H*4]
-    const T* x,  // Input vector [T,N,C]
-    T* h,        // Recurrent state [T+1,N,H]
-    T* c,        // Cell state [T+1,N,H]
-    T* v,        // Output vector (Wx + Rh + b) [T,N,H*4]
+    const T* x,  // Input vector [T,N,C] or [N,T,C]
+    T* h,        // Recurrent state [T+1,N,H] or [N,T+1,H]
+    T* c,        // Cell state [T+1,N,H] or [N,T+1,H]
+    T* v,        // Output vector (Wx + Rh + b) [T,N,H*4] or [N,T,H*4]
     T* tmp_Rh,   // Temporary storage for Rh vector [N,H*4]
     const float zoneout_prob,
-    const T* zoneout_mask) { // Zoneout mask [T,N,H]
+    const uint64_t zoneout_seed,
+    const int* batch_sizes,  // Active batch entries per time step [T]
+    const int64_t* sequence_length,  // [N]
+    const bool reverse,
+    const bool batch_first) {
   static const T alpha = static_cast<T>(1.0);
   static const T beta = static_cast<T>(0.0);
 
@@ -318,6 +376,8 @@ void ForwardPass<T>::Run(
   cudaStream_t save_stream;
   cublasGetStream(blas_handle, &save_stream);
 
+  // The rows of `v` come out in the same order as those of `x`, so this is the same for
+  // either layout.
   cublasSetStream(blas_handle, stream1);
   blas<T>::gemm(blas_handle,
       CUBLAS_OP_N, CUBLAS_OP_N,
@@ -328,19 +388,34 @@ void ForwardPass<T>::Run(
       &beta,
       v, hidden_size * 4);
 
+  // In reverse, time step `t` reads its state from slot t+1 and writes it to slot t, so the
+  // outputs stay aligned with the inputs and the initial state lives in the last slot.
+  // Batch-major slots and steps are strided [N,H] and [N,H*4] matrices.
+  const int NH = batch_size * hidden_size;
+  const int slot_offset = batch_first ? hidden_size : NH;
+  const int step_offset = batch_first ? hidden_size * 4 : NH * 4;
+  const int state_stride = batch_first ? (steps + 1) * hidden_size : hidden_size;
+  const int v_stride = batch_first ? steps * hidden_size * 4 : hidden_size * 4;
   for (int i = 0; i < steps; ++i) {
-    const int NH = batch_size * hidden_size;
+    const int t = reverse ? steps - 1 - i : i;
+    const int in = reverse ? t + 1 : t;
+    const int out = reverse ? t : t + 1;
     IterateInternal(
+        batch_sizes ? batch_sizes[t] : batch_size,
+        t,
+        sequence_length,
+        state_stride,
+        v_stride,
         R,
         b,
-        h + i * NH,
-        c + i * NH,
-        h + (i + 1) * NH,
-        c + (i + 1) * NH,
-        v + i * NH * 4,
+        h + in * slot_offset,
+        c + in * slot_offset,
+        h + out * slot_offset,
+        c + out * slot_offset,
+        v + t * step_offset,
         tmp_Rh,
         zoneout_prob,
-        zoneout_mask ? zoneout_mask + i * NH : nullptr);
+        zoneout_seed + t);
   }
 
   cublasSetStream(blas_handle, save_stream);
@@ -348,6 +423,8 @@ void ForwardPass<T>::Run(
 
 template struct ForwardPass<float>;
 template struct ForwardPass<double>;
+template struct ForwardPass<__half>;
+template struct ForwardPass<__nv_bfloat16>;
 
 }  // namespace lstm
 }  // namespace v0
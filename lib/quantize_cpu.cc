@@ -0,0 +1,52 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#include <vector>
+
+#include "haste/cpu/quantize.h"
+#include "int8_cpu.h"
+
+namespace haste {
+namespace v0 {
+namespace cpu {
+namespace quantize {
+
+template<typename T>
+void Weights(
+    const int input_dim,
+    const int output_dim,
+    const T* W,
+    int8_t* W_q,
+    float* scale,
+    const ParallelFor& parallel_for) {
+  // `W` is [input_dim,output_dim], so an output channel is a strided column. Gather each
+  // one into a contiguous row of `W_q` and quantize it there.
+  ParallelRange(parallel_for, output_dim, 4LL * input_dim, [&](int64_t begin, int64_t end) {
+    std::vector<T> column(input_dim);
+    for (int64_t j = begin; j < end; ++j) {
+      for (int k = 0; k < input_dim; ++k)
+        column[k] = W[static_cast<int64_t>(k) * output_dim + j];
+      QuantizeVector(input_dim, column.data(), W_q + j * input_dim, scale[j]);
+    }
+  });
+}
+
+template void Weights<float>(const int, const int, const float*, int8_t*, float*, const ParallelFor&);
+template void Weights<double>(const int, const int, const double*, int8_t*, float*, const ParallelFor&);
+
+}  // namespace quantize
+}  // namespace cpu
+}  // namespace v0
+}  // namespace haste
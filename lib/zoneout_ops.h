@@ -0,0 +1,46 @@
+// Copyright 2020 LMNT, Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+// ==============================================================================
+
+#pragma once
+
+#include <cstdint>
+
+// Zoneout masks are never materialized. Element `index` of the mask drawn for `seed` is
+// regenerated on demand from a counter-based generator (random access into a SplitMix64
+// stream keyed on the mixed seed), so the forward and backward passes agree on the mask
+// without storing or reading it. Used by both the CPU and the GPU implementations.
+
+#ifdef __CUDACC__
+#define HASTE_HOST_DEVICE __host__ __device__ __forceinline__
+#else
+#define HASTE_HOST_DEVICE inline
+#endif
+
+HASTE_HOST_DEVICE
+uint64_t zoneout_mix(uint64_t z) {
+  z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+  z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+  return z ^ (z >> 31);
+}
+
+// Returns `true` with probability 1-zoneout_prob, i.e. if element `index` of the
+// Bernoulli(1-zoneout_prob) zoneout mask for `seed` is 1 and the unit takes its new value.
+// The uniform variate has 24 bits so that the comparison is exact in single precision.
+HASTE_HOST_DEVICE
+bool zoneout_keep(const uint64_t seed, const int64_t index, const float zoneout_prob) {
+  const uint64_t z = zoneout_mix(
+      zoneout_mix(seed) + (static_cast<uint64_t>(index) + 1) * 0x9E3779B97F4A7C15ULL);
+  return static_cast<float>(z >> 40) * (1.0f / 16777216.0f) >= zoneout_prob;
+}
@@ -67,14 +67,26 @@ if sys.argv[1] == 'haste_tf':
       classifiers = CLASSIFIERS)
 elif sys.argv[1] == 'haste_pytorch':
   del sys.argv[1]
+  import os
   from glob import glob
   from torch.utils import cpp_extension
+  # Without nvcc, libhaste.a only holds the CPU passes, so the extension is built without
+  # the GPU code paths (and without the CUDA headers) to match. The Makefile passes its
+  # own decision in `HASTE_WITH_CUDA`.
+  cuda_home = cpp_extension.CUDA_HOME
+  with_cuda = os.environ.get('HASTE_WITH_CUDA')
+  if with_cuda is None:
+    with_cuda = cuda_home is not None and os.path.exists(os.path.join(cuda_home, 'bin', 'nvcc'))
+  else:
+    with_cuda = with_cuda == '1'
   extension = cpp_extension.CppExtension(
       'haste_pytorch_lib',
       sources = glob('pytorch/*.cc'),
-      include_dirs = ['lib', '/usr/local/cuda/include'],
+      include_dirs = ['lib'] + ([os.path.join(cuda_home, 'include')] if with_cuda else []),
+      define_macros = [('WITH_CUDA', None)] if with_cuda else [],
       libraries = ['haste'],
-      library_dirs = ['.'])
+      library_dirs = ['.'],
+      extra_link_args = ['-fopenmp'])
   setup(name = 'haste_pytorch',
       version = VERSION,
       description = DESCRIPTION,
@@ -89,3 +101,17 @@ elif sys.argv[1] == 'haste_pytorch':
       ext_modules = [extension],
       cmdclass = { 'build_ext': cpp_extension.BuildExtension },
       classifiers = CLASSIFIERS)
+elif sys.argv[1] == 'haste_numpy':
+  del sys.argv[1]
+  setup(name = 'haste_numpy',
+      version = VERSION,
+      description = DESCRIPTION,
+      author = AUTHOR,
+      author_email = AUTHOR_EMAIL,
+      url = URL,
+      license = LICENSE,
+      keywords = 'numpy machine learning rnn lstm gru',
+      packages = ['haste_numpy'],
+      package_dir = { 'haste_numpy': 'numpy' },
+      install_requires = ['numpy'],
+      classifiers = CLASSIFIERS)
@@ -0,0 +1,76 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""
+With `accumulate_grad_in_place`, the native backward passes accumulate into
+buffers that the layer reuses across steps and return them to autograd. The
+gradients must match the default path, reach the parameters' hooks, and stay
+correct when the layer runs more than once in a graph or a step is repeated.
+"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+haste = pytest.importorskip('haste_pytorch')
+
+
+TIME_STEPS = 6
+BATCH_SIZE = 3
+INPUT_SIZE = 5
+HIDDEN_SIZE = 7
+
+
+def _layers():
+  yield haste.LSTM, {}
+  yield haste.LSTM, {'checkpoint_every': 2}
+  yield haste.GRU, {'bidirectional': True}
+  yield haste.LayerNormLSTM, {'bidirectional': True}
+  yield haste.LayerNormLSTM, {'checkpoint_every': 2}
+
+
+def _step(layer, xs, hooked):
+  # Every input goes through the layer in the same graph, so the parameters receive
+  # one gradient per application.
+  loss = sum(layer(x)[0].sum() for x in xs)
+  loss.backward()
+  return {name: (p.grad.clone(), sum(hooked[name])) for name, p in layer.named_parameters()}
+
+
+@pytest.mark.parametrize('layer_class,kwargs', list(_layers()))
+def test_accumulated_gradients_reach_autograd(layer_class, kwargs):
+  torch.manual_seed(5566)
+  expected_layer = layer_class(INPUT_SIZE, HIDDEN_SIZE, **kwargs).double().train()
+  layer = layer_class(INPUT_SIZE, HIDDEN_SIZE, accumulate_grad_in_place=True, **kwargs).double().train()
+  layer.load_state_dict(expected_layer.state_dict())
+  xs = [torch.rand(TIME_STEPS, BATCH_SIZE, INPUT_SIZE, dtype=torch.float64) for _ in range(6)]
+
+  results = []
+  for l in [expected_layer, layer]:
+    hooked = {name: [] for name, _ in l.named_parameters()}
+    for name, param in l.named_parameters():
+      param.register_hook(lambda grad, name=name, hooked=hooked: hooked[name].append(grad.clone()))
+    steps = []
+    for step in range(3):
+      l.zero_grad(set_to_none=(step == 0))
+      for grads in hooked.values():
+        grads.clear()
+      steps.append(_step(l, xs[2*step:2*step+2], hooked))
+    results.append(steps)
+
+  for expected_step, step in zip(*results):
+    for name, (expected_grad, expected_hooked) in expected_step.items():
+      grad, hooked = step[name]
+      assert torch.allclose(grad, expected_grad), name
+      assert torch.allclose(hooked, expected_hooked), name
@@ -0,0 +1,42 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""
+Only the LSTM stores its state and weights in 16 bits. The GRU and
+LayerNormLSTM must reject float16 and bfloat16 inputs with an explicit error
+instead of failing inside the native dispatch.
+"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+haste = pytest.importorskip('haste_pytorch')
+
+
+TIME_STEPS = 3
+BATCH_SIZE = 2
+INPUT_SIZE = 5
+HIDDEN_SIZE = 7
+
+
+@pytest.mark.parametrize('layer_class', [haste.GRU, haste.LayerNormLSTM])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_16_bit_inputs_are_rejected(layer_class, dtype):
+  layer = layer_class(INPUT_SIZE, HIDDEN_SIZE).to(dtype).eval()
+  x = torch.rand(TIME_STEPS, BATCH_SIZE, INPUT_SIZE, dtype=dtype)
+  with pytest.raises(TypeError, match='Only the LSTM supports float16 and bfloat16'):
+    layer(x)
+  with pytest.raises(TypeError, match='Only the LSTM supports float16 and bfloat16'):
+    layer.step(x[0])
@@ -0,0 +1,150 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""
+With `flat_parameters=True`, every parameter and gradient of a layer must stay
+a view into `flat_weight` and `flat_grad` through `DistributedDataParallel`
+steps (a single-process gloo group on the CPU), gradient resets, replaced
+gradients, and dtype conversions, so that one all-reduce of `flat_grad` covers
+the whole layer without copies.
+"""
+
+import copy
+import pytest
+
+torch = pytest.importorskip('torch')
+haste = pytest.importorskip('haste_pytorch')
+dist = pytest.importorskip('torch.distributed')
+
+from torch.nn.parallel import DistributedDataParallel
+
+
+TIME_STEPS = 7
+BATCH_SIZE = 4
+INPUT_SIZE = 5
+HIDDEN_SIZE = 6
+LAYERS = [haste.LSTM, haste.GRU, haste.LayerNormLSTM]
+
+
+@pytest.fixture(scope='module')
+def process_group(tmp_path_factory):
+  if not dist.is_available() or not dist.is_gloo_available():
+    pytest.skip('torch.distributed with gloo is not available')
+  init_method = 'file://' + str(tmp_path_factory.mktemp('gloo') / 'store')
+  dist.init_process_group('gloo', init_method=init_method, rank=0, world_size=1)
+  yield
+  dist.destroy_process_group()
+
+
+def _check_views(layer):
+  offset = 0
+  for name, param in layer.named_parameters():
+    assert param.data_ptr() == layer.flat_weight[offset:].data_ptr(), name
+    assert param.grad is None or param.grad.data_ptr() == layer.flat_grad[offset:].data_ptr(), name
+    offset += param.numel()
+  assert offset == layer.flat_weight.numel() == layer.flat_grad.numel()
+
+
+def _check_grads(layer, reference, scale=1.0):
+  _check_views(layer)
+  assert torch.equal(layer.flat_grad, torch.cat([p.grad.reshape(-1) for p in layer.parameters()]))
+  for (name, param), expected in zip(layer.named_parameters(), reference.parameters()):
+    assert torch.allclose(param.grad, scale * expected.grad), name
+
+
+def _backward(layer, x, **kwargs):
+  output = layer(x)[0]
+  output.sum().backward(**kwargs)
+
+
+def _layers(layer_class, accumulate_grad_in_place):
+  torch.manual_seed(5566)
+  reference = layer_class(INPUT_SIZE, HIDDEN_SIZE).double()
+  layer = layer_class(
+      INPUT_SIZE,
+      HIDDEN_SIZE,
+      accumulate_grad_in_place=accumulate_grad_in_place,
+      flat_parameters=True).double()
+  layer.load_state_dict(reference.state_dict())
+  x = torch.rand(TIME_STEPS, BATCH_SIZE, INPUT_SIZE, dtype=torch.float64)
+  _backward(reference, x)
+  return reference, layer, x
+
+
+@pytest.mark.parametrize('layer_class', LAYERS)
+@pytest.mark.parametrize('accumulate_grad_in_place', [False, True])
+def test_ddp_steps_keep_views(process_group, layer_class, accumulate_grad_in_place):
+  reference, layer, x = _layers(layer_class, accumulate_grad_in_place)
+  model = DistributedDataParallel(layer)
+  optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+  flat_weight, flat_grad = layer.flat_weight, layer.flat_grad
+  _check_views(layer)
+
+  for set_to_none in [True, False, True]:
+    layer.load_state_dict(reference.state_dict())
+    optimizer.zero_grad(set_to_none=set_to_none)
+    _backward(model, x)
+    _check_grads(layer, reference)
+    expected = layer.flat_weight - 0.1 * layer.flat_grad
+    optimizer.step()
+    _check_views(layer)
+    assert torch.allclose(layer.flat_weight, expected)
+    assert layer.flat_weight is flat_weight and layer.flat_grad is flat_grad
+
+  dist.all_reduce(layer.flat_grad)
+  _check_grads(layer, reference)
+
+
+@pytest.mark.parametrize('layer_class', LAYERS)
+@pytest.mark.parametrize('accumulate_grad_in_place', [False, True])
+def test_replaced_grads_are_copied_back(layer_class, accumulate_grad_in_place):
+  reference, layer, x = _layers(layer_class, accumulate_grad_in_place)
+
+  # Gradients reset to None are reattached to zeroed views by the next forward pass.
+  _backward(layer, x)
+  layer.zero_grad(set_to_none=True)
+  _backward(layer, x)
+  _check_grads(layer, reference)
+
+  # Gradients replaced by the user are copied into the views.
+  for param in layer.parameters():
+    param.grad = param.grad.clone()
+  _backward(layer, x)
+  _check_grads(layer, reference, scale=2.0)
+
+  # Gradients reset between the forward and backward passes, and the new tensors
+  # that autograd installs with `create_graph`, are copied back once accumulated.
+  layer.zero_grad(set_to_none=False)
+  output = layer(x)[0]
+  layer.zero_grad(set_to_none=True)
+  output.sum().backward()
+  _check_grads(layer, reference)
+  _backward(layer, x, create_graph=True)
+  _check_grads(layer, reference, scale=2.0)
+
+
+@pytest.mark.parametrize('layer_class', LAYERS)
+def test_conversions_rebuild_buffers(layer_class):
+  reference, layer, x = _layers(layer_class, False)
+  for dtype in [torch.float32, torch.float64]:
+    converted = copy.deepcopy(layer).to(dtype)
+    assert converted.flat_weight.dtype == converted.flat_grad.dtype == dtype
+    converted.zero_grad(set_to_none=True)
+    _backward(converted, x.to(dtype))
+    _check_views(converted)
+    assert torch.equal(converted.flat_grad, torch.cat([p.grad.reshape(-1) for p in converted.parameters()]))
+  # The original layer's hooks still point at its own buffers.
+  _backward(layer, x)
+  _check_grads(layer, reference)
@@ -0,0 +1,175 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""
+Compares the native CPU passes of the PyTorch layers against `haste_numpy` on
+the same weights. Each layer is run forward and backward in double precision
+with every combination of `bidirectional`, `batch_first`, and sorted, unsorted,
+or missing `lengths`; the outputs, final states, and gradients must agree.
+
+The reference runs each sequence on its own, over its unpadded steps only, and
+gets the reverse direction by flipping the sequence.
+"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+haste = pytest.importorskip('haste_pytorch')
+pytest.importorskip('haste_numpy')
+
+from haste_numpy.gru import gru_forward, gru_backward
+from haste_numpy.layer_norm_lstm import layer_norm_lstm_forward, layer_norm_lstm_backward
+from haste_numpy.lstm import lstm_forward, lstm_backward
+
+
+TIME_STEPS = 13
+BATCH_SIZE = 5
+INPUT_SIZE = 11
+HIDDEN_SIZE = 17
+RTOL = 1e-6
+ATOL = 1e-8
+SEED = 5566
+
+
+def numpy_lstm(params, x, dh_new, dc_new):
+  h, c, v = lstm_forward(True, 0.0, x, *params)
+  dx, *grads = lstm_backward(x, *params, None, h, c, v, dh_new, dc_new)
+  return h, c, dx, grads
+
+
+def numpy_gru(params, x, dh_new, dc_new):
+  h, v = gru_forward(True, 0.0, x, *params)
+  dx, *grads = gru_backward(x, *params, None, h, v, dh_new)
+  return h, None, dx, grads
+
+
+def numpy_layer_norm_lstm(params, x, dh_new, dc_new):
+  h, c, cache = layer_norm_lstm_forward(True, 0.0, x, *params)
+  dx, *grads = layer_norm_lstm_backward(x, *params, None, h, c, cache, dh_new, dc_new)
+  return h, c, dx, grads
+
+
+LAYERS = {
+  'lstm': (haste.LSTM, numpy_lstm, ['kernel', 'recurrent_kernel', 'bias']),
+  'gru': (haste.GRU, numpy_gru, ['kernel', 'recurrent_kernel', 'bias', 'recurrent_bias']),
+  'layer_norm_lstm': (haste.LayerNormLSTM, numpy_layer_norm_lstm,
+      ['kernel', 'recurrent_kernel', 'bias', 'gamma', 'gamma_h', 'beta_h']),
+}
+
+
+def reference(run, params, x, lengths, grad_output, grad_h, grad_c):
+  """
+  Runs `run` over each sequence and direction of the time-major `x` [T,N,C].
+  Returns the output, final states, and gradients in the PyTorch layer's layout.
+  """
+  time_steps, batch_size, _ = x.shape
+  directions, _, hidden_size = grad_h.shape
+  output = np.zeros((time_steps, batch_size, directions * hidden_size))
+  h_n = np.zeros_like(grad_h)
+  c_n = np.zeros_like(grad_c)
+  dx = np.zeros_like(x)
+  grads = [[np.zeros_like(p) for p in direction] for direction in params]
+
+  for n, length in enumerate(lengths):
+    for d in range(directions):
+      # The reverse direction sees each sequence back to front.
+      order = slice(None, None, -1) if d else slice(None)
+      features = slice(d * hidden_size, (d + 1) * hidden_size)
+
+      dh_new = np.zeros((length + 1, 1, hidden_size))
+      dc_new = np.zeros((length + 1, 1, hidden_size))
+      dh_new[1:] = grad_output[:length, n:n+1, features][order]
+      dh_new[-1] += grad_h[d, n]
+      dc_new[-1] += grad_c[d, n]
+
+      h, c, dx_n, grads_n = run(params[d], np.ascontiguousarray(x[:length, n:n+1][order]), dh_new, dc_new)
+      output[:length, n, features] = h[1:, 0][order]
+      h_n[d, n] = h[-1, 0]
+      if c is not None:
+        c_n[d, n] = c[-1, 0]
+      dx[:length, n] += dx_n[:, 0][order]
+      for grad, grad_n in zip(grads[d], grads_n):
+        grad += grad_n
+
+  return output, h_n, c_n, dx, grads
+
+
+def compare(name, actual, expected):
+  error = np.max(np.abs(actual - expected))
+  assert np.allclose(actual, expected, rtol=RTOL, atol=ATOL), \
+      '{} differs from haste_numpy (max abs error {:.3g})'.format(name, error)
+
+
+@pytest.mark.parametrize('layer_name', list(LAYERS))
+@pytest.mark.parametrize('bidirectional', [False, True])
+@pytest.mark.parametrize('batch_first', [False, True])
+@pytest.mark.parametrize('lengths_mode', ['none', 'sorted', 'unsorted'])
+def test_matches_numpy(layer_name, bidirectional, batch_first, lengths_mode):
+  layer_class, run, param_names = LAYERS[layer_name]
+  rng = np.random.RandomState(SEED)
+  time_steps, batch_size, hidden_size = TIME_STEPS, BATCH_SIZE, HIDDEN_SIZE
+  directions = 2 if bidirectional else 1
+
+  layer = layer_class(INPUT_SIZE, hidden_size, batch_first=batch_first, bidirectional=bidirectional)
+  layer.double().train()
+  with torch.no_grad():
+    # Nonzero biases and gains exercise every gradient path.
+    for param in layer.parameters():
+      param.add_(torch.from_numpy(rng.uniform(-0.1, 0.1, param.shape)))
+  suffixes = ['', '_reverse'][:directions]
+  params = [[getattr(layer, p + s).detach().numpy().copy() for p in param_names] for s in suffixes]
+
+  if lengths_mode == 'none':
+    lengths = None
+    steps = np.full(batch_size, time_steps)
+  else:
+    steps = rng.randint(1, time_steps + 1, size=batch_size)
+    steps[0] = time_steps
+    if lengths_mode == 'sorted':
+      steps = np.sort(steps)[::-1].copy()
+    lengths = torch.from_numpy(steps)
+
+  x = rng.uniform(-1.0, 1.0, (time_steps, batch_size, INPUT_SIZE))
+  # Padded steps are left out of the loss, since their outputs are unspecified.
+  mask = (np.arange(time_steps)[:, None] < steps[None, :])[:, :, None]
+  grad_output = rng.uniform(-1.0, 1.0, (time_steps, batch_size, directions * hidden_size)) * mask
+  grad_h = rng.uniform(-1.0, 1.0, (directions, batch_size, hidden_size))
+  grad_c = rng.uniform(-1.0, 1.0, (directions, batch_size, hidden_size))
+  if layer_name == 'gru':
+    grad_c[:] = 0.0
+
+  input = torch.from_numpy(x.transpose(1, 0, 2).copy() if batch_first else x).requires_grad_()
+  output, state = layer(input, lengths)
+  h_n, c_n = state if isinstance(state, tuple) else (state, None)
+  output_t = output.transpose(0, 1) if batch_first else output
+  loss = (output_t * torch.from_numpy(grad_output)).sum() + (h_n * torch.from_numpy(grad_h)).sum()
+  if c_n is not None:
+    loss = loss + (c_n * torch.from_numpy(grad_c)).sum()
+  loss.backward()
+
+  expected = reference(run, params, x, steps, grad_output, grad_h, grad_c)
+  expected_output, expected_h, expected_c, expected_dx, expected_grads = expected
+
+  compare('output', output_t.detach().numpy() * mask, expected_output)
+  compare('h_n', h_n.detach().numpy(), expected_h)
+  if c_n is not None:
+    compare('c_n', c_n.detach().numpy(), expected_c)
+  dx = input.grad.numpy()
+  compare('dx', dx.transpose(1, 0, 2) if batch_first else dx, expected_dx)
+  for suffix, grads in zip(suffixes, expected_grads):
+    for param_name, grad in zip(param_names, grads):
+      compare('d' + param_name + suffix, getattr(layer, param_name + suffix).grad.numpy(), grad)
+
@@ -0,0 +1,100 @@
+# Copyright 2020 LMNT, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""
+The CPU GRU and LayerNormLSTM run the reverse direction of a bidirectional layer
+in place, with padded steps carrying the state through. Its outputs, final
+states, and gradients must match running the forward pass over a reversed copy
+of each sequence, which is what the GPU path does.
+"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+haste = pytest.importorskip('haste_pytorch')
+
+from haste_pytorch.gru import _reverse_sequence
+
+
+TIME_STEPS = 9
+BATCH_SIZE = 5
+INPUT_SIZE = 7
+HIDDEN_SIZE = 11
+
+
+def _lengths(mode):
+  if mode == 'none':
+    return None
+  lengths = torch.randint(1, TIME_STEPS + 1, (BATCH_SIZE,))
+  lengths[0] = TIME_STEPS
+  if mode == 'sorted':
+    lengths = lengths.sort(descending=True).values
+  return lengths
+
+
+def _mask(lengths):
+  if lengths is None:
+    return torch.ones(TIME_STEPS, BATCH_SIZE, 1, dtype=torch.float64)
+  steps = torch.arange(TIME_STEPS).unsqueeze(1)
+  return (steps < lengths.unsqueeze(0)).unsqueeze(-1).double()
+
+
+def _reverse_direction(layer, x, lengths, reverse):
+  """Runs the reverse direction of `layer` natively or over a reversed copy of `x`."""
+  params = layer._directions()[1]
+  zeros = torch.zeros(BATCH_SIZE, HIDDEN_SIZE, dtype=x.dtype)
+  state = (zeros,) if isinstance(layer, haste.GRU) else (zeros, zeros)
+  if reverse:
+    output, final = layer._forward_direction(x, lengths, *state, *params, reverse=True)
+  else:
+    output, final = layer._forward_direction(_reverse_sequence(x, lengths), lengths, *state, *params)
+    output = _reverse_sequence(output, lengths)
+  return output, (final if isinstance(final, tuple) else (final,))
+
+
+@pytest.mark.parametrize('layer_class', [haste.GRU, haste.LayerNormLSTM])
+@pytest.mark.parametrize('lengths_mode', ['none', 'sorted', 'unsorted'])
+def test_native_reverse_matches_reversed_input(layer_class, lengths_mode):
+  torch.manual_seed(5566)
+  layer = layer_class(INPUT_SIZE, HIDDEN_SIZE, bidirectional=True).double().train()
+  with torch.no_grad():
+    for param in layer.parameters():
+      param.add_(torch.empty_like(param).uniform_(-0.1, 0.1))
+  lengths = _lengths(lengths_mode)
+  mask = _mask(lengths)
+  x = torch.rand(TIME_STEPS, BATCH_SIZE, INPUT_SIZE, dtype=torch.float64)
+  grad_output = torch.rand(TIME_STEPS, BATCH_SIZE, HIDDEN_SIZE, dtype=torch.float64) * mask
+  grad_state = torch.rand(2, BATCH_SIZE, HIDDEN_SIZE, dtype=torch.float64)
+
+  results = []
+  for reverse in [True, False]:
+    layer.zero_grad(set_to_none=True)
+    input = x.clone().requires_grad_()
+    output, state = _reverse_direction(layer, input, lengths, reverse)
+    # Padded steps are left out, since their outputs are unspecified.
+    loss = (output * grad_output).sum()
+    for s, g in zip(state, grad_state):
+      loss = loss + (s[0] * g).sum()
+    loss.backward()
+    grads = [p.grad.clone() for p in layer._directions()[1]]
+    results.append((output.detach() * mask, [s.detach() for s in state], input.grad, grads))
+
+  (output, state, dx, grads), (expected_output, expected_state, expected_dx, expected_grads) = results
+  assert torch.allclose(output, expected_output)
+  for s, expected in zip(state, expected_state):
+    assert torch.allclose(s, expected)
+  assert torch.allclose(dx, expected_dx)
+  for grad, expected in zip(grads, expected_grads):
+    assert torch.allclose(grad, expected)